@@ -0,0 +1,44 @@
+"""
+Fixtures shared by the benchmarks. Run them from the repository root with
+
+    make bench
+
+which stores the results in .benchmarks so later runs can be compared with ``make bench-compare``.
+"""
+import datetime as dt
+
+import pytest
+
+from transit_notification import create_app, init_db, replay
+
+# number of onward calls used for each benchmark size
+CALL_COUNTS = [100, 1000, 10000, 50000]
+CALLS_PER_VEHICLE = 20
+OPERATOR_ID = 'SF'
+CURRENT_TIME = dt.datetime(2023, 9, 26, 15, 0, 0, 0, dt.UTC)
+
+
+@pytest.fixture(params=['memory', 'disk'])
+def bench_app(request, tmp_path):
+    """App backed by an in-memory or an on-disk SQLite database."""
+    if request.param == 'memory':
+        db_url = 'sqlite://'
+    else:
+        db_url = 'sqlite:///' + str(tmp_path / 'bench.db')
+    app = create_app({"TESTING": True, "SQLALCHEMY_DATABASE_URI": db_url})
+    with app.app_context():
+        init_db()
+        yield app
+
+
+@pytest.fixture(params=CALL_COUNTS, ids=lambda count: f"{count}_calls")
+def vehicle_monitoring(request):
+    """Synthetic vehicle monitoring response with the requested number of onward calls."""
+    return replay.synthesize_vehicle_monitoring(OPERATOR_ID, request.param // CALLS_PER_VEHICLE, CALLS_PER_VEHICLE,
+                                                CURRENT_TIME)
+
+
+@pytest.fixture(params=CALL_COUNTS, ids=lambda count: f"{count}_calls")
+def stop_monitoring(request):
+    """Synthetic stop monitoring response with the requested number of monitored stop visits."""
+    return replay.synthesize_stop_monitoring(OPERATOR_ID, request.param, CURRENT_TIME)
@@ -0,0 +1,104 @@
+"""
+Readers against one ingest writer. The writer rewrites the vehicle monitoring tables in a loop while reader threads
+query the upcoming vehicles, the benchmark times the reads of the main thread. Lock errors of the readers are stored
+in the extra info of the benchmark.
+"""
+import threading
+
+import pytest
+import sqlalchemy
+from conftest import CALLS_PER_VEHICLE, CURRENT_TIME, OPERATOR_ID
+
+from transit_notification import content_hash, create_app, db, db_commands, init_db, read_db, replay
+from transit_notification.models import Operator
+
+pytest.importorskip("pytest_benchmark")
+
+READER_COUNTS = [1, 4]
+CALL_COUNT = 2000
+PRAGMA_PROFILES = {
+    'tuned': None,
+    # rollback journal with a short busy timeout, the sqlite defaults
+    'default': {'journal_mode': 'DELETE', 'synchronous': 'FULL', 'busy_timeout': 100},
+}
+
+
+@pytest.fixture(params=list(PRAGMA_PROFILES))
+def disk_app(request, tmp_path):
+    test_config = {"TESTING": True, "SQLALCHEMY_DATABASE_URI": 'sqlite:///' + str(tmp_path / 'bench.db')}
+    if PRAGMA_PROFILES[request.param] is not None:
+        test_config["SQLITE_PRAGMAS"] = PRAGMA_PROFILES[request.param]
+    app = create_app(test_config)
+    with app.app_context():
+        init_db()
+        db.session.add(Operator(operator_id=OPERATOR_ID, operator_name='Benchmark', operator_monitored=True))
+        db.session.commit()
+    return app
+
+
+class Workload:
+    """Writer and reader threads that run until stopped."""
+
+    def __init__(self, app, response, stop_id, reader_count):
+        self.app = app
+        self.response = response
+        self.stop_id = stop_id
+        self.stopped = threading.Event()
+        self.errors = {'reader': 0, 'writer': 0}
+        self.writes = 0
+        self._lock = threading.Lock()
+        self.threads = [threading.Thread(target=self.write)]
+        self.threads += [threading.Thread(target=self.read) for _ in range(reader_count - 1)]
+
+    def add_error(self, role):
+        with self._lock:
+            self.errors[role] += 1
+
+    def write(self):
+        with self.app.app_context():
+            while not self.stopped.is_set():
+                try:
+                    # rewrite the tables every time instead of skipping the unchanged response
+                    content_hash.forget_digests(db, 'monitoring', OPERATOR_ID)
+                    db_commands.save_vehicle_monitoring(db, OPERATOR_ID, self.response, CURRENT_TIME)
+                    self.writes += 1
+                except sqlalchemy.exc.OperationalError:
+                    db.session.rollback()
+                    self.add_error('writer')
+
+    def read(self):
+        with self.app.app_context():
+            while not self.stopped.is_set():
+                self.read_once()
+
+    def read_once(self):
+        try:
+            return db_commands.upcoming_vehicles(read_db, OPERATOR_ID, self.stop_id, CURRENT_TIME)
+        except sqlalchemy.exc.OperationalError:
+            read_db.session.rollback()
+            self.add_error('reader')
+
+    def __enter__(self):
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        for thread in self.threads:
+            thread.join()
+
+
+@pytest.mark.parametrize('reader_count', READER_COUNTS, ids=lambda count: f"{count}_readers")
+def test_read_during_ingest(benchmark, disk_app, reader_count):
+    response = replay.synthesize_vehicle_monitoring(OPERATOR_ID, CALL_COUNT // CALLS_PER_VEHICLE,
+                                                    CALLS_PER_VEHICLE, CURRENT_TIME)
+    first_vehicle = response["Siri"]["ServiceDelivery"]["VehicleMonitoringDelivery"]["VehicleActivity"][0]
+    stop_id = first_vehicle["MonitoredVehicleJourney"]["MonitoredCall"]["StopPointRef"]
+    with disk_app.app_context():
+        db_commands.save_vehicle_monitoring(db, OPERATOR_ID, response, CURRENT_TIME)
+        workload = Workload(disk_app, response, stop_id, reader_count)
+        with workload:
+            benchmark.pedantic(workload.read_once, rounds=2000, warmup_rounds=2)
+    benchmark.extra_info.update(reader_errors=workload.errors['reader'], writer_errors=workload.errors['writer'],
+                                writes=workload.writes)
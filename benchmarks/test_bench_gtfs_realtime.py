@@ -0,0 +1,36 @@
+"""
+Compares the SIRI JSON and the GTFS-Realtime ingest paths on equivalent feeds. Both benchmarks start from the bytes
+received from the upstream api, so the parse time includes decoding the payload, and record the payload size.
+"""
+import json
+
+import pytest
+from conftest import OPERATOR_ID
+
+from transit_notification import db_commands, gtfs_realtime
+
+pytest.importorskip("pytest_benchmark")
+pytest.importorskip("google.transit.gtfs_realtime_pb2")
+
+
+def test_parse_siri_json(benchmark, vehicle_monitoring):
+    payload = json.dumps(vehicle_monitoring).encode()
+    benchmark.extra_info['payload_bytes'] = len(payload)
+
+    def parse():
+        return db_commands.parse_vehicle_monitoring(OPERATOR_ID, json.loads(payload))
+
+    vehicles, onward_calls = benchmark(parse)
+    assert onward_calls
+
+
+def test_parse_gtfs_realtime(benchmark, vehicle_monitoring):
+    payload = gtfs_realtime.feed_from_vehicle_monitoring(vehicle_monitoring)
+    benchmark.extra_info['payload_bytes'] = len(payload)
+    benchmark.extra_info['siri_json_payload_bytes'] = len(json.dumps(vehicle_monitoring).encode())
+
+    def parse():
+        return gtfs_realtime.parse_feed(OPERATOR_ID, [gtfs_realtime.decode_feed(payload)])
+
+    vehicles, onward_calls = benchmark(parse)
+    assert len(onward_calls) == len(db_commands.parse_vehicle_monitoring(OPERATOR_ID, vehicle_monitoring)[1])
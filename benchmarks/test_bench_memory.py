@@ -0,0 +1,50 @@
+"""
+Memory retained by the parsed monitoring records once the decoded response is released, which is the live state
+kept for an agency. The bytes per onward call are stored in the extra info of the benchmark so they can be compared
+between runs.
+"""
+import gc
+import json
+import tracemalloc
+
+import pytest
+from conftest import CALLS_PER_VEHICLE, CURRENT_TIME, OPERATOR_ID
+
+from transit_notification import db_commands, replay
+
+pytest.importorskip("pytest_benchmark")
+
+CALL_COUNT = 100000
+# records with interned identifiers keep about 270 B per vehicle monitoring call and 540 B per stop visit
+MAX_BYTES_PER_CALL = 1024
+
+
+def live_state_bytes(parse, raw_response):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        response = json.loads(raw_response)
+        records = parse(OPERATOR_ID, response)
+        del response
+        gc.collect()
+        retained, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return records, retained
+
+
+@pytest.mark.parametrize('feed', ['vehicle_monitoring', 'stop_monitoring'])
+def test_parse_memory(benchmark, feed):
+    if feed == 'vehicle_monitoring':
+        response = replay.synthesize_vehicle_monitoring(OPERATOR_ID, CALL_COUNT // CALLS_PER_VEHICLE,
+                                                        CALLS_PER_VEHICLE, CURRENT_TIME)
+        parse = db_commands.parse_vehicle_monitoring
+    else:
+        response = replay.synthesize_stop_monitoring(OPERATOR_ID, CALL_COUNT, CURRENT_TIME)
+        parse = db_commands.parse_stop_monitoring
+    (vehicles, onward_calls), retained = live_state_bytes(parse, json.dumps(response))
+    del vehicles, onward_calls
+    bytes_per_call = retained / CALL_COUNT
+    benchmark.extra_info.update(retained_bytes=retained, bytes_per_call=bytes_per_call)
+    benchmark.pedantic(parse, args=(OPERATOR_ID, response), rounds=3, warmup_rounds=1)
+    assert bytes_per_call < MAX_BYTES_PER_CALL
@@ -0,0 +1,39 @@
+import pytest
+from conftest import OPERATOR_ID
+
+from transit_notification import db_commands
+
+pytest.importorskip("pytest_benchmark")
+
+
+def test_parse_vehicle_dict(benchmark, vehicle_monitoring):
+    vehicle_list = vehicle_monitoring["Siri"]["ServiceDelivery"]["VehicleMonitoringDelivery"]["VehicleActivity"]
+
+    def parse_all():
+        return [db_commands.parse_vehicle_dict(OPERATOR_ID, vehicle) for vehicle in vehicle_list]
+
+    parsed = benchmark(parse_all)
+    assert len(parsed) == len(vehicle_list)
+
+
+def test_parse_stop_monitoring_dict(benchmark, stop_monitoring):
+    visits = stop_monitoring["ServiceDelivery"]["StopMonitoringDelivery"]["MonitoredStopVisit"]
+
+    def parse_all():
+        return [db_commands.parse_stop_monitoring_dict(OPERATOR_ID, visit) for visit in visits]
+
+    parsed = benchmark(parse_all)
+    assert len(parsed) == len(visits)
+
+
+def test_parse_time_str(benchmark, vehicle_monitoring):
+    vehicle_list = vehicle_monitoring["Siri"]["ServiceDelivery"]["VehicleMonitoringDelivery"]["VehicleActivity"]
+    time_strs = [call["ExpectedArrivalTime"]
+                 for vehicle in vehicle_list
+                 for call in vehicle["MonitoredVehicleJourney"]["OnwardCalls"]["OnwardCall"]]
+
+    def parse_all():
+        return [db_commands.parse_time_str(time_str) for time_str in time_strs]
+
+    parsed = benchmark(parse_all)
+    assert len(parsed) == len(time_strs)
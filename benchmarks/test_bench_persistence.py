@@ -0,0 +1,55 @@
+import pytest
+from conftest import CURRENT_TIME, OPERATOR_ID
+
+from transit_notification import content_hash, db, db_commands
+from transit_notification.models import Operator
+
+pytest.importorskip("pytest_benchmark")
+
+LINE_COUNTS = [100, 1000]
+
+
+def forget_digests(*scope):
+    """Benchmark setup that makes every round write, instead of skipping the rows stored by the previous round."""
+    def setup():
+        content_hash.forget_digests(db, *scope)
+        db.session.commit()
+    return setup
+
+
+def add_operator():
+    db.session.add(Operator(operator_id=OPERATOR_ID, operator_name='Benchmark', operator_monitored=True))
+    db.session.commit()
+
+
+@pytest.mark.parametrize('line_count', LINE_COUNTS, ids=lambda count: f"{count}_lines")
+def test_save_lines(benchmark, bench_app, line_count):
+    add_operator()
+    lines_dict = [{'Id': str(line_index), 'OperatorRef': OPERATOR_ID, 'Name': f'Line {line_index}',
+                   'Monitored': True}
+                  for line_index in range(line_count)]
+    benchmark.pedantic(db_commands.save_lines, setup=forget_digests('lines', OPERATOR_ID),
+                       args=(db, OPERATOR_ID, lines_dict, CURRENT_TIME), rounds=5, warmup_rounds=1)
+
+
+def test_save_vehicle_monitoring(benchmark, bench_app, vehicle_monitoring):
+    add_operator()
+    benchmark.pedantic(db_commands.save_vehicle_monitoring, setup=forget_digests('monitoring', OPERATOR_ID),
+                       args=(db, OPERATOR_ID, vehicle_monitoring, CURRENT_TIME), rounds=3, warmup_rounds=1)
+
+
+def test_save_unchanged_vehicle_monitoring(benchmark, bench_app, vehicle_monitoring):
+    add_operator()
+    db_commands.save_vehicle_monitoring(db, OPERATOR_ID, vehicle_monitoring, CURRENT_TIME)
+    benchmark.pedantic(db_commands.save_vehicle_monitoring,
+                       args=(db, OPERATOR_ID, vehicle_monitoring, CURRENT_TIME),
+                       rounds=3, warmup_rounds=1)
+
+
+def test_upcoming_vehicles(benchmark, bench_app, vehicle_monitoring):
+    add_operator()
+    db_commands.save_vehicle_monitoring(db, OPERATOR_ID, vehicle_monitoring, CURRENT_TIME)
+    first_vehicle = vehicle_monitoring["Siri"]["ServiceDelivery"]["VehicleMonitoringDelivery"]["VehicleActivity"][0]
+    stop_id = first_vehicle["MonitoredVehicleJourney"]["MonitoredCall"]["StopPointRef"]
+    upcoming = benchmark(db_commands.upcoming_vehicles, db, OPERATOR_ID, stop_id, CURRENT_TIME)
+    assert upcoming
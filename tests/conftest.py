@@ -3,14 +3,11 @@
 
 """
 
-from datetime import datetime
 import os
+
 import pytest
-import tempfile
-from transit_notification import create_app
-from transit_notification import db
-from transit_notification import init_db
 
+from transit_notification import create_app, init_db
 
 """
 with open(os.path.join(os.path.dirname(__file__), 'data.sql'), 'rb') as f:
@@ -18,24 +15,34 @@ with open(os.path.join(os.path.dirname(__file__), 'data.sql'), 'rb') as f:
 """
 
 
+@pytest.fixture(autouse=True)
+def tests_directory(monkeypatch):
+    """The test inputs are opened relative to the tests folder, so pytest can run from the project root."""
+    monkeypatch.chdir(os.path.dirname(__file__))
+
+
+@pytest.fixture(autouse=True)
+def test_database(tmp_path_factory, monkeypatch):
+    """Apps created without a database url use a temporary database instead of the one in the instance folder."""
+    database_uri = 'sqlite:///' + str(tmp_path_factory.mktemp('database') / 'database.db')
+    monkeypatch.setenv("DATABASE_URI", database_uri)
+    return database_uri
+
+
 @pytest.fixture
-def app():
+def app(tmp_path, test_database):
     """Create and configure a new app instance for each test."""
-    # create a temporary file to isolate the database for each test
-    db_fd, db_path = tempfile.mkstemp()
-    # create the app with common test config
-    app = create_app({"TESTING": True, "DATABASE": db_path})
+    # create the app with common test config, each test has a database of its own
+    app = create_app({"TESTING": True, "SQLALCHEMY_DATABASE_URI": test_database,
+                      "RESPONSE_CACHE_DIR": str(tmp_path / "response_cache"),
+                      "PATTERN_PREFETCH_WORKERS": 0})
 
     # create the database and load test data
     with app.app_context():
         init_db()
         #get_db().executescript(_data_sql)
 
-    yield app
-
-    # close and remove the temporary database
-    os.close(db_fd)
-    os.unlink(db_path)
+    return app
 
 @pytest.fixture
 def client(app):
@@ -0,0 +1,92 @@
+import datetime as dt
+import json
+
+import pandas as pd
+import pytest
+
+from transit_notification import analytics, commands, db, db_commands
+from transit_notification.models import OnwardCallArchive
+
+selected_operator = 'SF'
+current_time = dt.datetime(2023, 9, 26, 15, 0, 0, 0, dt.UTC)
+
+
+def make_archive_df():
+    base = pd.Timestamp('2023-09-26 15:00:00')
+    rows = []
+    # two trips of line 14 at stop 1 scheduled 10 minutes apart, predictions recorded every 5 minutes
+    for trip, (aimed_min, actual_min) in enumerate([(20, 22), (30, 29)]):
+        for recorded_min, predicted_min in [(0, actual_min + 2), (5, actual_min + 1), (10, actual_min)]:
+            rows.append({'operator_id': 'SF', 'line_id': '14', 'stop_id': '1',
+                         'vehicle_journey_ref': f'trip_{trip}', 'dataframe_ref_date': dt.date(2023, 9, 26),
+                         'recorded_time_utc': base + pd.Timedelta(minutes=recorded_min),
+                         'aimed_arrival_time_utc': base + pd.Timedelta(minutes=aimed_min),
+                         'expected_arrival_time_utc': base + pd.Timedelta(minutes=predicted_min),
+                         'aimed_departure_time_utc': base + pd.Timedelta(minutes=aimed_min),
+                         'expected_departure_time_utc': pd.NaT})
+    return pd.DataFrame(rows)
+
+
+def test_report_names():
+    assert list(analytics.REPORTS) == commands.ANALYTICS_REPORTS
+
+
+def test_final_observations():
+    final_df = analytics.final_observations(make_archive_df())
+    assert len(final_df) == 2
+    assert list(final_df['observed_arrival_utc']) == [pd.Timestamp('2023-09-26 15:22:00'),
+                                                       pd.Timestamp('2023-09-26 15:29:00')]
+
+
+def test_lateness_distribution():
+    lateness_df = analytics.lateness_distribution(make_archive_df(), by='line_id')
+    assert lateness_df.loc['14', 'count'] == 2
+    assert lateness_df.loc['14', 'mean'] == pytest.approx(30.0)
+    assert lateness_df.loc['14', 'p50'] == pytest.approx(30.0)
+    assert lateness_df.loc['14', 'on_time_fraction'] == pytest.approx(1.0)
+
+
+def test_prediction_error_by_lead_time():
+    error_df = analytics.prediction_error_by_lead_time(make_archive_df(), bins=(0, 15, 20, 25, 30))
+    assert list(error_df['count']) == [1, 2, 2, 1]
+    assert list(error_df['mean_abs_error_s']) == pytest.approx([0.0, 30.0, 90.0, 120.0])
+    assert list(error_df['mean_error_s']) == pytest.approx([0.0, 30.0, 90.0, 120.0])
+
+
+def test_headway_regularity():
+    headway_df = analytics.headway_regularity(make_archive_df())
+    assert headway_df.loc[('14', '1'), 'mean_headway_s'] == pytest.approx(420.0)
+    assert headway_df.loc[('14', '1'), 'scheduled_mean_headway_s'] == pytest.approx(600.0)
+
+
+def test_archive_onward_calls(app):
+    with open("test_input_jsons/vehicle_monitoring_modified.json") as f:
+        vehicles_dict = json.load(f)
+    with open("test_input_jsons/operators.json") as f:
+        operators_dict = json.load(f)
+    with app.app_context():
+        db_commands.save_operators(db, operators_dict)
+        db_commands.save_vehicle_monitoring(db, selected_operator, vehicles_dict, current_time, archive=True)
+        db_commands.save_vehicle_monitoring(db, selected_operator, vehicles_dict,
+                                            current_time + dt.timedelta(minutes=1), archive=True)
+        archived = db.session.execute(db.select(OnwardCallArchive)).scalars().all()
+        assert len(archived) == 2 * 106
+        archive_df = analytics.load_onward_call_archive(db, selected_operator,
+                                                        start_time=current_time + dt.timedelta(seconds=30))
+        assert len(archive_df) == 106
+        assert set(archive_df['line_id']) == {'14'}
+
+
+def test_analytics_command(app, runner):
+    with open("test_input_jsons/vehicle_monitoring_modified.json") as f:
+        vehicles_dict = json.load(f)
+    with open("test_input_jsons/operators.json") as f:
+        operators_dict = json.load(f)
+    with app.app_context():
+        db_commands.save_operators(db, operators_dict)
+        db_commands.save_vehicle_monitoring(db, selected_operator, vehicles_dict, current_time, archive=True)
+    result = runner.invoke(args=["analytics", selected_operator, "--report", "lateness-line"])
+    assert "Loaded 106 archived predictions" in result.output
+    assert "on_time_fraction" in result.output
+    result = runner.invoke(args=["analytics", "CT"])
+    assert "No archived onward calls for operator CT" in result.output
@@ -0,0 +1,131 @@
+import copy
+import datetime as dt
+import json
+
+import pytest
+
+from transit_notification import cadence, db, db_commands
+from transit_notification.cadence import FeedCadence
+
+selected_operator = 'SF'
+current_time = dt.datetime(2023, 9, 26, 15, 0, 0, 0, dt.UTC)
+
+
+def seconds(value):
+    return current_time + dt.timedelta(seconds=value)
+
+
+def test_interval_learned():
+    feed_cadence = FeedCadence()
+    feed_cadence.observe('SF', 'stop_monitoring', seconds(0), seconds(1))
+    assert feed_cadence.interval('SF', 'stop_monitoring') is None
+    assert feed_cadence.refresh_due('SF', 'stop_monitoring', seconds(1), 1) is None
+    feed_cadence.observe('SF', 'stop_monitoring', seconds(30), seconds(31))
+    assert feed_cadence.interval('SF', 'stop_monitoring') == 30
+    # polls that find the same feed time or no feed time are not updates
+    feed_cadence.observe('SF', 'stop_monitoring', seconds(30), seconds(46))
+    feed_cadence.observe('SF', 'stop_monitoring', None, seconds(50))
+    assert feed_cadence.interval('SF', 'stop_monitoring') == 30
+    feed_cadence.observe('SF', 'stop_monitoring', seconds(70), seconds(71))
+    assert feed_cadence.interval('SF', 'stop_monitoring') == pytest.approx(30 + cadence.SMOOTHING * 10)
+    # a gap longer than MAX_INTERVAL_S is a gap between polls
+    feed_cadence.observe('SF', 'stop_monitoring', seconds(70 + cadence.MAX_INTERVAL_S + 60), seconds(500))
+    assert feed_cadence.interval('SF', 'stop_monitoring') == pytest.approx(30 + cadence.SMOOTHING * 10)
+    assert feed_cadence.interval('SF', 'vehicle_monitoring') is None
+
+
+def test_next_poll_time():
+    feed_cadence = FeedCadence()
+    feed_cadence.observe('SF', 'vehicle_monitoring', seconds(0), seconds(1))
+    feed_cadence.observe('SF', 'vehicle_monitoring', seconds(60), seconds(61))
+    expected = seconds(120 + cadence.POLL_DELAY_S)
+    assert feed_cadence.next_poll_time('SF', 'vehicle_monitoring') == expected
+    assert not feed_cadence.refresh_due('SF', 'vehicle_monitoring', seconds(100), 1)
+    assert feed_cadence.refresh_due('SF', 'vehicle_monitoring', expected, 1)
+    # the update was late, poll again shortly after
+    feed_cadence.observe('SF', 'vehicle_monitoring', seconds(60), expected)
+    assert feed_cadence.next_poll_time('SF', 'vehicle_monitoring') == expected + dt.timedelta(
+        seconds=cadence.RETRY_S)
+
+
+def poll_views(feed_cadence, view_seconds, update_s):
+    """Polls the feed on each view that is due, the feed publishes every update_s seconds."""
+    due = []
+    for view_s in view_seconds:
+        refresh_due = feed_cadence.refresh_due('SF', 'stop_monitoring', seconds(view_s), 1)
+        due.append(refresh_due is not False)
+        if refresh_due is not False:
+            feed_cadence.observe('SF', 'stop_monitoring', seconds(view_s // update_s * update_s), seconds(view_s))
+    return due
+
+
+def test_sparse_views_refresh():
+    feed_cadence = FeedCadence()
+    assert poll_views(feed_cadence, [0, 20, 6 * 60, 7 * 60, 9 * 60], 20) == [True] * 5
+
+
+def test_refresh_limit_caps_interval():
+    feed_cadence = FeedCadence()
+    feed_cadence.observe('SF', 'stop_monitoring', seconds(0), seconds(0))
+    feed_cadence.observe('SF', 'stop_monitoring', seconds(cadence.MAX_INTERVAL_S), seconds(cadence.MAX_INTERVAL_S))
+    assert feed_cadence.next_poll_time('SF', 'stop_monitoring') > seconds(cadence.MAX_INTERVAL_S + 60)
+    assert not feed_cadence.refresh_due('SF', 'stop_monitoring', seconds(cadence.MAX_INTERVAL_S + 59), 1)
+    assert feed_cadence.refresh_due('SF', 'stop_monitoring', seconds(cadence.MAX_INTERVAL_S + 60), 1)
+
+
+def test_steady_polling_does_not_creep():
+    feed_cadence = FeedCadence()
+    assert all(poll_views(feed_cadence, range(20, 30 * 60, 60), 60))
+    assert feed_cadence.interval('SF', 'stop_monitoring') == 60
+    feed_cadence = FeedCadence()
+    # polling slower than the feed publishes learns at most the polling interval
+    assert all(poll_views(feed_cadence, range(20, 30 * 60, 60), 30))
+    assert feed_cadence.interval('SF', 'stop_monitoring') == 60
+
+
+def test_stalled_feed_backs_off():
+    feed_cadence = FeedCadence()
+    for update_s in range(0, 120, 30):
+        feed_cadence.observe('SF', 'stop_monitoring', seconds(update_s), seconds(update_s))
+    polls = []
+    # the feed stops publishing, a page is viewed every second for an hour
+    for view_s in range(120, 120 + 60 * 60):
+        if feed_cadence.refresh_due('SF', 'stop_monitoring', seconds(view_s), 1):
+            feed_cadence.observe('SF', 'stop_monitoring', seconds(90), seconds(view_s))
+            polls.append(view_s)
+    # a few retries after the expected update, then one poll per refresh limit
+    assert polls[:5] == [122, 127, 137, 157, 197]
+    assert polls[5:] == list(range(257, 120 + 60 * 60, 60))
+    # a poll every 5 seconds would have been 720 requests
+    assert len(polls) == 63
+    # the feed publishes again and is polled on its interval
+    feed_cadence.observe('SF', 'stop_monitoring', seconds(polls[-1]), seconds(polls[-1]))
+    assert feed_cadence.next_poll_time('SF', 'stop_monitoring') == seconds(polls[-1] + 30 + cadence.POLL_DELAY_S)
+
+
+def test_refresh_due_without_spare_budget():
+    feed_cadence = FeedCadence()
+    feed_cadence.observe('SF', 'stop_monitoring', seconds(0), seconds(0))
+    feed_cadence.observe('SF', 'stop_monitoring', seconds(20), seconds(20))
+    assert feed_cadence.refresh_due('SF', 'stop_monitoring', seconds(45), 1)
+    # only the refresh limit polls once the budget is down to its reserve
+    assert not feed_cadence.refresh_due('SF', 'stop_monitoring', seconds(45), 1, spare_budget=False)
+    assert feed_cadence.refresh_due('SF', 'stop_monitoring', seconds(80), 1, spare_budget=False)
+
+
+def test_save_observes_cadence(app):
+    with open("test_input_jsons/vehicle_monitoring_modified.json") as f:
+        vehicles_dict = json.load(f)
+    with open("test_input_jsons/operators.json") as f:
+        operators_dict = json.load(f)
+    later_dict = copy.deepcopy(vehicles_dict)
+    vehicle_activity = later_dict["Siri"]["ServiceDelivery"]["VehicleMonitoringDelivery"]["VehicleActivity"]
+    recorded_time = db_commands.recorded_time(vehicle_activity)
+    vehicle_activity[0]["RecordedAtTime"] = (recorded_time + dt.timedelta(seconds=45)).strftime('%Y-%m-%dT%H:%M:%SZ')
+    # a new ResponseTimestamp alone is not an update of the feed
+    later_dict["Siri"]["ServiceDelivery"]["ResponseTimestamp"] = "2023-09-26T15:05:00Z"
+    with app.app_context():
+        db_commands.save_operators(db, operators_dict)
+        db_commands.save_vehicle_monitoring(db, selected_operator, vehicles_dict, current_time)
+        db_commands.save_vehicle_monitoring(db, selected_operator, later_dict, current_time)
+        assert cadence.current_cadence().interval(selected_operator, 'vehicle_monitoring') == 45
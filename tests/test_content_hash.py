@@ -0,0 +1,93 @@
+import copy
+import datetime as dt
+import json
+
+from transit_notification import content_hash, db, db_commands, metrics
+from transit_notification.models import Line, OnwardCall, Operator, Parameter
+
+selected_operator = 'SF'
+selected_line = '14'
+current_time = dt.datetime(2023, 9, 26, 15, 0, 0, 0, dt.UTC)
+
+
+def load(name):
+    with open(f"test_input_jsons/{name}.json") as f:
+        return json.load(f)
+
+
+def monitoring_updated(column):
+    return db.session.execute(db.select(getattr(Operator, column)).filter_by(operator_id=selected_operator)).scalar()
+
+
+def test_content_digest():
+    rows = [('14', 'MISSION'), ('49', 'VAN NESS')]
+    assert content_hash.content_digest(rows) == content_hash.content_digest(list(rows))
+    assert content_hash.content_digest(rows) != content_hash.content_digest(rows[:1])
+    assert content_hash.content_digest(rows, []) != content_hash.content_digest([], rows)
+
+
+def test_content_digest_stable():
+    """The digest does not depend on the hash seed of the process, so every process stores the same digest."""
+    rows = [('14', 'MISSION', 1, 2.5, None, dt.datetime(2023, 9, 26, 15, 0))]
+    assert content_hash.content_digest(rows) == '5f1a65f90b0da417'
+
+
+def test_unchanged_monitoring_skipped(app):
+    vehicles_dict = load('vehicle_monitoring_modified')
+    with app.app_context():
+        db_commands.save_operators(db, load('operators'))
+        db_commands.save_vehicle_monitoring(db, selected_operator, vehicles_dict, current_time)
+        skipped = metrics.INGEST_WRITES_SKIPPED.value('vehicle_monitoring')
+        written = metrics.ROWS_WRITTEN.value('onward_call')
+        later_time = current_time + dt.timedelta(minutes=1)
+        db_commands.save_vehicle_monitoring(db, selected_operator, vehicles_dict, later_time)
+        assert metrics.INGEST_WRITES_SKIPPED.value('vehicle_monitoring') == skipped + 1
+        assert metrics.ROWS_WRITTEN.value('onward_call') == written
+        assert monitoring_updated('vehicle_monitoring_updated').replace(tzinfo=dt.UTC) == later_time
+        assert len(db.session.execute(db.select(OnwardCall)).all()) == 106
+
+        changed_dict = copy.deepcopy(vehicles_dict)
+        del changed_dict["Siri"]["ServiceDelivery"]["VehicleMonitoringDelivery"]["VehicleActivity"][0]
+        db_commands.save_vehicle_monitoring(db, selected_operator, changed_dict, later_time)
+        assert metrics.INGEST_WRITES_SKIPPED.value('vehicle_monitoring') == skipped + 1
+        assert metrics.ROWS_WRITTEN.value('onward_call') > written
+        assert len(db.session.execute(db.select(OnwardCall)).all()) < 106
+
+
+def test_monitoring_datasets_share_digest(app):
+    vehicles_dict = load('vehicle_monitoring_modified')
+    with app.app_context():
+        db_commands.save_operators(db, load('operators'))
+        db_commands.save_vehicle_monitoring(db, selected_operator, vehicles_dict, current_time)
+        db_commands.save_stop_monitoring(db, selected_operator, load('stop_monitoring_15553'), current_time)
+        db_commands.save_vehicle_monitoring(db, selected_operator, vehicles_dict, current_time)
+        assert len(db.session.execute(db.select(OnwardCall)).all()) == 106
+
+
+def test_new_lines_forget_patterns(app):
+    with app.app_context():
+        db_commands.save_operators(db, load('operators'))
+        db_commands.save_lines(db, selected_operator, load('lines'), current_time)
+        db_commands.save_patterns(db, selected_operator, selected_line, load('patterns'))
+        lines_dict = load('lines')
+        lines_dict[0]['Name'] = 'RENAMED'
+        db_commands.save_lines(db, selected_operator, lines_dict, current_time)
+        assert db.session.get(Parameter, content_hash.parameter_name('patterns', selected_operator,
+                                                                     selected_line)) is None
+        db_commands.save_patterns(db, selected_operator, selected_line, load('patterns'))
+        line = db.session.execute(db.select(Line).filter_by(operator_id=selected_operator,
+                                                            line_id=selected_line)).scalar()
+        assert line.direction_0_id is not None
+
+
+def test_forget_digests_scope(app):
+    with app.app_context():
+        content_hash.store_digest(db, ('patterns', 'S_', '1'), 'a')
+        content_hash.store_digest(db, ('patterns', 'SF', '1'), 'b')
+        content_hash.store_digest(db, ('patterns', 'SFO', '1'), 'c')
+        db.session.commit()
+        content_hash.forget_digests(db, 'patterns', 'S_')
+        db.session.commit()
+        names = set(db.session.execute(db.select(Parameter.name).where(
+            Parameter.name.startswith(content_hash.PARAMETER_PREFIX))).scalars())
+        assert names == {'content_hash:patterns:SF:1', 'content_hash:patterns:SFO:1'}
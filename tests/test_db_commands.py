@@ -1,23 +1,34 @@
-import pytest
+import datetime as dt
 import json
+from collections import OrderedDict, defaultdict
 
-from transit_notification import create_app, db, db_commands
-from transit_notification.models import (Operator, Vehicle, OnwardCall, Line, Stop, StopPattern, Pattern,
-                                         StopTimetable, Parameter, Shape)
-import datetime as dt
-from tests.test_comparison_jsons import TestComparisonJsons
-from collections import defaultdict, OrderedDict
 import dateutil
+import pytest
+
+from tests.test_comparison_jsons import TestComparisonJsons
+from transit_notification import db, db_commands, query_stats
+from transit_notification.models import (
+    Line,
+    OnwardCall,
+    Operator,
+    Parameter,
+    Pattern,
+    Shape,
+    Stop,
+    StopPattern,
+    StopTimetable,
+    Vehicle,
+)
 
 selected_operator = 'SF'
 selected_stop = '15553'
 selected_line = '14'
 current_time = dt.datetime(2023, 9, 26, 15, 0, 0, 0,
-                           dt.timezone.utc)
+                           dt.UTC)
 
 
 def test_save_operators(app):
-    with open("test_input_jsons/operators.json", 'r') as f:
+    with open("test_input_jsons/operators.json") as f:
         operators_dict = json.load(f)
     with app.app_context():
         db_commands.save_operators(db, operators_dict)
@@ -28,9 +39,9 @@ def test_save_operators(app):
 
 
 def test_save_lines(app):
-    with open("test_input_jsons/operators.json", 'r') as f:
+    with open("test_input_jsons/operators.json") as f:
         operators_dict = json.load(f)
-    with open("test_input_jsons/lines.json", 'r') as f:
+    with open("test_input_jsons/lines.json") as f:
         line_dict = json.load(f)
     with app.app_context():
         db_commands.save_operators(db, operators_dict)
@@ -39,14 +50,15 @@ def test_save_lines(app):
         lines = db.session.execute(select).scalars().all()
         line_cmp_dict = remove_internal_keys(TestComparisonJsons.line_14.__dict__)
         line_cmp_dict.update({'direction_0_id': None, 'direction_0_name': None, 'direction_1_id': None,
-                              'direction_1_name': None, 'shape_updated': None})
+                              'direction_1_name': None, 'shape_updated': None,
+                              'patterns_updated': None})
         assert remove_internal_keys(lines[0].__dict__) == line_cmp_dict
 
 
 def test_save_stops(app):
-    with open("test_input_jsons/operators.json", 'r') as f:
+    with open("test_input_jsons/operators.json") as f:
         operators_dict = json.load(f)
-    with open("test_input_jsons/stops.json", 'r') as f:
+    with open("test_input_jsons/stops.json") as f:
         stop_dict = json.load(f)
     with app.app_context():
         db_commands.save_operators(db, operators_dict)
@@ -58,16 +70,16 @@ def test_save_stops(app):
 
 
 def test_parse_vehicle_dict():
-    with open("test_input_jsons/vehicle_monitoring_modified.json", 'r') as f:
+    with open("test_input_jsons/vehicle_monitoring_modified.json") as f:
         vehicles_dict = json.load(f)
     vehicle_list = vehicles_dict["Siri"]["ServiceDelivery"]["VehicleMonitoringDelivery"]["VehicleActivity"]
     parsed_vehicle, onward_call = db_commands.parse_vehicle_dict(selected_operator, vehicle_list[0])
-    assert remove_internal_keys(parsed_vehicle.__dict__) == \
+    assert parsed_vehicle._asdict() == \
            remove_internal_keys(TestComparisonJsons.vehicle_0.__dict__)
 
 
 def test_onward_call():
-    with open("test_input_jsons/vehicle_monitoring_modified.json", 'r') as f:
+    with open("test_input_jsons/vehicle_monitoring_modified.json") as f:
         vehicles_dict = json.load(f)
     vehicle_list = vehicles_dict["Siri"]["ServiceDelivery"]["VehicleMonitoringDelivery"]["VehicleActivity"]
     vehicle = vehicle_list[0]
@@ -78,16 +90,16 @@ def test_onward_call():
                                                    dataframe_ref,
                                                    vehicle_list[0]["MonitoredVehicleJourney"])
     assert len(onward_calls) == 18
-    assert remove_internal_keys(onward_calls[-1].__dict__) == \
+    assert onward_calls[-1]._asdict() == \
            remove_internal_keys(TestComparisonJsons.vehicle_onward_calls[0].__dict__)
-    assert remove_internal_keys(onward_calls[0].__dict__) == \
+    assert onward_calls[0]._asdict() == \
            remove_internal_keys(TestComparisonJsons.vehicle_onward_calls[1].__dict__)
 
 
 def test_save_vehicle_monitoring(app):
-    with open("test_input_jsons/vehicle_monitoring_modified.json", 'r') as f:
+    with open("test_input_jsons/vehicle_monitoring_modified.json") as f:
         vehicles_dict = json.load(f)
-    with open("test_input_jsons/operators.json", 'r') as f:
+    with open("test_input_jsons/operators.json") as f:
         operators_dict = json.load(f)
     with app.app_context():
         db_commands.save_operators(db, operators_dict)
@@ -112,17 +124,17 @@ def test_save_vehicle_monitoring(app):
 
 def test_upcoming_vehicles(app):
 
-    with open("test_input_jsons/vehicle_monitoring_modified.json", 'r') as f:
+    with open("test_input_jsons/vehicle_monitoring_modified.json") as f:
         vehicles_dict = json.load(f)
-    with open("test_input_jsons/operators.json", 'r') as f:
+    with open("test_input_jsons/operators.json") as f:
         operators_dict = json.load(f)
-    with open("test_input_jsons/lines.json", 'r') as f:
+    with open("test_input_jsons/lines.json") as f:
         line_dict = json.load(f)
-    with open("test_input_jsons/stops.json", 'r') as f:
+    with open("test_input_jsons/stops.json") as f:
         stop_dict = json.load(f)
-    with open("test_input_jsons/patterns.json", 'r') as f:
+    with open("test_input_jsons/patterns.json") as f:
         pattern_dict = json.load(f)
-    with open("test_input_jsons/stop_timetable_15553.json", 'r') as f:
+    with open("test_input_jsons/stop_timetable_15553.json") as f:
         stop_timetable = json.load(f)
     with app.app_context():
         db_commands.save_operators(db, operators_dict)
@@ -136,7 +148,7 @@ def test_upcoming_vehicles(app):
 
 
 def test_save_stop_pattern(app):
-    with open("test_input_jsons/patterns.json", 'r') as f:
+    with open("test_input_jsons/patterns.json") as f:
         pattern_dict = json.load(f)
     pattern = pattern_dict['journeyPatterns'][0]
     pattern_id = pattern['serviceJourneyPatternRef']
@@ -150,13 +162,13 @@ def test_save_stop_pattern(app):
 
 
 def test_save_patterns(app):
-    with open("test_input_jsons/operators.json", 'r') as f:
+    with open("test_input_jsons/operators.json") as f:
         operators_dict = json.load(f)
-    with open("test_input_jsons/lines.json", 'r') as f:
+    with open("test_input_jsons/lines.json") as f:
         line_dict = json.load(f)
-    with open("test_input_jsons/stops.json", 'r') as f:
+    with open("test_input_jsons/stops.json") as f:
         stop_dict = json.load(f)
-    with open("test_input_jsons/patterns.json", 'r') as f:
+    with open("test_input_jsons/patterns.json") as f:
         pattern_dict = json.load(f)
     with app.app_context():
         db_commands.save_operators(db, operators_dict)
@@ -171,15 +183,15 @@ def test_save_patterns(app):
 
 
 def test_stop_timetable(app):
-    with open("test_input_jsons/operators.json", 'r') as f:
+    with open("test_input_jsons/operators.json") as f:
         operators_dict = json.load(f)
-    with open("test_input_jsons/lines.json", 'r') as f:
+    with open("test_input_jsons/lines.json") as f:
         line_dict = json.load(f)
-    with open("test_input_jsons/stops.json", 'r') as f:
+    with open("test_input_jsons/stops.json") as f:
         stop_dict = json.load(f)
-    with open("test_input_jsons/patterns.json", 'r') as f:
+    with open("test_input_jsons/patterns.json") as f:
         pattern_dict = json.load(f)
-    with open("test_input_jsons/stop_timetable_15553.json", 'r') as f:
+    with open("test_input_jsons/stop_timetable_15553.json") as f:
         stop_timetable = json.load(f)
     with app.app_context():
         db_commands.save_operators(db, operators_dict)
@@ -196,21 +208,51 @@ def test_stop_timetable(app):
                remove_internal_keys(TestComparisonJsons.stop_timetable_1.__dict__)
 
 
+def test_stop_timetable_refresh_needed(app):
+    with open("test_input_jsons/operators.json") as f:
+        operators_dict = json.load(f)
+    with open("test_input_jsons/stops.json") as f:
+        stop_dict = json.load(f)
+    with open("test_input_jsons/stop_timetable_15553.json") as f:
+        stop_timetable = json.load(f)
+    with app.app_context():
+        db_commands.save_operators(db, operators_dict)
+        db_commands.save_stops(db, selected_operator, stop_dict, current_time)
+        assert db_commands.stop_timetable_refresh_needed(db, selected_operator, selected_stop, 60, current_time)
+        db_commands.save_stop_timetable(db, selected_operator, selected_stop, stop_timetable, current_time)
+        assert not db_commands.stop_timetable_refresh_needed(db, selected_operator, selected_stop, 60, current_time)
+        later_time = current_time + dt.timedelta(minutes=60)
+        assert db_commands.stop_timetable_refresh_needed(db, selected_operator, selected_stop, 60, later_time)
+        # an unchanged response still refreshes the update time
+        db_commands.save_stop_timetable(db, selected_operator, selected_stop, stop_timetable, later_time)
+        assert not db_commands.stop_timetable_refresh_needed(db, selected_operator, selected_stop, 60, later_time)
+
+
+def test_parse_stop_timetable():
+    with open("test_input_jsons/stop_timetable_15553.json") as f:
+        stop_timetable = json.load(f)
+    records = db_commands.parse_stop_timetable(selected_operator, stop_timetable)
+    record = next(record for record in records if record.vehicle_journey_ref == "Schedule_0-Est_0")
+    assert {key: value.replace(tzinfo=None) if isinstance(value, dt.datetime) else value
+            for key, value in record._asdict().items()} == \
+           remove_internal_keys(TestComparisonJsons.stop_timetable_1.__dict__)
+
+
 def test_parse_stop_monitoring_dict():
-    with open("test_input_jsons/stop_monitoring_15553.json", 'r') as f:
+    with open("test_input_jsons/stop_monitoring_15553.json") as f:
         stop_monitoring_dict = json.load(f)
     monitored_stop_visit = stop_monitoring_dict['ServiceDelivery']['StopMonitoringDelivery']['MonitoredStopVisit'][0]
     vehicle, onward_call = db_commands.parse_stop_monitoring_dict(selected_operator, monitored_stop_visit)
-    assert (remove_internal_keys(vehicle.__dict__) ==
+    assert (vehicle._asdict() ==
             remove_internal_keys(TestComparisonJsons.stop_monitoring_vehicle.__dict__))
-    assert remove_internal_keys(onward_call.__dict__) == \
+    assert onward_call._asdict() == \
            remove_internal_keys(TestComparisonJsons.stop_monitoring_onward_call.__dict__)
 
 
 def test_save_stop_monitoring(app):
-    with open("test_input_jsons/stop_monitoring_15553.json", 'r') as f:
+    with open("test_input_jsons/stop_monitoring_15553.json") as f:
         stop_monitoring_dict = json.load(f)
-    with open("test_input_jsons/operators.json", 'r') as f:
+    with open("test_input_jsons/operators.json") as f:
         operators_dict = json.load(f)
     with app.app_context():
         db_commands.save_operators(db, operators_dict)
@@ -231,17 +273,17 @@ def test_save_stop_monitoring(app):
 
 
 def test_stop_monitoring_etas(app):
-    with open("test_input_jsons/stop_monitoring_15553.json", 'r') as f:
+    with open("test_input_jsons/stop_monitoring_15553.json") as f:
         stop_monitoring_dict = json.load(f)
-    with open("test_input_jsons/operators.json", 'r') as f:
+    with open("test_input_jsons/operators.json") as f:
         operators_dict = json.load(f)
-    with open("test_input_jsons/lines.json", 'r') as f:
+    with open("test_input_jsons/lines.json") as f:
         line_dict = json.load(f)
-    with open("test_input_jsons/stops.json", 'r') as f:
+    with open("test_input_jsons/stops.json") as f:
         stop_dict = json.load(f)
-    with open("test_input_jsons/patterns.json", 'r') as f:
+    with open("test_input_jsons/patterns.json") as f:
         pattern_dict = json.load(f)
-    with open("test_input_jsons/stop_timetable_15553.json", 'r') as f:
+    with open("test_input_jsons/stop_timetable_15553.json") as f:
         stop_timetable = json.load(f)
     with app.app_context():
         db_commands.save_operators(db, operators_dict)
@@ -254,17 +296,17 @@ def test_stop_monitoring_etas(app):
         assert upcoming_dict == TestComparisonJsons.stop_monitoring_upcoming_vehicles
 
 def test_determine_vehicle_ref_full_journey(app):
-    with open("test_input_jsons/operators.json", 'r') as f:
+    with open("test_input_jsons/operators.json") as f:
         operators_dict = json.load(f)
-    with open("test_input_jsons/lines.json", 'r') as f:
+    with open("test_input_jsons/lines.json") as f:
         line_dict = json.load(f)
-    with open("test_input_jsons/stops.json", 'r') as f:
+    with open("test_input_jsons/stops.json") as f:
         stop_dict = json.load(f)
-    with open("test_input_jsons/patterns.json", 'r') as f:
+    with open("test_input_jsons/patterns.json") as f:
         pattern_dict = json.load(f)
-    with open("test_input_jsons/stop_timetable_15553.json", 'r') as f:
+    with open("test_input_jsons/stop_timetable_15553.json") as f:
         stop_timetable_15553 = json.load(f)
-    with open("test_input_jsons/stop_timetable_15557.json", 'r') as f:
+    with open("test_input_jsons/stop_timetable_15557.json") as f:
         stop_timetable_15557 = json.load(f)
     with app.app_context():
         db_commands.save_operators(db, operators_dict)
@@ -286,9 +328,9 @@ def test_determine_vehicle_ref_full_journey(app):
 
 
 def test_refresh_limit(app):
-    with open("test_input_jsons/operators.json", 'r') as f:
+    with open("test_input_jsons/operators.json") as f:
         operators_dict = json.load(f)
-    with open("test_input_jsons/lines.json", 'r') as f:
+    with open("test_input_jsons/lines.json") as f:
         line_dict = json.load(f)
     with app.app_context():
         db_commands.save_operators(db, operators_dict)
@@ -368,13 +410,18 @@ def test_save_operator_refresh_time(app):
             name="operator_refresh_time")).scalar_one_or_none()
         last_update_time = dateutil.parser.isoparse(operator_refresh_time.value).replace(tzinfo=None)
         assert last_update_time == current_time.replace(tzinfo=None)
+        later_time = current_time + dt.timedelta(minutes=5)
+        db_commands.save_operator_refresh_time(db, later_time)
+        operator_refresh_time = db.session.execute(db.select(Parameter).filter_by(
+            name="operator_refresh_time")).scalar_one()
+        assert dateutil.parser.isoparse(operator_refresh_time.value) == later_time
 
 def test_save_shape(app):
-    with open("test_input_jsons/operators.json", 'r') as f:
+    with open("test_input_jsons/operators.json") as f:
         operators_dict = json.load(f)
-    with open("test_input_jsons/lines.json", 'r') as f:
+    with open("test_input_jsons/lines.json") as f:
         line_dict = json.load(f)
-    with open("test_input_jsons/shape.json", 'r') as f:
+    with open("test_input_jsons/shape.json") as f:
         shape_dict = json.load(f)
     with app.app_context():
         db_commands.save_operators(db, operators_dict)
@@ -391,3 +438,42 @@ def test_save_shape(app):
 
 
 
+
+
+def test_upcoming_vehicles_for_stops(app):
+    with open("test_input_jsons/stop_monitoring_15553.json") as f:
+        stop_monitoring_dict = json.load(f)
+    with open("test_input_jsons/operators.json") as f:
+        operators_dict = json.load(f)
+    with open("test_input_jsons/stops.json") as f:
+        stop_dict = json.load(f)
+    with app.app_context():
+        db_commands.save_operators(db, operators_dict)
+        db_commands.save_stops(db, selected_operator, stop_dict, current_time)
+        db_commands.save_stop_monitoring(db, selected_operator, stop_monitoring_dict, current_time)
+        stop_ids = ['15551', '15553', 'missing']
+        with query_stats.assert_max_queries(1):
+            board = db_commands.upcoming_vehicles_for_stops(db, selected_operator, stop_ids, current_time)
+        assert board[selected_stop] == TestComparisonJsons.stop_monitoring_upcoming_vehicles
+        assert board['15551'] == db_commands.upcoming_vehicles(db, selected_operator, '15551', current_time)
+        assert 'missing' not in board
+        # only the vehicle at the stop is left once the expected arrivals have passed
+        later = current_time + dt.timedelta(hours=2)
+        assert db_commands.upcoming_vehicles_for_stops(db, selected_operator, stop_ids, later) == \
+               {selected_stop: {'14': ['Arriving']}}
+
+
+def test_station_stop_ids(app):
+    with open("test_input_jsons/operators.json") as f:
+        operators_dict = json.load(f)
+    with open("test_input_jsons/stops.json") as f:
+        stop_dict = json.load(f)
+    with app.app_context():
+        db_commands.save_operators(db, operators_dict)
+        db_commands.save_stops(db, selected_operator, stop_dict, current_time)
+        # the other side of the street has the same name
+        db.session.add(Stop(selected_operator, '99999', 'Mission St & 18th St', -122.4195, 37.7627))
+        db.session.commit()
+        assert db_commands.station_stop_ids(db, selected_operator, selected_stop) == ['15553', '99999']
+        assert db_commands.station_stop_ids(db, selected_operator, '15551') == ['15551']
+        assert db_commands.station_stop_ids(db, selected_operator, 'missing') == []
@@ -0,0 +1,115 @@
+import datetime as dt
+import json
+
+from transit_notification import cadence, db, db_commands, demand, metrics
+from transit_notification.demand import POLL_AGENCY, POLL_STOPS, DemandTracker
+from transit_notification.models import OnwardCall, OnwardCallArchive, Operator
+
+selected_operator = 'SF'
+current_time = dt.datetime(2023, 9, 26, 15, 0, 0, 0, dt.UTC)
+
+
+def load(name):
+    with open(f"test_input_jsons/{name}.json") as f:
+        return json.load(f)
+
+
+def test_hot_stops():
+    tracker = DemandTracker(window_s=60)
+    tracker.record_view('SF', '15553', current_time)
+    tracker.record_view('SF', '15551', current_time - dt.timedelta(seconds=61))
+    tracker.record_view('AC', '1', current_time)
+    tracker.subscribe('SF', '15557')
+    tracker.subscribe('SF', '15559', until=current_time - dt.timedelta(seconds=1))
+    assert tracker.hot_stops('SF', current_time) == ['15553', '15557']
+    tracker.unsubscribe('SF', '15557')
+    assert tracker.hot_stops('SF', current_time) == ['15553']
+
+
+def test_choose_poll():
+    tracker = DemandTracker(max_stop_requests=3)
+    # the size of the agency response is not known yet
+    assert tracker.choose_poll('SF', 1) == POLL_AGENCY
+    tracker.mark_agency_refreshed('SF', 20000)
+    assert tracker.choose_poll('SF', 1) == POLL_STOPS
+    assert tracker.choose_poll('SF', 3) == POLL_STOPS
+    assert tracker.choose_poll('SF', 4) == POLL_AGENCY
+    assert tracker.choose_poll('SF', 0) == POLL_AGENCY
+    # single stop requests would use the reserve of the request budget
+    assert tracker.choose_poll('SF', 2, budget=16, capacity=60) == POLL_AGENCY
+    assert tracker.choose_poll('SF', 2, budget=60, capacity=60) == POLL_STOPS
+    # a small agency is cheaper in one request
+    tracker.mark_agency_refreshed('SF', 100)
+    assert tracker.choose_poll('SF', 2) == POLL_AGENCY
+
+
+def test_stop_refreshed_within():
+    tracker = DemandTracker()
+    assert not tracker.stop_refreshed_within('SF', '15553', 1, current_time)
+    tracker.mark_stops_refreshed('SF', ['15553'], 6, current_time)
+    assert tracker.stop_refreshed_within('SF', '15553', 1, current_time + dt.timedelta(seconds=59))
+    assert not tracker.stop_refreshed_within('SF', '15553', 1, current_time + dt.timedelta(seconds=60))
+    tracker.mark_agency_refreshed('SF', 100)
+    assert not tracker.stop_refreshed_within('SF', '15553', 1, current_time)
+
+
+def test_refresh_stop_monitoring(app, monkeypatch):
+    stop_monitoring = load('stop_monitoring_15553')
+    requests = []
+
+    def get_stop_monitoring_dict(transit_api_key, siri_base_url, operator_id, stop_id=None):
+        requests.append(stop_id)
+        return stop_monitoring
+
+    monkeypatch.setattr(db_commands, 'get_stop_monitoring_dict', get_stop_monitoring_dict)
+    tracker = DemandTracker()
+    tracker.record_view(selected_operator, '15553', current_time)
+    with app.app_context():
+        db_commands.save_operators(db, load('operators'))
+        polls = metrics.DEMAND_POLLS.value(POLL_STOPS)
+        assert demand.refresh_stop_monitoring(db, tracker, 'key', 'url', selected_operator,
+                                              current_time) == POLL_AGENCY
+        stored = db.session.execute(db.select(OnwardCall.stop_id)).scalars().all()
+        assert set(stored) == {'15553', '15551'}
+
+        # the agency is large enough to make the single stop request cheaper
+        tracker.mark_agency_refreshed(selected_operator, 50000)
+        assert demand.refresh_stop_monitoring(db, tracker, 'key', 'url', selected_operator,
+                                              current_time) == POLL_STOPS
+        assert requests == [None, '15553']
+        assert metrics.DEMAND_POLLS.value(POLL_STOPS) == polls + 1
+        assert tracker.stop_refreshed_within(selected_operator, '15553', 1, current_time)
+        # the predictions of the other stops are kept
+        assert sorted(db.session.execute(db.select(OnwardCall.stop_id)).scalars().all()) == sorted(stored)
+
+
+def test_refresh_single_stops_bookkeeping(app, monkeypatch):
+    stop_monitoring = load('stop_monitoring_15553')
+    monkeypatch.setattr(db_commands, 'get_stop_monitoring_dict',
+                        lambda transit_api_key, siri_base_url, operator_id, stop_id=None: stop_monitoring)
+    tracker = DemandTracker()
+    tracker.record_view(selected_operator, '15553', current_time)
+    tracker.mark_agency_refreshed(selected_operator, 50000)
+    with app.app_context():
+        db_commands.save_operators(db, load('operators'))
+        assert demand.refresh_stop_monitoring(db, tracker, 'key', 'url', selected_operator, current_time,
+                                              archive=True) == POLL_STOPS
+        updated = db.session.execute(db.select(Operator.stop_monitoring_updated).filter_by(
+            operator_id=selected_operator)).scalar()
+        assert updated == current_time.replace(tzinfo=None)
+        # only the onward calls of the requested stop are archived
+        archived = db.session.execute(db.select(OnwardCallArchive.stop_id)).scalars().all()
+        assert archived and set(archived) == {'15553'}
+
+        # the single stop responses teach the cadence of the feed
+        visits = demand.monitored_stop_visits(stop_monitoring)
+        recorded_time = db_commands.recorded_time(visits)
+        visits[0]["RecordedAtTime"] = (recorded_time + dt.timedelta(seconds=30)).strftime('%Y-%m-%dT%H:%M:%SZ')
+        later_time = current_time + dt.timedelta(seconds=30)
+        demand.refresh_stop_monitoring(db, tracker, 'key', 'url', selected_operator, later_time)
+        assert cadence.current_cadence().interval(selected_operator, 'stop_monitoring') == 30
+
+
+def test_tracker_created(app):
+    with app.app_context():
+        assert isinstance(demand.current_tracker(), DemandTracker)
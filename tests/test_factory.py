@@ -1,6 +1,5 @@
 from transit_notification import create_app
-import os
-from unittest import mock
+
 
 def test_config():
     """ Test create_app without passing test config. """
@@ -13,11 +12,12 @@ def test_hello(client):
     assert response.data == b'Hello World!'
 
 
-@mock.patch.dict(os.environ, {"DATABASE_URI": "sqlite:///environ"})
-def test_db_url_environ(monkeypatch):
+def test_db_url_environ(monkeypatch, tmp_path):
     """Test DATABASE_URL environment variable."""
+    database_uri = 'sqlite:///' + str(tmp_path / 'environ')
+    monkeypatch.setenv("DATABASE_URI", database_uri)
     app = create_app()
-    assert app.config["SQLALCHEMY_DATABASE_URI"] == "sqlite:///environ"
+    assert app.config["SQLALCHEMY_DATABASE_URI"] == database_uri
 
 
 def test_init_db_command(runner, monkeypatch):
@@ -0,0 +1,142 @@
+import datetime as dt
+import json
+import zipfile
+
+import pytest
+
+from transit_notification import db, db_commands, gtfs
+from transit_notification.models import Line, Operator, Pattern, Shape, Stop, StopPattern, StopTimetable
+
+selected_operator = 'SF'
+selected_line = '14'
+# a tuesday, 15:00 utc is 08:00 in the timezone of the test feed
+service_date = dt.date(2023, 9, 26)
+current_time = dt.datetime(2023, 9, 26, 15, 0, 0, 0, dt.UTC)
+
+FEED = {
+    'agency.txt': ["agency_id,agency_name,agency_url,agency_timezone",
+                   "SF,Muni,https://www.sfmta.com,America/Los_Angeles"],
+    'stops.txt': ["stop_id,stop_name,stop_lat,stop_lon,location_type",
+                  "A,Mission St & 1st St,37.79,-122.40,0",
+                  "B,Mission St & 16th St,37.76,-122.42,0",
+                  "C,Mission St & Cortland Ave,37.74,-122.42,0",
+                  "E,Station entrance,,,2"],
+    'trips.txt': ["route_id,service_id,trip_id,trip_headsign,direction_id,shape_id",
+                  "14,WKDY,T1,Daly City,0,S1",
+                  "14,WKDY,T2,Daly City,0,S1",
+                  "14,WKDY,T3,Downtown,1,S2",
+                  "14,WKND,T4,Cortland,0,S1"],
+    'stop_times.txt': ["trip_id,arrival_time,departure_time,stop_id,stop_sequence,timepoint",
+                       "T1,08:00:00,08:00:00,A,1,1",
+                       "T1,08:10:00,08:11:00,B,2,0",
+                       "T1,08:20:00,08:20:00,C,3,1",
+                       "T2,25:00:00,25:00:00,A,1,1",
+                       "T2,,,B,2,0",
+                       "T2,25:20:00,25:20:00,C,3,1",
+                       "T3,09:00:00,09:00:00,C,1,1",
+                       "T3,09:20:00,09:20:00,A,2,1",
+                       "T4,10:00:00,10:00:00,A,1,1",
+                       "T4,10:20:00,10:20:00,C,2,1"],
+    'calendar.txt': ["service_id,monday,tuesday,wednesday,thursday,friday,saturday,sunday,start_date,end_date",
+                     "WKDY,1,1,1,1,1,0,0,20230101,20231231",
+                     "WKND,0,0,0,0,0,1,1,20230101,20231231"],
+    'calendar_dates.txt': ["service_id,date,exception_type",
+                           "WKDY,20230927,2"],
+    'shapes.txt': ["shape_id,shape_pt_lat,shape_pt_lon,shape_pt_sequence",
+                   "S1,37.79,-122.40,1",
+                   "S1,37.76,-122.42,2",
+                   "S1,37.74,-122.42,3",
+                   "S2,37.74,-122.42,1",
+                   "S2,37.79,-122.40,2"],
+}
+
+
+def load(name):
+    with open(f"test_input_jsons/{name}.json") as f:
+        return json.load(f)
+
+
+def write_feed(path, feed=FEED):
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as f:
+        for name, lines in feed.items():
+            f.writestr(name, "\n".join(lines) + "\n")
+    return str(path)
+
+
+def count(model):
+    return db.session.execute(db.select(db.func.count()).select_from(model)).scalar()
+
+
+def test_import_gtfs(app, tmp_path):
+    path = write_feed(tmp_path / "gtfs.zip")
+    with app.app_context():
+        db_commands.save_operators(db, load('operators'))
+        db_commands.save_lines(db, selected_operator, load('lines'), current_time)
+        counts = gtfs.import_gtfs(db, path, selected_operator, service_date, current_time, chunk_rows=2)
+        assert counts == {'stop': 3, 'stop_pattern': 7, 'stop_timetable': 8, 'pattern': 3, 'shape': 3}
+        assert count(Stop) == 3
+
+        patterns = db.session.execute(db.select(Pattern).order_by(Pattern.pattern_id)).scalars().all()
+        assert [(pattern.pattern_direction, pattern.pattern_trip_count, pattern.pattern_name)
+                for pattern in patterns] == [('0', 2, 'Daly City'), ('1', 1, 'Downtown'), ('0', 1, 'Cortland')]
+        timing_points = db.session.execute(db.select(StopPattern.timing_point).filter_by(
+            pattern_id=patterns[0].pattern_id).order_by(StopPattern.stop_order)).scalars().all()
+        assert timing_points == [True, False, True]
+
+        line = db.session.get(Line, (selected_operator, selected_line))
+        assert (line.direction_0_id, line.direction_0_name) == ('0', 'Daly City')
+        assert (line.direction_1_id, line.direction_1_name) == ('1', 'Downtown')
+        assert line.patterns_updated == current_time.replace(tzinfo=None)
+        assert db.session.get(Operator, selected_operator).stops_updated == current_time.replace(tzinfo=None)
+
+        # only the weekday trips run on the service date, times past 24:00 belong to the next calendar day
+        visits = {(row.vehicle_journey_ref, row.stop_id): row for row in
+                  db.session.execute(db.select(StopTimetable)).scalars()}
+        assert sorted({trip_id for trip_id, _ in visits}) == ['T1', 'T2', 'T3']
+        assert visits[('T1', 'A')].aimed_arrival_time_utc == dt.datetime(2023, 9, 26, 15, 0)
+        assert visits[('T1', 'B')].aimed_departure_time_utc == dt.datetime(2023, 9, 26, 15, 11)
+        assert visits[('T2', 'A')].aimed_arrival_time_utc == dt.datetime(2023, 9, 27, 8, 0)
+        assert visits[('T2', 'B')].aimed_arrival_time_utc is None
+
+        shape_points = db.session.execute(db.select(Shape).order_by(Shape.shape_order)).scalars().all()
+        assert [point.shape_latitude for point in shape_points] == [37.79, 37.76, 37.74]
+
+
+def test_active_services(tmp_path):
+    path = write_feed(tmp_path / "gtfs.zip")
+    with zipfile.ZipFile(path) as feed:
+        assert gtfs.active_services(feed, service_date) == {'WKDY'}
+        assert gtfs.active_services(feed, dt.date(2023, 9, 27)) == set()
+        assert gtfs.active_services(feed, dt.date(2023, 9, 30)) == {'WKND'}
+
+
+def test_import_replaces_rows(app, tmp_path):
+    path = write_feed(tmp_path / "gtfs.zip")
+    with app.app_context():
+        db_commands.save_operators(db, load('operators'))
+        gtfs.import_gtfs(db, path, selected_operator, service_date, current_time)
+        gtfs.import_gtfs(db, path, selected_operator, service_date, current_time)
+        assert count(Pattern) == 3
+        assert count(StopTimetable) == 8
+
+
+def test_stop_times_must_be_grouped_by_trip(app, tmp_path):
+    feed = dict(FEED)
+    feed['stop_times.txt'] = FEED['stop_times.txt'] + ["T1,08:30:00,08:30:00,C,4,1"]
+    path = write_feed(tmp_path / "gtfs.zip", feed)
+    with app.app_context():
+        db_commands.save_operators(db, load('operators'))
+        with pytest.raises(gtfs.GtfsError):
+            gtfs.import_gtfs(db, path, selected_operator, service_date, current_time)
+        assert count(Stop) == 0
+
+
+def test_import_gtfs_command(app, runner, tmp_path):
+    path = write_feed(tmp_path / "gtfs.zip")
+    with app.app_context():
+        db_commands.save_operators(db, load('operators'))
+    result = runner.invoke(args=["import-gtfs", path, "--operator", selected_operator, "--date", "2023-09-26"])
+    assert result.exit_code == 0
+    assert "stop_timetable: 8 rows" in result.output
+    result = runner.invoke(args=["import-gtfs", str(tmp_path / "missing.zip"), "--operator", selected_operator])
+    assert result.exit_code != 0
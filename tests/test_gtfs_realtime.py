@@ -0,0 +1,138 @@
+import datetime as dt
+import json
+
+import pytest
+import responses
+
+from transit_notification import db, db_commands, gtfs_realtime
+from transit_notification.models import OnwardCall, Operator, Vehicle
+
+gtfs_realtime_pb2 = pytest.importorskip("google.transit.gtfs_realtime_pb2")
+
+selected_operator = 'SF'
+current_time = dt.datetime(2023, 9, 26, 15, 0, 0, 0, dt.UTC)
+feed_url = "http://localhost:8000/gtfs-rt/trip-updates.pb"
+
+
+def load(name):
+    with open(f"test_input_jsons/{name}.json") as f:
+        return json.load(f)
+
+
+def epoch(hour, minute):
+    return int(dt.datetime(2023, 9, 26, hour, minute, tzinfo=dt.UTC).timestamp())
+
+
+def trip_updates_feed():
+    feed_message = gtfs_realtime_pb2.FeedMessage()
+    feed_message.header.gtfs_realtime_version = "2.0"
+    feed_message.header.timestamp = epoch(15, 0)
+    trip_update = feed_message.entity.add(id="1").trip_update
+    trip_update.trip.trip_id = "T1"
+    trip_update.trip.route_id = "14"
+    trip_update.trip.direction_id = 1
+    trip_update.trip.start_date = "20230926"
+    first = trip_update.stop_time_update.add(stop_id="A")
+    first.arrival.time = epoch(15, 2)
+    first.arrival.delay = 120
+    trip_update.stop_time_update.add(stop_id="B",
+                                     schedule_relationship=gtfs_realtime_pb2.TripUpdate.StopTimeUpdate.SKIPPED)
+    last = trip_update.stop_time_update.add(stop_id="C")
+    last.arrival.delay = 60
+    return feed_message
+
+
+def vehicle_positions_feed():
+    feed_message = gtfs_realtime_pb2.FeedMessage()
+    feed_message.header.gtfs_realtime_version = "2.0"
+    feed_message.header.timestamp = epoch(15, 1)
+    vehicle = feed_message.entity.add(id="1").vehicle
+    vehicle.trip.trip_id = "T1"
+    vehicle.trip.start_date = "20230926"
+    vehicle.position.latitude = 37.75
+    vehicle.position.longitude = -122.42
+    vehicle.stop_id = "A"
+    vehicle.current_status = gtfs_realtime_pb2.VehiclePosition.STOPPED_AT
+    # a vehicle without a trip cannot be matched to a journey
+    unassigned = feed_message.entity.add(id="2").vehicle
+    unassigned.position.latitude = 37.7
+    unassigned.position.longitude = -122.4
+    return feed_message
+
+
+def test_parse_feed_merges_trip_updates_and_vehicle_positions():
+    vehicles, onward_calls = gtfs_realtime.parse_feed(selected_operator,
+                                                      [trip_updates_feed(), vehicle_positions_feed()])
+    assert len(vehicles) == 1
+    vehicle = vehicles[0]
+    assert (vehicle.vehicle_journey_ref, vehicle.dataframe_ref_date, vehicle.line_id, vehicle.vehicle_direction) == \
+           ('T1', dt.date(2023, 9, 26), '14', '1')
+    assert vehicle.vehicle_latitude == pytest.approx(37.75)
+    assert vehicle.vehicle_bearing is None
+
+    # the skipped stop is dropped, a delay without a time cannot be resolved without the static timetable
+    assert [call.stop_id for call in onward_calls] == ['A', 'C']
+    assert onward_calls[0].vehicle_at_stop
+    assert onward_calls[0].aimed_arrival_time_utc == dt.datetime(2023, 9, 26, 15, 0)
+    assert onward_calls[0].expected_arrival_time_utc == dt.datetime(2023, 9, 26, 15, 2)
+    assert onward_calls[1].expected_arrival_time_utc is None
+
+
+def test_feed_matches_vehicle_monitoring():
+    vehicle_monitoring = load('vehicle_monitoring_modified')
+    payload = gtfs_realtime.feed_from_vehicle_monitoring(vehicle_monitoring)
+    vehicles, onward_calls = gtfs_realtime.parse_feed(selected_operator, [gtfs_realtime.decode_feed(payload)])
+    expected_vehicles, expected_calls = db_commands.parse_vehicle_monitoring(selected_operator, vehicle_monitoring)
+    assert sorted(onward_calls) == sorted(expected_calls)
+
+    directions = {str(direction_id): direction for direction, direction_id in gtfs_realtime.SIRI_DIRECTIONS.items()}
+    assert len(vehicles) == len(expected_vehicles)
+    for vehicle, expected in zip(sorted(vehicles), sorted(expected_vehicles), strict=True):
+        assert vehicle[:4] == expected[:4]
+        assert directions[vehicle.vehicle_direction] == expected.vehicle_direction
+        # positions are single precision floats in the feed
+        assert vehicle[5:] == pytest.approx(expected[5:], abs=1e-4)
+
+
+def test_save_gtfs_realtime(app):
+    payload = gtfs_realtime.feed_from_vehicle_monitoring(load('vehicle_monitoring_modified'))
+    with app.app_context():
+        db_commands.save_operators(db, load('operators'))
+        assert gtfs_realtime.save_gtfs_realtime(db, selected_operator, [payload], current_time)
+        assert db.session.execute(db.select(db.func.count()).select_from(OnwardCall)).scalar() == 106
+        assert db.session.execute(db.select(db.func.count()).select_from(Vehicle)).scalar() > 0
+        assert not gtfs_realtime.save_gtfs_realtime(db, selected_operator, [payload], current_time)
+
+
+@responses.activate
+def test_read_feed(tmp_path):
+    payload = trip_updates_feed().SerializeToString()
+    path = tmp_path / "trip_updates.pb"
+    path.write_bytes(payload)
+    responses.add(responses.GET, feed_url, body=payload, status=200,
+                  content_type="application/x-protobuf")
+    assert gtfs_realtime.read_feed(str(path)) == payload
+    assert gtfs_realtime.read_feed(f"file://{path}") == payload
+    assert gtfs_realtime.read_feed(feed_url) == payload
+    with pytest.raises(gtfs_realtime.GtfsRealtimeError):
+        gtfs_realtime.read_feed(str(tmp_path / "missing.pb"))
+    with pytest.raises(gtfs_realtime.GtfsRealtimeError):
+        gtfs_realtime.decode_feed(b"not a feed message")
+
+
+def test_ingest_gtfs_realtime_command(app, runner, tmp_path):
+    trip_updates = tmp_path / "trip_updates.pb"
+    trip_updates.write_bytes(trip_updates_feed().SerializeToString())
+    vehicle_positions = tmp_path / "vehicle_positions.pb"
+    vehicle_positions.write_bytes(vehicle_positions_feed().SerializeToString())
+    with app.app_context():
+        db_commands.save_operators(db, load('operators'))
+    result = runner.invoke(args=["ingest-gtfs-rt", str(trip_updates), str(vehicle_positions),
+                                 "--operator", selected_operator])
+    assert result.exit_code == 0
+    assert "Ingested 2 feeds as SF" in result.output
+    with app.app_context():
+        # the test trip ran in the past, so its rows may already be evicted, but the update is recorded
+        assert db.session.get(Operator, selected_operator).vehicle_monitoring_updated is not None
+    result = runner.invoke(args=["ingest-gtfs-rt", str(tmp_path / "missing.pb"), "--operator", selected_operator])
+    assert result.exit_code != 0
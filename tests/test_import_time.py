@@ -0,0 +1,31 @@
+import subprocess
+import sys
+
+# total import time of create_app measured with python -X importtime, in seconds
+IMPORT_TIME_BUDGET_S = 1.0
+# modules that must only be imported by the functions that need them
+LAZY_MODULES = {'pandas', 'numpy', 'natsort', 'dateutil', 'siri_transit_api_client', 'requests'}
+
+STARTUP_CODE = ("from transit_notification import create_app; "
+                "create_app({'TESTING': True, 'SQLALCHEMY_DATABASE_URI': 'sqlite://'})")
+
+
+def import_times():
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', STARTUP_CODE],
+                            capture_output=True, text=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # top level imports are only indented by the separator space
+        times[name.rstrip()] = (int(cumulative), not name[1:].startswith(' '))
+    return times
+
+
+def test_create_app_import_budget():
+    times = import_times()
+    imported = {name.strip().split('.')[0] for name in times}
+    assert imported.isdisjoint(LAZY_MODULES), imported & LAZY_MODULES
+    total_us = sum(cumulative for cumulative, top_level in times.values() if top_level)
+    assert total_us / 1e6 < IMPORT_TIME_BUDGET_S
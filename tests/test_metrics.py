@@ -0,0 +1,95 @@
+import datetime as dt
+import json
+
+from transit_notification import db, db_commands, metrics
+
+selected_operator = 'SF'
+current_time = dt.datetime(2023, 9, 26, 15, 0, 0, 0, dt.UTC)
+
+
+def test_histogram_render():
+    histogram = metrics.Histogram('test_seconds', 'Test histogram.', ['function'], buckets=(0.1, 1.0))
+    metrics.REGISTRY.remove(histogram)
+    histogram.observe(0.05, 'f')
+    histogram.observe(0.5, 'f')
+    histogram.observe(5, 'f')
+    assert histogram.count('f') == 3
+    assert histogram.render() == ['# HELP test_seconds Test histogram.',
+                                  '# TYPE test_seconds histogram',
+                                  'test_seconds_bucket{function="f",le="0.1"} 1',
+                                  'test_seconds_bucket{function="f",le="1.0"} 2',
+                                  'test_seconds_bucket{function="f",le="+Inf"} 3',
+                                  'test_seconds_sum{function="f"} 5.55',
+                                  'test_seconds_count{function="f"} 3']
+
+
+def test_counter_and_labels():
+    counter = metrics.Counter('test_total', 'Test counter.', ['table'])
+    metrics.REGISTRY.remove(counter)
+    counter.inc(2, 'a"b')
+    counter.inc(1, 'a"b')
+    assert counter.value('a"b') == 3
+    assert counter.samples() == ['test_total{table="a\\"b"} 3.0']
+
+
+def test_timed():
+    histogram = metrics.Histogram('test_timed_seconds', 'Test histogram.', ['function'])
+    metrics.REGISTRY.remove(histogram)
+
+    @metrics.timed(histogram, 'add')
+    def add(a, b):
+        return a + b
+
+    assert add(1, 2) == 3
+    assert add.__name__ == 'add'
+    assert histogram.count('add') == 1
+
+
+def test_ingest_metrics(app):
+    with open("test_input_jsons/operators.json") as f:
+        operators_dict = json.load(f)
+    with open("test_input_jsons/vehicle_monitoring_modified.json") as f:
+        vehicles_dict = json.load(f)
+    parse_count = metrics.PARSE_SECONDS.count('vehicle_monitoring')
+    write_count = metrics.WRITE_SECONDS.count('save_vehicle_monitoring')
+    onward_calls_written = metrics.ROWS_WRITTEN.value('onward_call')
+    with app.app_context():
+        db_commands.save_operators(db, operators_dict)
+        db_commands.save_vehicle_monitoring(db, selected_operator, vehicles_dict, current_time)
+    assert metrics.PARSE_SECONDS.count('vehicle_monitoring') == parse_count + 1
+    assert metrics.WRITE_SECONDS.count('save_vehicle_monitoring') == write_count + 1
+    assert metrics.ROWS_WRITTEN.value('onward_call') == onward_calls_written + 106
+
+
+def test_metrics_endpoint(app, client):
+    with open("test_input_jsons/operators.json") as f:
+        operators_dict = json.load(f)
+    with open("test_input_jsons/lines.json") as f:
+        line_dict = json.load(f)
+    with app.app_context():
+        db_commands.save_operators(db, operators_dict)
+        db_commands.save_lines(db, selected_operator, line_dict, dt.datetime.now(dt.UTC))
+    client.get('/hello')
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain; version=0.0.4')
+    text = response.get_data(as_text=True)
+    assert 'transit_request_seconds_count{endpoint="hello"}' in text
+    assert 'transit_ingest_write_seconds_count{function="save_lines"}' in text
+    assert 'transit_feed_age_seconds{operator_id="SF",feed="lines"}' in text
+    assert 'feed="stops"' not in text
+
+
+def test_pattern_rows_written(app):
+    with open("test_input_jsons/operators.json") as f:
+        operators_dict = json.load(f)
+    with open("test_input_jsons/lines.json") as f:
+        line_dict = json.load(f)
+    with open("test_input_jsons/patterns.json") as f:
+        pattern_dict = json.load(f)
+    patterns_written = metrics.ROWS_WRITTEN.value('pattern')
+    with app.app_context():
+        db_commands.save_operators(db, operators_dict)
+        db_commands.save_lines(db, selected_operator, line_dict, current_time)
+        db_commands.save_patterns(db, selected_operator, '14', pattern_dict)
+    assert metrics.ROWS_WRITTEN.value('pattern') == patterns_written + len(pattern_dict['journeyPatterns'])
@@ -0,0 +1,149 @@
+import copy
+import datetime as dt
+import json
+
+import sqlalchemy
+
+from transit_notification import create_app, db, db_commands, prefetch, rate_limit, schema
+from transit_notification.models import Operator, Pattern
+
+selected_operator = 'SF'
+current_time = dt.datetime(2023, 9, 26, 15, 0, 0, 0, dt.UTC)
+
+
+def load(name):
+    with open(f"test_input_jsons/{name}.json") as f:
+        return json.load(f)
+
+
+def patterns_for(line_id):
+    """The test patterns moved to another line, with pattern ids that do not collide with line 14."""
+    pattern_dict = copy.deepcopy(load('patterns'))
+    if line_id != '14':
+        for pattern in pattern_dict['journeyPatterns']:
+            pattern['LineRef'] = line_id
+            pattern['serviceJourneyPatternRef'] = int(pattern['serviceJourneyPatternRef']) + 100000
+    return pattern_dict
+
+
+def save_static():
+    db_commands.save_operators(db, load('operators'))
+    db_commands.save_lines(db, selected_operator, load('lines'), current_time)
+    db_commands.save_stops(db, selected_operator, load('stops'), current_time)
+
+
+def fake_pattern_dict(fetched, failing=()):
+    def get_pattern_dict(transit_api_key, siri_base_url, operator_id, line_id, cache=None):
+        fetched.append(line_id)
+        if line_id in failing:
+            raise ConnectionError(line_id)
+        return patterns_for(line_id)
+    return get_pattern_dict
+
+
+def operator_patterns_updated():
+    return db.session.execute(db.select(Operator.patterns_updated).filter_by(operator_id=selected_operator)).scalar()
+
+
+def test_line_patterns_refresh_needed(app):
+    with app.app_context():
+        save_static()
+        assert db_commands.line_patterns_refresh_needed(db, selected_operator, '14', 60, current_time)
+        db_commands.save_patterns(db, selected_operator, '14', patterns_for('14'), current_time)
+        assert not db_commands.line_patterns_refresh_needed(db, selected_operator, '14', 60, current_time)
+        assert db_commands.line_patterns_refresh_needed(db, selected_operator, '49', 60, current_time)
+        later_time = current_time + dt.timedelta(minutes=60)
+        assert db_commands.line_patterns_refresh_needed(db, selected_operator, '14', 60, later_time)
+        # an unchanged response still refreshes the update time
+        db_commands.save_patterns(db, selected_operator, '14', patterns_for('14'), later_time)
+        assert not db_commands.line_patterns_refresh_needed(db, selected_operator, '14', 60, later_time)
+        assert db_commands.stale_pattern_lines(db, selected_operator, 60, later_time) == ['49']
+
+
+def test_prefetch_patterns(app, monkeypatch):
+    fetched = []
+    monkeypatch.setattr(db_commands, "get_pattern_dict", fake_pattern_dict(fetched))
+    with app.app_context():
+        save_static()
+        assert db_commands.prefetch_patterns(db, None, None, selected_operator, current_time, max_workers=2) == 2
+        assert sorted(fetched) == ['14', '49']
+        for line_id in ('14', '49'):
+            patterns = db.session.execute(db.select(Pattern).filter_by(operator_id=selected_operator,
+                                                                       line_id=line_id)).scalars().all()
+            assert len(patterns) == 9
+        assert operator_patterns_updated() == current_time.replace(tzinfo=None)
+        # the lines are fresh, nothing is fetched again
+        assert db_commands.prefetch_patterns(db, None, None, selected_operator, current_time, refresh_limit=60) == 0
+        assert len(fetched) == 2
+
+
+def test_prefetch_failed_line_stays_stale(app, monkeypatch):
+    monkeypatch.setattr(db_commands, "get_pattern_dict", fake_pattern_dict([], failing=('49',)))
+    with app.app_context():
+        save_static()
+        assert db_commands.prefetch_patterns(db, None, None, selected_operator, current_time) == 1
+        assert db_commands.stale_pattern_lines(db, selected_operator, 60, current_time) == ['49']
+        assert operator_patterns_updated() is None
+
+
+def test_prefetcher_runs_in_background(app, monkeypatch):
+    fetched = []
+    monkeypatch.setattr(db_commands, "get_pattern_dict", fake_pattern_dict(fetched))
+    with app.app_context():
+        save_static()
+    prefetcher = prefetch.PatternPrefetcher(app, max_workers=2)
+    assert prefetcher.submit(selected_operator, 60)
+    prefetcher.shutdown()
+    assert prefetcher.pending() == set()
+    assert sorted(fetched) == ['14', '49']
+    with app.app_context():
+        assert db_commands.stale_pattern_lines(db, selected_operator, 60, dt.datetime.now(dt.UTC)) == []
+
+
+def test_prefetcher_continues_within_budget(app, monkeypatch):
+    fetched = []
+    monkeypatch.setattr(db_commands, "get_pattern_dict", fake_pattern_dict(fetched, failing=('14',)))
+    monkeypatch.setattr(prefetch, "prefetch_budget", lambda transit_api_key: 1)
+    with app.app_context():
+        save_static()
+    prefetcher = prefetch.PatternPrefetcher(app, max_workers=2)
+    prefetcher.run(selected_operator, 60)
+    assert fetched == ['14']
+    # the next view continues with the line that was not tried yet
+    prefetcher.run(selected_operator, 60)
+    assert fetched == ['14', '49']
+    with app.app_context():
+        assert operator_patterns_updated() is None
+    # every stale line was tried, the failed line is tried again
+    prefetcher.run(selected_operator, 60)
+    assert fetched == ['14', '49', '14']
+
+
+def test_prefetch_budget():
+    app = create_app({"TESTING": True, "RATE_LIMIT_REQUESTS": 8})
+    with app.app_context():
+        assert prefetch.prefetch_budget('key') == 6
+        for _ in range(5):
+            rate_limit.acquire('key')
+        assert prefetch.prefetch_budget('key') == 1
+        rate_limit.acquire('key')
+        assert prefetch.prefetch_budget('key') == 0
+    app = create_app({"TESTING": True, "RATE_LIMIT_REQUESTS": 0})
+    with app.app_context():
+        assert prefetch.prefetch_budget('key') is None
+
+
+def test_prefetch_disabled(app):
+    with app.app_context():
+        assert prefetch.current_prefetcher() is None
+        prefetch.schedule_patterns(selected_operator, 60)
+
+
+def test_line_patterns_updated_migration(app):
+    with app.app_context():
+        with db.engine.begin() as connection:
+            connection.execute(sqlalchemy.text("ALTER TABLE line DROP COLUMN patterns_updated"))
+        schema.stamp_schema_version(db, 2)
+        assert schema.prepare_database(db) == "migrated"
+        columns = {column['name'] for column in sqlalchemy.inspect(db.engine).get_columns('line')}
+        assert 'patterns_updated' in columns
@@ -0,0 +1,77 @@
+import cProfile
+import os
+import pstats
+
+import pytest
+
+from transit_notification import create_app, profiling
+
+
+def busy_function():
+    return sum(i * i for i in range(20000))
+
+
+def test_pstats_to_folded():
+    profiler = cProfile.Profile()
+    profiler.enable()
+    busy_function()
+    profiler.disable()
+    folded = profiling.pstats_to_folded(pstats.Stats(profiler))
+    assert folded
+    stack, value = folded[0].rsplit(' ', 1)
+    assert int(value) > 0
+    assert any('test_profiling.py:busy_function' in line for line in folded)
+
+
+def test_profiled(tmp_path):
+    with profiling.profiled('unit test', str(tmp_path)):
+        busy_function()
+    file_names = sorted(os.listdir(tmp_path))
+    assert len(file_names) == 2
+    assert file_names[0].endswith('-unit_test.folded')
+    assert file_names[1].endswith('-unit_test.pstats')
+    pstats.Stats(str(tmp_path / file_names[1]))
+
+
+def test_profiling_disabled_registers_no_hooks(app):
+    assert profiling.start_request_profile not in app.before_request_funcs.get(None, [])
+
+
+def test_profile_token(tmp_path):
+    app = create_app({"TESTING": True, "PROFILE_TOKEN": "secret", "PROFILE_DIR": str(tmp_path)})
+    client = app.test_client()
+    response = client.get('/hello')
+    assert profiling.PROFILE_HEADER not in response.headers
+    response = client.get('/hello?profile=wrong')
+    assert profiling.PROFILE_HEADER not in response.headers
+    assert os.listdir(tmp_path) == []
+    response = client.get('/hello?profile=secret')
+    assert response.data == b'Hello World!'
+    assert response.headers[profiling.PROFILE_HEADER].endswith('-hello.pstats')
+    assert len(os.listdir(tmp_path)) == 2
+
+
+def test_profile_requests(tmp_path):
+    app = create_app({"TESTING": True, "PROFILE_REQUESTS": True, "PROFILE_DIR": str(tmp_path)})
+    response = app.test_client().get('/setup')
+    assert response.headers[profiling.PROFILE_HEADER].endswith('-routes.setup.pstats')
+
+
+def test_replay_profile(app, runner, tmp_path):
+    app.config['PROFILE_DIR'] = str(tmp_path / 'profiles')
+    runner.invoke(args=["replay", "generate", str(tmp_path / 'responses'), "--polls", "1", "--vehicles", "2"])
+    result = runner.invoke(args=["replay", "run", str(tmp_path / 'responses'), "--profile"])
+    assert "Replayed 1 responses" in result.output
+    assert len(os.listdir(tmp_path / 'profiles')) == 2
+
+
+def test_profile_failed_request(tmp_path):
+    app = create_app({"TESTING": True, "PROFILE_REQUESTS": True, "PROFILE_DIR": str(tmp_path)})
+
+    @app.route('/fail')
+    def fail():
+        raise RuntimeError("view failed")
+
+    with pytest.raises(RuntimeError):
+        app.test_client().get('/fail')
+    assert sorted(os.path.splitext(name)[1] for name in os.listdir(tmp_path)) == ['.folded', '.pstats']
@@ -0,0 +1,64 @@
+import json
+import logging
+
+import pytest
+
+from transit_notification import create_app, db, db_commands, query_stats
+from transit_notification.models import Operator
+
+
+def save_operators(app):
+    with open("test_input_jsons/operators.json") as f:
+        operators_dict = json.load(f)
+    with app.app_context():
+        db_commands.save_operators(db, operators_dict)
+
+
+def test_count_queries(app):
+    with app.app_context():
+        with query_stats.count_queries() as stats:
+            db.session.execute(db.select(Operator)).all()
+            db.session.execute(db.select(Operator)).all()
+    assert stats.count == 2
+    assert stats.duration > 0
+    assert all('FROM operator' in statement for statement in stats.statements)
+
+
+def test_assert_max_queries(app):
+    with app.app_context():
+        with pytest.raises(AssertionError, match="Expected at most 0 queries, 1 were executed"):
+            with query_stats.assert_max_queries(0):
+                db.session.execute(db.select(Operator)).all()
+
+
+def test_route_query_budget(app, client):
+    save_operators(app)
+    with query_stats.assert_max_queries(0):
+        client.get('/setup')
+    # check_valid_operator runs two queries before redirecting
+    with query_stats.assert_max_queries(2):
+        client.get('/operator/abc')
+
+
+def test_query_headers(app, client):
+    save_operators(app)
+    response = client.get('/operator/abc')
+    assert query_stats.QUERY_COUNT_HEADER not in response.headers
+    app.config['QUERY_STATS_HEADERS'] = True
+    response = client.get('/operator/abc')
+    assert response.headers[query_stats.QUERY_COUNT_HEADER] == '2'
+    assert float(response.headers[query_stats.QUERY_TIME_HEADER]) >= 0
+
+
+def test_query_headers_debug():
+    app = create_app({"TESTING": True, "DEBUG": True})
+    response = app.test_client().get('/setup')
+    assert response.headers[query_stats.QUERY_COUNT_HEADER] == '0'
+
+
+def test_slow_query_log(app, caplog):
+    app.config['SLOW_QUERY_THRESHOLD_MS'] = 0
+    with app.app_context(), caplog.at_level(logging.WARNING, logger='transit_notification.query_stats'):
+        db.session.execute(db.select(Operator).filter_by(operator_id='SF')).all()
+    assert "Slow query" in caplog.text
+    assert "('SF'" in caplog.text
@@ -0,0 +1,81 @@
+import threading
+
+import pytest
+
+from transit_notification import create_app, metrics, rate_limit
+from transit_notification.rate_limit import RateLimitExceeded, RequestScheduler, TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_token_bucket_refill():
+    clock = FakeClock()
+    bucket = TokenBucket(2, 10, clock)
+    assert bucket.wait_time() == 0
+    bucket.take()
+    bucket.take()
+    assert bucket.wait_time() == pytest.approx(5)
+    clock.now = 2.5
+    assert bucket.available() == pytest.approx(0.5)
+    clock.now = 100
+    assert bucket.available() == 2
+
+
+def test_budget_per_key():
+    scheduler = RequestScheduler(requests=1, period_s=3600, timeout_s=0)
+    scheduler.acquire('key-a')
+    assert scheduler.remaining('key-a') < 1
+    scheduler.acquire('key-b')
+    timeouts = metrics.RATE_LIMIT_TIMEOUTS.value('static')
+    with pytest.raises(RateLimitExceeded):
+        scheduler.acquire('key-a')
+    assert metrics.RATE_LIMIT_TIMEOUTS.value('static') == timeouts + 1
+    assert scheduler.waiting('key-a') == 0
+    assert set(scheduler.budget_samples()) == {(rate_limit.key_fingerprint('key-a'),),
+                                               (rate_limit.key_fingerprint('key-b'),)}
+
+
+def test_priority_order():
+    # one token every 200 ms
+    scheduler = RequestScheduler(requests=1, period_s=0.2, timeout_s=5)
+    scheduler.acquire('key')
+    served = []
+
+    def request(priority):
+        scheduler.acquire('key', priority)
+        served.append(priority)
+
+    threads = [threading.Thread(target=request, args=(priority,))
+               for priority in [rate_limit.PRIORITY_STATIC, rate_limit.PRIORITY_VEHICLE_MONITORING,
+                                rate_limit.PRIORITY_STOP_MONITORING]]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # the requests were queued long before the next token, so they are served by priority
+    assert served == [rate_limit.PRIORITY_STOP_MONITORING, rate_limit.PRIORITY_VEHICLE_MONITORING,
+                      rate_limit.PRIORITY_STATIC]
+
+
+def test_budget_metric(client):
+    assert b'transit_rate_limit_tokens' in client.get('/metrics').data
+
+
+def test_scheduler_disabled():
+    app = create_app({"TESTING": True, "RATE_LIMIT_REQUESTS": 0})
+    with app.app_context():
+        assert rate_limit.current_scheduler() is None
+        rate_limit.acquire('key')
+    assert rate_limit.current_scheduler() is None
+
+
+def test_budget_split_between_workers():
+    app = create_app({"TESTING": True, "RATE_LIMIT_REQUESTS": 60, "RATE_LIMIT_WORKERS": 4})
+    with app.app_context():
+        assert rate_limit.current_scheduler().remaining('key') == 15
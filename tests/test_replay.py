@@ -0,0 +1,95 @@
+import datetime as dt
+import json
+
+from transit_notification import db, db_commands, metrics, replay
+from transit_notification.models import OnwardCall, OnwardCallArchive, Operator, Vehicle
+
+selected_operator = 'SF'
+current_time = dt.datetime(2023, 9, 26, 15, 0, 0, 0, dt.UTC)
+
+
+def load_operators():
+    with open("test_input_jsons/operators.json") as f:
+        return json.load(f)
+
+
+def test_response_feed_type():
+    with open("test_input_jsons/vehicle_monitoring_modified.json") as f:
+        vehicles_dict = json.load(f)
+    with open("test_input_jsons/stop_monitoring_15553.json") as f:
+        stop_monitoring_dict = json.load(f)
+    with open("test_input_jsons/lines.json") as f:
+        line_dict = json.load(f)
+    assert replay.response_feed_type(vehicles_dict) == replay.VEHICLE_MONITORING
+    assert replay.response_feed_type(stop_monitoring_dict) == replay.STOP_MONITORING
+    assert replay.response_feed_type({"lines": line_dict}) is None
+    assert db_commands.response_time(vehicles_dict) == current_time
+
+
+def test_replay_recorded_responses(app):
+    with open("test_input_jsons/operators.json") as f:
+        operators_dict = json.load(f)
+    with app.app_context():
+        db_commands.save_operators(db, operators_dict)
+        responses = list(replay.iter_recorded_responses("test_input_jsons"))
+        assert [feed_type for _, feed_type, _, _ in responses] == [replay.STOP_MONITORING, replay.VEHICLE_MONITORING]
+        report = replay.replay_responses(db, responses)
+        assert report.responses == 2
+        assert report.rows == 5 + 6 + 4 + 106
+        assert report.rows_per_second > 0
+        assert report.database_size > 0
+        assert len(report.stage_times['write']) == 2
+        assert len(db.session.execute(db.select(OnwardCall)).scalars().all()) == 106
+        operator = db.session.execute(db.select(Operator).filter_by(operator_id=selected_operator)).scalar_one()
+        assert operator.vehicle_monitoring_updated == current_time.replace(tzinfo=None)
+        assert operator.stop_monitoring_updated == current_time.replace(tzinfo=None)
+        assert report.summary()[0].startswith("Replayed 2 responses, 121 rows")
+
+
+def test_replay_speed(app):
+    responses = [("", replay.VEHICLE_MONITORING,
+                  replay.synthesize_vehicle_monitoring(selected_operator, 2, 3, current_time + dt.timedelta(minutes=i)),
+                  0.0) for i in range(3)]
+    waits = []
+    with app.app_context():
+        replay.replay_responses(db, responses, speed=60, sleep=waits.append)
+    assert len(waits) == 2
+    assert 0.9 < waits[0] <= 1.0
+    assert 1.9 < waits[1] <= 2.0
+
+
+def test_synthesize_vehicle_monitoring():
+    response = replay.synthesize_vehicle_monitoring(selected_operator, 10, 5, current_time)
+    vehicles, onward_calls = db_commands.parse_vehicle_monitoring(selected_operator, response)
+    assert len(vehicles) == 10
+    assert len(onward_calls) == 50
+    assert onward_calls[-1].vehicle_at_stop is False
+
+
+def test_synthesize_stop_monitoring():
+    response = replay.synthesize_stop_monitoring(selected_operator, 10, current_time)
+    vehicles, onward_calls = db_commands.parse_stop_monitoring(selected_operator, response)
+    assert len(vehicles) == 10
+    assert len(onward_calls) == 10
+
+
+def test_replay_commands(app, runner, tmp_path):
+    result = runner.invoke(args=["replay", "generate", str(tmp_path), "--polls", "2", "--vehicles", "4",
+                                 "--calls", "3"])
+    assert "Wrote 2 responses" in result.output
+    result = runner.invoke(args=["replay", "run", str(tmp_path)])
+    assert "Replayed 2 responses, 32 rows" in result.output
+    with app.app_context():
+        assert len(db.session.execute(db.select(Vehicle)).scalars().all()) == 4
+
+
+def test_replay_uses_ingest_path(app):
+    responses = [("", replay.VEHICLE_MONITORING,
+                  replay.synthesize_vehicle_monitoring(selected_operator, 2, 3, current_time), 0.0)]
+    write_count = metrics.WRITE_SECONDS.count('save_vehicle_monitoring')
+    with app.app_context():
+        db_commands.save_operators(db, load_operators())
+        report = replay.replay_responses(db, responses, archive=True)
+        assert report.rows == 2 + 6
+        assert len(db.session.execute(db.select(OnwardCallArchive)).scalars().all()) == 6
+    assert metrics.WRITE_SECONDS.count('save_vehicle_monitoring') == write_count + 1
@@ -0,0 +1,87 @@
+import gzip
+import json
+import os
+from unittest import mock
+
+import responses
+
+from transit_notification import create_app, db_commands, metrics
+from transit_notification.response_cache import ResponseCache, current_cache
+
+test_url = "https://api.511.org/Transit/"
+test_key = "fake-key"
+lines_url = "https://api.511.org/Transit/lines?api_key=fake-key&Format=json&Operator_id=SF"
+operators_url = "https://api.511.org/Transit/Operators?api_key=fake-key&Format=json"
+
+
+def test_put_and_get(tmp_path):
+    cache = ResponseCache(str(tmp_path), ttl_s=60)
+    params = {'base_url': test_url, 'operator_id': 'SF'}
+    assert cache.get('lines', params) is None
+    cache.put('lines', params, {'lines': [1, 2]}, current_time=1000)
+    assert cache.get('lines', params, current_time=1060) == {'lines': [1, 2]}
+    assert cache.get('lines', params, current_time=1061) is None
+    assert cache.get('lines', {'base_url': test_url, 'operator_id': 'AC'}, current_time=1000) is None
+    path = cache.path('lines', params)
+    assert os.path.basename(path).startswith('lines-')
+    with gzip.open(path, 'rt') as f:
+        assert json.load(f)['response'] == {'lines': [1, 2]}
+
+
+def test_unreadable_file_discarded(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    path = cache.path('operators', {})
+    with open(path, 'wb') as f:
+        f.write(b'not gzip')
+    assert cache.get('operators', {}) is None
+    assert not os.path.exists(path)
+
+
+def test_fetch_reads_through(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    fetch_response = mock.Mock(return_value={'stops': []})
+    hits = metrics.RESPONSE_CACHE_LOOKUPS.value('stops', 'hit')
+    assert cache.fetch('stops', {'operator_id': 'SF'}, fetch_response) == {'stops': []}
+    assert cache.fetch('stops', {'operator_id': 'SF'}, fetch_response) == {'stops': []}
+    assert fetch_response.call_count == 1
+    assert metrics.RESPONSE_CACHE_LOOKUPS.value('stops', 'hit') == hits + 1
+    cache.clear()
+    assert os.listdir(tmp_path) == []
+
+
+@responses.activate
+def test_get_lines_dict_cached(tmp_path):
+    with open("test_input_jsons/lines.json") as f:
+        lines_json = json.load(f)
+    responses.add(responses.GET, lines_url, body=json.dumps(lines_json), status=200,
+                  content_type="application/json")
+    cache = ResponseCache(str(tmp_path))
+    assert db_commands.get_lines_dict(test_key, test_url, 'SF', cache=cache) == lines_json
+    assert db_commands.get_lines_dict('other-key', test_url, 'SF', cache=cache) == lines_json
+    assert len(responses.calls) == 1
+    # the api key is not stored
+    for name in os.listdir(tmp_path):
+        with gzip.open(tmp_path / name, 'rt') as f:
+            assert test_key not in f.read()
+
+
+def test_cache_disabled(tmp_path):
+    app = create_app({"TESTING": True, "RESPONSE_CACHE_TTL_S": 0, "RESPONSE_CACHE_DIR": str(tmp_path)})
+    with app.app_context():
+        assert current_cache() is None
+
+
+@responses.activate
+@mock.patch.dict(os.environ, {'API_KEY': test_key, 'BASE_URL': test_url})
+def test_restart_uses_cache(tmp_path):
+    with open("test_input_jsons/operators.json") as f:
+        operators_json = json.load(f)
+    responses.add(responses.GET, operators_url, body=json.dumps(operators_json), status=200,
+                  content_type="application/json")
+    config = {"TESTING": True, "RESET_TABLES": True, "RESPONSE_CACHE_DIR": str(tmp_path)}
+    response = create_app(config).test_client().get('/operators')
+    assert b'<a href="/operator/SF">San Francisco Municipal Transportation Agency</a>' in response.data
+    # the rebuilt database is filled from the cache
+    response = create_app(config).test_client().get('/operators')
+    assert b'<a href="/operator/SF">San Francisco Municipal Transportation Agency</a>' in response.data
+    assert len(responses.calls) == 1
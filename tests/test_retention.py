@@ -0,0 +1,109 @@
+import datetime as dt
+import json
+
+import sqlalchemy
+
+from transit_notification import db, db_commands, metrics, retention, schema
+from transit_notification.models import OnwardCall, Vehicle, onward_call_expiry_time
+
+selected_operator = 'SF'
+current_time = dt.datetime(2023, 9, 26, 15, 0, 0, 0, dt.UTC)
+
+
+def load(name):
+    with open(f"test_input_jsons/{name}.json") as f:
+        return json.load(f)
+
+
+def save_monitoring(time=current_time):
+    db_commands.save_operators(db, load('operators'))
+    db_commands.save_vehicle_monitoring(db, selected_operator, load('vehicle_monitoring_modified'), time)
+
+
+def count(model):
+    return db.session.execute(db.select(db.func.count()).select_from(model)).scalar()
+
+
+def test_evict_expired_onward_calls(app):
+    with app.app_context():
+        save_monitoring()
+        cutoff = dt.datetime(2023, 9, 26, 15, 30)
+        expired = db.session.execute(db.select(db.func.count()).select_from(OnwardCall).where(
+            onward_call_expiry_time < cutoff)).scalar()
+        evicted_before = metrics.ROWS_EVICTED.value('onward_call')
+        evicted = retention.evict_expired(db, current_time + dt.timedelta(minutes=90), horizon_s=60 * 60,
+                                          batch_size=10)
+        assert 0 < expired < 106
+        assert evicted['onward_call'] == expired
+        assert count(OnwardCall) == 106 - expired
+        assert metrics.ROWS_EVICTED.value('onward_call') == evicted_before + expired
+        # the vehicles of the current dataframe ref are kept
+        assert evicted['vehicle'] == 0
+        assert count(Vehicle) == 4
+
+
+def test_evict_expired_vehicles(app):
+    with app.app_context():
+        save_monitoring()
+        evicted = retention.evict_expired(db, current_time + dt.timedelta(days=3))
+        assert evicted['onward_call'] == 106
+        assert evicted['vehicle'] == 4
+        assert count(OnwardCall) == 0
+        assert count(Vehicle) == 0
+
+
+def test_evict_in_batches(app):
+    with app.app_context():
+        save_monitoring()
+        evicted = retention.evict_expired(db, current_time + dt.timedelta(days=3), batch_size=10, max_batches=1)
+        assert evicted['onward_call'] == 10
+        # the vehicles still have onward calls
+        assert evicted['vehicle'] == 0
+        assert count(OnwardCall) == 96
+
+
+def test_eviction_forgets_digest(app):
+    with app.app_context():
+        save_monitoring()
+        retention.evict_expired(db, current_time + dt.timedelta(days=3))
+        save_monitoring()
+        assert count(OnwardCall) == 106
+
+
+def test_step_waits_for_interval(app):
+    with app.app_context():
+        save_monitoring()
+        steps = retention.Retention(batch_size=10, interval_s=60)
+        later_time = current_time + dt.timedelta(days=3)
+        assert steps.step(db, later_time)['onward_call'] == 10
+        assert steps.step(db, later_time + dt.timedelta(seconds=30)) is None
+        assert steps.step(db, later_time + dt.timedelta(seconds=60))['onward_call'] == 10
+        assert count(OnwardCall) == 86
+
+
+def test_retention_disabled(app):
+    app.config["RETENTION_HORIZON_S"] = 0
+    retention.init_app(app)
+    with app.app_context():
+        assert retention.current_retention() is None
+        save_monitoring(current_time + dt.timedelta(days=3))
+        assert count(OnwardCall) == 106
+
+
+def test_retention_indexes_migration(app):
+    with app.app_context():
+        for index in schema.RETENTION_INDEXES:
+            index.drop(db.engine)
+        schema.stamp_schema_version(db, 1)
+        assert schema.prepare_database(db) == "migrated"
+        index_names = db.session.execute(sqlalchemy.text("SELECT name FROM sqlite_master WHERE type = 'index'"))
+        assert {index.name for index in schema.RETENTION_INDEXES} <= set(index_names.scalars())
+
+
+def test_evict_expired_command(app, runner):
+    with app.app_context():
+        save_monitoring()
+    result = runner.invoke(args=["evict-expired", "--horizon", "0"])
+    assert "onward_call: 106 rows evicted" in result.output
+    with app.app_context():
+        assert count(OnwardCall) == 0
@@ -1,13 +1,12 @@
-import pytest
-import responses
+import datetime as dt
 import json
-import configparser
 import os
 from unittest import mock
-from transit_notification import create_app, db
-from transit_notification.models import Operator
-from transit_notification import db_commands, routes
 
+import responses
+
+from transit_notification import db, db_commands, rate_limit, routes
+from transit_notification.models import Line, Pattern
 
 test_url = "https://api.511.org/Transit/"
 test_key = "fake-key"
@@ -25,7 +24,7 @@ def test_setup_render(client):
 @responses.activate
 @mock.patch.dict(os.environ, {'API_KEY': test_key})
 def test_operators_with_proper_setup(client, app):
-    with open("test_input_jsons/operators.json", 'r') as f:
+    with open("test_input_jsons/operators.json") as f:
         operators_json = json.load(f)
     responses.add(
         responses.GET,
@@ -78,9 +77,9 @@ def test_operator_before_index(client, app):
 @responses.activate
 @mock.patch.dict(os.environ, {'API_KEY': test_key})
 def test_valid_operator(client, app):
-    with open("test_input_jsons/operators.json", 'r') as f:
+    with open("test_input_jsons/operators.json") as f:
         operators_json = json.load(f)
-    with open("test_input_jsons/lines.json", 'r') as f:
+    with open("test_input_jsons/lines.json") as f:
         lines_json = json.load(f)
     responses.add(
         responses.GET,
@@ -106,3 +105,95 @@ def test_valid_operator(client, app):
         response = client.get('/operator/SF', follow_redirects=True)
         assert response.status_code == 200
         assert b'VAN NESS-MISSION' in response.data
+
+
+def test_station_board(client, app, monkeypatch):
+    with open("test_input_jsons/operators.json") as f:
+        operators_json = json.load(f)
+    with open("test_input_jsons/stops.json") as f:
+        stops_json = json.load(f)
+    with open("test_input_jsons/stop_monitoring_15553.json") as f:
+        stop_monitoring_json = json.load(f)
+    requested = []
+
+    def get_stop_monitoring_dict(transit_api_key, siri_base_url, operator_id, stop_id=None):
+        requested.append(stop_id)
+        return stop_monitoring_json
+
+    monkeypatch.setattr(db_commands, 'get_stop_monitoring_dict', get_stop_monitoring_dict)
+    with app.app_context():
+        db_commands.save_operators(db, operators_json)
+        db_commands.save_stops(db, 'SF', stops_json, dt.datetime.now(dt.UTC))
+
+    response = client.get('/operator/SF/board?stop=15553,15551&stop=unknown')
+    assert response.status_code == 200
+    assert b"Mission St &amp; 16th St (15551)" in response.data
+    assert b"Mission St &amp; 18th St (15553)" in response.data
+    assert requested
+    refreshes = len(requested)
+
+    response = client.get('/operator/SF/station/15553')
+    assert response.status_code == 200
+    assert b"Mission St &amp; 18th St (15553)" in response.data
+    assert b"(15551)" not in response.data
+    # the refresh of the board covered the stop
+    assert len(requested) == refreshes
+
+    response = client.get('/operator/SF/board?stop=unknown')
+    assert b"Operator SF with stops unknown is not in database." in response.data
+
+
+def test_rate_limited_views(client, app, monkeypatch):
+    with open("test_input_jsons/operators.json") as f:
+        operators_json = json.load(f)
+    with open("test_input_jsons/lines.json") as f:
+        lines_json = json.load(f)
+
+    def rate_limited(*args, **kwargs):
+        raise rate_limit.RateLimitExceeded("No request budget")
+
+    monkeypatch.setattr(db_commands, 'get_operators_dict', rate_limited)
+    monkeypatch.setattr(db_commands, 'get_lines_dict', rate_limited)
+    monkeypatch.setattr(db_commands, 'get_stops_dict', rate_limited)
+    monkeypatch.setattr(db_commands, 'get_pattern_dict', rate_limited)
+    response = client.get('/operators')
+    assert response.status_code == 200
+    assert routes.RATE_LIMIT_ERROR.encode() in response.data
+
+    with app.app_context():
+        db_commands.save_operators(db, operators_json)
+    response = client.get('/operator/SF')
+    assert response.status_code == 200
+    assert routes.RATE_LIMIT_ERROR.encode() in response.data
+
+    with app.app_context():
+        db_commands.save_lines(db, 'SF', lines_json, dt.datetime(2023, 9, 26, 15, 0, 0, 0, dt.UTC))
+    # the stored lines are shown while the budget is exhausted
+    response = client.get('/operator/SF')
+    assert response.status_code == 200
+    assert b'VAN NESS-MISSION' in response.data
+    response = client.get('/operator/SF/line/14', follow_redirects=True)
+    assert response.status_code == 200
+    assert routes.RATE_LIMIT_ERROR.encode() in response.data
+    assert b'VAN NESS-MISSION' in response.data
+
+    # only the patterns of one direction are stored
+    monkeypatch.setattr(db_commands, 'get_stop_timetable_dict', rate_limited)
+    with app.app_context():
+        with open("test_input_jsons/patterns.json") as f:
+            patterns_json = json.load(f)
+        # a stop for every stop of the patterns
+        stop_ids = {stop['ScheduledStopPointRef'] for pattern in patterns_json['journeyPatterns']
+                    for stop in pattern['PointsInSequence']['StopPointInJourneyPattern']}
+        stops_json = {'Contents': {'dataObjects': {'ScheduledStopPoint': [
+            {'id': stop_id, 'Name': stop_id, 'Location': {'Longitude': '-122.4', 'Latitude': '37.7'}}
+            for stop_id in sorted(stop_ids)]}}}
+        db_commands.save_stops(db, 'SF', stops_json, dt.datetime(2023, 9, 26, 15, 0, 0, 0, dt.UTC))
+        db_commands.save_patterns(db, 'SF', '14', patterns_json)
+        line = db.session.execute(db.select(Line).filter_by(operator_id='SF', line_id='14')).scalar()
+        db.session.execute(db.delete(Pattern).where(Pattern.operator_id == 'SF',
+                                                    Pattern.pattern_direction == line.direction_1_id))
+        db.session.commit()
+    response = client.get('/operator/SF/line/14', follow_redirects=True)
+    assert response.status_code == 200
+    assert routes.RATE_LIMIT_ERROR.encode() in response.data
@@ -0,0 +1,85 @@
+from transit_notification import create_app, db, schema
+from transit_notification.models import Parameter
+
+
+def add_parameter(name, value):
+    db.session.add(Parameter(name, value))
+    db.session.commit()
+
+
+def read_parameter(name):
+    return db.session.execute(db.select(Parameter.value).filter_by(name=name)).scalar_one_or_none()
+
+
+def test_init_db_stamps_version(app):
+    with app.app_context():
+        assert schema.stored_schema_version(db) == schema.SCHEMA_VERSION
+
+
+def test_empty_database_is_created():
+    app = create_app({"TESTING": True, "SQLALCHEMY_DATABASE_URI": "sqlite://"})
+    with app.app_context():
+        assert schema.stored_schema_version(db) == schema.SCHEMA_VERSION
+        db.drop_all(bind_key=None)
+        assert schema.prepare_database(db) == "created"
+        assert schema.stored_schema_version(db) == schema.SCHEMA_VERSION
+
+
+def test_current_schema_keeps_data(app):
+    with app.app_context():
+        add_parameter("kept", "1")
+        assert schema.prepare_database(db) == "current"
+        assert read_parameter("kept") == "1"
+
+
+def test_restart_keeps_data(app):
+    with app.app_context():
+        add_parameter("kept", "1")
+    restarted_app = create_app({"TESTING": True, "SQLALCHEMY_DATABASE_URI": app.config["SQLALCHEMY_DATABASE_URI"]})
+    with restarted_app.app_context():
+        assert read_parameter("kept") == "1"
+
+
+def test_reset_rebuilds(app):
+    with app.app_context():
+        add_parameter("dropped", "1")
+        assert schema.prepare_database(db, reset=True) == "rebuilt"
+        assert read_parameter("dropped") is None
+        assert schema.stored_schema_version(db) == schema.SCHEMA_VERSION
+
+
+def test_unversioned_database_rebuilds(app):
+    with app.app_context():
+        add_parameter("dropped", "1")
+        db.session.execute(db.delete(Parameter).filter_by(name=schema.SCHEMA_VERSION_PARAMETER))
+        db.session.commit()
+        assert schema.stored_schema_version(db) is None
+        assert schema.prepare_database(db) == "rebuilt"
+        assert read_parameter("dropped") is None
+
+
+def test_newer_schema_rebuilds(app):
+    with app.app_context():
+        schema.stamp_schema_version(db, schema.SCHEMA_VERSION + 1)
+        assert schema.prepare_database(db) == "rebuilt"
+        assert schema.stored_schema_version(db) == schema.SCHEMA_VERSION
+
+
+def test_migration_keeps_data(app, monkeypatch):
+    applied = []
+    monkeypatch.setattr(schema, "SCHEMA_VERSION", schema.SCHEMA_VERSION + 1)
+    monkeypatch.setattr(schema, "MIGRATIONS", {schema.SCHEMA_VERSION - 1: applied.append})
+    with app.app_context():
+        schema.stamp_schema_version(db, schema.SCHEMA_VERSION - 1)
+        add_parameter("kept", "1")
+        assert schema.prepare_database(db) == "migrated"
+        assert applied == [db]
+        assert read_parameter("kept") == "1"
+        assert schema.stored_schema_version(db) == schema.SCHEMA_VERSION
+
+
+def test_missing_migration_rebuilds(app, monkeypatch):
+    monkeypatch.setattr(schema, "SCHEMA_VERSION", schema.SCHEMA_VERSION + 1)
+    with app.app_context():
+        schema.stamp_schema_version(db, schema.SCHEMA_VERSION - 1)
+        assert schema.prepare_database(db) == "rebuilt"
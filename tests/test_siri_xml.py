@@ -0,0 +1,145 @@
+import datetime as dt
+import json
+import tracemalloc
+
+from transit_notification import db, db_commands, siri_xml
+from transit_notification.models import OnwardCall, StopTimetable
+
+selected_operator = 'SF'
+selected_stop = '15553'
+current_time = dt.datetime(2023, 9, 26, 15, 0, 0, 0, dt.UTC)
+
+SINGLE_CALL_XML = b"""<?xml version="1.0" encoding="UTF-8"?>
+<Siri xmlns="http://www.siri.org.uk/siri" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" version="1.4">
+  <ServiceDelivery>
+    <ResponseTimestamp>2023-09-26T15:00:00Z</ResponseTimestamp>
+    <VehicleMonitoringDelivery version="1.4">
+      <VehicleActivity>
+        <MonitoredVehicleJourney>
+          <LineRef>14</LineRef>
+          <DirectionRef>IB</DirectionRef>
+          <FramedVehicleJourneyRef>
+            <DataFrameRef>2023-09-26</DataFrameRef>
+            <DatedVehicleJourneyRef>Single</DatedVehicleJourneyRef>
+          </FramedVehicleJourneyRef>
+          <VehicleLocation><Longitude>-122.42</Longitude><Latitude>37.76</Latitude></VehicleLocation>
+          <Bearing>90</Bearing>
+          <OnwardCalls>
+            <OnwardCall>
+              <StopPointRef>15551</StopPointRef>
+              <AimedArrivalTime>2023-09-26T15:02:00Z</AimedArrivalTime>
+              <ExpectedArrivalTime xsi:nil="true"/>
+            </OnwardCall>
+          </OnwardCalls>
+        </MonitoredVehicleJourney>
+      </VehicleActivity>
+      <VehicleActivity>
+        <MonitoredVehicleJourney>
+          <LineRef>14</LineRef>
+          <DirectionRef>OB</DirectionRef>
+          <FramedVehicleJourneyRef>
+            <DataFrameRef>2023-09-26</DataFrameRef>
+            <DatedVehicleJourneyRef>NoCalls</DatedVehicleJourneyRef>
+          </FramedVehicleJourneyRef>
+          <VehicleLocation><Longitude>-122.42</Longitude><Latitude>37.76</Latitude></VehicleLocation>
+          <Bearing>270</Bearing>
+          <OnwardCalls/>
+        </MonitoredVehicleJourney>
+      </VehicleActivity>
+    </VehicleMonitoringDelivery>
+  </ServiceDelivery>
+</Siri>
+"""
+
+
+def load(name):
+    with open(f"test_input_jsons/{name}.json") as f:
+        return json.load(f)
+
+
+def xml_path(name):
+    return f"test_input_xmls/{name}.xml"
+
+
+def test_vehicle_monitoring_matches_json():
+    header = {}
+    vehicles, onward_calls = siri_xml.parse_vehicle_monitoring_xml(selected_operator, xml_path('vehicle_monitoring'),
+                                                                   header)
+    assert (vehicles, onward_calls) == db_commands.parse_vehicle_monitoring(
+        selected_operator, load('vehicle_monitoring_modified'))
+    assert header['ResponseTimestamp'] == "2023-09-26T15:00:00Z"
+
+
+def test_stop_monitoring_matches_json():
+    assert siri_xml.parse_stop_monitoring_xml(selected_operator, xml_path('stop_monitoring_15553')) == \
+           db_commands.parse_stop_monitoring(selected_operator, load('stop_monitoring_15553'))
+
+
+def test_stop_timetable_matches_json():
+    assert siri_xml.parse_stop_timetable_xml(selected_operator, xml_path('stop_timetable_15553')) == \
+           db_commands.parse_stop_timetable(selected_operator, load('stop_timetable_15553'))
+
+
+def test_single_and_missing_elements():
+    vehicles, onward_calls = siri_xml.parse_vehicle_monitoring_xml(selected_operator, SINGLE_CALL_XML)
+    assert [vehicle.vehicle_journey_ref for vehicle in vehicles] == ['Single', 'NoCalls']
+    assert len(onward_calls) == 1
+    assert onward_calls[0].aimed_arrival_time_utc == dt.datetime(2023, 9, 26, 15, 2)
+    assert onward_calls[0].expected_arrival_time_utc is None
+    assert onward_calls[0].aimed_departure_time_utc is None
+
+
+def test_records_are_released(tmp_path):
+    # a document of many records is parsed in the memory of a few records
+    path = tmp_path / "large.xml"
+    with open(xml_path('vehicle_monitoring'), 'rb') as f:
+        document = f.read()
+    start = document.index(b"<VehicleActivity>")
+    end = document.rindex(b"</VehicleActivity>") + len(b"</VehicleActivity>")
+    path.write_bytes(document[:start] + document[start:end] * 200 + document[end:])
+
+    def peak_bytes(source):
+        tracemalloc.start()
+        try:
+            for _ in siri_xml.iter_records(source, 'VehicleActivity'):
+                pass
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    assert peak_bytes(str(path)) < peak_bytes(xml_path('vehicle_monitoring')) * 5
+
+
+def test_save_xml(app):
+    with app.app_context():
+        db_commands.save_operators(db, load('operators'))
+        assert siri_xml.save_monitoring_xml(db, selected_operator, siri_xml.VEHICLE_MONITORING,
+                                            xml_path('vehicle_monitoring'), current_time)
+        assert db.session.execute(db.select(db.func.count()).select_from(OnwardCall)).scalar() == 106
+        # the xml and the json response hold the same rows
+        db_commands.save_vehicle_monitoring(db, selected_operator, load('vehicle_monitoring_modified'), current_time)
+        assert not siri_xml.save_monitoring_xml(db, selected_operator, siri_xml.VEHICLE_MONITORING,
+                                                xml_path('vehicle_monitoring'), current_time)
+
+        siri_xml.save_stop_timetable_xml(db, selected_operator, selected_stop, xml_path('stop_timetable_15553'))
+        assert db.session.execute(db.select(db.func.count()).select_from(StopTimetable)).scalar() == \
+               len(db_commands.parse_stop_timetable(selected_operator, load('stop_timetable_15553')))
+
+
+def test_ingest_siri_xml_command(app, runner, tmp_path):
+    with app.app_context():
+        db_commands.save_operators(db, load('operators'))
+    result = runner.invoke(args=["ingest-siri-xml", xml_path('stop_monitoring_15553'), "--operator", selected_operator,
+                                 "--feed", "stop_monitoring"])
+    assert result.exit_code == 0
+    assert f"Ingested {xml_path('stop_monitoring_15553')} as SF" in result.output
+
+    result = runner.invoke(args=["ingest-siri-xml", xml_path('stop_timetable_15553'), "--operator", selected_operator,
+                                 "--feed", "stop_timetable"])
+    assert result.exit_code != 0
+
+    not_xml = tmp_path / "not_xml.xml"
+    not_xml.write_text("{}")
+    result = runner.invoke(args=["ingest-siri-xml", str(not_xml), "--operator", selected_operator,
+                                 "--feed", "vehicle_monitoring"])
+    assert result.exit_code != 0
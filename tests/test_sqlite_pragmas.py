@@ -0,0 +1,37 @@
+import pytest
+
+from transit_notification import create_app, db, sqlite_pragmas
+
+
+def test_pragma_statements():
+    assert sqlite_pragmas.pragma_statements({'journal_mode': 'WAL', 'cache_size': -2000}) == [
+        'PRAGMA journal_mode=WAL', 'PRAGMA cache_size=-2000']
+    with pytest.raises(ValueError):
+        sqlite_pragmas.pragma_statements({'journal_mode': 'WAL; DROP TABLE operator'})
+    with pytest.raises(ValueError):
+        sqlite_pragmas.pragma_statements({'journal_mode; DROP TABLE operator': 'WAL'})
+
+
+def test_default_pragmas_applied(tmp_path):
+    app = create_app({"TESTING": True, "SQLALCHEMY_DATABASE_URI": 'sqlite:///' + str(tmp_path / 'test.db')})
+    with app.app_context():
+        values = sqlite_pragmas.read_pragmas(db.engine, sqlite_pragmas.DEFAULT_SQLITE_PRAGMAS)
+    assert values == {
+        'journal_mode': 'wal',
+        # NORMAL
+        'synchronous': 1,
+        'mmap_size': sqlite_pragmas.DEFAULT_SQLITE_PRAGMAS['mmap_size'],
+        'cache_size': sqlite_pragmas.DEFAULT_SQLITE_PRAGMAS['cache_size'],
+        'busy_timeout': 5000,
+        # MEMORY
+        'temp_store': 2,
+    }
+
+
+def test_pragmas_configurable(tmp_path):
+    app = create_app({"TESTING": True, "SQLALCHEMY_DATABASE_URI": 'sqlite:///' + str(tmp_path / 'test.db'),
+                      "SQLITE_PRAGMAS": {'journal_mode': 'DELETE', 'busy_timeout': 250}})
+    with app.app_context():
+        values = sqlite_pragmas.read_pragmas(db.engine, ['journal_mode', 'busy_timeout', 'synchronous'])
+    # synchronous keeps the sqlite default of FULL
+    assert values == {'journal_mode': 'delete', 'busy_timeout': 250, 'synchronous': 2}
@@ -0,0 +1,46 @@
+import json
+
+from transit_notification import db_commands, symbols
+
+selected_operator = 'SF'
+
+
+def test_intern_shares_strings():
+    table = symbols.SymbolTable()
+    first = table.intern(''.join(['15', '553']))
+    second = table.intern(''.join(['155', '53']))
+    assert first == '15553'
+    assert first is second
+    assert table.intern(None) is None
+    assert len(table) == 2
+
+
+def test_symbol_table_per_operator(monkeypatch):
+    monkeypatch.setattr(symbols, '_tables', {})
+    assert symbols.symbol_table('SF') is symbols.symbol_table('SF')
+    assert symbols.symbol_table('SF') is not symbols.symbol_table('AC')
+
+
+def test_full_symbol_table_replaced(monkeypatch):
+    monkeypatch.setattr(symbols, '_tables', {})
+    monkeypatch.setattr(symbols, 'MAX_SYMBOLS', 2)
+    table = symbols.symbol_table('SF')
+    for value in ['a', 'b', 'c']:
+        table.intern(value)
+    new_table = symbols.symbol_table('SF')
+    assert new_table is not table
+    assert len(new_table) == 0
+    assert len(table) == 3
+
+
+def test_parsed_records_share_identifiers():
+    with open("test_input_jsons/vehicle_monitoring_modified.json") as f:
+        vehicles_dict = json.load(f)
+    vehicles, onward_calls = db_commands.parse_vehicle_monitoring(selected_operator, vehicles_dict)
+    calls = [call for call in onward_calls if call.vehicle_journey_ref == vehicles[0].vehicle_journey_ref]
+    assert len(calls) > 1
+    assert all(call.vehicle_journey_ref is vehicles[0].vehicle_journey_ref for call in calls)
+    assert all(call.dataframe_ref_date is vehicles[0].dataframe_ref_date for call in calls)
+    stop_ids = {}
+    for call in onward_calls:
+        assert stop_ids.setdefault(call.stop_id, call.stop_id) is call.stop_id
@@ -0,0 +1,138 @@
+import copy
+import datetime as dt
+import json
+
+from transit_notification import db, db_commands, rate_limit, response_cache, warm_cache
+from transit_notification.models import Line, Pattern, StopTimetable
+
+selected_operator = 'SF'
+current_time = dt.datetime(2023, 9, 26, 15, 0, 0, 0, dt.UTC)
+# the test timetables stand in for the first and last stop of the test patterns
+timetables = {'16498': 'stop_timetable_15553', '17099': 'stop_timetable_15557'}
+
+
+def load(name):
+    with open(f"test_input_jsons/{name}.json") as f:
+        return json.load(f)
+
+
+def patterns_for(line_id):
+    pattern_dict = copy.deepcopy(load('patterns'))
+    if line_id != '14':
+        for pattern in pattern_dict['journeyPatterns']:
+            pattern['LineRef'] = line_id
+            pattern['serviceJourneyPatternRef'] = int(pattern['serviceJourneyPatternRef']) + 100000
+    return pattern_dict
+
+
+def fake_api(monkeypatch, requested, failing=(), rate_limited=()):
+    def respond(dataset, response):
+        def request(*args, cache=None):
+            def fetch_response():
+                requested.append((dataset,) + args[2:])
+                if dataset in failing:
+                    raise ConnectionError(dataset)
+                if dataset in rate_limited:
+                    raise rate_limit.RateLimitExceeded(dataset)
+                return response(*args[2:])
+            return response_cache.read_through(cache, dataset, {'args': args[2:]}, fetch_response)
+        return request
+
+    monkeypatch.setattr(db_commands, "get_operators_dict", respond('operators', lambda: load('operators')))
+    monkeypatch.setattr(db_commands, "get_lines_dict", respond('lines', lambda operator_id: load('lines')))
+    monkeypatch.setattr(db_commands, "get_stops_dict", respond('stops', lambda operator_id: load('stops')))
+    monkeypatch.setattr(db_commands, "get_pattern_dict",
+                        respond('patterns', lambda operator_id, line_id: patterns_for(line_id)))
+    monkeypatch.setattr(db_commands, "get_stop_timetable_dict",
+                        respond('timetables', lambda operator_id, stop_id: load(timetables[stop_id])))
+
+
+def by_stage(reports):
+    return {report.stage: report for report in reports}
+
+
+def test_warm_cache(app, monkeypatch):
+    requested = []
+    fake_api(monkeypatch, requested)
+    with app.app_context():
+        reports = by_stage(warm_cache.warm_cache(db, None, None, [selected_operator], current_time, max_workers=2))
+        assert [reports[stage].saved for stage in ('operators', 'lines', 'stops', 'patterns')] == [1, 1, 1, 2]
+        assert reports['timetables'].saved == 2
+        assert sum(report.failed for report in reports.values()) == 0
+        assert db.session.execute(db.select(db.func.count()).select_from(Pattern)).scalar() == 18
+        assert db.session.execute(db.select(db.func.count()).select_from(StopTimetable)).scalar() > 0
+        assert db.session.execute(db.select(Line.patterns_updated).filter_by(line_id='49')).scalar() is not None
+        assert ('lines', selected_operator) in requested
+
+        # everything is fresh, nothing is requested again
+        requested.clear()
+        reports = by_stage(warm_cache.warm_cache(db, None, None, [selected_operator], current_time))
+        assert [report.stage for report in reports.values() if report.saved] == []
+        assert requested == []
+        assert reports['patterns'].skipped == 2
+        assert reports['timetables'].skipped == 2
+
+
+def test_line_endpoint_stops(app, monkeypatch):
+    fake_api(monkeypatch, [])
+    with app.app_context():
+        assert warm_cache.line_endpoint_stops(db, selected_operator, '14') is None
+        warm_cache.warm_cache(db, None, None, [selected_operator], current_time)
+        first_stop, last_stop = warm_cache.line_endpoint_stops(db, selected_operator, '14')
+        assert first_stop != last_stop
+
+
+def test_warm_cache_failure(app, monkeypatch):
+    fake_api(monkeypatch, [], failing=('stops',))
+    with app.app_context():
+        reports = by_stage(warm_cache.warm_cache(db, None, None, [selected_operator], current_time))
+        assert reports['stops'].failed == 1
+        assert reports['lines'].saved == 1
+
+
+def test_warm_cache_budget_exhausted(app, monkeypatch):
+    requested = []
+    fake_api(monkeypatch, requested, rate_limited=('patterns',))
+    with app.app_context():
+        reports = by_stage(warm_cache.warm_cache(db, None, None, [selected_operator], current_time, max_workers=1))
+        assert reports['stops'].saved == 1
+        assert reports['patterns'].deferred == 2
+        assert sum(report.failed for report in reports.values()) == 0
+        # the requests after the budget ran out are not sent
+        assert [request[0] for request in requested].count('patterns') == 1
+        assert 'timetables' not in {request[0] for request in requested}
+
+
+def test_warm_cache_command(app, runner, monkeypatch):
+    fake_api(monkeypatch, [])
+    result = runner.invoke(args=["warm-cache", "--operators", "SF,XX"])
+    assert result.exit_code == 0
+    assert "lines: 1 saved, 0 fresh, 0 failed" in result.output
+    assert "Warmed up in" in result.output
+
+    fake_api(monkeypatch, [], failing=('timetables',))
+    result = runner.invoke(args=["warm-cache", "--operators", "SF", "--force"])
+    assert result.exit_code == 1
+
+    fake_api(monkeypatch, [], rate_limited=('timetables',))
+    result = runner.invoke(args=["warm-cache", "--operators", "SF", "--force"])
+    assert result.exit_code == 0
+    assert "2 requests deferred to the next run" in result.output
+
+
+def test_warm_cache_command_force(app, runner, monkeypatch):
+    requested = []
+    fake_api(monkeypatch, requested)
+    result = runner.invoke(args=["warm-cache", "--operators", "SF"])
+    assert result.exit_code == 0
+    with app.app_context():
+        # the cache holds the responses, a reload without --force does not request them
+        requested.clear()
+        warm_cache.warm_cache(db, None, None, [selected_operator], dt.datetime.now(dt.UTC),
+                              refresh_limit=0, cache=response_cache.current_cache())
+        assert {request[0] for request in requested} == {'timetables'}
+
+    requested.clear()
+    result = runner.invoke(args=["warm-cache", "--operators", "SF", "--force"])
+    assert result.exit_code == 0
+    assert {request[0] for request in requested} == {'operators', 'lines', 'stops', 'patterns', 'timetables'}
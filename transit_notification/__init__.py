@@ -1,21 +1,26 @@
 """Top-level package for Transit notification."""
 
+import os
+
 import click
+from dotenv import load_dotenv
 from flask import Flask
 from flask.cli import with_appcontext
 from flask_sqlalchemy import SQLAlchemy
-import os
-from dotenv import load_dotenv
 
+from transit_notification.read_database import READ_BIND_KEY, ReadDatabase
 
 __author__ = """Robert G Hennessy"""
 __email__ = 'robertghennessy@gmail.com'
 __version__ = '0.2.0'
 
 db = SQLAlchemy()
+# the routes read through read_db, the ingest functions write through db
+read_db = ReadDatabase(db)
 
 
 def create_app(test_config=None) -> Flask:
+    from transit_notification import sqlite_pragmas
     app = Flask(__name__)
 
     load_dotenv()
@@ -30,7 +35,38 @@ def create_app(test_config=None) -> Flask:
     app.config.from_mapping(
         SECRET_KEY=os.environ.get("SECRET_KEY", "dev"),
         SQLALCHEMY_DATABASE_URI=db_url,
-        SQLALCHEMY_TRACK_MODIFICATIONS=False
+        SQLALCHEMY_TRACK_MODIFICATIONS=False,
+        READ_DATABASE_URI=os.environ.get("READ_DATABASE_URI"),
+        READ_POOL_SIZE=int(os.environ.get("READ_POOL_SIZE", 10)),
+        WRITE_POOL_SIZE=int(os.environ.get("WRITE_POOL_SIZE", 2)),
+        ARCHIVE_ONWARD_CALLS=os.environ.get("ARCHIVE_ONWARD_CALLS", "false").lower() == "true",
+        SLOW_QUERY_THRESHOLD_MS=float(os.environ.get("SLOW_QUERY_THRESHOLD_MS", 100)),
+        QUERY_STATS_HEADERS=None,
+        PROFILE_REQUESTS=os.environ.get("PROFILE_REQUESTS", "false").lower() == "true",
+        PROFILE_TOKEN=os.environ.get("PROFILE_TOKEN"),
+        PROFILE_DIR=os.environ.get("PROFILE_DIR"),
+        # keep the database across restarts unless RESET_TABLES is true
+        RESET_TABLES=os.environ.get("RESET_TABLES", "false").lower() == "true",
+        # raw responses of the static datasets are cached on disk, a ttl of 0 disables the cache
+        RESPONSE_CACHE_DIR=os.environ.get("RESPONSE_CACHE_DIR"),
+        RESPONSE_CACHE_TTL_S=float(os.environ.get("RESPONSE_CACHE_TTL_S", 24 * 60 * 60)),
+        # request budget shared by every call to the SIRI api, 0 requests disables the limit
+        RATE_LIMIT_REQUESTS=int(os.environ.get("RATE_LIMIT_REQUESTS", 60)),
+        RATE_LIMIT_PERIOD_S=float(os.environ.get("RATE_LIMIT_PERIOD_S", 60 * 60)),
+        RATE_LIMIT_TIMEOUT_S=float(os.environ.get("RATE_LIMIT_TIMEOUT_S", 10)),
+        # the budget is kept per process, so it is split between the worker processes of the server
+        RATE_LIMIT_WORKERS=int(os.environ.get("RATE_LIMIT_WORKERS", 1)),
+        # stops viewed within the window are refreshed one by one when that is cheaper than the whole agency
+        DEMAND_WINDOW_S=float(os.environ.get("DEMAND_WINDOW_S", 5 * 60)),
+        DEMAND_MAX_STOP_REQUESTS=int(os.environ.get("DEMAND_MAX_STOP_REQUESTS", 5)),
+        # realtime rows are evicted this long after their arrival time, a horizon of 0 disables the incremental eviction
+        RETENTION_HORIZON_S=float(os.environ.get("RETENTION_HORIZON_S", 60 * 60)),
+        RETENTION_BATCH_SIZE=int(os.environ.get("RETENTION_BATCH_SIZE", 500)),
+        RETENTION_INTERVAL_S=float(os.environ.get("RETENTION_INTERVAL_S", 60)),
+        # patterns of every line of an operator are loaded in the background, 0 workers disables the prefetch
+        PATTERN_PREFETCH_WORKERS=int(os.environ.get("PATTERN_PREFETCH_WORKERS", 4)),
+        # applied to every sqlite connection, set to an empty dict to use the sqlite defaults
+        SQLITE_PRAGMAS=dict(sqlite_pragmas.DEFAULT_SQLITE_PRAGMAS)
     )
 
     if test_config:
@@ -44,17 +80,51 @@ def create_app(test_config=None) -> Flask:
         pass
 
     # initialize Flask-SQLAlchemy and the init-db command
+    read_db.init_app(app)
     db.init_app(app)
     app.cli.add_command(init_db_command)
 
-    if bool(os.environ.get("RESET_TABLES", "dev")) is True:
-        with app.app_context():
-            from transit_notification import models
-            db.drop_all()
-            db.create_all()  # Create sql tables for our data models
-
-    from transit_notification import routes
+    from transit_notification import (
+        commands,
+        gtfs,
+        gtfs_realtime,
+        profiling,
+        replay,
+        retention,
+        siri_xml,
+        snapshot,
+        warm_cache,
+    )
+    app.cli.add_command(commands.analytics_command)
+    app.cli.add_command(replay.replay_command)
+    app.cli.add_command(profiling.profile_ingest_command)
+    app.cli.add_command(retention.evict_expired_command)
+    app.cli.add_command(warm_cache.warm_cache_command)
+    app.cli.add_command(snapshot.snapshot_command)
+    app.cli.add_command(gtfs.import_gtfs_command)
+    app.cli.add_command(gtfs_realtime.ingest_gtfs_realtime_command)
+    app.cli.add_command(siri_xml.ingest_siri_xml_command)
+
+    from transit_notification import schema
+    with app.app_context():
+        # the pragmas must be registered before the first connection is opened
+        for bind_key, engine in db.engines.items():
+            sqlite_pragmas.register_engine(engine, app.config["SQLITE_PRAGMAS"], read_only=bind_key == READ_BIND_KEY)
+        schema.prepare_database(db, reset=app.config["RESET_TABLES"])
+
+    from transit_notification import cadence, demand, metrics, prefetch, query_stats, rate_limit, response_cache, routes
+    response_cache.init_app(app)
+    rate_limit.init_app(app)
+    demand.init_app(app)
+    cadence.init_app(app)
+    retention.init_app(app)
+    prefetch.init_app(app)
     app.register_blueprint(routes.routes)
+    # profiling hooks are registered first so the profile covers the other hooks
+    profiling.init_app(app)
+    metrics.init_app(app)
+    with app.app_context():
+        query_stats.init_app(app, db.engines.values())
 
     @app.route('/hello')
     def hello():
@@ -64,8 +134,8 @@ def create_app(test_config=None) -> Flask:
 
 
 def init_db():
-    db.drop_all()
-    db.create_all()
+    from transit_notification import schema
+    schema.rebuild_database(db)
 
 
 @click.command("init-db")
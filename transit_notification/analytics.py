@@ -0,0 +1,187 @@
+"""Prediction accuracy analytics computed over the onward call archive."""
+import datetime as dt
+import typing
+
+import flask_sqlalchemy
+import numpy as np
+import pandas as pd
+
+from transit_notification.models import OnwardCallArchive
+
+# a prediction is counted as on time when the vehicle arrives between 1 minute early and 5 minutes late
+ON_TIME_EARLY_LIMIT_S = -60
+ON_TIME_LATE_LIMIT_S = 5 * 60
+# edges of the lead time bins in minutes
+LEAD_TIME_BINS = (0, 2, 5, 10, 15, 20, 30, 45, 60, np.inf)
+QUANTILES = (0.1, 0.5, 0.9)
+
+TRIP_STOP_KEYS = ['operator_id', 'line_id', 'stop_id', 'vehicle_journey_ref', 'dataframe_ref_date']
+TIME_COLUMNS = ['recorded_time_utc', 'aimed_arrival_time_utc', 'expected_arrival_time_utc',
+                'aimed_departure_time_utc', 'expected_departure_time_utc']
+
+
+def load_onward_call_archive(siri_db: flask_sqlalchemy.SQLAlchemy,
+                             operator_id: str,
+                             start_time: dt.datetime | None = None,
+                             end_time: dt.datetime | None = None) -> pd.DataFrame:
+    """
+    Loads the archived onward calls of an operator into a dataframe.
+
+    :param siri_db: database
+    :type siri_db: flask_sqlalchemy.SQLAlchemy
+
+    :param operator_id: operator id
+    :type operator_id: str
+
+    :param start_time: only load predictions recorded at or after this utc time
+    :type start_time: dt.datetime, optional
+
+    :param end_time: only load predictions recorded before this utc time
+    :type end_time: dt.datetime, optional
+
+    :return: dataframe with one row per archived prediction
+    :rtype: pd.DataFrame
+    """
+    stmt = siri_db.select(*OnwardCallArchive.__table__.columns).where(OnwardCallArchive.operator_id == operator_id)
+    if start_time is not None:
+        stmt = stmt.where(OnwardCallArchive.recorded_time_utc >= start_time.replace(tzinfo=None))
+    if end_time is not None:
+        stmt = stmt.where(OnwardCallArchive.recorded_time_utc < end_time.replace(tzinfo=None))
+    with siri_db.engine.connect() as connection:
+        archive_df = pd.read_sql(stmt, connection, parse_dates=TIME_COLUMNS)
+    # categorical identifiers keep the group by keys small and fast over many days of data
+    for column in ['operator_id', 'line_id', 'stop_id', 'vehicle_journey_ref']:
+        archive_df[column] = archive_df[column].astype('category')
+    return archive_df
+
+
+def final_observations(archive_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Reduces the archive to the last prediction recorded for each trip at each stop. The last prediction is used as
+    the observed arrival since the feed does not report actual arrival times.
+
+    :param archive_df: archived predictions
+    :type archive_df: pd.DataFrame
+
+    :return: dataframe with one row per trip and stop, with observed and scheduled arrival columns added
+    :rtype: pd.DataFrame
+    """
+    last_recorded = archive_df.groupby(TRIP_STOP_KEYS, observed=True, sort=False)['recorded_time_utc'].idxmax()
+    final_df = archive_df.loc[last_recorded.to_numpy()]
+    return final_df.assign(
+        observed_arrival_utc=final_df['expected_arrival_time_utc'].fillna(final_df['expected_departure_time_utc']),
+        scheduled_arrival_utc=final_df['aimed_arrival_time_utc'].fillna(final_df['aimed_departure_time_utc']))
+
+
+def lateness_distribution(archive_df: pd.DataFrame,
+                          by: str = 'line_id',
+                          quantiles: typing.Sequence[float] = QUANTILES) -> pd.DataFrame:
+    """
+    Computes the distribution of lateness (observed minus scheduled arrival) per line or per stop.
+
+    :param archive_df: archived predictions
+    :type archive_df: pd.DataFrame
+
+    :param by: column to group by, line_id or stop_id
+    :type by: str
+
+    :param quantiles: quantiles of the lateness to report
+    :type quantiles: typing.Sequence[float]
+
+    :return: dataframe indexed by the group with count, mean, std, quantiles (seconds) and on time fraction
+    :rtype: pd.DataFrame
+    """
+    final_df = final_observations(archive_df)
+    lateness_s = (final_df['observed_arrival_utc'] - final_df['scheduled_arrival_utc']).dt.total_seconds()
+    lateness_s = lateness_s.dropna()
+    groups = final_df.loc[lateness_s.index, by]
+    grouped = lateness_s.groupby(groups, observed=True)
+
+    summary_df = grouped.agg(['count', 'mean', 'std'])
+    quantile_df = grouped.quantile(list(quantiles)).unstack()
+    quantile_df.columns = [f"p{round(q * 100)}" for q in quantile_df.columns]
+    on_time = lateness_s.between(ON_TIME_EARLY_LIMIT_S, ON_TIME_LATE_LIMIT_S)
+    summary_df['on_time_fraction'] = on_time.groupby(groups, observed=True).mean()
+    return summary_df.join(quantile_df)
+
+
+def prediction_error_by_lead_time(archive_df: pd.DataFrame,
+                                  bins: typing.Sequence[float] = LEAD_TIME_BINS) -> pd.DataFrame:
+    """
+    Computes the error of the predicted arrival times grouped by how far ahead of the arrival the prediction was
+    made. Positive errors mean that the vehicle arrived earlier than predicted.
+
+    :param archive_df: archived predictions
+    :type archive_df: pd.DataFrame
+
+    :param bins: edges of the lead time bins in minutes
+    :type bins: typing.Sequence[float]
+
+    :return: dataframe indexed by lead time bin with count, mean error, mean absolute error and 90th percentile of
+        the absolute error (seconds)
+    :rtype: pd.DataFrame
+    """
+    final_df = final_observations(archive_df)[TRIP_STOP_KEYS + ['observed_arrival_utc']]
+    predictions_df = archive_df.merge(final_df, on=TRIP_STOP_KEYS, how='inner')
+    predicted_arrival = predictions_df['expected_arrival_time_utc'].fillna(
+        predictions_df['expected_departure_time_utc'])
+    lead_time_min = (predictions_df['observed_arrival_utc'] - predictions_df['recorded_time_utc']
+                     ).dt.total_seconds() / 60
+    error_s = (predicted_arrival - predictions_df['observed_arrival_utc']).dt.total_seconds()
+
+    valid = (lead_time_min >= 0) & error_s.notna()
+    lead_time_bin = pd.cut(lead_time_min[valid], bins=list(bins), right=False)
+    error_s = error_s[valid]
+    abs_error_s = error_s.abs()
+
+    error_df = pd.DataFrame({
+        'count': error_s.groupby(lead_time_bin, observed=False).count(),
+        'mean_error_s': error_s.groupby(lead_time_bin, observed=False).mean(),
+        'mean_abs_error_s': abs_error_s.groupby(lead_time_bin, observed=False).mean(),
+        'p90_abs_error_s': abs_error_s.groupby(lead_time_bin, observed=False).quantile(0.9),
+    })
+    error_df.index.name = 'lead_time_min'
+    return error_df
+
+
+def headway_regularity(archive_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Computes the regularity of the observed headways for each line at each stop. The coefficient of variation
+    (std / mean of the headway) is 0 for perfectly regular service.
+
+    :param archive_df: archived predictions
+    :type archive_df: pd.DataFrame
+
+    :return: dataframe indexed by line and stop with count, observed and scheduled mean headway (seconds), std of the
+        observed headway and the coefficient of variation
+    :rtype: pd.DataFrame
+    """
+    group_keys = ['line_id', 'stop_id']
+    final_df = final_observations(archive_df)
+
+    observed_df = final_df.dropna(subset=['observed_arrival_utc']).sort_values('observed_arrival_utc')
+    observed_headway_s = observed_df.groupby(group_keys, observed=True)['observed_arrival_utc'].diff(
+    ).dt.total_seconds()
+    observed_grouped = observed_headway_s.groupby([observed_df[key] for key in group_keys], observed=True)
+
+    scheduled_df = final_df.dropna(subset=['scheduled_arrival_utc']).sort_values('scheduled_arrival_utc')
+    scheduled_headway_s = scheduled_df.groupby(group_keys, observed=True)['scheduled_arrival_utc'].diff(
+    ).dt.total_seconds()
+    scheduled_grouped = scheduled_headway_s.groupby([scheduled_df[key] for key in group_keys], observed=True)
+
+    headway_df = pd.DataFrame({
+        'count': observed_grouped.count(),
+        'mean_headway_s': observed_grouped.mean(),
+        'std_headway_s': observed_grouped.std(),
+        'scheduled_mean_headway_s': scheduled_grouped.mean(),
+    })
+    headway_df['coefficient_of_variation'] = headway_df['std_headway_s'] / headway_df['mean_headway_s']
+    return headway_df[headway_df['count'] > 0]
+
+
+REPORTS = {
+    'lateness-line': lambda archive_df: lateness_distribution(archive_df, by='line_id'),
+    'lateness-stop': lambda archive_df: lateness_distribution(archive_df, by='stop_id'),
+    'prediction-error': prediction_error_by_lead_time,
+    'headways': headway_regularity,
+}
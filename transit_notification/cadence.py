@@ -0,0 +1,172 @@
+"""
+Learns how often the monitoring feed of each operator is updated upstream, so the next poll is made just after the
+expected update instead of on a fixed refresh limit. The update times are read from the feed, the RecordedAtTime of the
+records or the timestamp of a GTFS-Realtime header, which only change when the feed publishes. The ResponseTimestamp
+and the poll time are stamped when the request is answered, so they measure how often the feed is polled instead.
+"""
+import datetime as dt
+import threading
+
+from flask import Flask, current_app, has_app_context
+
+# learned intervals are kept within these bounds, longer gaps between updates are gaps between polls and are not learned
+MIN_INTERVAL_S = 10
+MAX_INTERVAL_S = 2 * 60
+# weight of the newest interval in the moving average
+SMOOTHING = 0.3
+# poll this long after the expected update, so the update is already published
+POLL_DELAY_S = 2
+# wait this long before polling again when an expected update was not published yet, doubled after every poll that
+# finds no update so a stalled feed is only polled on the refresh limit
+RETRY_S = 5
+MAX_RETRY_DOUBLINGS = 16
+EXTENSION_KEY = 'feed_cadence'
+
+
+class FeedState:
+    """Last update and learned update interval of one feed of an operator."""
+
+    def __init__(self):
+        self.updated = None
+        self.interval_s = None
+        self.polled = None
+        # polls since the expected update that found no update
+        self.misses = 0
+
+    def expected_update(self) -> dt.datetime | None:
+        if self.interval_s is None:
+            return None
+        return self.updated + dt.timedelta(seconds=self.interval_s + POLL_DELAY_S)
+
+
+class FeedCadence:
+    """
+    Update interval of each (operator, feed), learned from the update times published by the feed. Thread safe.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._feeds = {}
+
+    def observe(self, operator_id: str, feed: str, feed_time: dt.datetime | None,
+                poll_time: dt.datetime) -> None:
+        """
+        Records a poll of a feed. An update is seen when the feed time is later than the feed time of the previous
+        update, its distance to the previous update is learned when it is within MAX_INTERVAL_S.
+
+        :param operator_id: operator id
+        :type operator_id: str
+
+        :param feed: feed name, vehicle_monitoring or stop_monitoring
+        :type feed: str
+
+        :param feed_time: latest update time published in the response, such as the latest RecordedAtTime
+        :type feed_time: dt.datetime, optional
+
+        :param poll_time: current utc time
+        :type poll_time: dt.datetime
+
+        :return: None
+        :rtype: None
+        """
+        with self._lock:
+            state = self._feeds.setdefault((operator_id, feed), FeedState())
+            state.polled = poll_time
+            if feed_time is None or (state.updated is not None and feed_time <= state.updated):
+                expected = state.expected_update()
+                if expected is not None and poll_time >= expected:
+                    state.misses += 1
+                return
+            state.misses = 0
+            if state.updated is not None:
+                sample_s = (feed_time - state.updated).total_seconds()
+                if sample_s <= MAX_INTERVAL_S:
+                    sample_s = max(sample_s, MIN_INTERVAL_S)
+                    if state.interval_s is None:
+                        state.interval_s = sample_s
+                    else:
+                        state.interval_s += SMOOTHING * (sample_s - state.interval_s)
+            state.updated = feed_time
+
+    def interval(self, operator_id: str, feed: str) -> float | None:
+        """Learned update interval in seconds, None until two updates have been seen."""
+        with self._lock:
+            state = self._feeds.get((operator_id, feed))
+            return None if state is None else state.interval_s
+
+    def next_poll_time(self, operator_id: str, feed: str) -> dt.datetime | None:
+        """
+        Time of the next poll, just after the expected update. When that poll has already been made without finding
+        the update, the feed is polled again RETRY_S after the last poll, and the wait doubles with every poll that
+        finds no update.
+
+        :param operator_id: operator id
+        :type operator_id: str
+
+        :param feed: feed name
+        :type feed: str
+
+        :return: next poll time, None until the interval has been learned
+        :rtype: dt.datetime, optional
+        """
+        with self._lock:
+            state = self._feeds.get((operator_id, feed))
+            if state is None or state.interval_s is None:
+                return None
+            expected = state.expected_update()
+            if state.polled is not None and state.polled >= expected:
+                retry_s = RETRY_S * 2 ** min(max(state.misses - 1, 0), MAX_RETRY_DOUBLINGS)
+                return state.polled + dt.timedelta(seconds=retry_s)
+            return expected
+
+    def refresh_due(self, operator_id: str, feed: str, current_time: dt.datetime, refresh_limit: float,
+                    spare_budget: bool = True) -> bool | None:
+        """
+        Checks if the feed should be polled now. The feed is always polled once the last poll is older than the refresh
+        limit, whatever the learned interval. Earlier polls at the learned interval are only made when the request
+        budget has requests to spare.
+
+        :param operator_id: operator id
+        :type operator_id: str
+
+        :param feed: feed name
+        :type feed: str
+
+        :param current_time: current utc time
+        :type current_time: dt.datetime
+
+        :param refresh_limit: longest time between two polls in minutes
+        :type refresh_limit: float
+
+        :param spare_budget: False if the request budget is down to its reserve
+        :type spare_budget: bool
+
+        :return: True if a poll is due, None if the interval is not known and the refresh limit has to be used
+        :rtype: bool, optional
+        """
+        next_poll = self.next_poll_time(operator_id, feed)
+        if next_poll is None:
+            return None
+        with self._lock:
+            polled = self._feeds[(operator_id, feed)].polled
+        if current_time >= polled + dt.timedelta(minutes=refresh_limit):
+            return True
+        return spare_budget and current_time >= next_poll
+
+
+def init_app(app: Flask) -> None:
+    app.extensions[EXTENSION_KEY] = FeedCadence()
+
+
+def current_cadence() -> FeedCadence | None:
+    """Feed cadence of the current app, None outside an app context."""
+    if not has_app_context():
+        return None
+    return current_app.extensions.get(EXTENSION_KEY)
+
+
+def observe(operator_id: str, feed: str, feed_time: dt.datetime | None, poll_time: dt.datetime) -> None:
+    """Records a poll in the feed cadence of the current app, see FeedCadence.observe."""
+    feed_cadence = current_cadence()
+    if feed_cadence is not None:
+        feed_cadence.observe(operator_id, feed, feed_time, poll_time)
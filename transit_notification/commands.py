@@ -0,0 +1,39 @@
+"""Cli commands whose implementation needs heavy dependencies. The implementation modules are imported when a
+command runs so that registering the commands in create_app stays cheap."""
+import os
+
+import click
+from flask.cli import with_appcontext
+
+# names of the reports in transit_notification.analytics.REPORTS
+ANALYTICS_REPORTS = ['lateness-line', 'lateness-stop', 'prediction-error', 'headways']
+
+
+@click.command("analytics")
+@click.argument("operator_id")
+@click.option("--start", type=click.DateTime(), default=None, help="Start of the analysis window (UTC).")
+@click.option("--end", type=click.DateTime(), default=None, help="End of the analysis window (UTC).")
+@click.option("--report", "report_names", type=click.Choice(ANALYTICS_REPORTS), multiple=True,
+              help="Report to compute. Defaults to all reports.")
+@click.option("--output-dir", type=click.Path(file_okay=False), default=None,
+              help="Write each report to a csv file in this directory instead of printing it.")
+@with_appcontext
+def analytics_command(operator_id, start, end, report_names, output_dir):
+    """Report prediction accuracy computed from the onward call archive."""
+    from transit_notification import analytics, db
+
+    archive_df = analytics.load_onward_call_archive(db, operator_id, start, end)
+    if archive_df.empty:
+        click.echo(f"No archived onward calls for operator {operator_id}.")
+        return
+    click.echo(f"Loaded {len(archive_df)} archived predictions for operator {operator_id}.")
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+    for report_name in report_names or ANALYTICS_REPORTS:
+        report_df = analytics.REPORTS[report_name](archive_df)
+        if output_dir is None:
+            click.echo(f"\n{report_name}\n{report_df.to_string()}")
+        else:
+            report_path = os.path.join(output_dir, f"{operator_id}_{report_name}.csv")
+            report_df.to_csv(report_path)
+            click.echo(f"Wrote {report_path}")
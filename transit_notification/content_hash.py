@@ -0,0 +1,109 @@
+"""
+Digests of the rows written by the ingest functions. When the rows of a poll match the rows already stored, the
+delete and insert is skipped and only the update time is refreshed.
+"""
+import hashlib
+import typing
+
+import flask_sqlalchemy
+
+from transit_notification import metrics
+from transit_notification.models import Parameter
+
+PARAMETER_PREFIX = "content_hash"
+DIGEST_SIZE = 8
+
+
+def content_digest(*row_groups: typing.Sequence[tuple]) -> str:
+    """
+    Digest of the rows written to one or more tables, a blake2b hash of the repr of the rows. Unlike the builtin hash,
+    which is salted per process, the digest is the same in every process, so a digest stored by a worker, a CLI
+    command or an earlier run of the server matches the same rows.
+
+    :param row_groups: rows of each table, as tuples of column values
+    :type row_groups: typing.Sequence[tuple]
+
+    :return: digest of the rows
+    :rtype: str
+    """
+    encoded = repr(tuple(tuple(rows) for rows in row_groups)).encode()
+    return hashlib.blake2b(encoded, digest_size=DIGEST_SIZE).hexdigest()
+
+
+def parameter_name(*scope: str) -> str:
+    """
+    Name of the parameter that stores the digest of a set of rows, for example ('monitoring', operator_id).
+
+    :param scope: parts that identify the rows
+    :type scope: str
+
+    :return: parameter name
+    :rtype: str
+    """
+    return ':'.join((PARAMETER_PREFIX,) + tuple(str(part) for part in scope))
+
+
+def content_unchanged(siri_db: flask_sqlalchemy.SQLAlchemy, dataset: str, scope: typing.Sequence[str],
+                      digest: str) -> bool:
+    """
+    Checks the digest of new rows against the stored digest and counts the write or skip for the dataset.
+
+    :param siri_db: database
+    :type siri_db: flask_sqlalchemy.SQLAlchemy
+
+    :param dataset: dataset the rows were parsed from, used as the metric label
+    :type dataset: str
+
+    :param scope: parts that identify the rows
+    :type scope: typing.Sequence[str]
+
+    :param digest: digest of the new rows
+    :type digest: str
+
+    :return: True if the stored rows already match
+    :rtype: bool
+    """
+    stored = siri_db.session.get(Parameter, parameter_name(*scope))
+    unchanged = stored is not None and stored.value == digest
+    metrics.INGEST_WRITES.inc(1, dataset)
+    if unchanged:
+        metrics.INGEST_WRITES_SKIPPED.inc(1, dataset)
+    return unchanged
+
+
+def store_digest(siri_db: flask_sqlalchemy.SQLAlchemy, scope: typing.Sequence[str], digest: str) -> None:
+    """
+    Stores the digest of the rows that were written. The caller commits it together with the update time.
+
+    :param siri_db: database
+    :type siri_db: flask_sqlalchemy.SQLAlchemy
+
+    :param scope: parts that identify the rows
+    :type scope: typing.Sequence[str]
+
+    :param digest: digest of the written rows
+    :type digest: str
+
+    :return: None
+    :rtype: None
+    """
+    siri_db.session.merge(Parameter(parameter_name(*scope), digest))
+
+
+def forget_digests(siri_db: flask_sqlalchemy.SQLAlchemy, *scope: str) -> None:
+    """
+    Removes the digests of a scope and of every scope nested in it, so the next write of those rows is not skipped.
+    Used when rows are changed by something other than their own ingest function. The caller commits.
+
+    :param siri_db: database
+    :type siri_db: flask_sqlalchemy.SQLAlchemy
+
+    :param scope: parts that identify the rows, for example ('patterns', operator_id) for the patterns of every line
+    :type scope: str
+
+    :return: None
+    :rtype: None
+    """
+    name = parameter_name(*scope)
+    siri_db.session.execute(siri_db.delete(Parameter).where(
+        siri_db.or_(Parameter.name == name, Parameter.name.startswith(name + ':', autoescape=True))))
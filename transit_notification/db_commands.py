@@ -1,22 +1,61 @@
-import pandas as pd
 import datetime as dt
-import numpy as np
-from natsort import index_natsorted, natsorted
+import functools
+import logging
 import os
+import time
+import typing
+from collections import OrderedDict, defaultdict
 from itertools import chain
-import dateutil
-import dateutil.parser
+
 import flask_sqlalchemy
-import typing
-from collections import defaultdict, OrderedDict
-from sqlalchemy import func
+from sqlalchemy import func, tuple_
+
+from transit_notification import cadence, content_hash, metrics, rate_limit, retention
+from transit_notification.models import (
+    Line,
+    OnwardCall,
+    OnwardCallArchive,
+    Operator,
+    Parameter,
+    Pattern,
+    Shape,
+    Stop,
+    StopPattern,
+    StopTimetable,
+    Vehicle,
+)
+from transit_notification.records import OnwardCallRecord, StopTimetableRecord, VehicleRecord, as_rows
+from transit_notification.response_cache import ResponseCache, read_through
+from transit_notification.symbols import SymbolTable, symbol_table
+
+logger = logging.getLogger(__name__)
+
+# requests in flight while the patterns of an operator are prefetched
+DEFAULT_PREFETCH_WORKERS = 4
+
+# natsort, dateutil and the SIRI client are imported inside the functions that use them so that create_app, the cli
+# and the workers do not pay for them at startup
+
+
+def siri_client(transit_api_key: str, siri_base_url: str):
+    """
+    Creates a SIRI client, importing the client library on first use.
+
+    :param transit_api_key: api key
+    :type transit_api_key: api key
+
+    :param siri_base_url: url for the transit api
+    :type siri_base_url: url for the transit api
+
+    :return: SIRI client
+    :rtype: siri_transit_api_client.SiriClient
+    """
+    import siri_transit_api_client
 
-from transit_notification.models import (Operator, Line, Stop, Vehicle, Pattern, StopPattern, OnwardCall,
-                                         StopTimetable, Parameter, Shape)
-import siri_transit_api_client
+    return siri_transit_api_client.SiriClient(api_key=transit_api_key, base_url=siri_base_url)
 
 
-def get_operators_dict(transit_api_key: str, siri_base_url: str) -> dict:
+def get_operators_dict(transit_api_key: str, siri_base_url: str, cache: ResponseCache | None = None) -> dict:
     """
     Get operators from SIRI using api key and url
 
@@ -26,14 +65,21 @@ def get_operators_dict(transit_api_key: str, siri_base_url: str) -> dict:
     :param siri_base_url: url for the transit api
     :type siri_base_url: url for the transit api
 
+    :param cache: cache of the responses, the api is always requested if None
+    :type cache: ResponseCache, optional
+
     :return: dictionary containing the operators
     :rtype: dict
     """
+    def fetch_response():
+        rate_limit.acquire(transit_api_key, rate_limit.PRIORITY_STATIC)
+        with metrics.UPSTREAM_FETCH_SECONDS.time('get_operators_dict'):
+            return siri_client(transit_api_key, siri_base_url).operators()
 
-    siri_client = siri_transit_api_client.SiriClient(api_key=transit_api_key, base_url=siri_base_url)
-    return siri_client.operators()
+    return read_through(cache, 'operators', {'base_url': siri_base_url}, fetch_response)
 
 
+@metrics.timed(metrics.WRITE_SECONDS, 'save_operators')
 def save_operators(siri_db: flask_sqlalchemy.SQLAlchemy, operators_dict: dict) -> None:
     """
     Stores the operators into the database.
@@ -47,19 +93,24 @@ def save_operators(siri_db: flask_sqlalchemy.SQLAlchemy, operators_dict: dict) -
     :return: None
     :rtype: None
     """
-    operators_df = pd.DataFrame(operators_dict)
-    operators = [Operator(operator_id=row['Id'], operator_name=row['Name'], operator_monitored=row['Monitored'])
-                 for _, row in operators_df.iterrows()]
+    rows = [(row['Id'], row['Name'], row['Monitored']) for row in operators_dict]
+    digest = content_hash.content_digest(rows)
+    if content_hash.content_unchanged(siri_db, 'operators', ('operators',), digest):
+        return None
+    operators = [Operator(operator_id=operator_id, operator_name=operator_name, operator_monitored=operator_monitored)
+                 for operator_id, operator_name, operator_monitored in rows]
 
     operators_to_delete = siri_db.delete(Operator)
     siri_db.session.execute(operators_to_delete)
     siri_db.session.commit()
     siri_db.session.add_all(operators)
+    content_hash.store_digest(siri_db, ('operators',), digest)
     siri_db.session.commit()
+    metrics.ROWS_WRITTEN.inc(len(operators), 'operator')
     return None
 
 
-def get_lines_dict(transit_api_key, siri_base_url, operator_id) -> dict:
+def get_lines_dict(transit_api_key, siri_base_url, operator_id, cache: ResponseCache | None = None) -> dict:
     """
     Get lines from SIRI using api key and url
 
@@ -72,13 +123,21 @@ def get_lines_dict(transit_api_key, siri_base_url, operator_id) -> dict:
     :param operator_id: operator id
     :type operator_id: str
 
+    :param cache: cache of the responses, the api is always requested if None
+    :type cache: ResponseCache, optional
+
     :return: dictionary containing the lines
     :rtype: dict
     """
-    siri_client = siri_transit_api_client.SiriClient(api_key=transit_api_key, base_url=siri_base_url)
-    return siri_client.lines(operator_id=operator_id)
+    def fetch_response():
+        rate_limit.acquire(transit_api_key, rate_limit.PRIORITY_STATIC)
+        with metrics.UPSTREAM_FETCH_SECONDS.time('get_lines_dict'):
+            return siri_client(transit_api_key, siri_base_url).lines(operator_id=operator_id)
 
+    return read_through(cache, 'lines', {'base_url': siri_base_url, 'operator_id': operator_id}, fetch_response)
 
+
+@metrics.timed(metrics.WRITE_SECONDS, 'save_lines')
 def save_lines(siri_db: flask_sqlalchemy.SQLAlchemy, operator_id: str, lines_dict: dict,
                current_time: dt.datetime) -> None:
     """
@@ -99,30 +158,33 @@ def save_lines(siri_db: flask_sqlalchemy.SQLAlchemy, operator_id: str, lines_dic
     :return: None
     :rtype: None
     """
-    lines_df = pd.DataFrame(lines_dict)
-    lines_df.sort_values(by="Id",
-                         key=lambda x: np.argsort(index_natsorted(lines_df["Id"])),
-                         inplace=True,
-                         ignore_index=True
-                         )
-    lines_to_add = [Line(line_id=row['Id'],
-                         operator_id=row['OperatorRef'],
-                         line_name=row['Name'],
-                         line_monitored=row['Monitored'],
-                         sort_index=int(ind))
-                    for ind, row in lines_df.iterrows()]
-
-    lines_to_delete = siri_db.delete(Line).where(Line.operator_id == operator_id)
-    siri_db.session.execute(lines_to_delete)
-    siri_db.session.commit()
-    siri_db.session.add_all(lines_to_add)
-    siri_db.session.commit()
+    from natsort import natsorted
+
+    digest = content_hash.content_digest(
+        [(row['Id'], row['OperatorRef'], row['Name'], row['Monitored']) for row in lines_dict])
+    if not content_hash.content_unchanged(siri_db, 'lines', ('lines', operator_id), digest):
+        lines_to_add = [Line(line_id=row['Id'],
+                             operator_id=row['OperatorRef'],
+                             line_name=row['Name'],
+                             line_monitored=row['Monitored'],
+                             sort_index=ind)
+                        for ind, row in enumerate(natsorted(lines_dict, key=lambda line: line['Id']))]
+
+        lines_to_delete = siri_db.delete(Line).where(Line.operator_id == operator_id)
+        siri_db.session.execute(lines_to_delete)
+        siri_db.session.commit()
+        siri_db.session.add_all(lines_to_add)
+        content_hash.store_digest(siri_db, ('lines', operator_id), digest)
+        # the new lines have no directions, so the patterns of every line have to be saved again
+        content_hash.forget_digests(siri_db, 'patterns', operator_id)
+        siri_db.session.commit()
+        metrics.ROWS_WRITTEN.inc(len(lines_to_add), 'line')
     stmt = siri_db.update(Operator).where(Operator.operator_id == operator_id).values(lines_updated=current_time)
     siri_db.session.execute(stmt)
     siri_db.session.commit()
 
 
-def get_stops_dict(transit_api_key, siri_base_url, operator_id) -> dict:
+def get_stops_dict(transit_api_key, siri_base_url, operator_id, cache: ResponseCache | None = None) -> dict:
     """
     Get stops from SIRI using api key and url
 
@@ -135,14 +197,21 @@ def get_stops_dict(transit_api_key, siri_base_url, operator_id) -> dict:
     :param operator_id: operator id
     :type operator_id: str
 
+    :param cache: cache of the responses, the api is always requested if None
+    :type cache: ResponseCache, optional
+
     :return: dictionary containing the lines
     :rtype: dict
     """
+    def fetch_response():
+        rate_limit.acquire(transit_api_key, rate_limit.PRIORITY_STATIC)
+        with metrics.UPSTREAM_FETCH_SECONDS.time('get_stops_dict'):
+            return siri_client(transit_api_key, siri_base_url).stops(operator_id=operator_id)
 
-    siri_client = siri_transit_api_client.SiriClient(api_key=transit_api_key, base_url=siri_base_url)
-    return siri_client.stops(operator_id=operator_id)
+    return read_through(cache, 'stops', {'base_url': siri_base_url, 'operator_id': operator_id}, fetch_response)
 
 
+@metrics.timed(metrics.WRITE_SECONDS, 'save_stops')
 def save_stops(siri_db: flask_sqlalchemy.SQLAlchemy, operator_id: str, stops_dict: dict,
                current_time: dt.datetime) -> None:
     """
@@ -165,18 +234,24 @@ def save_stops(siri_db: flask_sqlalchemy.SQLAlchemy, operator_id: str, stops_dic
     """
 
     stop_list = stops_dict['Contents']['dataObjects']['ScheduledStopPoint']
-    stops_to_add = [Stop(operator_id=operator_id,
-                         stop_id=stop["id"],
-                         stop_name=stop['Name'],
-                         stop_longitude=float(stop["Location"]["Longitude"]),
-                         stop_latitude=float(stop["Location"]["Latitude"]))
-                    for stop in stop_list]
-
-    stops_to_delete = siri_db.delete(Stop).where(Stop.operator_id == operator_id)
-    siri_db.session.execute(stops_to_delete)
-    siri_db.session.commit()
-    siri_db.session.add_all(stops_to_add)
-    siri_db.session.commit()
+    rows = [(stop["id"], stop['Name'], float(stop["Location"]["Longitude"]), float(stop["Location"]["Latitude"]))
+            for stop in stop_list]
+    digest = content_hash.content_digest(rows)
+    if not content_hash.content_unchanged(siri_db, 'stops', ('stops', operator_id), digest):
+        stops_to_add = [Stop(operator_id=operator_id,
+                             stop_id=stop_id,
+                             stop_name=stop_name,
+                             stop_longitude=stop_longitude,
+                             stop_latitude=stop_latitude)
+                        for stop_id, stop_name, stop_longitude, stop_latitude in rows]
+
+        stops_to_delete = siri_db.delete(Stop).where(Stop.operator_id == operator_id)
+        siri_db.session.execute(stops_to_delete)
+        siri_db.session.commit()
+        siri_db.session.add_all(stops_to_add)
+        content_hash.store_digest(siri_db, ('stops', operator_id), digest)
+        siri_db.session.commit()
+        metrics.ROWS_WRITTEN.inc(len(stops_to_add), 'stop')
     stmt = siri_db.update(Operator).where(Operator.operator_id == operator_id).values(stops_updated=current_time)
     siri_db.session.execute(stmt)
     siri_db.session.commit()
@@ -198,12 +273,14 @@ def get_vehicle_monitoring_dict(transit_api_key, siri_base_url, operator_id):
     :return: dictionary containing the lines
     :rtype: dict
     """
-    siri_client = siri_transit_api_client.SiriClient(api_key=transit_api_key, base_url=siri_base_url)
-    return siri_client.vehicle_monitoring(agency=operator_id)
+    rate_limit.acquire(transit_api_key, rate_limit.PRIORITY_VEHICLE_MONITORING)
+    with metrics.UPSTREAM_FETCH_SECONDS.time('get_vehicle_monitoring_dict'):
+        return siri_client(transit_api_key, siri_base_url).vehicle_monitoring(agency=operator_id)
 
 
 def save_vehicle_monitoring(siri_db, operator_id: str, vehicle_monitoring: dict,
-                            current_time: dt.datetime) -> None:
+                            current_time: dt.datetime, archive: bool = False,
+                            timings: dict | None = None) -> None:
     """
     Stores the vehicles and vehicle monitoring into the database.
 
@@ -219,44 +296,174 @@ def save_vehicle_monitoring(siri_db, operator_id: str, vehicle_monitoring: dict,
     :param current_time: current utc time
     :type current_time: dt.datetime
 
+    :param archive: if True, copy the onward calls into the onward call archive
+    :type archive: bool
+
+    :param timings: if given, filled with the parse and write seconds and the number of parsed rows
+    :type timings: dict, optional
+
     :return: None
     :rtype: None
     """
+    parse_start = time.perf_counter()
+    with metrics.PARSE_SECONDS.time('vehicle_monitoring'):
+        vehicles_to_add, onward_calls_to_add = parse_vehicle_monitoring(operator_id, vehicle_monitoring)
+    write_start = time.perf_counter()
+    with metrics.WRITE_SECONDS.time('save_vehicle_monitoring'):
+        write_monitoring(siri_db, operator_id, vehicles_to_add, onward_calls_to_add, 'vehicle_monitoring_updated',
+                         current_time)
+    finish_monitoring_write(siri_db, operator_id, 'vehicle_monitoring',
+                            vehicle_monitoring["Siri"]["ServiceDelivery"]["VehicleMonitoringDelivery"]["VehicleActivity"],
+                            current_time, archive)
+    if timings is not None:
+        timings.update(parse=write_start - parse_start, write=time.perf_counter() - write_start,
+                       rows=len(vehicles_to_add) + len(onward_calls_to_add))
+
+    return None
+
+
+def parse_vehicle_monitoring(operator_id: str,
+                             vehicle_monitoring: dict) -> (list[VehicleRecord], list[OnwardCallRecord]):
+    """
+    Parses a vehicle monitoring response into the vehicles and onward calls to be stored.
+
+    :param operator_id: operator id
+    :type operator_id: str
+
+    :param vehicle_monitoring: dictionary that contains the vehicle monitoring response
+    :type vehicle_monitoring: dict
+
+    :return: vehicles and onward calls
+    :rtype: (list[VehicleRecord], list[OnwardCallRecord])
+    """
     vehicle_list = vehicle_monitoring["Siri"]["ServiceDelivery"]["VehicleMonitoringDelivery"]["VehicleActivity"]
+    symbols = symbol_table(operator_id)
     vehicles_to_add = []
     onward_calls_to_add = []
     for vehicle in vehicle_list:
-        vehicle, onward_calls = parse_vehicle_dict(operator_id, vehicle)
+        vehicle, onward_calls = parse_vehicle_dict(operator_id, vehicle, symbols)
         if not vehicle.contains_none():
             vehicles_to_add.append(vehicle)
         if onward_calls:
             onward_calls_to_add.append(onward_calls)
 
-    onward_calls_to_add = list(chain.from_iterable(onward_calls_to_add))
+    return vehicles_to_add, list(chain.from_iterable(onward_calls_to_add))
 
-    vehicles_to_delete = siri_db.delete(Vehicle).where(Vehicle.operator_id == operator_id)
-    siri_db.session.execute(vehicles_to_delete)
-    siri_db.session.commit()
-    siri_db.session.add_all(vehicles_to_add)
-    siri_db.session.commit()
 
-    onward_calls_to_delete = siri_db.delete(OnwardCall).where(OnwardCall.operator_id == operator_id)
-    siri_db.session.execute(onward_calls_to_delete)
-    siri_db.session.commit()
-    siri_db.session.add_all(onward_calls_to_add)
-    siri_db.session.commit()
+def write_monitoring(siri_db: flask_sqlalchemy.SQLAlchemy,
+                     operator_id: str,
+                     vehicles: list[VehicleRecord],
+                     onward_calls: list[OnwardCallRecord],
+                     updated_column: str,
+                     current_time: dt.datetime) -> bool:
+    """
+    Replaces the vehicles and onward calls of an operator and records when the monitoring data was updated.
+
+    :param siri_db: database
+    :type siri_db: flask_sqlalchemy.SQLAlchemy
+
+    :param operator_id: operator id
+    :type operator_id: str
+
+    :param vehicles: vehicles to store
+    :type vehicles: list[VehicleRecord]
+
+    :param onward_calls: onward calls to store
+    :type onward_calls: list[OnwardCallRecord]
+
+    :param updated_column: column of the operator table that records the update time
+    :type updated_column: str
+
+    :param current_time: current utc time
+    :type current_time: dt.datetime
+
+    :return: True if the rows were written, False if they matched the stored rows
+    :rtype: bool
+    """
+    # vehicle and stop monitoring replace the same tables, so they share a digest
+    scope = ('monitoring', operator_id)
+    digest = content_hash.content_digest(vehicles, onward_calls)
+    changed = not content_hash.content_unchanged(siri_db, updated_column.removesuffix('_updated'), scope, digest)
+    if changed:
+        vehicles_to_delete = siri_db.delete(Vehicle).where(Vehicle.operator_id == operator_id)
+        siri_db.session.execute(vehicles_to_delete)
+        siri_db.session.commit()
+        insert_records(siri_db, Vehicle, vehicles)
+
+        onward_calls_to_delete = siri_db.delete(OnwardCall).where(OnwardCall.operator_id == operator_id)
+        siri_db.session.execute(onward_calls_to_delete)
+        siri_db.session.commit()
+        insert_records(siri_db, OnwardCall, onward_calls)
+        content_hash.store_digest(siri_db, scope, digest)
+        metrics.ROWS_WRITTEN.inc(len(vehicles), 'vehicle')
+        metrics.ROWS_WRITTEN.inc(len(onward_calls), 'onward_call')
 
     stmt = siri_db.update(Operator).where(Operator.operator_id == operator_id).values(
-        vehicle_monitoring_updated=current_time)
+        {updated_column: current_time})
     siri_db.session.execute(stmt)
     siri_db.session.commit()
+    return changed
 
-    return None
 
+def write_stop_monitoring_for_stops(siri_db: flask_sqlalchemy.SQLAlchemy,
+                                    operator_id: str,
+                                    stop_ids: typing.Collection[str],
+                                    vehicles: list[VehicleRecord],
+                                    onward_calls: list[OnwardCallRecord],
+                                    current_time: dt.datetime) -> None:
+    """
+    Replaces the onward calls of some stops of an operator and the vehicles that serve them, and records when the stop
+    monitoring data was updated. The predictions of the other stops are kept until the next agency wide write.
 
-def parse_vehicle_dict(operator_id: str, vehicle_dict: dict) -> (Vehicle, list[OnwardCall]):
+    :param siri_db: database
+    :type siri_db: flask_sqlalchemy.SQLAlchemy
+
+    :param operator_id: operator id
+    :type operator_id: str
+
+    :param stop_ids: stops whose onward calls are replaced
+    :type stop_ids: typing.Collection[str]
+
+    :param vehicles: vehicles serving the stops
+    :type vehicles: list[VehicleRecord]
+
+    :param onward_calls: onward calls of the stops, calls at other stops are ignored
+    :type onward_calls: list[OnwardCallRecord]
+
+    :param current_time: current utc time
+    :type current_time: dt.datetime
+
+    :return: None
+    :rtype: None
     """
-    Parses the vehicle dictionary and returns Vehicle object and a list of onward calls
+    stop_ids = set(stop_ids)
+    onward_calls = [onward_call for onward_call in onward_calls if onward_call.stop_id in stop_ids]
+
+    onward_calls_to_delete = siri_db.delete(OnwardCall).where(OnwardCall.operator_id == operator_id,
+                                                              OnwardCall.stop_id.in_(stop_ids))
+    siri_db.session.execute(onward_calls_to_delete)
+    if vehicles:
+        vehicles_to_delete = siri_db.delete(Vehicle).where(
+            Vehicle.operator_id == operator_id,
+            tuple_(Vehicle.vehicle_journey_ref, Vehicle.dataframe_ref_date).in_(
+                [(vehicle.vehicle_journey_ref, vehicle.dataframe_ref_date) for vehicle in vehicles]))
+        siri_db.session.execute(vehicles_to_delete)
+    # the tables no longer hold the rows of the last agency wide write
+    content_hash.forget_digests(siri_db, 'monitoring', operator_id)
+    siri_db.session.execute(siri_db.update(Operator).where(Operator.operator_id == operator_id).values(
+        stop_monitoring_updated=current_time))
+    siri_db.session.commit()
+    insert_records(siri_db, Vehicle, vehicles)
+    insert_records(siri_db, OnwardCall, onward_calls)
+    metrics.ROWS_WRITTEN.inc(len(vehicles), 'vehicle')
+    metrics.ROWS_WRITTEN.inc(len(onward_calls), 'onward_call')
+
+
+def parse_vehicle_dict(operator_id: str,
+                       vehicle_dict: dict,
+                       symbols: SymbolTable | None = None) -> (VehicleRecord, list[OnwardCallRecord]):
+    """
+    Parses the vehicle dictionary and returns a vehicle record and a list of onward call records
 
     :param operator_id: operator id
     :type operator_id: str
@@ -264,25 +471,32 @@ def parse_vehicle_dict(operator_id: str, vehicle_dict: dict) -> (Vehicle, list[O
     :param vehicle_dict: dictionary for a vehicle to be parsed
     :type vehicle_dict: dict
 
-    :return: returns Vehicle object and a list of onward calls
-    :rtype: (Vehicle, list[OnwardCall])
+    :param symbols: symbol table that interns the identifiers, defaults to the table of the operator
+    :type symbols: SymbolTable, optional
+
+    :return: returns vehicle record and a list of onward call records
+    :rtype: (VehicleRecord, list[OnwardCallRecord])
 
     """
 
+    if symbols is None:
+        symbols = symbol_table(operator_id)
     dataframe_ref = vehicle_dict["MonitoredVehicleJourney"]["FramedVehicleJourneyRef"]["DataFrameRef"]
-    vehicle_journey_ref = vehicle_dict["MonitoredVehicleJourney"]["FramedVehicleJourneyRef"][
-        "DatedVehicleJourneyRef"]
-    vehicle = Vehicle(operator_id=operator_id,
-                      vehicle_journey_ref=vehicle_journey_ref,
-                      dataframe_ref_date=parse_time_str(dataframe_ref).date(),
-                      line_id=vehicle_dict["MonitoredVehicleJourney"]["LineRef"],
-                      vehicle_direction=vehicle_dict["MonitoredVehicleJourney"]["DirectionRef"],
-                      vehicle_longitude=float(vehicle_dict["MonitoredVehicleJourney"]["VehicleLocation"]["Longitude"]),
-                      vehicle_latitude=float(vehicle_dict["MonitoredVehicleJourney"]["VehicleLocation"]["Latitude"]),
-                      vehicle_bearing=float(vehicle_dict["MonitoredVehicleJourney"]["Bearing"]))
+    vehicle_journey_ref = symbols.intern(vehicle_dict["MonitoredVehicleJourney"]["FramedVehicleJourneyRef"][
+        "DatedVehicleJourneyRef"])
+    vehicle = VehicleRecord(operator_id=symbols.intern(operator_id),
+                            vehicle_journey_ref=vehicle_journey_ref,
+                            dataframe_ref_date=parse_dataframe_ref(dataframe_ref),
+                            line_id=symbols.intern(vehicle_dict["MonitoredVehicleJourney"]["LineRef"]),
+                            vehicle_direction=symbols.intern(vehicle_dict["MonitoredVehicleJourney"]["DirectionRef"]),
+                            vehicle_longitude=float(vehicle_dict["MonitoredVehicleJourney"]["VehicleLocation"][
+                                                        "Longitude"]),
+                            vehicle_latitude=float(vehicle_dict["MonitoredVehicleJourney"]["VehicleLocation"][
+                                                       "Latitude"]),
+                            vehicle_bearing=float(vehicle_dict["MonitoredVehicleJourney"]["Bearing"]))
 
     onward_calls = parse_vehicle_calls(operator_id, vehicle_journey_ref, dataframe_ref,
-                                       vehicle_dict["MonitoredVehicleJourney"])
+                                       vehicle_dict["MonitoredVehicleJourney"], symbols)
 
     return vehicle, onward_calls
 
@@ -290,9 +504,10 @@ def parse_vehicle_dict(operator_id: str, vehicle_dict: dict) -> (Vehicle, list[O
 def parse_vehicle_calls(operator_id: str,
                         vehicle_journey_ref: str,
                         dataframe_ref: str,
-                        vehicle_dict: dict) -> list[OnwardCall]:
+                        vehicle_dict: dict,
+                        symbols: SymbolTable | None = None) -> list[OnwardCallRecord]:
     """
-    Parses the monitored and onward calls for a vehicle. Returns a list of OnwardCall Objects.
+    Parses the monitored and onward calls for a vehicle. Returns a list of onward call records.
 
     :param operator_id: operator id
     :type operator_id: str
@@ -307,42 +522,51 @@ def parse_vehicle_calls(operator_id: str,
     :param vehicle_dict: dictionary for a vehicle to be parsed
     :type vehicle_dict: dict
 
+    :param symbols: symbol table that interns the identifiers, defaults to the table of the operator
+    :type symbols: SymbolTable, optional
+
     :return: list containing parsed monitored and onward calls
-    :rtype: list[OnwardCall]
+    :rtype: list[OnwardCallRecord]
     """
+    if symbols is None:
+        symbols = symbol_table(operator_id)
+    operator_id = symbols.intern(operator_id)
+    vehicle_journey_ref = symbols.intern(vehicle_journey_ref)
+    dataframe_ref_date = parse_dataframe_ref(dataframe_ref)
     ret_list = []
     if "OnwardCalls" in vehicle_dict:
-        ret_list = [OnwardCall(operator_id=operator_id,
-                               vehicle_journey_ref=vehicle_journey_ref,
-                               dataframe_ref_date=parse_time_str(dataframe_ref).date(),
-                               stop_id=call_json["StopPointRef"],
-                               vehicle_at_stop=False,
-                               aimed_arrival_time_utc=parse_time_str(call_json["AimedArrivalTime"]),
-                               expected_arrival_time_utc=parse_time_str(call_json["ExpectedArrivalTime"]),
-                               aimed_departure_time_utc=parse_time_str(call_json["AimedDepartureTime"]),
-                               expected_departure_time_utc=parse_time_str(call_json["ExpectedDepartureTime"]))
+        ret_list = [OnwardCallRecord(operator_id=operator_id,
+                                     vehicle_journey_ref=vehicle_journey_ref,
+                                     dataframe_ref_date=dataframe_ref_date,
+                                     stop_id=symbols.intern(call_json["StopPointRef"]),
+                                     vehicle_at_stop=False,
+                                     aimed_arrival_time_utc=parse_time_str(call_json["AimedArrivalTime"]),
+                                     expected_arrival_time_utc=parse_time_str(call_json["ExpectedArrivalTime"]),
+                                     aimed_departure_time_utc=parse_time_str(call_json["AimedDepartureTime"]),
+                                     expected_departure_time_utc=parse_time_str(call_json["ExpectedDepartureTime"]))
                     for call_json in vehicle_dict["OnwardCalls"]["OnwardCall"]]
 
     if "MonitoredCall" in vehicle_dict:
-        monitored_call = OnwardCall(operator_id=operator_id,
-                                    vehicle_journey_ref=vehicle_journey_ref,
-                                    dataframe_ref_date=parse_time_str(dataframe_ref).date(),
-                                    stop_id=vehicle_dict["MonitoredCall"]["StopPointRef"],
-                                    vehicle_at_stop=parse_bools(vehicle_dict["MonitoredCall"]["VehicleAtStop"]),
-                                    aimed_arrival_time_utc=parse_time_str(vehicle_dict["MonitoredCall"][
-                                                                               "AimedArrivalTime"]),
-                                    expected_arrival_time_utc=parse_time_str(vehicle_dict["MonitoredCall"][
-                                                                                  "ExpectedArrivalTime"]),
-                                    aimed_departure_time_utc=parse_time_str(vehicle_dict["MonitoredCall"][
-                                                                                 "AimedDepartureTime"]),
-                                    expected_departure_time_utc=parse_time_str(vehicle_dict["MonitoredCall"][
-                                                                                    "ExpectedDepartureTime"]))
+        monitored_call = OnwardCallRecord(operator_id=operator_id,
+                                          vehicle_journey_ref=vehicle_journey_ref,
+                                          dataframe_ref_date=dataframe_ref_date,
+                                          stop_id=symbols.intern(vehicle_dict["MonitoredCall"]["StopPointRef"]),
+                                          vehicle_at_stop=parse_bools(vehicle_dict["MonitoredCall"]["VehicleAtStop"]),
+                                          aimed_arrival_time_utc=parse_time_str(vehicle_dict["MonitoredCall"][
+                                                                                     "AimedArrivalTime"]),
+                                          expected_arrival_time_utc=parse_time_str(vehicle_dict["MonitoredCall"][
+                                                                                        "ExpectedArrivalTime"]),
+                                          aimed_departure_time_utc=parse_time_str(vehicle_dict["MonitoredCall"][
+                                                                                       "AimedDepartureTime"]),
+                                          expected_departure_time_utc=parse_time_str(vehicle_dict["MonitoredCall"][
+                                                                                          "ExpectedDepartureTime"]))
         ret_list.append(monitored_call)
 
     return ret_list
 
 
-def get_pattern_dict(transit_api_key: str, siri_base_url: str, operator_id: str, line_id: str) -> dict:
+def get_pattern_dict(transit_api_key: str, siri_base_url: str, operator_id: str, line_id: str,
+                     cache: ResponseCache | None = None) -> dict:
     """
     Get patterns from SIRI using api key and url
 
@@ -358,14 +582,24 @@ def get_pattern_dict(transit_api_key: str, siri_base_url: str, operator_id: str,
     :param line_id: line id
     :type line_id: str
 
+    :param cache: cache of the responses, the api is always requested if None
+    :type cache: ResponseCache, optional
+
     :return: dictionary containing the lines
     :rtype: dict
     """
-    siri_client = siri_transit_api_client.SiriClient(api_key=transit_api_key, base_url=siri_base_url)
-    return siri_client.patterns(operator_id=operator_id, line_id=line_id)
+    def fetch_response():
+        rate_limit.acquire(transit_api_key, rate_limit.PRIORITY_STATIC)
+        with metrics.UPSTREAM_FETCH_SECONDS.time('get_pattern_dict'):
+            return siri_client(transit_api_key, siri_base_url).patterns(operator_id=operator_id, line_id=line_id)
+
+    return read_through(cache, 'patterns', {'base_url': siri_base_url, 'operator_id': operator_id, 'line_id': line_id},
+                        fetch_response)
 
 
-def save_patterns(siri_db: flask_sqlalchemy.SQLAlchemy, operator_id: str, line_id: str, pattern_dict: dict) -> None:
+@metrics.timed(metrics.WRITE_SECONDS, 'save_patterns')
+def save_patterns(siri_db: flask_sqlalchemy.SQLAlchemy, operator_id: str, line_id: str, pattern_dict: dict,
+                  current_time: dt.datetime | None = None) -> None:
     """
     Save the patterns into the database. Adds direction to lines.
 
@@ -381,11 +615,30 @@ def save_patterns(siri_db: flask_sqlalchemy.SQLAlchemy, operator_id: str, line_i
     :param pattern_dict: dictionary that contains the pattern
     :type pattern_dict: dict
 
+    :param current_time: current utc time, stored as the patterns update time of the line if given
+    :type current_time: dt.datetime, optional
+
     :return: None
     :rtype: None
 
     """
     directions = pattern_dict["directions"]
+    scope = ('patterns', operator_id, line_id)
+    digest = content_hash.content_digest(
+        [(direction["DirectionId"], direction["Name"]) for direction in directions],
+        [(pattern['LineRef'], pattern['serviceJourneyPatternRef'], pattern['Name'], pattern['DirectionRef'],
+          pattern['TripCount'],
+          tuple((stop["Order"], stop["ScheduledStopPointRef"])
+                for stop in pattern['PointsInSequence']['StopPointInJourneyPattern']),
+          tuple((stop["Order"], stop["ScheduledStopPointRef"])
+                for stop in pattern['PointsInSequence']['TimingPointInJourneyPattern']))
+         for pattern in pattern_dict['journeyPatterns']])
+    if content_hash.content_unchanged(siri_db, 'patterns', scope, digest):
+        if current_time is not None:
+            siri_db.session.execute(siri_db.update(Line).where(
+                Line.operator_id == operator_id, Line.line_id == line_id).values(patterns_updated=current_time))
+            siri_db.session.commit()
+        return None
     if len(directions) == 2:
         stmt = siri_db.update(Line).where(Line.operator_id == operator_id, Line.line_id == line_id).values(
             {
@@ -404,6 +657,8 @@ def save_patterns(siri_db: flask_sqlalchemy.SQLAlchemy, operator_id: str, line_i
             })
     else:
         raise Exception("Only 1 or 2 directions are supported")
+    if current_time is not None:
+        stmt = stmt.values(patterns_updated=current_time)
     siri_db.session.execute(stmt)
     siri_db.session.commit()
 
@@ -423,10 +678,179 @@ def save_patterns(siri_db: flask_sqlalchemy.SQLAlchemy, operator_id: str, line_i
     siri_db.session.commit()
 
     siri_db.session.add_all(patterns_to_add)
+    content_hash.store_digest(siri_db, scope, digest)
     siri_db.session.commit()
+    metrics.ROWS_WRITTEN.inc(len(patterns_to_add), 'pattern')
     return None
 
 
+def line_patterns_refresh_needed(siri_db: flask_sqlalchemy.SQLAlchemy,
+                                 operator_id: str,
+                                 line_id: str,
+                                 refresh_limit: float,
+                                 current_time: dt.datetime) -> bool:
+    """
+    Determines if the patterns of a line should be refreshed.
+
+    :param siri_db: database
+    :type siri_db: flask_sqlalchemy.SQLAlchemy
+
+    :param operator_id: operator id
+    :type operator_id: str
+
+    :param line_id: line id
+    :type line_id: str
+
+    :param refresh_limit: minimum time in minutes to elapse before refreshing the patterns
+    :type refresh_limit: float
+
+    :param current_time: current time in utc
+    :type current_time: dt.datetime
+
+    :return: boolean for if the patterns should be refreshed
+    :rtype: bool
+    """
+    last_update_time = siri_db.session.execute(siri_db.select(Line.patterns_updated).filter_by(
+        operator_id=operator_id, line_id=line_id)).scalar_one_or_none()
+    if last_update_time is None:
+        return True
+    return current_time.replace(tzinfo=None) - last_update_time >= dt.timedelta(minutes=refresh_limit)
+
+
+def stale_pattern_lines(siri_db: flask_sqlalchemy.SQLAlchemy,
+                        operator_id: str,
+                        refresh_limit: float,
+                        current_time: dt.datetime) -> list[str]:
+    """
+    Lines of an operator whose patterns were never saved or are older than the refresh limit.
+
+    :param siri_db: database
+    :type siri_db: flask_sqlalchemy.SQLAlchemy
+
+    :param operator_id: operator id
+    :type operator_id: str
+
+    :param refresh_limit: minimum time in minutes to elapse before refreshing the patterns
+    :type refresh_limit: float
+
+    :param current_time: current time in utc
+    :type current_time: dt.datetime
+
+    :return: line ids in sort order
+    :rtype: list[str]
+    """
+    updated_before = current_time.replace(tzinfo=None) - dt.timedelta(minutes=refresh_limit)
+    return list(siri_db.session.execute(siri_db.select(Line.line_id).where(
+        Line.operator_id == operator_id,
+        siri_db.or_(Line.patterns_updated.is_(None), Line.patterns_updated <= updated_before)
+    ).order_by(Line.sort_index.asc())).scalars())
+
+
+def fetch_concurrently(requests: dict[typing.Hashable, typing.Callable[[], dict]],
+                       max_workers: int = DEFAULT_PREFETCH_WORKERS
+                       ) -> typing.Iterator[tuple[typing.Hashable, dict | None, Exception | None]]:
+    """
+    Sends requests to the SIRI api on a thread pool and yields the responses as they arrive, so the caller can save
+    each one in its own thread while the others are in flight. The requests run in the app context of the caller, so
+    they share its rate limit.
+
+    :param requests: functions that send a request and return its response, keyed by an identifier
+    :type requests: dict[typing.Hashable, typing.Callable[[], dict]]
+
+    :param max_workers: most requests in flight
+    :type max_workers: int
+
+    :return: identifier, response and the exception raised by the request for each request
+    :rtype: typing.Iterator[tuple[typing.Hashable, typing.Optional[dict], typing.Optional[Exception]]]
+    """
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    from flask import current_app, has_app_context
+
+    app = current_app._get_current_object() if has_app_context() else None
+
+    def send(request):
+        if app is None:
+            return request()
+        with app.app_context():
+            return request()
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix='siri-fetch') as executor:
+        futures = {executor.submit(send, request): key for key, request in requests.items()}
+        for future in as_completed(futures):
+            error = future.exception()
+            yield futures[future], None if error is not None else future.result(), error
+
+
+def prefetch_patterns(siri_db: flask_sqlalchemy.SQLAlchemy,
+                      transit_api_key: str,
+                      siri_base_url: str,
+                      operator_id: str,
+                      current_time: dt.datetime,
+                      refresh_limit: float = 0,
+                      max_workers: int = DEFAULT_PREFETCH_WORKERS,
+                      cache: ResponseCache | None = None,
+                      line_ids: list[str] | None = None) -> int:
+    """
+    Fetches the patterns of every stale line of an operator concurrently and saves them as they arrive. The saves run
+    in the calling thread, so only the requests overlap. A line that fails is logged and left stale. When every stale
+    line is saved the operator patterns update time is set.
+
+    :param siri_db: database
+    :type siri_db: flask_sqlalchemy.SQLAlchemy
+
+    :param transit_api_key: api key
+    :type transit_api_key: str
+
+    :param siri_base_url: url for the transit api
+    :type siri_base_url: str
+
+    :param operator_id: operator id
+    :type operator_id: str
+
+    :param current_time: current utc time
+    :type current_time: dt.datetime
+
+    :param refresh_limit: lines saved within this many minutes are skipped, 0 refreshes every line
+    :type refresh_limit: float
+
+    :param max_workers: most requests in flight
+    :type max_workers: int
+
+    :param cache: cache of the responses, the api is always requested if None
+    :type cache: ResponseCache, optional
+
+    :param line_ids: stale lines to fetch, every stale line if None
+    :type line_ids: list[str], optional
+
+    :return: number of lines whose patterns were saved
+    :rtype: int
+    """
+    stale_line_ids = stale_pattern_lines(siri_db, operator_id, refresh_limit, current_time)
+    if line_ids is None:
+        line_ids = stale_line_ids
+    requests = {line_id: functools.partial(get_pattern_dict, transit_api_key, siri_base_url, operator_id, line_id,
+                                           cache=cache)
+                for line_id in line_ids}
+    saved = 0
+    for line_id, pattern_dict, error in fetch_concurrently(requests, max_workers):
+        try:
+            if error is not None:
+                raise error
+            save_patterns(siri_db, operator_id, line_id, pattern_dict, current_time)
+        except Exception:
+            siri_db.session.rollback()
+            logger.exception("Unable to prefetch the patterns of line %s of %s", line_id, operator_id)
+            continue
+        saved += 1
+    if saved == len(line_ids) and set(stale_line_ids) <= set(line_ids):
+        stmt = siri_db.update(Operator).where(Operator.operator_id == operator_id).values(
+            patterns_updated=current_time)
+        siri_db.session.execute(stmt)
+        siri_db.session.commit()
+    return saved
+
+
 def save_stop_pattern(siri_db: flask_sqlalchemy.SQLAlchemy,
                       operator_id: str,
                       pattern_id: str,
@@ -470,10 +894,11 @@ def save_stop_pattern(siri_db: flask_sqlalchemy.SQLAlchemy,
 
     siri_db.session.add_all(untimed_stops + timed_stops)
     siri_db.session.commit()
+    metrics.ROWS_WRITTEN.inc(len(untimed_stops) + len(timed_stops), 'stop_pattern')
     return None
 
 
-def get_stop_monitoring_dict(transit_api_key, siri_base_url, operator_id):
+def get_stop_monitoring_dict(transit_api_key, siri_base_url, operator_id, stop_id: str | None = None):
     """
     Get stop monitoring from SIRI using api key and url
 
@@ -486,14 +911,20 @@ def get_stop_monitoring_dict(transit_api_key, siri_base_url, operator_id):
     :param operator_id: operator id
     :type operator_id: str
 
+    :param stop_id: only request the visits of this stop, defaults to every stop of the operator
+    :type stop_id: str, optional
+
     :return: dictionary containing the lines
     :rtype: dict
     """
-    siri_client = siri_transit_api_client.SiriClient(api_key=transit_api_key, base_url=siri_base_url)
-    return siri_client.stop_monitoring(agency=operator_id)
+    rate_limit.acquire(transit_api_key, rate_limit.PRIORITY_STOP_MONITORING)
+    with metrics.UPSTREAM_FETCH_SECONDS.time('get_stop_monitoring_dict'):
+        return siri_client(transit_api_key, siri_base_url).stop_monitoring(agency=operator_id, stop_code=stop_id)
 
 
-def parse_stop_monitoring_dict(operator_id: str, stop_monitoring_dict: dict) -> (Vehicle, OnwardCall):
+def parse_stop_monitoring_dict(operator_id: str,
+                               stop_monitoring_dict: dict,
+                               symbols: SymbolTable | None = None) -> (VehicleRecord, OnwardCallRecord):
     """
     Parses the stop monitoring dictionary and returns a dictionary of selected items
 
@@ -503,30 +934,36 @@ def parse_stop_monitoring_dict(operator_id: str, stop_monitoring_dict: dict) ->
     :param stop_monitoring_dict: dictionary for a vehicle to be parsed
     :type stop_monitoring_dict: dict
 
-    :return: Vehicle object and onward call object
-    :rtype: Vehicle, OnwardCall
-    """
+    :param symbols: symbol table that interns the identifiers, defaults to the table of the operator
+    :type symbols: SymbolTable, optional
 
-    dataframe_ref = stop_monitoring_dict["MonitoredVehicleJourney"]["FramedVehicleJourneyRef"]["DataFrameRef"]
-    vehicle = Vehicle(
+    :return: vehicle record and onward call record
+    :rtype: VehicleRecord, OnwardCallRecord
+    """
+    if symbols is None:
+        symbols = symbol_table(operator_id)
+    operator_id = symbols.intern(operator_id)
+    dataframe_ref_date = parse_dataframe_ref(
+        stop_monitoring_dict["MonitoredVehicleJourney"]["FramedVehicleJourneyRef"]["DataFrameRef"])
+    vehicle_journey_ref = symbols.intern(stop_monitoring_dict["MonitoredVehicleJourney"]["FramedVehicleJourneyRef"][
+        "DatedVehicleJourneyRef"])
+    vehicle = VehicleRecord(
         operator_id=operator_id,
-        vehicle_journey_ref=stop_monitoring_dict["MonitoredVehicleJourney"]["FramedVehicleJourneyRef"][
-            "DatedVehicleJourneyRef"],
-        dataframe_ref_date=parse_time_str(dataframe_ref).date(),
-        line_id=stop_monitoring_dict["MonitoredVehicleJourney"]["LineRef"],
-        vehicle_direction=stop_monitoring_dict["MonitoredVehicleJourney"]["DirectionRef"],
+        vehicle_journey_ref=vehicle_journey_ref,
+        dataframe_ref_date=dataframe_ref_date,
+        line_id=symbols.intern(stop_monitoring_dict["MonitoredVehicleJourney"]["LineRef"]),
+        vehicle_direction=symbols.intern(stop_monitoring_dict["MonitoredVehicleJourney"]["DirectionRef"]),
         vehicle_longitude=parse_optional_floats(stop_monitoring_dict["MonitoredVehicleJourney"]["VehicleLocation"][
                                                     "Longitude"]),
         vehicle_latitude=parse_optional_floats(stop_monitoring_dict["MonitoredVehicleJourney"]["VehicleLocation"][
                                                    "Latitude"]),
         vehicle_bearing=parse_optional_floats(stop_monitoring_dict["MonitoredVehicleJourney"]["Bearing"])
     )
-    onward_call = OnwardCall(
+    onward_call = OnwardCallRecord(
         operator_id=operator_id,
-        vehicle_journey_ref=stop_monitoring_dict["MonitoredVehicleJourney"]["FramedVehicleJourneyRef"][
-            "DatedVehicleJourneyRef"],
-        dataframe_ref_date=parse_time_str(dataframe_ref).date(),
-        stop_id=stop_monitoring_dict["MonitoredVehicleJourney"]["MonitoredCall"]["StopPointRef"],
+        vehicle_journey_ref=vehicle_journey_ref,
+        dataframe_ref_date=dataframe_ref_date,
+        stop_id=symbols.intern(stop_monitoring_dict["MonitoredVehicleJourney"]["MonitoredCall"]["StopPointRef"]),
         vehicle_at_stop=parse_bools(stop_monitoring_dict["MonitoredVehicleJourney"]["MonitoredCall"]["VehicleAtStop"]),
         aimed_arrival_time_utc=parse_time_str(stop_monitoring_dict["MonitoredVehicleJourney"]["MonitoredCall"][
                                                       "AimedArrivalTime"]),
@@ -544,7 +981,9 @@ def parse_stop_monitoring_dict(operator_id: str, stop_monitoring_dict: dict) ->
 def save_stop_monitoring(siri_db,
                          operator_id: str,
                          stop_monitoring: dict,
-                         current_time: dt.datetime) -> None:
+                         current_time: dt.datetime,
+                         archive: bool = False,
+                         timings: dict | None = None) -> None:
     """
     Stores the vehicles and stop monitoring into the database.
 
@@ -560,16 +999,137 @@ def save_stop_monitoring(siri_db,
     :param current_time: current utc time
     :type current_time: dt.datetime
 
+    :param archive: if True, copy the onward calls into the onward call archive
+    :type archive: bool
+
+    :param timings: if given, filled with the parse and write seconds and the number of parsed rows
+    :type timings: dict, optional
+
+    :return: None
+    :rtype: None
+    """
+
+    parse_start = time.perf_counter()
+    with metrics.PARSE_SECONDS.time('stop_monitoring'):
+        vehicles_to_add, onward_calls_to_add = parse_stop_monitoring(operator_id, stop_monitoring)
+    write_start = time.perf_counter()
+    with metrics.WRITE_SECONDS.time('save_stop_monitoring'):
+        write_monitoring(siri_db, operator_id, vehicles_to_add, onward_calls_to_add, 'stop_monitoring_updated',
+                         current_time)
+    finish_monitoring_write(siri_db, operator_id, 'stop_monitoring',
+                            stop_monitoring["ServiceDelivery"]["StopMonitoringDelivery"]["MonitoredStopVisit"],
+                            current_time, archive)
+    if timings is not None:
+        timings.update(parse=write_start - parse_start, write=time.perf_counter() - write_start,
+                       rows=len(vehicles_to_add) + len(onward_calls_to_add))
+
+    return None
+
+
+def save_stop_monitoring_for_stops(siri_db: flask_sqlalchemy.SQLAlchemy,
+                                   operator_id: str,
+                                   stop_ids: typing.Collection[str],
+                                   stop_monitoring: dict,
+                                   current_time: dt.datetime,
+                                   archive: bool = False) -> None:
+    """
+    Stores the stop monitoring responses of some stops of an operator, with the same bookkeeping as
+    save_stop_monitoring.
+
+    :param siri_db: database
+    :type siri_db: flask_sqlalchemy.SQLAlchemy
+
+    :param operator_id: operator id
+    :type operator_id: str
+
+    :param stop_ids: requested stops
+    :type stop_ids: typing.Collection[str]
+
+    :param stop_monitoring: dictionary that contains the monitored stop visits of the stops
+    :type stop_monitoring: dict
+
+    :param current_time: current utc time
+    :type current_time: dt.datetime
+
+    :param archive: if True, copy the onward calls of the stops into the onward call archive
+    :type archive: bool
+
+    :return: None
+    :rtype: None
+    """
+    with metrics.PARSE_SECONDS.time('stop_monitoring'):
+        vehicles_to_add, onward_calls_to_add = parse_stop_monitoring(operator_id, stop_monitoring)
+    with metrics.WRITE_SECONDS.time('save_stop_monitoring_for_stops'):
+        write_stop_monitoring_for_stops(siri_db, operator_id, stop_ids, vehicles_to_add, onward_calls_to_add,
+                                        current_time)
+    finish_monitoring_write(siri_db, operator_id, 'stop_monitoring',
+                            stop_monitoring["ServiceDelivery"]["StopMonitoringDelivery"]["MonitoredStopVisit"],
+                            current_time, archive, stop_ids)
+
+
+def finish_monitoring_write(siri_db: flask_sqlalchemy.SQLAlchemy,
+                            operator_id: str,
+                            feed: str,
+                            records: typing.Iterable[dict],
+                            current_time: dt.datetime,
+                            archive: bool,
+                            stop_ids: typing.Collection[str] | None = None) -> None:
+    """
+    Bookkeeping after a monitoring write: learns the cadence of the feed, archives the onward calls and runs a step
+    of the retention.
+
+    :param siri_db: database
+    :type siri_db: flask_sqlalchemy.SQLAlchemy
+
+    :param operator_id: operator id
+    :type operator_id: str
+
+    :param feed: feed name, vehicle_monitoring or stop_monitoring
+    :type feed: str
+
+    :param records: vehicle activities or monitored stop visits of the response
+    :type records: typing.Iterable[dict]
+
+    :param current_time: current utc time
+    :type current_time: dt.datetime
+
+    :param archive: if True, copy the onward calls into the onward call archive
+    :type archive: bool
+
+    :param stop_ids: if given, only the onward calls of these stops were written and are archived
+    :type stop_ids: typing.Collection[str], optional
+
     :return: None
     :rtype: None
     """
+    cadence.observe(operator_id, feed, recorded_time(records), current_time)
+    if archive:
+        archive_onward_calls(siri_db, operator_id, current_time, stop_ids)
+    retention.step(siri_db, current_time)
+
+
+def parse_stop_monitoring(operator_id: str,
+                          stop_monitoring: dict) -> (list[VehicleRecord], list[OnwardCallRecord]):
+    """
+    Parses a stop monitoring response into the vehicles and onward calls to be stored. Each vehicle is only
+    returned once even if it visits several monitored stops.
+
+    :param operator_id: operator id
+    :type operator_id: str
+
+    :param stop_monitoring: dictionary that contains the stop monitoring response
+    :type stop_monitoring: dict
 
+    :return: vehicles and onward calls
+    :rtype: (list[VehicleRecord], list[OnwardCallRecord])
+    """
     monitored_stop_visits = stop_monitoring["ServiceDelivery"]["StopMonitoringDelivery"]["MonitoredStopVisit"]
+    symbols = symbol_table(operator_id)
     vehicles_to_add = []
     vehicle_tracker = set()
     onward_calls_to_add = []
     for monitored_stop_visit in monitored_stop_visits:
-        vehicle, onward_call = parse_stop_monitoring_dict(operator_id,  monitored_stop_visit)
+        vehicle, onward_call = parse_stop_monitoring_dict(operator_id, monitored_stop_visit, symbols)
         vehicle_tuple = (vehicle.vehicle_journey_ref, vehicle.dataframe_ref_date)
         if not vehicle.contains_none() and vehicle_tuple not in vehicle_tracker:
             vehicles_to_add.append(vehicle)
@@ -577,25 +1137,57 @@ def save_stop_monitoring(siri_db,
         if onward_call:
             onward_calls_to_add.append(onward_call)
 
-    vehicles_to_delete = siri_db.delete(Vehicle).where(Vehicle.operator_id == operator_id)
-    siri_db.session.execute(vehicles_to_delete)
-    siri_db.session.commit()
-    siri_db.session.add_all(list(vehicles_to_add))
-    siri_db.session.commit()
+    return vehicles_to_add, onward_calls_to_add
 
-    onward_calls_to_delete = siri_db.delete(OnwardCall).where(OnwardCall.operator_id == operator_id)
-    siri_db.session.execute(onward_calls_to_delete)
-    siri_db.session.commit()
-    siri_db.session.add_all(onward_calls_to_add)
-    siri_db.session.commit()
 
-    stmt = siri_db.update(Operator).where(Operator.operator_id == operator_id).values(
-        stop_monitoring_updated=current_time)
+def archive_onward_calls(siri_db: flask_sqlalchemy.SQLAlchemy,
+                         operator_id: str,
+                         current_time: dt.datetime,
+                         stop_ids: typing.Collection[str] | None = None) -> None:
+    """
+    Copies the current onward calls of an operator into the onward call archive. The copy is done with a single
+    INSERT ... SELECT so the rows never pass through python.
+
+    :param siri_db: database
+    :type siri_db: flask_sqlalchemy.SQLAlchemy
+
+    :param operator_id: operator id
+    :type operator_id: str
+
+    :param current_time: current utc time, stored as the time the predictions were recorded
+    :type current_time: dt.datetime
+
+    :param stop_ids: if given, only the onward calls of these stops are copied
+    :type stop_ids: typing.Collection[str], optional
+
+    :return: None
+    :rtype: None
+    """
+    recorded_time = siri_db.literal(current_time.replace(tzinfo=None), siri_db.DateTime)
+    calls = siri_db.select(OnwardCall.operator_id,
+                           Vehicle.line_id,
+                           OnwardCall.stop_id,
+                           OnwardCall.vehicle_journey_ref,
+                           OnwardCall.dataframe_ref_date,
+                           recorded_time,
+                           OnwardCall.aimed_arrival_time_utc,
+                           OnwardCall.expected_arrival_time_utc,
+                           OnwardCall.aimed_departure_time_utc,
+                           OnwardCall.expected_departure_time_utc
+                           ).join(Vehicle, siri_db.and_(Vehicle.operator_id == OnwardCall.operator_id,
+                                                        Vehicle.vehicle_journey_ref == OnwardCall.vehicle_journey_ref,
+                                                        Vehicle.dataframe_ref_date == OnwardCall.dataframe_ref_date)
+                                  ).where(OnwardCall.operator_id == operator_id)
+    if stop_ids is not None:
+        calls = calls.where(OnwardCall.stop_id.in_(stop_ids))
+    stmt = siri_db.insert(OnwardCallArchive).from_select(
+        ['operator_id', 'line_id', 'stop_id', 'vehicle_journey_ref', 'dataframe_ref_date', 'recorded_time_utc',
+         'aimed_arrival_time_utc', 'expected_arrival_time_utc', 'aimed_departure_time_utc',
+         'expected_departure_time_utc'],
+        calls)
     siri_db.session.execute(stmt)
     siri_db.session.commit()
 
-    return None
-
 
 def get_shapes_dict(transit_api_key: str,
                     siri_base_url: str,
@@ -620,10 +1212,12 @@ def get_shapes_dict(transit_api_key: str,
     :rtype: dict
     """
 
-    siri_client = siri_transit_api_client.SiriClient(api_key=transit_api_key, base_url=siri_base_url)
-    return siri_client.shapes(operator_id, trip_id)
+    rate_limit.acquire(transit_api_key, rate_limit.PRIORITY_STATIC)
+    with metrics.UPSTREAM_FETCH_SECONDS.time('get_shapes_dict'):
+        return siri_client(transit_api_key, siri_base_url).shapes(operator_id, trip_id)
 
 
+@metrics.timed(metrics.WRITE_SECONDS, 'save_shapes')
 def save_shapes(siri_db: flask_sqlalchemy.SQLAlchemy,
                 operator_id: str,
                 line_id: str,
@@ -655,19 +1249,19 @@ def save_shapes(siri_db: flask_sqlalchemy.SQLAlchemy,
     shape_dict['Content']['TimetableFrame']['vehicleJourneys']['ServiceJourney']['LinkSequenceProjection'][
         'LineString']['pos']
     shape_coordinates_list = [x.split() for x in shape_coordinates_list]
-    shape_coordinates_df = pd.DataFrame(shape_coordinates_list, columns=['latitude', 'longitude']).astype(float)
     shape_coordinates = [Shape(operator_id=operator_id,
                                line_id=line_id,
                                shape_order=ind,
-                               shape_latitude=row['latitude'],
-                               shape_longitude=row['longitude'])
-                         for ind, row in shape_coordinates_df.iterrows()]
+                               shape_latitude=float(latitude),
+                               shape_longitude=float(longitude))
+                         for ind, (latitude, longitude) in enumerate(shape_coordinates_list)]
 
     shapes_to_delete = siri_db.delete(Shape)
     siri_db.session.execute(shapes_to_delete)
     siri_db.session.commit()
     siri_db.session.add_all(shape_coordinates)
     siri_db.session.commit()
+    metrics.ROWS_WRITTEN.inc(len(shape_coordinates), 'shape')
 
     stmt = siri_db.update(Line).where(siri_db.and_(Line.operator_id == operator_id,
                                                    Line.line_id == line_id)).values(
@@ -699,24 +1293,74 @@ def upcoming_vehicles(siri_db: flask_sqlalchemy.SQLAlchemy,
     :return: list containing upcoming vehicles to a stop
     :rtype: list[dict]
     """
+    return upcoming_vehicles_for_stops(siri_db, operator_id, [stop_id], current_time).get(stop_id, {})
+
 
-    stmt = siri_db.select(Vehicle, OnwardCall).join(OnwardCall).filter(siri_db.and_(
-        OnwardCall.stop_id == stop_id, OnwardCall.operator_id == operator_id))
-    response_dict = defaultdict(list)
-    for row in siri_db.session.execute(stmt):
-        vehicle = row[0]
-        onward_call = row[1]
-        vehicle_at_stop = onward_call.vehicle_at_stop
+def upcoming_vehicles_for_stops(siri_db: flask_sqlalchemy.SQLAlchemy,
+                                operator_id: str,
+                                stop_ids: typing.Collection[str],
+                                current_time: dt.datetime) -> dict[str, dict[str, list[str]]]:
+    """
+    Creates the upcoming vehicles of several stops with one query. Vehicles that already left a stop are filtered
+    by the query, which reads the onward calls through the primary key index on operator and stop.
+
+    :param siri_db: database
+    :type siri_db: flask_sqlalchemy.SQLAlchemy
+
+    :param operator_id: operator id
+    :type operator_id: str
+
+    :param stop_ids: stop ids
+    :type stop_ids: typing.Collection[str]
+
+    :param current_time: current utc time
+    :type current_time: dt.datetime
+
+    :return: formatted etas by stop and line, stops without upcoming vehicles are left out
+    :rtype: dict[str, dict[str, list[str]]]
+    """
+    stored_time = current_time.astimezone(dt.UTC).replace(tzinfo=None)
+    stmt = siri_db.select(OnwardCall.stop_id, Vehicle.line_id, OnwardCall.vehicle_at_stop,
+                          OnwardCall.expected_arrival_time_utc).join(Vehicle, siri_db.and_(
+                              Vehicle.operator_id == OnwardCall.operator_id,
+                              Vehicle.vehicle_journey_ref == OnwardCall.vehicle_journey_ref,
+                              Vehicle.dataframe_ref_date == OnwardCall.dataframe_ref_date)).where(
+        OnwardCall.operator_id == operator_id,
+        OnwardCall.stop_id.in_(set(stop_ids)),
+        siri_db.or_(OnwardCall.vehicle_at_stop, OnwardCall.expected_arrival_time_utc >= stored_time))
+    eta_times = defaultdict(lambda: defaultdict(list))
+    for stop_id, line_id, vehicle_at_stop, expected_arrival_time_utc in siri_db.session.execute(stmt):
         if vehicle_at_stop:
             eta_time = dt.timedelta(seconds=0)
         else:
-            expected_arrival_time_utc = onward_call.expected_arrival_time_utc
-            eta_time = expected_arrival_time_utc.replace(tzinfo=dt.timezone.utc) - current_time
-        if eta_time >= dt.timedelta(seconds=0):
-            response_dict[vehicle.line_id].append(eta_time)
-    for key in response_dict.keys():
-        response_dict[key] = [format_eta_time(eta_time) for eta_time in sorted(response_dict[key])]
-    return response_dict
+            eta_time = expected_arrival_time_utc.replace(tzinfo=dt.UTC) - current_time
+        eta_times[stop_id][line_id].append(eta_time)
+    return {stop_id: {line_id: [format_eta_time(eta_time) for eta_time in sorted(line_eta_times)]
+                      for line_id, line_eta_times in lines.items()}
+            for stop_id, lines in eta_times.items()}
+
+
+def station_stop_ids(siri_db: flask_sqlalchemy.SQLAlchemy, operator_id: str, stop_id: str) -> list[str]:
+    """
+    Returns the stops of the station of a stop. The feeds do not link the stops of a street corner or a station, so
+    the stops that share the name of the stop, such as both sides of a street, are taken as the station.
+
+    :param siri_db: database
+    :type siri_db: flask_sqlalchemy.SQLAlchemy
+
+    :param operator_id: operator id
+    :type operator_id: str
+
+    :param stop_id: stop id
+    :type stop_id: str
+
+    :return: stop ids of the station, empty if the stop is not stored
+    :rtype: list[str]
+    """
+    stop_name = siri_db.select(Stop.stop_name).where(Stop.operator_id == operator_id,
+                                                     Stop.stop_id == stop_id).scalar_subquery()
+    return siri_db.session.execute(siri_db.select(Stop.stop_id).where(
+        Stop.operator_id == operator_id, Stop.stop_name == stop_name).order_by(Stop.stop_id)).scalars().all()
 
 
 def get_stop_timetable_dict(transit_api_key: str,
@@ -743,15 +1387,18 @@ def get_stop_timetable_dict(transit_api_key: str,
     :rtype: dict
     """
 
-    siri_client = siri_transit_api_client.SiriClient(api_key=transit_api_key, base_url=siri_base_url)
-    return siri_client.stop_timetable(operator_id, stop_code)
+    rate_limit.acquire(transit_api_key, rate_limit.PRIORITY_STATIC)
+    with metrics.UPSTREAM_FETCH_SECONDS.time('get_stop_timetable_dict'):
+        return siri_client(transit_api_key, siri_base_url).stop_timetable(operator_id, stop_code)
 
 
 
+@metrics.timed(metrics.WRITE_SECONDS, 'save_stop_timetable')
 def save_stop_timetable(siri_db: flask_sqlalchemy.SQLAlchemy,
                         operator_id: str,
                         stop_id: str,
-                        timetable_dict: dict) -> None:
+                        timetable_dict: dict,
+                        current_time: dt.datetime | None = None) -> None:
     """
    Store stop timetable for a given stop in the database.
 
@@ -767,32 +1414,164 @@ def save_stop_timetable(siri_db: flask_sqlalchemy.SQLAlchemy,
    :param timetable_dict: dictionary containing timetable for a given stop
    :type timetable_dict: dict
 
+   :param current_time: if given, stored as the refresh time of the timetable
+   :type current_time: dt.datetime, optional
+
    :return: None
    :rtype: None
    """
-    timetable_list = timetable_dict["Siri"]["ServiceDelivery"]["StopTimetableDelivery"]["TimetabledStopVisit"]
-    stop_timetable_list = [StopTimetable(operator_id=operator_id,
-                                         vehicle_journey_ref=timetable["TargetedVehicleJourney"][
-                                             "DatedVehicleJourneyRef"],
-                                         stop_id=timetable["MonitoringRef"],
-                                         aimed_arrival_time_utc=parse_time_str(timetable["TargetedVehicleJourney"][
-                                                                                   "TargetedCall"]["AimedArrivalTime"]),
-                                         aimed_departure_time_utc=parse_time_str(
-                                             timetable["TargetedVehicleJourney"]["TargetedCall"]["AimedDepartureTime"])
-                                         )
-                           for timetable in timetable_list]
+    write_stop_timetable(siri_db, operator_id, stop_id, parse_stop_timetable(operator_id, timetable_dict),
+                         current_time)
+    return None
+
+
+def stop_timetable_parameter(operator_id: str, stop_id: str) -> str:
+    return f"stop_timetable_refresh_time:{operator_id}:{stop_id}"
+
+
+def stop_timetable_refresh_needed(siri_db: flask_sqlalchemy.SQLAlchemy,
+                                  operator_id: str,
+                                  stop_id: str,
+                                  refresh_limit: float,
+                                  current_time: dt.datetime) -> bool:
+    """
+    Determines if the timetable of a stop was never saved with a refresh time or is older than the refresh limit.
+
+    :param siri_db: database
+    :type siri_db: flask_sqlalchemy.SQLAlchemy
+
+    :param operator_id: operator id
+    :type operator_id: str
+
+    :param stop_id: stop id
+    :type stop_id: str
+
+    :param refresh_limit: minimum time in minutes to elapse before refreshing the timetable
+    :type refresh_limit: float
+
+    :param current_time: current time in utc
+    :type current_time: dt.datetime
+
+    :return: boolean for if the timetable should be refreshed
+    :rtype: bool
+    """
+    refresh_time = siri_db.session.get(Parameter, stop_timetable_parameter(operator_id, stop_id))
+    if refresh_time is None:
+        return True
+    last_update_time = dt.datetime.fromisoformat(refresh_time.value).replace(tzinfo=None)
+    return current_time.replace(tzinfo=None) - last_update_time >= dt.timedelta(minutes=refresh_limit)
+
+
+def write_stop_timetable(siri_db: flask_sqlalchemy.SQLAlchemy,
+                         operator_id: str,
+                         stop_id: str,
+                         stop_timetable_list: list[StopTimetableRecord],
+                         current_time: dt.datetime | None = None) -> None:
+    """
+    Replaces the timetable of a stop, unless it matches the stored timetable.
+
+    :param siri_db: database
+    :type siri_db: flask_sqlalchemy.SQLAlchemy
+
+    :param operator_id: operator id
+    :type operator_id: str
+
+    :param stop_id: stop id
+    :type stop_id: str
+
+    :param stop_timetable_list: timetabled visits of the stop
+    :type stop_timetable_list: list[StopTimetableRecord]
+
+    :param current_time: if given, stored as the refresh time of the timetable
+    :type current_time: dt.datetime, optional
+
+    :return: None
+    :rtype: None
+    """
+    if current_time is not None:
+        # an unchanged response still refreshes the update time
+        siri_db.session.merge(Parameter(stop_timetable_parameter(operator_id, stop_id), current_time.isoformat()))
+    scope = ('stop_timetable', operator_id, stop_id)
+    digest = content_hash.content_digest(stop_timetable_list)
+    if content_hash.content_unchanged(siri_db, 'stop_timetable', scope, digest):
+        siri_db.session.commit()
+        return None
 
     stop_timetable_to_delete = siri_db.delete(StopTimetable).where(StopTimetable.operator_id == operator_id,
                                                                    StopTimetable.stop_id == stop_id)
     siri_db.session.execute(stop_timetable_to_delete)
     siri_db.session.commit()
 
-    siri_db.session.add_all(stop_timetable_list)
+    insert_records(siri_db, StopTimetable, stop_timetable_list)
+    content_hash.store_digest(siri_db, scope, digest)
     siri_db.session.commit()
+    metrics.ROWS_WRITTEN.inc(len(stop_timetable_list), 'stop_timetable')
 
     return None
 
 
+def parse_stop_timetable(operator_id: str, timetable_dict: dict) -> list[StopTimetableRecord]:
+    """
+    Parses the timetable of a stop.
+
+    :param operator_id: operator id
+    :type operator_id: str
+
+    :param timetable_dict: dictionary containing timetable for a given stop
+    :type timetable_dict: dict
+
+    :return: timetabled visits of the stop
+    :rtype: list[StopTimetableRecord]
+    """
+    timetable_list = timetable_dict["Siri"]["ServiceDelivery"]["StopTimetableDelivery"]["TimetabledStopVisit"]
+    return [parse_timetabled_stop_visit(operator_id, timetable) for timetable in timetable_list]
+
+
+def parse_timetabled_stop_visit(operator_id: str, timetable: dict) -> StopTimetableRecord:
+    """
+    Parses one timetabled visit of a stop.
+
+    :param operator_id: operator id
+    :type operator_id: str
+
+    :param timetable: dictionary for a TimetabledStopVisit element
+    :type timetable: dict
+
+    :return: timetabled visit
+    :rtype: StopTimetableRecord
+    """
+    return StopTimetableRecord(operator_id=operator_id,
+                               vehicle_journey_ref=timetable["TargetedVehicleJourney"]["DatedVehicleJourneyRef"],
+                               stop_id=timetable["MonitoringRef"],
+                               aimed_arrival_time_utc=parse_time_str(timetable["TargetedVehicleJourney"][
+                                                                         "TargetedCall"]["AimedArrivalTime"]),
+                               aimed_departure_time_utc=parse_time_str(timetable["TargetedVehicleJourney"][
+                                                                           "TargetedCall"]["AimedDepartureTime"]))
+
+
+def insert_records(siri_db: flask_sqlalchemy.SQLAlchemy,
+                   model: type,
+                   records: typing.Sequence[typing.NamedTuple]) -> None:
+    """
+    Inserts parsed records into the table of a model with a single executemany, without building ORM instances.
+
+    :param siri_db: database
+    :type siri_db: flask_sqlalchemy.SQLAlchemy
+
+    :param model: model of the table
+    :type model: type
+
+    :param records: records whose fields match the columns of the model
+    :type records: typing.Sequence[typing.NamedTuple]
+
+    :return: None
+    :rtype: None
+    """
+    if records:
+        siri_db.session.execute(siri_db.insert(model), as_rows(records))
+        siri_db.session.commit()
+
+
 def determine_vehicle_ref_full_journey(siri_db: flask_sqlalchemy.SQLAlchemy,
                                        operator_id: str,
                                        beg_stop_code: str,
@@ -894,7 +1673,7 @@ def operator_refresh_needed(siri_db: flask_sqlalchemy.SQLAlchemy,
         name="operator_refresh_time")).scalar_one_or_none()
     if operator_refresh_time is None:
         return True
-    last_update_time = dateutil.parser.isoparse(operator_refresh_time.value).replace(tzinfo=None)
+    last_update_time = dt.datetime.fromisoformat(operator_refresh_time.value).replace(tzinfo=None)
     delta_time = current_time.replace(tzinfo=None) - last_update_time
     return delta_time >= dt.timedelta(minutes=refresh_limit)
 
@@ -914,13 +1693,14 @@ def save_operator_refresh_time(siri_db: flask_sqlalchemy.SQLAlchemy,
     :rtype: bool
     """
     operator_refresh = Parameter("operator_refresh_time", current_time.isoformat())
-    siri_db.session.add(operator_refresh)
+    # the parameter survives restarts, so replace the stored time
+    siri_db.session.merge(operator_refresh)
     siri_db.session.commit()
 
 
-def parse_time_str(time_str: typing.Optional[str] = None) -> typing.Union[dt.datetime, None]:
+def parse_time_str(time_str: str | None = None) -> dt.datetime | None:
     """
-    Parses the time string and returns datetime object if time string is not none. If none, returns none.
+    Parses the time string and returns datetime object if time string is not empty. If empty or none, returns none.
 
     :param time_str: string that would be converted to datetime object
     :type time_str: str
@@ -928,16 +1708,54 @@ def parse_time_str(time_str: typing.Optional[str] = None) -> typing.Union[dt.dat
     :return: datetime object
     :rtype: dt.datetime
     """
-    if time_str is None:
+    if not time_str:
         return None
     else:
-        dt_obj = dateutil.parser.isoparse(time_str)
+        try:
+            dt_obj = dt.datetime.fromisoformat(time_str)
+        except ValueError:
+            # fall back to dateutil for the less common ISO 8601 forms
+            import dateutil.parser
+            dt_obj = dateutil.parser.isoparse(time_str)
         if dt_is_timezone_aware(dt_obj):
-            return dt_obj.astimezone(dateutil.tz.UTC).replace(tzinfo=None)
+            return dt_obj.astimezone(dt.UTC).replace(tzinfo=None)
         else:
             return dt_obj
 
 
+def response_time(response: dict) -> dt.datetime | None:
+    """
+    Returns the ResponseTimestamp of a response in utc.
+
+    :param response: SIRI response
+    :type response: dict
+
+    :return: response timestamp or None if the response does not have one
+    :rtype: dt.datetime or None
+    """
+    timestamp = response.get("Siri", response).get("ServiceDelivery", {}).get("ResponseTimestamp")
+    if not timestamp:
+        return None
+    return parse_time_str(timestamp).replace(tzinfo=dt.UTC)
+
+
+def recorded_time(records: typing.Iterable[dict]) -> dt.datetime | None:
+    """
+    Returns the latest RecordedAtTime of the records of a response in utc. Unlike the ResponseTimestamp, it only
+    changes when the feed is updated.
+
+    :param records: VehicleActivity or MonitoredStopVisit elements of a response
+    :type records: typing.Iterable[dict]
+
+    :return: latest recorded time or None if no record has one
+    :rtype: dt.datetime or None
+    """
+    timestamps = [parse_time_str(record["RecordedAtTime"]) for record in records if record.get("RecordedAtTime")]
+    if not timestamps:
+        return None
+    return max(timestamps).replace(tzinfo=dt.UTC)
+
+
 def dt_is_timezone_aware(dt_obj: dt.datetime) -> bool:
     """
     Checks if a given datetime object is timezone aware.
@@ -965,12 +1783,27 @@ def format_eta_time(time_delta: dt.timedelta) -> str:
     if minutes == 0:
         return "Arriving"
     elif minutes == 1:
-        return "{:.0f} min".format(minutes)
+        return f"{minutes:.0f} min"
     else:
-        return "{:.0f} mins".format(minutes)
+        return f"{minutes:.0f} mins"
 
 
-def parse_optional_floats(value: str) -> typing.Union[float, None]:
+@functools.lru_cache(maxsize=64)
+def parse_dataframe_ref(dataframe_ref: str) -> dt.date:
+    """
+    Parses the service date of a vehicle journey. A response only has a few distinct dates, so the parsed dates are
+    cached and shared by every record.
+
+    :param dataframe_ref: date string of the DataFrameRef element
+    :type dataframe_ref: str
+
+    :return: service date
+    :rtype: dt.date
+    """
+    return parse_time_str(dataframe_ref).date()
+
+
+def parse_optional_floats(value: str) -> float | None:
     """
     Parses the optional number string.
 
@@ -1016,6 +1849,8 @@ def sort_response_dict(input_dict) -> OrderedDict:
     :return: sorted dictionary of the arrival times
     :rtype: bool
     """
+    from natsort import natsorted
+
     sorted_dict = OrderedDict(sorted(input_dict.items()))
     for key in sorted_dict:
         eta_list = sorted_dict[key]
@@ -0,0 +1,269 @@
+"""
+Tracks the stops that are being viewed or subscribed to, and refreshes stop monitoring with one request per hot stop
+or with one agency wide request, whichever is cheaper.
+"""
+import datetime as dt
+import threading
+import typing
+
+import flask_sqlalchemy
+from flask import Flask, current_app
+
+from transit_notification import db_commands, metrics, rate_limit
+
+# a stop stays hot this long after it was last viewed
+DEFAULT_WINDOW_S = 5 * 60
+# never fan out into more requests than this, the agency wide request is used instead
+DEFAULT_MAX_STOP_REQUESTS = 5
+# latency of a request, the same for a single stop and the agency
+REQUEST_COST_S = 0.5
+# parse and write time of one monitored stop visit, measured with the ingest benchmarks
+VISIT_COST_S = 60e-6
+# assumed visits per stop until a stop response has been seen
+DEFAULT_VISITS_PER_STOP = 20
+# share of the request budget kept for the other feeds when requesting single stops
+BUDGET_RESERVE = 0.25
+EXTENSION_KEY = 'demand_tracker'
+
+POLL_STOPS = 'stops'
+POLL_AGENCY = 'agency'
+
+
+class DemandTracker:
+    """
+    Recently viewed and subscribed (operator, stop) pairs, the size of the recent responses and the time each stop
+    was last refreshed on its own. Thread safe, shared by the routes of a process.
+    """
+
+    def __init__(self, window_s: float = DEFAULT_WINDOW_S, max_stop_requests: int = DEFAULT_MAX_STOP_REQUESTS):
+        self.window_s = window_s
+        self.max_stop_requests = max_stop_requests
+        self._lock = threading.Lock()
+        self._viewed = {}
+        self._subscribed = {}
+        self._stop_refreshed = {}
+        self._agency_visits = {}
+        self._visits_per_stop = {}
+
+    def record_view(self, operator_id: str, stop_id: str, current_time: dt.datetime) -> None:
+        with self._lock:
+            self._viewed[(operator_id, stop_id)] = current_time
+
+    def subscribe(self, operator_id: str, stop_id: str, until: dt.datetime | None = None) -> None:
+        """
+        Keeps a stop hot until the subscription ends.
+
+        :param operator_id: operator id
+        :type operator_id: str
+
+        :param stop_id: stop id
+        :type stop_id: str
+
+        :param until: end of the subscription, None keeps the stop hot until unsubscribe is called
+        :type until: dt.datetime, optional
+
+        :return: None
+        :rtype: None
+        """
+        with self._lock:
+            self._subscribed[(operator_id, stop_id)] = until
+
+    def unsubscribe(self, operator_id: str, stop_id: str) -> None:
+        with self._lock:
+            self._subscribed.pop((operator_id, stop_id), None)
+
+    def hot_stops(self, operator_id: str, current_time: dt.datetime) -> list[str]:
+        """
+        Stops of an operator viewed within the window or with an active subscription. Expired entries are dropped.
+
+        :param operator_id: operator id
+        :type operator_id: str
+
+        :param current_time: current utc time
+        :type current_time: dt.datetime
+
+        :return: sorted stop ids
+        :rtype: list[str]
+        """
+        viewed_after = current_time - dt.timedelta(seconds=self.window_s)
+        with self._lock:
+            self._viewed = {key: viewed for key, viewed in self._viewed.items() if viewed >= viewed_after}
+            self._subscribed = {key: until for key, until in self._subscribed.items()
+                                if until is None or until >= current_time}
+            stops = {stop_id for (stop_operator_id, stop_id) in list(self._viewed) + list(self._subscribed)
+                     if stop_operator_id == operator_id}
+        return sorted(stops)
+
+    def mark_stops_refreshed(self, operator_id: str, stop_ids: typing.Iterable[str], visit_count: int,
+                             current_time: dt.datetime) -> None:
+        stop_ids = list(stop_ids)
+        with self._lock:
+            for stop_id in stop_ids:
+                self._stop_refreshed[(operator_id, stop_id)] = current_time
+            if stop_ids:
+                self._visits_per_stop[operator_id] = visit_count / len(stop_ids)
+
+    def mark_agency_refreshed(self, operator_id: str, visit_count: int) -> None:
+        with self._lock:
+            self._agency_visits[operator_id] = visit_count
+            # the agency write replaced the rows of the single stop requests
+            self._stop_refreshed = {key: refreshed for key, refreshed in self._stop_refreshed.items()
+                                    if key[0] != operator_id}
+
+    def stop_refreshed_within(self, operator_id: str, stop_id: str, refresh_limit: float,
+                              current_time: dt.datetime) -> bool:
+        """
+        Checks if a stop was refreshed on its own within the refresh limit.
+
+        :param operator_id: operator id
+        :type operator_id: str
+
+        :param stop_id: stop id
+        :type stop_id: str
+
+        :param refresh_limit: refresh limit in minutes
+        :type refresh_limit: float
+
+        :param current_time: current utc time
+        :type current_time: dt.datetime
+
+        :return: True if the stop does not need a refresh
+        :rtype: bool
+        """
+        with self._lock:
+            refreshed = self._stop_refreshed.get((operator_id, stop_id))
+        return refreshed is not None and current_time - refreshed < dt.timedelta(minutes=refresh_limit)
+
+    def choose_poll(self, operator_id: str, stop_count: int, budget: float | None = None,
+                    capacity: float | None = None) -> str:
+        """
+        Chooses between one request per hot stop and one agency wide request. Each option costs the request latency
+        plus the parse and write time of its visits. Single stop requests are only used when they fit in the request
+        budget without using the reserve, and the agency is requested until its size is known.
+
+        :param operator_id: operator id
+        :type operator_id: str
+
+        :param stop_count: number of hot stops
+        :type stop_count: int
+
+        :param budget: requests that can be sent now, None if there is no limit
+        :type budget: float, optional
+
+        :param capacity: size of the request budget, None if there is no limit
+        :type capacity: float, optional
+
+        :return: POLL_STOPS or POLL_AGENCY
+        :rtype: str
+        """
+        with self._lock:
+            agency_visits = self._agency_visits.get(operator_id)
+            visits_per_stop = self._visits_per_stop.get(operator_id, DEFAULT_VISITS_PER_STOP)
+        if agency_visits is None or stop_count == 0 or stop_count > self.max_stop_requests:
+            return POLL_AGENCY
+        if budget is not None and capacity is not None and budget - stop_count < capacity * BUDGET_RESERVE:
+            return POLL_AGENCY
+        stops_cost = stop_count * (REQUEST_COST_S + visits_per_stop * VISIT_COST_S)
+        agency_cost = REQUEST_COST_S + agency_visits * VISIT_COST_S
+        return POLL_STOPS if stops_cost < agency_cost else POLL_AGENCY
+
+
+def spare_requests(transit_api_key: str | None) -> int | None:
+    """
+    Requests that can be sent now above the share of the request budget kept for the other feeds.
+
+    :param transit_api_key: api key
+    :type transit_api_key: str, optional
+
+    :return: spare requests, None if there is no request budget
+    :rtype: int, optional
+    """
+    scheduler = rate_limit.current_scheduler()
+    if scheduler is None:
+        return None
+    return max(int(scheduler.remaining(transit_api_key) - scheduler.requests * BUDGET_RESERVE), 0)
+
+
+def monitored_stop_visits(stop_monitoring: dict) -> list[dict]:
+    return stop_monitoring["ServiceDelivery"]["StopMonitoringDelivery"]["MonitoredStopVisit"]
+
+
+def refresh_stop_monitoring(siri_db: flask_sqlalchemy.SQLAlchemy,
+                            tracker: DemandTracker,
+                            transit_api_key: str,
+                            siri_base_url: str,
+                            operator_id: str,
+                            current_time: dt.datetime,
+                            archive: bool = False) -> str:
+    """
+    Refreshes stop monitoring of an operator for the hot stops, with the cheaper of single stop requests and an
+    agency wide request.
+
+    :param siri_db: database
+    :type siri_db: flask_sqlalchemy.SQLAlchemy
+
+    :param tracker: demand tracker of the app
+    :type tracker: DemandTracker
+
+    :param transit_api_key: api key
+    :type transit_api_key: str
+
+    :param siri_base_url: url for the transit api
+    :type siri_base_url: str
+
+    :param operator_id: operator id
+    :type operator_id: str
+
+    :param current_time: current utc time
+    :type current_time: dt.datetime
+
+    :param archive: if True, copy the refreshed onward calls into the onward call archive
+    :type archive: bool
+
+    :return: POLL_STOPS or POLL_AGENCY
+    :rtype: str
+    """
+    stop_ids = tracker.hot_stops(operator_id, current_time)
+    scheduler = rate_limit.current_scheduler()
+    if scheduler is None:
+        poll = tracker.choose_poll(operator_id, len(stop_ids))
+    else:
+        poll = tracker.choose_poll(operator_id, len(stop_ids), scheduler.remaining(transit_api_key),
+                                   scheduler.requests)
+    metrics.DEMAND_POLLS.inc(1, poll)
+
+    if poll == POLL_AGENCY:
+        stop_monitoring = db_commands.get_stop_monitoring_dict(transit_api_key, siri_base_url, operator_id)
+        db_commands.save_stop_monitoring(siri_db, operator_id, stop_monitoring, current_time, archive=archive)
+        tracker.mark_agency_refreshed(operator_id, len(monitored_stop_visits(stop_monitoring)))
+        return poll
+
+    visits = []
+    for stop_id in stop_ids:
+        stop_monitoring = db_commands.get_stop_monitoring_dict(transit_api_key, siri_base_url, operator_id, stop_id)
+        visits.extend(monitored_stop_visits(stop_monitoring))
+    combined = {"ServiceDelivery": {"StopMonitoringDelivery": {"MonitoredStopVisit": visits}}}
+    db_commands.save_stop_monitoring_for_stops(siri_db, operator_id, stop_ids, combined, current_time, archive=archive)
+    tracker.mark_stops_refreshed(operator_id, stop_ids, len(visits), current_time)
+    return poll
+
+
+def init_app(app: Flask) -> None:
+    """
+    Creates the demand tracker of the app. DEMAND_WINDOW_S sets how long a viewed stop stays hot and
+    DEMAND_MAX_STOP_REQUESTS the most stops that are requested one by one.
+
+    :param app: flask application
+    :type app: Flask
+
+    :return: None
+    :rtype: None
+    """
+    app.extensions[EXTENSION_KEY] = DemandTracker(app.config.get("DEMAND_WINDOW_S", DEFAULT_WINDOW_S),
+                                                  app.config.get("DEMAND_MAX_STOP_REQUESTS",
+                                                                 DEFAULT_MAX_STOP_REQUESTS))
+
+
+def current_tracker() -> DemandTracker:
+    """Demand tracker of the current app."""
+    return current_app.extensions[EXTENSION_KEY]
@@ -0,0 +1,349 @@
+"""
+Imports the stops, patterns, shapes and the timetable of one service day from a GTFS static feed. The files are read
+straight out of the zip and written in chunks, so a stop_times.txt with millions of rows is imported in bounded memory.
+"""
+import collections
+import csv
+import datetime as dt
+import io
+import itertools
+import typing
+import zipfile
+from zoneinfo import ZoneInfo
+
+import click
+import flask_sqlalchemy
+from flask.cli import with_appcontext
+
+from transit_notification import content_hash, metrics
+from transit_notification.models import Line, Operator, Pattern, Shape, Stop, StopPattern, StopTimetable
+from transit_notification.records import StopTimetableRecord, as_rows
+
+# rows per executemany insert
+CHUNK_ROWS = 10000
+WEEKDAYS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+
+
+class GtfsError(Exception):
+    """Raised when a feed is missing a required file or its rows are not in the expected order."""
+
+
+class Trip(typing.NamedTuple):
+    route_id: str
+    service_id: str
+    direction_id: str
+    headsign: str
+    shape_id: str | None
+
+
+def read_csv(feed: zipfile.ZipFile, name: str) -> typing.Iterator[dict]:
+    """
+    Streams the rows of a file of the feed.
+
+    :param feed: GTFS zip
+    :type feed: zipfile.ZipFile
+
+    :param name: file name, for example stops.txt
+    :type name: str
+
+    :return: rows keyed by column name
+    :rtype: typing.Iterator[dict]
+
+    :raises GtfsError: if the feed does not contain the file
+    """
+    try:
+        raw = feed.open(name)
+    except KeyError as exc:
+        raise GtfsError(f"The feed has no {name}") from exc
+    with raw, io.TextIOWrapper(raw, encoding='utf-8-sig', newline='') as text:
+        yield from csv.DictReader(text)
+
+
+def has_file(feed: zipfile.ZipFile, name: str) -> bool:
+    return name in feed.namelist()
+
+
+def chunks(rows: typing.Iterable, size: int = CHUNK_ROWS) -> typing.Iterator[list]:
+    rows = iter(rows)
+    while chunk := list(itertools.islice(rows, size)):
+        yield chunk
+
+
+def active_services(feed: zipfile.ZipFile, service_date: dt.date) -> set[str]:
+    """
+    Services that run on a date according to calendar.txt and the exceptions in calendar_dates.txt.
+
+    :param feed: GTFS zip
+    :type feed: zipfile.ZipFile
+
+    :param service_date: service date
+    :type service_date: dt.date
+
+    :return: service ids
+    :rtype: set[str]
+    """
+    services = set()
+    date_str = service_date.strftime('%Y%m%d')
+    if has_file(feed, 'calendar.txt'):
+        weekday = WEEKDAYS[service_date.weekday()]
+        services = {row['service_id'] for row in read_csv(feed, 'calendar.txt')
+                    if row['start_date'] <= date_str <= row['end_date'] and row[weekday] == '1'}
+    if has_file(feed, 'calendar_dates.txt'):
+        for row in read_csv(feed, 'calendar_dates.txt'):
+            if row['date'] == date_str:
+                if row['exception_type'] == '1':
+                    services.add(row['service_id'])
+                elif row['exception_type'] == '2':
+                    services.discard(row['service_id'])
+    return services
+
+
+def feed_timezone(feed: zipfile.ZipFile) -> ZoneInfo:
+    for row in read_csv(feed, 'agency.txt'):
+        return ZoneInfo(row['agency_timezone'])
+    raise GtfsError("The feed has no agency")
+
+
+def gtfs_time_utc(value: str, service_noon: dt.datetime) -> dt.datetime | None:
+    """
+    Converts a GTFS time, which counts from noon minus 12 hours of the service day and can pass 24:00:00, to naive
+    utc.
+
+    :param value: time as H:MM:SS, empty if the stop is not timed
+    :type value: str
+
+    :param service_noon: noon of the service day in the timezone of the feed
+    :type service_noon: dt.datetime
+
+    :return: naive utc time, None if the stop is not timed
+    :rtype: dt.datetime, optional
+    """
+    if not value:
+        return None
+    hours, minutes, seconds = value.strip().split(':')
+    local = service_noon + dt.timedelta(hours=int(hours) - 12, minutes=int(minutes), seconds=int(seconds))
+    return local.astimezone(dt.UTC).replace(tzinfo=None)
+
+
+def trip_visits(feed: zipfile.ZipFile) -> typing.Iterator[tuple[str, list[dict]]]:
+    """
+    Groups the rows of stop_times.txt by trip without holding more than one trip in memory.
+
+    :param feed: GTFS zip
+    :type feed: zipfile.ZipFile
+
+    :return: trip id and its stop times in stop sequence order
+    :rtype: typing.Iterator[tuple[str, list[dict]]]
+
+    :raises GtfsError: if the rows of a trip are not consecutive
+    """
+    finished = set()
+    for trip_id, rows in itertools.groupby(read_csv(feed, 'stop_times.txt'), key=lambda row: row['trip_id']):
+        if trip_id in finished:
+            raise GtfsError(f"The stop times of trip {trip_id} are not consecutive in stop_times.txt")
+        finished.add(trip_id)
+        yield trip_id, sorted(rows, key=lambda row: int(row['stop_sequence']))
+
+
+def import_gtfs(siri_db: flask_sqlalchemy.SQLAlchemy,
+                path: str,
+                operator_id: str,
+                service_date: dt.date,
+                current_time: dt.datetime,
+                chunk_rows: int = CHUNK_ROWS) -> dict[str, int]:
+    """
+    Replaces the stops, patterns, stop patterns, shapes and stop timetable of an operator with the content of a GTFS
+    feed, in one transaction. Trips of a route and direction that visit the same stops form a pattern, the timetable
+    holds the trips of the service date and each line gets the shape used by most of its trips. Lines that have
+    patterns get the GTFS directions 0 and 1, named after their most common headsign.
+
+    :param siri_db: database
+    :type siri_db: flask_sqlalchemy.SQLAlchemy
+
+    :param path: path of the GTFS zip
+    :type path: str
+
+    :param operator_id: operator id
+    :type operator_id: str
+
+    :param service_date: date whose trips are written to the stop timetable
+    :type service_date: dt.date
+
+    :param current_time: current utc time, stored as the update time of the stops and patterns
+    :type current_time: dt.datetime
+
+    :param chunk_rows: rows per insert
+    :type chunk_rows: int
+
+    :return: number of written rows per table
+    :rtype: dict[str, int]
+
+    :raises GtfsError: if the feed is missing a required file or its stop times are not grouped by trip
+    """
+    counts = collections.Counter()
+    with zipfile.ZipFile(path) as feed:
+        timezone = feed_timezone(feed)
+        services = active_services(feed, service_date)
+        service_noon = dt.datetime.combine(service_date, dt.time(12), tzinfo=timezone)
+        trips = {row['trip_id']: Trip(row['route_id'], row['service_id'], row.get('direction_id') or '0',
+                                      row.get('trip_headsign', ''), row.get('shape_id') or None)
+                 for row in read_csv(feed, 'trips.txt')}
+        try:
+            for model in (StopTimetable, StopPattern, Pattern, Shape, Stop):
+                siri_db.session.execute(siri_db.delete(model).where(model.operator_id == operator_id))
+
+            # entrances and nodes of a station may have no position
+            stop_rows = ({'operator_id': operator_id, 'stop_id': row['stop_id'], 'stop_name': row['stop_name'],
+                          'stop_longitude': float(row['stop_lon']), 'stop_latitude': float(row['stop_lat'])}
+                         for row in read_csv(feed, 'stops.txt') if row.get('stop_lat') and row.get('stop_lon'))
+            for chunk in chunks(stop_rows, chunk_rows):
+                siri_db.session.execute(siri_db.insert(Stop), chunk)
+                counts['stop'] += len(chunk)
+
+            # patterns are keyed by their stops, only the trip counts and headsigns are kept per pattern
+            pattern_ids = {}
+            trip_counts = collections.Counter()
+            headsigns = collections.defaultdict(collections.Counter)
+            line_shapes = collections.defaultdict(collections.Counter)
+            stop_patterns = []
+            timetable = []
+            for trip_id, visits in trip_visits(feed):
+                trip = trips.get(trip_id)
+                if trip is None:
+                    continue
+                stops = tuple((int(row['stop_sequence']), row['stop_id'], row.get('timepoint', '1') != '0')
+                              for row in visits)
+                key = (trip.route_id, trip.direction_id, tuple(stop_id for _, stop_id, _ in stops))
+                pattern_id = pattern_ids.get(key)
+                if pattern_id is None:
+                    pattern_id = pattern_ids[key] = len(pattern_ids) + 1
+                    stop_patterns.extend({'operator_id': operator_id, 'pattern_id': pattern_id, 'stop_id': stop_id,
+                                          'stop_order': stop_order, 'timing_point': timing_point}
+                                         for stop_order, stop_id, timing_point in stops)
+                trip_counts[pattern_id] += 1
+                headsigns[pattern_id][trip.headsign] += 1
+                if trip.shape_id is not None:
+                    line_shapes[trip.route_id][trip.shape_id] += 1
+
+                if trip.service_id in services:
+                    visited = set()
+                    for row in visits:
+                        # a loop visits its first stop again, the timetable keeps one visit per stop and trip
+                        if row['stop_id'] in visited:
+                            continue
+                        visited.add(row['stop_id'])
+                        timetable.append(StopTimetableRecord(
+                            operator_id=operator_id, vehicle_journey_ref=trip_id, stop_id=row['stop_id'],
+                            aimed_arrival_time_utc=gtfs_time_utc(row['arrival_time'], service_noon),
+                            aimed_departure_time_utc=gtfs_time_utc(row['departure_time'], service_noon)))
+
+                if len(stop_patterns) >= chunk_rows:
+                    siri_db.session.execute(siri_db.insert(StopPattern), stop_patterns)
+                    counts['stop_pattern'] += len(stop_patterns)
+                    stop_patterns = []
+                if len(timetable) >= chunk_rows:
+                    siri_db.session.execute(siri_db.insert(StopTimetable), as_rows(timetable))
+                    counts['stop_timetable'] += len(timetable)
+                    timetable = []
+            if stop_patterns:
+                siri_db.session.execute(siri_db.insert(StopPattern), stop_patterns)
+                counts['stop_pattern'] += len(stop_patterns)
+            if timetable:
+                siri_db.session.execute(siri_db.insert(StopTimetable), as_rows(timetable))
+                counts['stop_timetable'] += len(timetable)
+
+            patterns = [{'operator_id': operator_id, 'line_id': route_id, 'pattern_id': pattern_id,
+                         'pattern_name': headsigns[pattern_id].most_common(1)[0][0][:100],
+                         'pattern_direction': direction_id, 'pattern_trip_count': trip_counts[pattern_id]}
+                        for (route_id, direction_id, _), pattern_id in pattern_ids.items()]
+            for chunk in chunks(patterns, chunk_rows):
+                siri_db.session.execute(siri_db.insert(Pattern), chunk)
+            counts['pattern'] = len(patterns)
+            update_line_directions(siri_db, operator_id, patterns, current_time)
+
+            # one shape per line, the one most of its trips follow
+            shape_lines = {shapes.most_common(1)[0][0]: route_id for route_id, shapes in line_shapes.items()}
+            if shape_lines and has_file(feed, 'shapes.txt'):
+                shape_rows = ({'operator_id': operator_id, 'line_id': shape_lines[row['shape_id']],
+                               'shape_order': int(row['shape_pt_sequence']),
+                               'shape_longitude': float(row['shape_pt_lon']),
+                               'shape_latitude': float(row['shape_pt_lat'])}
+                              for row in read_csv(feed, 'shapes.txt') if row['shape_id'] in shape_lines)
+                for chunk in chunks(shape_rows, chunk_rows):
+                    siri_db.session.execute(siri_db.insert(Shape), chunk)
+                    counts['shape'] += len(chunk)
+
+            siri_db.session.execute(siri_db.update(Operator).where(Operator.operator_id == operator_id).values(
+                stops_updated=current_time, patterns_updated=current_time))
+            # the stored digests describe the replaced rows
+            for dataset in ('stops', 'patterns', 'stop_timetable'):
+                content_hash.forget_digests(siri_db, dataset, operator_id)
+            siri_db.session.commit()
+        except BaseException:
+            siri_db.session.rollback()
+            raise
+    for table_name, count in counts.items():
+        metrics.ROWS_WRITTEN.inc(count, table_name)
+    return dict(counts)
+
+
+def update_line_directions(siri_db: flask_sqlalchemy.SQLAlchemy, operator_id: str, patterns: list[dict],
+                           current_time: dt.datetime) -> None:
+    """
+    Sets the directions of the lines that have patterns to the GTFS directions, named after the headsign of their
+    most travelled pattern. The caller commits.
+
+    :param siri_db: database
+    :type siri_db: flask_sqlalchemy.SQLAlchemy
+
+    :param operator_id: operator id
+    :type operator_id: str
+
+    :param patterns: imported pattern rows
+    :type patterns: list[dict]
+
+    :param current_time: current utc time, stored as the patterns update time of the lines
+    :type current_time: dt.datetime
+
+    :return: None
+    :rtype: None
+    """
+    busiest = {}
+    for pattern in patterns:
+        key = (pattern['line_id'], pattern['pattern_direction'])
+        if key not in busiest or pattern['pattern_trip_count'] > busiest[key]['pattern_trip_count']:
+            busiest[key] = pattern
+    for line_id in sorted({line_id for line_id, _ in busiest}):
+        directions = sorted(direction_id for busiest_line_id, direction_id in busiest if busiest_line_id == line_id)
+        values = {'direction_0_id': None, 'direction_0_name': None, 'direction_1_id': None, 'direction_1_name': None,
+                  'patterns_updated': current_time}
+        for index, direction_id in enumerate(directions[:2]):
+            values[f'direction_{index}_id'] = direction_id
+            values[f'direction_{index}_name'] = busiest[(line_id, direction_id)]['pattern_name']
+        siri_db.session.execute(siri_db.update(Line).where(Line.operator_id == operator_id,
+                                                           Line.line_id == line_id).values(values))
+
+
+@click.command("import-gtfs")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--operator", "operator_id", required=True, help="Operator id the feed is imported as.")
+@click.option("--date", "service_date", type=click.DateTime(formats=["%Y-%m-%d"]), default=None,
+              help="Service date of the stop timetable. Defaults to today in the timezone of the feed.")
+@with_appcontext
+def import_gtfs_command(path, operator_id, service_date):
+    """Import the stops, patterns, shapes and stop timetable of a GTFS zip."""
+    from transit_notification import db
+
+    current_time = dt.datetime.now(dt.UTC)
+    try:
+        if service_date is None:
+            with zipfile.ZipFile(path) as feed:
+                service_date = current_time.astimezone(feed_timezone(feed)).date()
+        else:
+            service_date = service_date.date()
+        counts = import_gtfs(db, path, operator_id, service_date, current_time)
+    except (GtfsError, zipfile.BadZipFile) as exc:
+        raise click.ClickException(str(exc)) from exc
+    for table_name, count in counts.items():
+        click.echo(f"{table_name}: {count} rows")
+    click.echo(f"Imported {path} as {operator_id} for {service_date.isoformat()}")
@@ -0,0 +1,307 @@
+"""
+Ingests GTFS-Realtime TripUpdates and VehiclePositions feeds. The protobuf messages are decoded into the same vehicle
+and onward call records as the SIRI vehicle monitoring response, so they are written through the same bulk write path.
+Needs the gtfs-realtime-bindings package, install transit_notification[gtfs-rt].
+"""
+import datetime as dt
+import typing
+
+import click
+import flask_sqlalchemy
+from flask.cli import with_appcontext
+
+from transit_notification import cadence, metrics, retention
+from transit_notification.db_commands import archive_onward_calls, parse_time_str, response_time, write_monitoring
+from transit_notification.records import OnwardCallRecord, VehicleRecord
+from transit_notification.symbols import SymbolTable, symbol_table
+
+EPOCH = dt.datetime(1970, 1, 1)
+FETCH_TIMEOUT_S = 30
+# DirectionRef of the SIRI feed for the direction_id of the GTFS trips, used to build equivalent feeds
+SIRI_DIRECTIONS = {'OB': 0, 'IB': 1}
+
+
+class GtfsRealtimeError(Exception):
+    """Raised when a feed cannot be read or is not a GTFS-Realtime feed message."""
+
+
+def bindings_module():
+    try:
+        from google.transit import gtfs_realtime_pb2
+    except ImportError as exc:
+        raise GtfsRealtimeError("GTFS-Realtime feeds need gtfs-realtime-bindings, "
+                                "install transit_notification[gtfs-rt]") from exc
+    return gtfs_realtime_pb2
+
+
+def read_feed(source: str) -> bytes:
+    """
+    Reads a feed from a path, a file:// url or a http(s) url.
+
+    :param source: path or url of the feed
+    :type source: str
+
+    :return: serialized feed message
+    :rtype: bytes
+    """
+    import requests
+
+    try:
+        if source.startswith(('http://', 'https://')):
+            with metrics.UPSTREAM_FETCH_SECONDS.time('read_gtfs_realtime_feed'):
+                response = requests.get(source, timeout=FETCH_TIMEOUT_S)
+                response.raise_for_status()
+            return response.content
+        with open(source.removeprefix('file://'), 'rb') as f:
+            return f.read()
+    except (OSError, requests.RequestException) as exc:
+        raise GtfsRealtimeError(f"Cannot read {source}: {exc}") from exc
+
+
+def decode_feed(payload: bytes):
+    """
+    Decodes a serialized feed message.
+
+    :param payload: serialized feed message
+    :type payload: bytes
+
+    :return: feed message
+    :rtype: gtfs_realtime_pb2.FeedMessage
+    """
+    gtfs_realtime_pb2 = bindings_module()
+    try:
+        return gtfs_realtime_pb2.FeedMessage.FromString(payload)
+    except Exception as exc:
+        # the decode error class depends on the protobuf backend
+        raise GtfsRealtimeError("Payload is not a GTFS-Realtime feed message") from exc
+
+
+def feed_time(feed_message) -> dt.datetime | None:
+    """
+    Returns the timestamp of the feed header in utc.
+
+    :param feed_message: feed message
+    :type feed_message: gtfs_realtime_pb2.FeedMessage
+
+    :return: header timestamp or None if the header does not have one
+    :rtype: dt.datetime or None
+    """
+    if not feed_message.header.timestamp:
+        return None
+    return dt.datetime.fromtimestamp(feed_message.header.timestamp, dt.UTC)
+
+
+def event_times(event) -> (dt.datetime | None, dt.datetime | None):
+    """
+    Returns the aimed and expected time of a stop time event. The aimed time is the scheduled time or the predicted
+    time minus the delay. An event that only has a delay has no times, resolving it needs the static timetable.
+    """
+    expected = EPOCH + dt.timedelta(seconds=event.time) if event.time else None
+    if event.scheduled_time:
+        return EPOCH + dt.timedelta(seconds=event.scheduled_time), expected
+    if expected is not None and event.HasField('delay'):
+        return expected - dt.timedelta(seconds=event.delay), expected
+    return None, expected
+
+
+def parse_feed(operator_id: str, feed_messages: typing.Iterable,
+               symbols: SymbolTable | None = None) -> (list[VehicleRecord], list[OnwardCallRecord]):
+    """
+    Parses the trip updates and vehicle positions of one or more feed messages into the vehicles and onward calls to be
+    stored. Entities of the same trip are merged, so an agency that publishes trip updates and vehicle positions as
+    separate feeds gives one vehicle per trip. The route_id is stored as the line and the direction_id as the
+    direction, like the GTFS static import.
+
+    :param operator_id: operator id
+    :type operator_id: str
+
+    :param feed_messages: decoded feed messages
+    :type feed_messages: typing.Iterable[gtfs_realtime_pb2.FeedMessage]
+
+    :param symbols: symbol table that interns the identifiers, defaults to the table of the operator
+    :type symbols: SymbolTable, optional
+
+    :return: vehicles and onward calls
+    :rtype: (list[VehicleRecord], list[OnwardCallRecord])
+    """
+    gtfs_realtime_pb2 = bindings_module()
+    stopped_at = gtfs_realtime_pb2.VehiclePosition.STOPPED_AT
+    skipped = gtfs_realtime_pb2.TripUpdate.StopTimeUpdate.SKIPPED
+    if symbols is None:
+        symbols = symbol_table(operator_id)
+    operator_id = symbols.intern(operator_id)
+    vehicles = {}
+    stop_time_updates = {}
+    at_stop = {}
+    for feed_message in feed_messages:
+        feed_date = (feed_time(feed_message) or dt.datetime.now(dt.UTC)).date()
+        for entity in feed_message.entity:
+            if entity.is_deleted:
+                continue
+            if entity.HasField('trip_update'):
+                trip = entity.trip_update.trip
+            elif entity.HasField('vehicle') and entity.vehicle.HasField('trip'):
+                trip = entity.vehicle.trip
+            else:
+                continue
+            if not trip.trip_id:
+                continue
+            service_date = dt.datetime.strptime(trip.start_date, '%Y%m%d').date() if trip.start_date else feed_date
+            key = (symbols.intern(trip.trip_id), service_date)
+            vehicle = vehicles.get(key)
+            if vehicle is None:
+                vehicle = VehicleRecord(operator_id=operator_id,
+                                        vehicle_journey_ref=key[0],
+                                        dataframe_ref_date=service_date,
+                                        line_id=symbols.intern(trip.route_id) if trip.route_id else None,
+                                        vehicle_direction=symbols.intern(str(trip.direction_id))
+                                        if trip.HasField('direction_id') else None,
+                                        vehicle_longitude=None,
+                                        vehicle_latitude=None,
+                                        vehicle_bearing=None)
+            if entity.HasField('trip_update'):
+                stop_time_updates.setdefault(key, []).extend(entity.trip_update.stop_time_update)
+            else:
+                position = entity.vehicle.position
+                if entity.vehicle.HasField('position'):
+                    vehicle = vehicle._replace(vehicle_longitude=float(position.longitude),
+                                               vehicle_latitude=float(position.latitude),
+                                               vehicle_bearing=float(position.bearing)
+                                               if position.HasField('bearing') else None)
+                if entity.vehicle.current_status == stopped_at and entity.vehicle.stop_id:
+                    at_stop[key] = entity.vehicle.stop_id
+            vehicles[key] = vehicle
+
+    onward_calls = []
+    for key, updates in stop_time_updates.items():
+        vehicle_journey_ref, service_date = key
+        stop_at = at_stop.get(key)
+        for update in updates:
+            if update.schedule_relationship == skipped or not update.stop_id:
+                continue
+            aimed_arrival, expected_arrival = event_times(update.arrival)
+            aimed_departure, expected_departure = event_times(update.departure)
+            onward_calls.append(OnwardCallRecord(operator_id=operator_id,
+                                                 vehicle_journey_ref=vehicle_journey_ref,
+                                                 dataframe_ref_date=service_date,
+                                                 stop_id=symbols.intern(update.stop_id),
+                                                 vehicle_at_stop=update.stop_id == stop_at,
+                                                 aimed_arrival_time_utc=aimed_arrival,
+                                                 expected_arrival_time_utc=expected_arrival,
+                                                 aimed_departure_time_utc=aimed_departure,
+                                                 expected_departure_time_utc=expected_departure))
+    return [vehicle for vehicle in vehicles.values() if not vehicle.contains_none()], onward_calls
+
+
+def save_gtfs_realtime(siri_db: flask_sqlalchemy.SQLAlchemy, operator_id: str, payloads: typing.Sequence[bytes],
+                       current_time: dt.datetime, archive: bool = False) -> bool:
+    """
+    Stores the vehicles and onward calls of GTFS-Realtime feeds. The feeds replace the vehicle monitoring rows of the
+    operator.
+
+    :param siri_db: database
+    :type siri_db: flask_sqlalchemy.SQLAlchemy
+
+    :param operator_id: operator id
+    :type operator_id: str
+
+    :param payloads: serialized feed messages, usually the trip updates and the vehicle positions feed
+    :type payloads: typing.Sequence[bytes]
+
+    :param current_time: current utc time
+    :type current_time: dt.datetime
+
+    :param archive: if True, copy the onward calls into the onward call archive
+    :type archive: bool
+
+    :return: True if the rows were written, False if they matched the stored rows
+    :rtype: bool
+    """
+    with metrics.PARSE_SECONDS.time('gtfs_realtime'):
+        feed_messages = [decode_feed(payload) for payload in payloads]
+        vehicles, onward_calls = parse_feed(operator_id, feed_messages)
+    with metrics.WRITE_SECONDS.time('save_gtfs_realtime'):
+        changed = write_monitoring(siri_db, operator_id, vehicles, onward_calls, 'vehicle_monitoring_updated',
+                                   current_time)
+    timestamps = [timestamp for timestamp in map(feed_time, feed_messages) if timestamp is not None]
+    cadence.observe(operator_id, 'gtfs_realtime', max(timestamps, default=None), current_time)
+
+    if archive:
+        archive_onward_calls(siri_db, operator_id, current_time)
+    retention.step(siri_db, current_time)
+    return changed
+
+
+def feed_from_vehicle_monitoring(vehicle_monitoring: dict) -> bytes:
+    """
+    Builds the GTFS-Realtime feed that carries the same vehicles and calls as a SIRI vehicle monitoring response, with
+    one trip update and one vehicle position per vehicle. Used to compare the two ingest paths.
+
+    :param vehicle_monitoring: dictionary that contains the vehicle monitoring response
+    :type vehicle_monitoring: dict
+
+    :return: serialized feed message
+    :rtype: bytes
+    """
+    gtfs_realtime_pb2 = bindings_module()
+
+    def timestamp(time_str):
+        return int((parse_time_str(time_str) - EPOCH).total_seconds())
+
+    def set_event(event, aimed, expected):
+        if aimed is not None:
+            event.scheduled_time = timestamp(aimed)
+        if expected is not None:
+            event.time = timestamp(expected)
+
+    feed_message = gtfs_realtime_pb2.FeedMessage()
+    feed_message.header.gtfs_realtime_version = "2.0"
+    header_time = response_time(vehicle_monitoring)
+    if header_time is not None:
+        feed_message.header.timestamp = int(header_time.timestamp())
+    vehicle_list = vehicle_monitoring["Siri"]["ServiceDelivery"]["VehicleMonitoringDelivery"]["VehicleActivity"]
+    for vehicle_dict in vehicle_list:
+        journey = vehicle_dict["MonitoredVehicleJourney"]
+        trip_id = journey["FramedVehicleJourneyRef"]["DatedVehicleJourneyRef"]
+        trip = gtfs_realtime_pb2.TripDescriptor(
+            trip_id=trip_id, route_id=journey["LineRef"], direction_id=SIRI_DIRECTIONS[journey["DirectionRef"]],
+            start_date=parse_time_str(journey["FramedVehicleJourneyRef"]["DataFrameRef"]).strftime('%Y%m%d'))
+        calls = journey.get("OnwardCalls", {}).get("OnwardCall", [])
+        if "MonitoredCall" in journey:
+            calls = calls + [journey["MonitoredCall"]]
+
+        trip_update = feed_message.entity.add(id=f"trip_update_{trip_id}").trip_update
+        trip_update.trip.CopyFrom(trip)
+        for call in calls:
+            update = trip_update.stop_time_update.add(stop_id=call["StopPointRef"])
+            set_event(update.arrival, call["AimedArrivalTime"], call["ExpectedArrivalTime"])
+            set_event(update.departure, call["AimedDepartureTime"], call["ExpectedDepartureTime"])
+
+        vehicle = feed_message.entity.add(id=f"vehicle_{trip_id}").vehicle
+        vehicle.trip.CopyFrom(trip)
+        vehicle.position.longitude = float(journey["VehicleLocation"]["Longitude"])
+        vehicle.position.latitude = float(journey["VehicleLocation"]["Latitude"])
+        vehicle.position.bearing = float(journey["Bearing"])
+        monitored_call = journey.get("MonitoredCall")
+        if monitored_call is not None and str(monitored_call.get("VehicleAtStop")).lower() == "true":
+            vehicle.stop_id = monitored_call["StopPointRef"]
+            vehicle.current_status = gtfs_realtime_pb2.VehiclePosition.STOPPED_AT
+    return feed_message.SerializeToString()
+
+
+@click.command("ingest-gtfs-rt")
+@click.argument("sources", nargs=-1, required=True)
+@click.option("--operator", "operator_id", required=True, help="Operator id the vehicles are stored under.")
+@click.option("--archive", is_flag=True, help="Copy the onward calls into the onward call archive.")
+@with_appcontext
+def ingest_gtfs_realtime_command(sources, operator_id, archive):
+    """Store the vehicles and onward calls of GTFS-Realtime feeds, given as paths or urls."""
+    from transit_notification import db
+
+    current_time = dt.datetime.now(dt.UTC)
+    try:
+        payloads = [read_feed(source) for source in sources]
+        changed = save_gtfs_realtime(db, operator_id, payloads, current_time, archive)
+    except GtfsRealtimeError as exc:
+        raise click.ClickException(str(exc)) from exc
+    click.echo(f"Ingested {len(payloads)} feeds as {operator_id}" + ("" if changed else ", rows unchanged"))
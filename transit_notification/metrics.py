@@ -0,0 +1,303 @@
+"""Prometheus metrics for the ingest functions and the routes."""
+import bisect
+import datetime as dt
+import functools
+import threading
+import time
+import typing
+from contextlib import contextmanager
+
+from flask import Blueprint, Flask, Response, g, request
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# operator columns reported by the feed age gauge
+FEED_UPDATED_COLUMNS = {
+    'lines': 'lines_updated',
+    'stops': 'stops_updated',
+    'patterns': 'patterns_updated',
+    'vehicle_monitoring': 'vehicle_monitoring_updated',
+    'stop_monitoring': 'stop_monitoring_updated',
+}
+
+metrics = Blueprint('metrics', __name__)
+
+
+class Metric:
+    """Base class of the metrics. Values are stored per tuple of label values."""
+    metric_type = None
+
+    def __init__(self, name: str, documentation: str, labelnames: typing.Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        REGISTRY.append(self)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+    def header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+
+    def samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def render(self) -> list[str]:
+        return self.header() + self.samples()
+
+
+class Counter(Metric):
+    metric_type = 'counter'
+
+    def inc(self, amount: float = 1, *labelvalues: str) -> None:
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def value(self, *labelvalues: str) -> float:
+        return self._values.get(labelvalues, 0)
+
+    def samples(self) -> list[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{format_labels(self.labelnames, labelvalues)} {format_value(value)}"
+                for labelvalues, value in values]
+
+
+class Gauge(Metric):
+    """Gauge whose values are either set directly or read from a collect function when the metrics are rendered."""
+    metric_type = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: typing.Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.collect = None
+
+    def set(self, value: float, *labelvalues: str) -> None:
+        with self._lock:
+            self._values[labelvalues] = value
+
+    def value(self, *labelvalues: str) -> float:
+        return self._values.get(labelvalues, 0)
+
+    def set_collect(self, collect: typing.Callable[[], dict[tuple, float]] | None) -> None:
+        """Sets the function that returns the current values keyed by the tuple of label values."""
+        self.collect = collect
+
+    def samples(self) -> list[str]:
+        with self._lock:
+            values = dict(self._values)
+        if self.collect is not None:
+            values.update(self.collect())
+        return [f"{self.name}{format_labels(self.labelnames, labelvalues)} {format_value(value)}"
+                for labelvalues, value in values.items()]
+
+
+class Histogram(Metric):
+    metric_type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: typing.Sequence[str] = (),
+                 buckets: typing.Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        # upper bound of every count, the last count holds the observations above the largest bucket
+        self.bounds = self.buckets + (float('inf'),)
+
+    def observe(self, value: float, *labelvalues: str) -> None:
+        bucket_index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labelvalues)
+            if state is None:
+                # counts per bound, sum of the observations
+                state = self._values[labelvalues] = [[0] * len(self.bounds), 0.0]
+            state[0][bucket_index] += 1
+            state[1] += value
+
+    @contextmanager
+    def time(self, *labelvalues: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labelvalues)
+
+    def count(self, *labelvalues: str) -> int:
+        state = self._values.get(labelvalues)
+        return sum(state[0]) if state else 0
+
+    def samples(self) -> list[str]:
+        with self._lock:
+            values = [(labelvalues, list(state[0]), state[1]) for labelvalues, state in self._values.items()]
+        lines = []
+        labelnames = self.labelnames + ('le',)
+        for labelvalues, bucket_counts, total in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.bounds, bucket_counts, strict=True):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{format_labels(labelnames, labelvalues + (format_value(bound),))} "
+                             f"{cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labelnames, labelvalues)} {format_value(total)}")
+            lines.append(f"{self.name}_count{format_labels(self.labelnames, labelvalues)} {cumulative}")
+        return lines
+
+
+REGISTRY = []
+
+UPSTREAM_FETCH_SECONDS = Histogram('transit_upstream_fetch_seconds',
+                                   'Latency of the requests to the SIRI api.', ['function'])
+PARSE_SECONDS = Histogram('transit_ingest_parse_seconds',
+                          'Time spent parsing SIRI responses.', ['dataset'])
+WRITE_SECONDS = Histogram('transit_ingest_write_seconds',
+                          'Time spent writing parsed responses to the database.', ['function'])
+ROWS_WRITTEN = Counter('transit_ingest_rows_written_total',
+                       'Rows written to the database.', ['table'])
+REQUEST_SECONDS = Histogram('transit_request_seconds',
+                            'Latency of the requests served by the application.', ['endpoint'])
+INGEST_WRITES = Counter('transit_ingest_writes_total',
+                        'Parsed responses checked against the stored rows.', ['dataset'])
+INGEST_WRITES_SKIPPED = Counter('transit_ingest_writes_skipped_total',
+                                'Parsed responses not written because the stored rows already matched.', ['dataset'])
+RATE_LIMIT_TOKENS = Gauge('transit_rate_limit_tokens',
+                          'Requests to the SIRI api that can be made now without waiting, per api key.', ['api_key'])
+RATE_LIMIT_WAIT_SECONDS = Histogram('transit_rate_limit_wait_seconds',
+                                    'Time spent waiting for the request budget of the SIRI api.', ['priority'])
+RATE_LIMIT_TIMEOUTS = Counter('transit_rate_limit_timeouts_total',
+                              'Requests to the SIRI api abandoned because the budget was exhausted.', ['priority'])
+DEMAND_POLLS = Counter('transit_demand_polls_total',
+                       'Stop monitoring refreshes by kind, single stop requests or one agency wide request.',
+                       ['poll'])
+RESPONSE_CACHE_LOOKUPS = Counter('transit_response_cache_lookups_total',
+                                 'Lookups of the static SIRI responses in the response cache.', ['dataset', 'result'])
+ROWS_EVICTED = Counter('transit_retention_rows_evicted_total',
+                       'Expired realtime rows deleted by the retention eviction.', ['table'])
+
+
+def format_labels(labelnames: typing.Sequence[str], labelvalues: typing.Sequence[str]) -> str:
+    """
+    Formats the labels of a sample in the Prometheus text format.
+
+    :param labelnames: names of the labels
+    :type labelnames: typing.Sequence[str]
+
+    :param labelvalues: values of the labels
+    :type labelvalues: typing.Sequence[str]
+
+    :return: formatted labels, empty if there are no labels
+    :rtype: str
+    """
+    if not labelnames:
+        return ''
+    labels = ','.join(f'{name}="{escape_label_value(str(value))}"'
+                      for name, value in zip(labelnames, labelvalues, strict=True))
+    return '{' + labels + '}'
+
+
+def escape_label_value(value: str) -> str:
+    return value.replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+def timed(histogram: Histogram, *labelvalues: str) -> typing.Callable:
+    """
+    Decorator that observes the run time of a function in a histogram.
+
+    :param histogram: histogram that receives the run time
+    :type histogram: Histogram
+
+    :param labelvalues: label values of the observation
+    :type labelvalues: str
+
+    :return: decorator
+    :rtype: typing.Callable
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, *labelvalues)
+        return wrapper
+    return decorator
+
+
+def feed_age_samples(current_time: dt.datetime) -> list[str]:
+    """
+    Samples of the feed age gauge, derived from the update times stored in the operator table.
+
+    :param current_time: current utc time
+    :type current_time: dt.datetime
+
+    :return: gauge in the Prometheus text format
+    :rtype: list[str]
+    """
+    from transit_notification import read_db as db
+    from transit_notification.models import Operator
+
+    name = 'transit_feed_age_seconds'
+    lines = [f"# HELP {name} Seconds since the feed of an operator was last stored.", f"# TYPE {name} gauge"]
+    columns = [getattr(Operator, column) for column in FEED_UPDATED_COLUMNS.values()]
+    stmt = db.select(Operator.operator_id, *columns).where(db.or_(*[column.is_not(None) for column in columns]))
+    now = current_time.replace(tzinfo=None)
+    for row in db.session.execute(stmt):
+        for feed, updated in zip(FEED_UPDATED_COLUMNS, row[1:], strict=True):
+            if updated is not None:
+                lines.append(f"{name}{format_labels(('operator_id', 'feed'), (row[0], feed))} "
+                             f"{format_value((now - updated).total_seconds())}")
+    return lines
+
+
+def render_metrics(current_time: dt.datetime) -> str:
+    """
+    Renders every registered metric and the feed age gauge in the Prometheus text format.
+
+    :param current_time: current utc time
+    :type current_time: dt.datetime
+
+    :return: metrics exposition
+    :rtype: str
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    lines.extend(feed_age_samples(current_time))
+    return '\n'.join(lines) + '\n'
+
+
+@metrics.route('/metrics')
+def show_metrics():
+    return Response(render_metrics(dt.datetime.now(dt.UTC)), content_type=CONTENT_TYPE)
+
+
+def start_request_timer() -> None:
+    g.request_start_time = time.perf_counter()
+
+
+def observe_request(response):
+    start = g.pop('request_start_time', None)
+    if start is not None:
+        REQUEST_SECONDS.observe(time.perf_counter() - start, request.endpoint or 'unknown')
+    return response
+
+
+def init_app(app: Flask) -> None:
+    """
+    Registers the metrics endpoint and the request timing hooks.
+
+    :param app: flask application
+    :type app: Flask
+
+    :return: None
+    :rtype: None
+    """
+    app.register_blueprint(metrics)
+    app.before_request(start_request_timer)
+    app.after_request(observe_request)
@@ -1,7 +1,8 @@
 """Data models."""
-from transit_notification import db
 from sqlalchemy import ForeignKeyConstraint
 
+from transit_notification import db
+
 
 class Operator(db.Model):
     operator_id = db.Column(db.String(2), primary_key=True)
@@ -38,6 +39,7 @@ class Line(db.Model):
     direction_1_id = db.Column(db.String(10))
     direction_1_name = db.Column(db.String(100))
     shape_updated = db.Column(db.DateTime)
+    patterns_updated = db.Column(db.DateTime)
 
     patterns = db.relationship('Pattern', backref='line', lazy=True)
     vehicles = db.relationship('Vehicle', backref='line', lazy=True)
@@ -243,3 +245,53 @@ class Shape(db.Model):
                f"Latitude: {self.shape_latitude}"
 
 
+class OnwardCallArchive(db.Model):
+    operator_id = db.Column(db.String(2), db.ForeignKey("operator.operator_id"), nullable=False, primary_key=True)
+    line_id = db.Column(db.String(10), nullable=False)
+    stop_id = db.Column(db.String(10), nullable=False, primary_key=True)
+    vehicle_journey_ref = db.Column(db.String(100), nullable=False, primary_key=True)
+    dataframe_ref_date = db.Column(db.Date, nullable=False, primary_key=True)
+    recorded_time_utc = db.Column(db.DateTime, nullable=False, primary_key=True)
+    aimed_arrival_time_utc = db.Column(db.DateTime)
+    expected_arrival_time_utc = db.Column(db.DateTime)
+    aimed_departure_time_utc = db.Column(db.DateTime)
+    expected_departure_time_utc = db.Column(db.DateTime)
+
+    def __init__(self,
+                 operator_id,
+                 line_id,
+                 stop_id,
+                 vehicle_journey_ref,
+                 dataframe_ref_date,
+                 recorded_time_utc,
+                 aimed_arrival_time_utc,
+                 expected_arrival_time_utc,
+                 aimed_departure_time_utc,
+                 expected_departure_time_utc):
+        self.operator_id = operator_id
+        self.line_id = line_id
+        self.stop_id = stop_id
+        self.vehicle_journey_ref = vehicle_journey_ref
+        self.dataframe_ref_date = dataframe_ref_date
+        self.recorded_time_utc = recorded_time_utc
+        self.aimed_arrival_time_utc = aimed_arrival_time_utc
+        self.expected_arrival_time_utc = expected_arrival_time_utc
+        self.aimed_departure_time_utc = aimed_departure_time_utc
+        self.expected_departure_time_utc = expected_departure_time_utc
+
+    def __repr__(self):
+        return f"Onward Call Archive, Vehicle : {self.vehicle_journey_ref}, Stop id: {self.stop_id}, " \
+               f"Recorded: {self.recorded_time_utc}, Expected Arrival Time: {self.expected_arrival_time_utc}"
+
+
+# expiry times used by the retention eviction, the indexes let each eviction batch find its rows without a scan
+onward_call_expiry_time = db.func.coalesce(OnwardCall.expected_arrival_time_utc, OnwardCall.aimed_arrival_time_utc,
+                                           OnwardCall.expected_departure_time_utc,
+                                           OnwardCall.aimed_departure_time_utc)
+stop_timetable_expiry_time = db.func.coalesce(StopTimetable.aimed_arrival_time_utc,
+                                              StopTimetable.aimed_departure_time_utc)
+RETENTION_INDEXES = (
+    db.Index('ix_onward_call_expiry_time', onward_call_expiry_time),
+    db.Index('ix_stop_timetable_expiry_time', stop_timetable_expiry_time),
+    db.Index('ix_vehicle_dataframe_ref_date', Vehicle.dataframe_ref_date),
+)
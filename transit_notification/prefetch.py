@@ -0,0 +1,152 @@
+"""
+Prefetches the patterns of every line of an operator in the background once its lines are listed, so the line pages
+find their patterns already saved instead of waiting for the SIRI api. Each prefetch only spends the request budget
+above the reserve kept for the realtime feeds, and the next one continues with the lines that were not tried yet.
+"""
+import datetime as dt
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Flask, current_app, has_app_context
+
+from transit_notification import db_commands, demand
+
+logger = logging.getLogger(__name__)
+
+EXTENSION_KEY = 'pattern_prefetcher'
+
+
+class PatternPrefetcher:
+    """
+    Runs the pattern prefetch of one operator at a time on a background thread. An operator that is already queued or
+    being prefetched is not queued again. The lines tried by the previous prefetches of an operator are kept, so a
+    prefetch cut short by the request budget is continued by the next one, and lines that failed are retried last.
+    """
+
+    def __init__(self, app: Flask, max_workers: int = db_commands.DEFAULT_PREFETCH_WORKERS):
+        self.app = app
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='pattern-prefetch')
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._tried = {}
+
+    def submit(self, operator_id: str, refresh_limit: float) -> bool:
+        """
+        Queues the prefetch of the stale lines of an operator.
+
+        :param operator_id: operator id
+        :type operator_id: str
+
+        :param refresh_limit: lines saved within this many minutes are skipped
+        :type refresh_limit: float
+
+        :return: True if the prefetch was queued, False if it was already pending
+        :rtype: bool
+        """
+        with self._lock:
+            if operator_id in self._pending:
+                return False
+            self._pending.add(operator_id)
+        self._executor.submit(self.run, operator_id, refresh_limit)
+        return True
+
+    def pending(self) -> set[str]:
+        with self._lock:
+            return set(self._pending)
+
+    def next_lines(self, operator_id: str, stale_line_ids: list[str], budget: int | None) -> list[str]:
+        """
+        Stale lines to fetch next, the lines not tried yet first. Once every stale line was tried, a new round starts.
+
+        :param operator_id: operator id
+        :type operator_id: str
+
+        :param stale_line_ids: stale lines in sort order
+        :type stale_line_ids: list[str]
+
+        :param budget: most lines to fetch, None if there is no limit
+        :type budget: int, optional
+
+        :return: lines to fetch
+        :rtype: list[str]
+        """
+        with self._lock:
+            tried = self._tried.setdefault(operator_id, set())
+            tried.intersection_update(stale_line_ids)
+            if len(tried) == len(stale_line_ids):
+                tried.clear()
+            line_ids = ([line_id for line_id in stale_line_ids if line_id not in tried] +
+                        [line_id for line_id in stale_line_ids if line_id in tried])[:budget]
+            tried.update(line_ids)
+        return line_ids
+
+    def run(self, operator_id: str, refresh_limit: float) -> None:
+        from transit_notification import db, response_cache
+
+        try:
+            with self.app.app_context():
+                transit_api_key, siri_base_url = db_commands.read_key_api_file()
+                current_time = dt.datetime.now(dt.UTC)
+                line_ids = self.next_lines(operator_id, db_commands.stale_pattern_lines(
+                    db, operator_id, refresh_limit, current_time), prefetch_budget(transit_api_key))
+                if not line_ids:
+                    return
+                db_commands.prefetch_patterns(db, transit_api_key, siri_base_url, operator_id, current_time,
+                                              refresh_limit, self.max_workers, cache=response_cache.current_cache(),
+                                              line_ids=line_ids)
+        except Exception:
+            logger.exception("Pattern prefetch of %s failed", operator_id)
+        finally:
+            with self._lock:
+                self._pending.discard(operator_id)
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait)
+
+
+def prefetch_budget(transit_api_key: str | None) -> int | None:
+    """
+    Pattern requests a prefetch may send, the available requests above the share of the budget kept for the other
+    feeds.
+
+    :param transit_api_key: api key
+    :type transit_api_key: str, optional
+
+    :return: most pattern requests, None if there is no request budget
+    :rtype: int, optional
+    """
+    return demand.spare_requests(transit_api_key)
+
+
+def init_app(app: Flask) -> None:
+    """
+    Creates the pattern prefetcher of the app. PATTERN_PREFETCH_WORKERS sets the pattern requests in flight during a
+    prefetch, 0 disables the background prefetch.
+
+    :param app: flask application
+    :type app: Flask
+
+    :return: None
+    :rtype: None
+    """
+    max_workers = app.config.get("PATTERN_PREFETCH_WORKERS", db_commands.DEFAULT_PREFETCH_WORKERS)
+    if not max_workers or max_workers <= 0:
+        app.extensions[EXTENSION_KEY] = None
+        return
+    app.extensions[EXTENSION_KEY] = PatternPrefetcher(app, max_workers)
+
+
+def current_prefetcher() -> PatternPrefetcher | None:
+    """Pattern prefetcher of the current app, None outside an app context or if it is disabled."""
+    if not has_app_context():
+        return None
+    return current_app.extensions.get(EXTENSION_KEY)
+
+
+def schedule_patterns(operator_id: str, refresh_limit: float) -> None:
+    """Queues the pattern prefetch of an operator on the prefetcher of the current app, see PatternPrefetcher.submit."""
+    prefetcher = current_prefetcher()
+    if prefetcher is not None:
+        prefetcher.submit(operator_id, refresh_limit)
@@ -0,0 +1,237 @@
+"""Opt-in profiling of single requests and ingest cycles."""
+import cProfile
+import datetime as dt
+import hmac
+import os
+import pstats
+import re
+import typing
+from contextlib import contextmanager
+
+import click
+from flask import Flask, current_app, g, request
+from flask.cli import with_appcontext
+
+PROFILE_QUERY_PARAMETER = 'profile'
+PROFILE_HEADER = 'X-Profile'
+# deepest call stack written to the flamegraph file
+MAX_STACK_DEPTH = 64
+# call paths that account for less time than this (seconds) are not followed
+MIN_TIME_SHARE = 1e-6
+
+
+def profile_directory(app: Flask) -> str:
+    """
+    Directory the profiles are written to, PROFILE_DIR or the profiles folder of the instance folder.
+
+    :param app: flask application
+    :type app: Flask
+
+    :return: profile directory
+    :rtype: str
+    """
+    return app.config.get('PROFILE_DIR') or os.path.join(app.instance_path, 'profiles')
+
+
+def profile_file_stem(directory: str, name: str) -> str:
+    """
+    Builds the path, without extension, of a new profile.
+
+    :param directory: profile directory
+    :type directory: str
+
+    :param name: name of the profiled request or command
+    :type name: str
+
+    :return: path without extension
+    :rtype: str
+    """
+    timestamp = dt.datetime.now(dt.UTC).strftime('%Y%m%dT%H%M%S%f')
+    safe_name = re.sub(r'[^A-Za-z0-9_.-]+', '_', name)
+    return os.path.join(directory, f"{timestamp}-{safe_name}")
+
+
+def write_profile(profiler: cProfile.Profile, directory: str, name: str) -> tuple[str, str]:
+    """
+    Writes a profile as a pstats file and as folded stacks that can be loaded by flamegraph.pl or speedscope.
+
+    :param profiler: stopped profiler
+    :type profiler: cProfile.Profile
+
+    :param directory: profile directory
+    :type directory: str
+
+    :param name: name of the profiled request or command
+    :type name: str
+
+    :return: paths of the pstats and folded stack files
+    :rtype: tuple[str, str]
+    """
+    return dump_profile(profiler, profile_file_stem(directory, name))
+
+
+def dump_profile(profiler: cProfile.Profile, stem: str) -> tuple[str, str]:
+    """
+    Writes a profile to the pstats and folded stack files of a path built by profile_file_stem.
+
+    :param profiler: stopped profiler
+    :type profiler: cProfile.Profile
+
+    :param stem: path of the files without extension
+    :type stem: str
+
+    :return: paths of the pstats and folded stack files
+    :rtype: tuple[str, str]
+    """
+    os.makedirs(os.path.dirname(stem), exist_ok=True)
+    pstats_path = stem + '.pstats'
+    folded_path = stem + '.folded'
+    profiler.dump_stats(pstats_path)
+    with open(folded_path, 'w') as f:
+        f.write('\n'.join(pstats_to_folded(pstats.Stats(profiler))) + '\n')
+    return pstats_path, folded_path
+
+
+def function_label(function: tuple[str, int, str]) -> str:
+    filename, line_number, function_name = function
+    if filename == '~':
+        return function_name
+    return f"{os.path.basename(filename)}:{function_name}:{line_number}"
+
+
+def pstats_to_folded(stats: pstats.Stats) -> list[str]:
+    """
+    Converts profile statistics to folded stacks ("root;child;leaf microseconds"). cProfile only records caller and
+    callee pairs, so the time of a function is split between its callers in proportion to the time spent under
+    each caller.
+
+    :param stats: profile statistics
+    :type stats: pstats.Stats
+
+    :return: folded stack lines
+    :rtype: list[str]
+    """
+    raw_stats = stats.stats
+    callees = {}
+    for function, (_, _, _, _, callers) in raw_stats.items():
+        for caller, caller_stats in callers.items():
+            callees.setdefault(caller, []).append((function, caller_stats[3]))
+    roots = [function for function, function_stats in raw_stats.items()
+             if not any(caller in raw_stats for caller in function_stats[4])]
+
+    folded = {}
+
+    def walk(function, stack, time_share):
+        _, _, total_time, cumulative_time, _ = raw_stats[function]
+        if cumulative_time <= 0 or time_share < MIN_TIME_SHARE:
+            return
+        stack = stack + [function_label(function)]
+        scale = time_share / cumulative_time
+        self_time = total_time * scale
+        if self_time > 0:
+            key = ';'.join(stack)
+            folded[key] = folded.get(key, 0) + self_time
+        if len(stack) >= MAX_STACK_DEPTH:
+            return
+        for callee, edge_time in callees.get(function, []):
+            if function_label(callee) not in stack:
+                walk(callee, stack, edge_time * scale)
+
+    for root in roots:
+        walk(root, [], raw_stats[root][3])
+    return [f"{stack} {round(value * 1e6)}" for stack, value in folded.items() if round(value * 1e6) > 0]
+
+
+@contextmanager
+def profiled(name: str, directory: str) -> typing.Iterator[cProfile.Profile]:
+    """
+    Profiles the with block and writes the profile to the directory.
+
+    :param name: name used in the file names
+    :type name: str
+
+    :param directory: profile directory
+    :type directory: str
+
+    :return: the running profiler
+    :rtype: typing.Iterator[cProfile.Profile]
+    """
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        write_profile(profiler, directory, name)
+
+
+def profiling_requested() -> bool:
+    if current_app.config.get('PROFILE_REQUESTS'):
+        return True
+    token = current_app.config.get('PROFILE_TOKEN')
+    supplied_token = request.args.get(PROFILE_QUERY_PARAMETER)
+    return bool(token) and supplied_token is not None and hmac.compare_digest(supplied_token, token)
+
+
+def start_request_profile() -> None:
+    if profiling_requested():
+        g.profile_stem = profile_file_stem(profile_directory(current_app), request.endpoint or 'unknown')
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+
+def add_profile_header(response):
+    stem = g.get('profile_stem')
+    if stem is not None:
+        response.headers[PROFILE_HEADER] = os.path.basename(stem + '.pstats')
+    return response
+
+
+def stop_request_profile(exc: BaseException | None = None) -> None:
+    # runs on teardown, so the requests whose view raised are profiled as well
+    profiler = g.pop('profiler', None)
+    stem = g.pop('profile_stem', None)
+    if profiler is not None:
+        profiler.disable()
+        dump_profile(profiler, stem)
+
+
+def init_app(app: Flask) -> None:
+    """
+    Registers the request profiling hooks when PROFILE_REQUESTS or PROFILE_TOKEN is configured. With PROFILE_TOKEN
+    only requests with ?profile=<token> are profiled. No hooks are registered otherwise, so profiling costs nothing
+    when it is disabled.
+
+    :param app: flask application
+    :type app: Flask
+
+    :return: None
+    :rtype: None
+    """
+    if app.config.get('PROFILE_REQUESTS') or app.config.get('PROFILE_TOKEN'):
+        app.before_request(start_request_profile)
+        app.after_request(add_profile_header)
+        app.teardown_request(stop_request_profile)
+
+
+@click.command("profile-ingest")
+@click.argument("operator_id")
+@click.option("--feed", type=click.Choice(['vehicle_monitoring', 'stop_monitoring']), default='stop_monitoring',
+              show_default=True, help="Monitoring feed to fetch and store.")
+@with_appcontext
+def profile_ingest_command(operator_id, feed):
+    """Profile one fetch and save cycle of a monitoring feed."""
+    from transit_notification import db
+    from transit_notification import db_commands as tndc
+
+    transit_api_key, siri_base_url = tndc.read_key_api_file()
+    directory = profile_directory(current_app)
+    with profiled(f"ingest-{operator_id}-{feed}", directory):
+        current_time = dt.datetime.now(dt.UTC)
+        if feed == 'vehicle_monitoring':
+            response = tndc.get_vehicle_monitoring_dict(transit_api_key, siri_base_url, operator_id)
+            tndc.save_vehicle_monitoring(db, operator_id, response, current_time)
+        else:
+            response = tndc.get_stop_monitoring_dict(transit_api_key, siri_base_url, operator_id)
+            tndc.save_stop_monitoring(db, operator_id, response, current_time)
+    click.echo(f"Wrote profile to {directory}")
@@ -0,0 +1,137 @@
+"""Per request SQL query counting and slow query logging."""
+import logging
+import time
+import typing
+from contextlib import contextmanager
+
+import sqlalchemy
+from flask import Flask, current_app, g, has_app_context
+
+logger = logging.getLogger(__name__)
+
+# queries slower than this are logged with their parameters
+DEFAULT_SLOW_QUERY_THRESHOLD_MS = 100
+
+QUERY_COUNT_HEADER = 'X-Query-Count'
+QUERY_TIME_HEADER = 'X-Query-Time-Ms'
+
+
+class QueryStats:
+    """Number of queries and total database time, optionally with the executed statements."""
+
+    def __init__(self, keep_statements: bool = False):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = [] if keep_statements else None
+
+    def add(self, statement: str, duration: float) -> None:
+        self.count += 1
+        self.duration += duration
+        if self.statements is not None:
+            self.statements.append(statement)
+
+
+# recorders opened with count_queries, they receive every query regardless of the app context
+_recorders = []
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context.query_start_time = time.perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    duration = time.perf_counter() - context.query_start_time
+    for recorder in _recorders:
+        recorder.add(statement, duration)
+    if not has_app_context():
+        return
+    request_stats = g.get('query_stats')
+    if request_stats is not None:
+        request_stats.add(statement, duration)
+    threshold_ms = current_app.config.get('SLOW_QUERY_THRESHOLD_MS', DEFAULT_SLOW_QUERY_THRESHOLD_MS)
+    if threshold_ms is not None and duration * 1000 >= threshold_ms:
+        logger.warning("Slow query (%.1f ms): %s parameters: %r", duration * 1000, statement, parameters)
+
+
+def register_engine(engine: sqlalchemy.engine.Engine) -> None:
+    """
+    Adds the query timing hooks to an engine. Registering the same engine again has no effect.
+
+    :param engine: engine to instrument
+    :type engine: sqlalchemy.engine.Engine
+
+    :return: None
+    :rtype: None
+    """
+    if not sqlalchemy.event.contains(engine, 'before_cursor_execute', before_cursor_execute):
+        sqlalchemy.event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        sqlalchemy.event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+
+
+@contextmanager
+def count_queries() -> typing.Iterator[QueryStats]:
+    """
+    Counts the queries executed inside the with block.
+
+    :return: stats that are updated while the block runs
+    :rtype: typing.Iterator[QueryStats]
+    """
+    stats = QueryStats(keep_statements=True)
+    _recorders.append(stats)
+    try:
+        yield stats
+    finally:
+        _recorders.remove(stats)
+
+
+@contextmanager
+def assert_max_queries(max_count: int) -> typing.Iterator[QueryStats]:
+    """
+    Fails with an AssertionError listing the statements if the with block runs more than max_count queries.
+
+    :param max_count: maximum number of queries allowed
+    :type max_count: int
+
+    :return: stats that are updated while the block runs
+    :rtype: typing.Iterator[QueryStats]
+    """
+    with count_queries() as stats:
+        yield stats
+    if stats.count > max_count:
+        statements = '\n'.join(stats.statements)
+        raise AssertionError(f"Expected at most {max_count} queries, {stats.count} were executed:\n{statements}")
+
+
+def start_request_stats() -> None:
+    g.query_stats = QueryStats()
+
+
+def add_query_headers(response):
+    stats = g.get('query_stats')
+    headers_enabled = current_app.config.get('QUERY_STATS_HEADERS')
+    if headers_enabled is None:
+        headers_enabled = current_app.debug
+    if stats is not None and headers_enabled:
+        response.headers[QUERY_COUNT_HEADER] = str(stats.count)
+        response.headers[QUERY_TIME_HEADER] = f"{stats.duration * 1000:.1f}"
+    return response
+
+
+def init_app(app: Flask, engines: typing.Iterable[sqlalchemy.engine.Engine]) -> None:
+    """
+    Instruments the engines and adds the per request query stats. The stats are returned in response headers when
+    the app runs in debug mode or QUERY_STATS_HEADERS is set.
+
+    :param app: flask application
+    :type app: Flask
+
+    :param engines: engines to instrument
+    :type engines: typing.Iterable[sqlalchemy.engine.Engine]
+
+    :return: None
+    :rtype: None
+    """
+    for engine in engines:
+        register_engine(engine)
+    app.before_request(start_request_stats)
+    app.after_request(add_query_headers)
@@ -0,0 +1,223 @@
+"""
+Shared request budget of the SIRI api. Every upstream request takes a token from the bucket of its api key, and when
+the bucket is empty the waiting requests are served in priority order.
+
+The buckets live in the memory of the process, so every worker process of the server and every CLI command has a
+budget of its own. RATE_LIMIT_WORKERS splits the budget of the api key between the processes that share it.
+"""
+import hashlib
+import heapq
+import itertools
+import threading
+import time
+import typing
+
+from flask import Flask, current_app, has_app_context
+
+from transit_notification import metrics
+
+# 511.org allows 60 requests per hour per api key unless a higher limit was granted
+DEFAULT_REQUESTS = 60
+DEFAULT_PERIOD_S = 60 * 60
+DEFAULT_TIMEOUT_S = 10
+EXTENSION_KEY = 'request_scheduler'
+
+# lower values are served first
+PRIORITY_STOP_MONITORING = 0
+PRIORITY_VEHICLE_MONITORING = 1
+PRIORITY_STATIC = 2
+PRIORITY_NAMES = {PRIORITY_STOP_MONITORING: 'stop_monitoring',
+                  PRIORITY_VEHICLE_MONITORING: 'vehicle_monitoring',
+                  PRIORITY_STATIC: 'static'}
+
+
+class RateLimitExceeded(Exception):
+    """Raised when a request cannot get a token from the budget before its timeout."""
+
+
+class TokenBucket:
+    """
+    Holds up to capacity tokens and refills them continuously, so a full bucket allows a burst of capacity requests
+    and the long term rate is capacity per period.
+    """
+
+    def __init__(self, capacity: float, period_s: float, clock: typing.Callable[[], float] = time.monotonic):
+        self.capacity = capacity
+        self.refill_rate = capacity / period_s
+        self.clock = clock
+        self.tokens = capacity
+        self.updated = clock()
+
+    def refill(self) -> None:
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_rate)
+        self.updated = now
+
+    def available(self) -> float:
+        self.refill()
+        return self.tokens
+
+    def wait_time(self) -> float:
+        """Seconds until a token is available, 0 if one is available now."""
+        self.refill()
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.refill_rate
+
+    def take(self) -> None:
+        self.refill()
+        self.tokens -= 1
+
+
+class RequestScheduler:
+    """
+    Token bucket per api key with a priority queue of the requests waiting for a token. Thread safe, one scheduler is
+    shared by every route and command of the app.
+    """
+
+    def __init__(self, requests: float = DEFAULT_REQUESTS, period_s: float = DEFAULT_PERIOD_S,
+                 timeout_s: float | None = DEFAULT_TIMEOUT_S,
+                 clock: typing.Callable[[], float] = time.monotonic):
+        self.requests = requests
+        self.period_s = period_s
+        self.timeout_s = timeout_s
+        self.clock = clock
+        self._buckets = {}
+        self._queues = {}
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+
+    def bucket(self, api_key: str | None) -> TokenBucket:
+        bucket = self._buckets.get(api_key)
+        if bucket is None:
+            bucket = self._buckets[api_key] = TokenBucket(self.requests, self.period_s, self.clock)
+        return bucket
+
+    def acquire(self, api_key: str | None, priority: int = PRIORITY_STATIC) -> float:
+        """
+        Waits until the request may be sent. Requests of a key are served in priority order, in arrival order within
+        a priority.
+
+        :param api_key: api key of the request
+        :type api_key: str, optional
+
+        :param priority: priority of the request, lower values are served first
+        :type priority: int
+
+        :return: seconds spent waiting
+        :rtype: float
+
+        :raises RateLimitExceeded: if no token became available within the timeout
+        """
+        timeout_s = self.timeout_s
+        priority_name = PRIORITY_NAMES.get(priority, str(priority))
+        start = time.monotonic()
+        deadline = None if timeout_s is None else start + timeout_s
+        entry = (priority, next(self._sequence))
+        with self._condition:
+            queue = self._queues.setdefault(api_key, [])
+            heapq.heappush(queue, entry)
+            bucket = self.bucket(api_key)
+            try:
+                while True:
+                    # only the first request in the queue may take a token, the others wait to be notified
+                    wait_s = bucket.wait_time() if queue[0] == entry else None
+                    if wait_s == 0:
+                        bucket.take()
+                        heapq.heappop(queue)
+                        break
+                    if deadline is not None:
+                        remaining_s = deadline - time.monotonic()
+                        if remaining_s <= 0 or (wait_s is not None and wait_s > remaining_s):
+                            metrics.RATE_LIMIT_TIMEOUTS.inc(1, priority_name)
+                            raise RateLimitExceeded(f"No request budget for {priority_name} within {timeout_s}s")
+                        wait_s = remaining_s if wait_s is None else wait_s
+                    self._condition.wait(wait_s)
+            except BaseException:
+                queue.remove(entry)
+                heapq.heapify(queue)
+                raise
+            finally:
+                # the next request in the queue may now be first
+                self._condition.notify_all()
+        waited_s = time.monotonic() - start
+        metrics.RATE_LIMIT_WAIT_SECONDS.observe(waited_s, priority_name)
+        return waited_s
+
+    def remaining(self, api_key: str | None) -> float:
+        """
+        Requests that can be sent now without waiting.
+
+        :param api_key: api key
+        :type api_key: str, optional
+
+        :return: available tokens
+        :rtype: float
+        """
+        with self._condition:
+            return self.bucket(api_key).available()
+
+    def waiting(self, api_key: str | None) -> int:
+        with self._condition:
+            return len(self._queues.get(api_key, ()))
+
+    def budget_samples(self) -> dict[tuple, float]:
+        """Available tokens of every api key, keyed by a fingerprint so the keys are not exposed."""
+        with self._condition:
+            return {(key_fingerprint(api_key),): bucket.available() for api_key, bucket in self._buckets.items()}
+
+
+def key_fingerprint(api_key: str | None) -> str:
+    if api_key is None:
+        return 'none'
+    return hashlib.sha256(api_key.encode()).hexdigest()[:8]
+
+
+def init_app(app: Flask) -> None:
+    """
+    Creates the request scheduler of the app. RATE_LIMIT_REQUESTS requests are allowed per RATE_LIMIT_PERIOD_S
+    seconds, 0 disables the scheduler, and a request waits at most RATE_LIMIT_TIMEOUT_S seconds for the budget. The
+    scheduler only sees the requests of this process, so it allows RATE_LIMIT_REQUESTS / RATE_LIMIT_WORKERS requests.
+
+    :param app: flask application
+    :type app: Flask
+
+    :return: None
+    :rtype: None
+    """
+    requests = app.config.get("RATE_LIMIT_REQUESTS", DEFAULT_REQUESTS)
+    if not requests or requests <= 0:
+        app.extensions[EXTENSION_KEY] = None
+        return
+    requests /= max(app.config.get("RATE_LIMIT_WORKERS", 1), 1)
+    scheduler = RequestScheduler(requests, app.config.get("RATE_LIMIT_PERIOD_S", DEFAULT_PERIOD_S),
+                                 app.config.get("RATE_LIMIT_TIMEOUT_S", DEFAULT_TIMEOUT_S))
+    app.extensions[EXTENSION_KEY] = scheduler
+    metrics.RATE_LIMIT_TOKENS.set_collect(scheduler.budget_samples)
+
+
+def current_scheduler() -> RequestScheduler | None:
+    """Request scheduler of the current app, None outside an app context or if it is disabled."""
+    if not has_app_context():
+        return None
+    return current_app.extensions.get(EXTENSION_KEY)
+
+
+def acquire(api_key: str | None, priority: int = PRIORITY_STATIC) -> None:
+    """
+    Takes a token from the budget of the current app before a request is sent.
+
+    :param api_key: api key of the request
+    :type api_key: str, optional
+
+    :param priority: priority of the request
+    :type priority: int
+
+    :return: None
+    :rtype: None
+
+    :raises RateLimitExceeded: if no token became available within the timeout
+    """
+    scheduler = current_scheduler()
+    if scheduler is not None:
+        scheduler.acquire(api_key, priority)
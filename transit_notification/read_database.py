@@ -0,0 +1,115 @@
+"""Read only engine and session used by the routes, separate from the engine used by the ingest functions."""
+
+import flask_sqlalchemy
+import sqlalchemy
+import sqlalchemy.orm
+from flask import Flask
+from flask.globals import app_ctx
+
+# bind key of the read engine in SQLALCHEMY_BINDS
+READ_BIND_KEY = 'read'
+
+
+def is_memory_database(uri: str | sqlalchemy.engine.URL) -> bool:
+    """
+    Checks if the uri points to an in-memory SQLite database, which can only be shared through a single engine.
+
+    :param uri: database uri
+    :type uri: typing.Union[str, sqlalchemy.engine.URL]
+
+    :return: True for in-memory SQLite databases
+    :rtype: bool
+    """
+    url = sqlalchemy.engine.make_url(uri)
+    return url.get_backend_name() == 'sqlite' and (url.database in (None, '', ':memory:')
+                                                   or url.query.get('mode') == 'memory')
+
+
+def read_only_uri(uri: str | sqlalchemy.engine.URL) -> str | None:
+    """
+    Derives the uri of the read engine from the uri of the write engine. SQLite files are opened read only, other
+    databases use the same uri with their own pool and in-memory SQLite databases have no separate read engine.
+
+    :param uri: uri of the write database
+    :type uri: typing.Union[str, sqlalchemy.engine.URL]
+
+    :return: uri of the read database, None if the write engine has to be used
+    :rtype: str, optional
+    """
+    url = sqlalchemy.engine.make_url(uri)
+    if is_memory_database(url):
+        return None
+    if url.get_backend_name() != 'sqlite':
+        return url.render_as_string(hide_password=False)
+    path = url.database[len('file:'):] if url.query.get('uri') else url.database
+    return f"{url.drivername}:///file:{path}?mode=ro&uri=true"
+
+
+def pool_options(uri: str | sqlalchemy.engine.URL, pool_size: int | None) -> dict:
+    """
+    Engine options that set the pool size. In-memory SQLite databases use a single static connection.
+
+    :param uri: database uri
+    :type uri: typing.Union[str, sqlalchemy.engine.URL]
+
+    :param pool_size: number of connections kept in the pool
+    :type pool_size: int, optional
+
+    :return: engine options
+    :rtype: dict
+    """
+    if pool_size is None or is_memory_database(uri):
+        return {}
+    return {'pool_size': pool_size}
+
+
+class ReadDatabase:
+    """
+    Read only access to the database. The session is bound to the read engine, every other attribute (select, and_,
+    ...) comes from the write database, so the db_commands query functions accept either of them.
+    """
+
+    def __init__(self, siri_db: flask_sqlalchemy.SQLAlchemy):
+        self.siri_db = siri_db
+        self.session = sqlalchemy.orm.scoped_session(self.create_session,
+                                                     scopefunc=lambda: id(app_ctx._get_current_object()))
+
+    def __getattr__(self, name):
+        return getattr(self.siri_db, name)
+
+    @property
+    def engine(self) -> sqlalchemy.engine.Engine:
+        """Read engine of the current app, the write engine if no read engine is configured."""
+        engines = self.siri_db.engines
+        return engines[READ_BIND_KEY] if READ_BIND_KEY in engines else engines[None]
+
+    def create_session(self) -> sqlalchemy.orm.Session:
+        return sqlalchemy.orm.Session(bind=self.engine, autoflush=False)
+
+    def init_app(self, app: Flask) -> None:
+        """
+        Configures the read engine as a bind and sets the pool sizes of both engines. Has to be called before the
+        init_app of the write database.
+
+        READ_DATABASE_URI selects the read database, by default the write database is used, opened read only for
+        SQLite files. READ_POOL_SIZE and WRITE_POOL_SIZE set the pool sizes.
+
+        :param app: flask application
+        :type app: Flask
+
+        :return: None
+        :rtype: None
+        """
+        write_uri = app.config["SQLALCHEMY_DATABASE_URI"]
+        write_options = pool_options(write_uri, app.config.get("WRITE_POOL_SIZE"))
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {**write_options, **app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {})}
+
+        read_uri = app.config.get("READ_DATABASE_URI") or read_only_uri(write_uri)
+        if read_uri is not None and not is_memory_database(read_uri):
+            binds = dict(app.config.get("SQLALCHEMY_BINDS") or {})
+            binds[READ_BIND_KEY] = {'url': read_uri, **pool_options(read_uri, app.config.get("READ_POOL_SIZE"))}
+            app.config["SQLALCHEMY_BINDS"] = binds
+        app.teardown_appcontext(self.teardown_session)
+
+    def teardown_session(self, exc: BaseException | None) -> None:
+        self.session.remove()
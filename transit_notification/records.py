@@ -0,0 +1,54 @@
+"""
+Immutable records produced by the SIRI parsers. The field names match the columns of the models, so a record can be
+passed to a bulk insert with _asdict() without building ORM instances.
+"""
+import datetime as dt
+import typing
+
+
+class VehicleRecord(typing.NamedTuple):
+    operator_id: str
+    vehicle_journey_ref: str
+    dataframe_ref_date: dt.date
+    line_id: str
+    vehicle_direction: str
+    vehicle_longitude: float | None
+    vehicle_latitude: float | None
+    vehicle_bearing: float | None
+
+    def contains_none(self) -> bool:
+        return ((self.operator_id is None) or (self.vehicle_journey_ref is None) or (self.dataframe_ref_date is None) or
+                (self.line_id is None) or (self.vehicle_direction is None))
+
+
+class OnwardCallRecord(typing.NamedTuple):
+    operator_id: str
+    vehicle_journey_ref: str
+    dataframe_ref_date: dt.date
+    stop_id: str
+    vehicle_at_stop: bool
+    aimed_arrival_time_utc: dt.datetime | None
+    expected_arrival_time_utc: dt.datetime | None
+    aimed_departure_time_utc: dt.datetime | None
+    expected_departure_time_utc: dt.datetime | None
+
+
+class StopTimetableRecord(typing.NamedTuple):
+    operator_id: str
+    vehicle_journey_ref: str
+    stop_id: str
+    aimed_arrival_time_utc: dt.datetime | None
+    aimed_departure_time_utc: dt.datetime | None
+
+
+def as_rows(records: typing.Iterable[typing.NamedTuple]) -> list[dict]:
+    """
+    Converts records to the parameter dictionaries of an executemany insert.
+
+    :param records: parsed records
+    :type records: typing.Iterable[typing.NamedTuple]
+
+    :return: one dictionary per record, keyed by column name
+    :rtype: list[dict]
+    """
+    return [record._asdict() for record in records]
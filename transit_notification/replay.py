@@ -0,0 +1,431 @@
+"""Replays recorded or synthetic SIRI monitoring responses through the ingest path to benchmark throughput."""
+import datetime as dt
+import json
+import os
+import random
+import time
+import typing
+from collections import defaultdict
+
+import click
+import flask_sqlalchemy
+from flask.cli import with_appcontext
+
+from transit_notification import db_commands
+
+VEHICLE_MONITORING = 'vehicle_monitoring'
+STOP_MONITORING = 'stop_monitoring'
+
+# ingest function of each replayable feed
+FEEDS = {
+    VEHICLE_MONITORING: db_commands.save_vehicle_monitoring,
+    STOP_MONITORING: db_commands.save_stop_monitoring,
+}
+
+STAGES = ('load', 'parse', 'write')
+
+
+class ReplayReport:
+    """Collects the row counts and per stage latencies of a replay."""
+
+    def __init__(self):
+        self.responses = 0
+        self.rows = 0
+        self.elapsed = 0.0
+        self.database_size = None
+        self.stage_times = defaultdict(list)
+
+    def add(self, rows: int, stage_times: dict) -> None:
+        self.responses += 1
+        self.rows += rows
+        for stage, stage_time in stage_times.items():
+            self.stage_times[stage].append(stage_time)
+
+    @property
+    def rows_per_second(self) -> float:
+        busy_time = sum(sum(self.stage_times[stage]) for stage in ('parse', 'write'))
+        return self.rows / busy_time if busy_time else 0.0
+
+    def summary(self) -> list[str]:
+        lines = [f"Replayed {self.responses} responses, {self.rows} rows in {self.elapsed:.3f} s "
+                 f"({self.rows_per_second:.0f} rows/s through parse and write)"]
+        for stage in STAGES:
+            stage_times = sorted(self.stage_times[stage])
+            if not stage_times:
+                continue
+            lines.append(f"  {stage:<6} mean {1000 * sum(stage_times) / len(stage_times):8.2f} ms  "
+                         f"p50 {1000 * percentile(stage_times, 0.5):8.2f} ms  "
+                         f"p95 {1000 * percentile(stage_times, 0.95):8.2f} ms  "
+                         f"max {1000 * stage_times[-1]:8.2f} ms")
+        if self.database_size is not None:
+            lines.append(f"Database size: {self.database_size / 1024:.0f} KiB")
+        return lines
+
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    """
+    Nearest rank percentile of an already sorted list.
+
+    :param sorted_values: sorted values
+    :type sorted_values: list[float]
+
+    :param fraction: percentile as a fraction between 0 and 1
+    :type fraction: float
+
+    :return: value at the percentile
+    :rtype: float
+    """
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def response_feed_type(response: dict) -> str | None:
+    """
+    Determines which monitoring feed a response belongs to.
+
+    :param response: SIRI response
+    :type response: dict
+
+    :return: VEHICLE_MONITORING, STOP_MONITORING or None if the response is not a monitoring response
+    :rtype: str or None
+    """
+    if not isinstance(response, dict):
+        return None
+    service_delivery = response.get("Siri", response).get("ServiceDelivery", {})
+    if "VehicleMonitoringDelivery" in service_delivery:
+        return VEHICLE_MONITORING
+    if "StopMonitoringDelivery" in service_delivery:
+        return STOP_MONITORING
+    return None
+
+
+def normalize_response(feed_type: str, response: dict) -> dict:
+    """
+    Wraps or unwraps the Siri root element so the response has the layout the parser of the feed expects.
+
+    :param feed_type: VEHICLE_MONITORING or STOP_MONITORING
+    :type feed_type: str
+
+    :param response: SIRI response
+    :type response: dict
+
+    :return: response in the layout expected by the parser
+    :rtype: dict
+    """
+    if feed_type == VEHICLE_MONITORING:
+        return response if "Siri" in response else {"Siri": response}
+    return response.get("Siri", response)
+
+
+def iter_recorded_responses(directory: str) -> typing.Iterator[tuple[str, str, dict, float]]:
+    """
+    Loads the monitoring responses stored as json files in a directory in file name order. Files that are not
+    monitoring responses are skipped.
+
+    :param directory: directory containing the recorded responses
+    :type directory: str
+
+    :return: iterator of (path, feed type, response, load time in seconds)
+    :rtype: typing.Iterator[tuple[str, str, dict, float]]
+    """
+    for file_name in sorted(os.listdir(directory)):
+        if not file_name.endswith('.json'):
+            continue
+        path = os.path.join(directory, file_name)
+        load_start = time.perf_counter()
+        with open(path) as f:
+            response = json.load(f)
+        load_time = time.perf_counter() - load_start
+        feed_type = response_feed_type(response)
+        if feed_type is not None:
+            yield path, feed_type, response, load_time
+
+
+def replay_responses(siri_db: flask_sqlalchemy.SQLAlchemy,
+                     responses: typing.Iterable[tuple[str, str, dict, float]],
+                     operator_id: str | None = None,
+                     speed: float | None = None,
+                     sleep: typing.Callable[[float], None] = time.sleep,
+                     archive: bool = False) -> ReplayReport:
+    """
+    Feeds responses through save_vehicle_monitoring and save_stop_monitoring, timing each stage. The write stage
+    includes the cadence, archive and retention steps that follow the write.
+
+    :param siri_db: database
+    :type siri_db: flask_sqlalchemy.SQLAlchemy
+
+    :param responses: iterable of (path, feed type, response, load time) as returned by iter_recorded_responses
+    :type responses: typing.Iterable[tuple[str, str, dict, float]]
+
+    :param operator_id: operator id, defaults to the ProducerRef of each response
+    :type operator_id: str, optional
+
+    :param speed: replay at this multiple of real time using the response timestamps. None replays as fast as
+        possible.
+    :type speed: float, optional
+
+    :param sleep: function used to wait between responses
+    :type sleep: typing.Callable[[float], None]
+
+    :param archive: if True, copy the onward calls into the onward call archive
+    :type archive: bool
+
+    :return: report of the replay
+    :rtype: ReplayReport
+    """
+    report = ReplayReport()
+    replay_start = time.perf_counter()
+    first_response_time = None
+    for _, feed_type, response, load_time in responses:
+        recorded_time = db_commands.response_time(response) or dt.datetime.now(dt.UTC)
+        if speed is not None:
+            if first_response_time is None:
+                first_response_time = recorded_time
+            wait_time = ((recorded_time - first_response_time).total_seconds() / speed -
+                         (time.perf_counter() - replay_start))
+            if wait_time > 0:
+                sleep(wait_time)
+
+        response = normalize_response(feed_type, response)
+        response_operator_id = operator_id or response.get("Siri", response)["ServiceDelivery"]["ProducerRef"]
+        timings = {}
+        FEEDS[feed_type](siri_db, response_operator_id, response, recorded_time, archive=archive, timings=timings)
+
+        report.add(timings['rows'], {'load': load_time, 'parse': timings['parse'], 'write': timings['write']})
+
+    report.elapsed = time.perf_counter() - replay_start
+    report.database_size = database_size(siri_db)
+    return report
+
+
+def database_size(siri_db: flask_sqlalchemy.SQLAlchemy) -> int | None:
+    """
+    Size of the database in bytes. Only supported for SQLite.
+
+    :param siri_db: database
+    :type siri_db: flask_sqlalchemy.SQLAlchemy
+
+    :return: size in bytes or None if the database is not SQLite
+    :rtype: int or None
+    """
+    if siri_db.engine.dialect.name != 'sqlite':
+        return None
+    page_count = siri_db.session.execute(siri_db.text('PRAGMA page_count')).scalar()
+    page_size = siri_db.session.execute(siri_db.text('PRAGMA page_size')).scalar()
+    return page_count * page_size
+
+
+def synthesize_vehicle_monitoring(operator_id: str,
+                                  vehicle_count: int,
+                                  calls_per_vehicle: int,
+                                  current_time: dt.datetime,
+                                  seed: int = 0) -> dict:
+    """
+    Creates a vehicle monitoring response with the layout of the 511.org feed.
+
+    :param operator_id: operator id
+    :type operator_id: str
+
+    :param vehicle_count: number of vehicles
+    :type vehicle_count: int
+
+    :param calls_per_vehicle: number of calls (monitored call and onward calls) for each vehicle
+    :type calls_per_vehicle: int
+
+    :param current_time: response timestamp in utc
+    :type current_time: dt.datetime
+
+    :param seed: seed of the random number generator
+    :type seed: int
+
+    :return: vehicle monitoring response
+    :rtype: dict
+    """
+    rng = random.Random(seed)
+    vehicle_activity = []
+    for vehicle_index in range(vehicle_count):
+        journey = synthesize_journey(rng, vehicle_index, current_time)
+        calls = [synthesize_call(rng, f"{(vehicle_index * 7 + call_index) % 5000 + 10000}",
+                                 current_time + dt.timedelta(minutes=2 * call_index))
+                 for call_index in range(calls_per_vehicle)]
+        if calls:
+            monitored_call = calls[0]
+            monitored_call["VehicleAtStop"] = "false"
+            journey["MonitoredCall"] = monitored_call
+        if len(calls) > 1:
+            journey["OnwardCalls"] = {"OnwardCall": calls[1:]}
+        vehicle_activity.append({"RecordedAtTime": format_time(current_time), "MonitoredVehicleJourney": journey})
+    return {"Siri": {"ServiceDelivery": {
+        "ResponseTimestamp": format_time(current_time),
+        "ProducerRef": operator_id,
+        "Status": True,
+        "VehicleMonitoringDelivery": {"version": "1.4",
+                                      "ResponseTimestamp": format_time(current_time),
+                                      "VehicleActivity": vehicle_activity}}}}
+
+
+def synthesize_stop_monitoring(operator_id: str,
+                               visit_count: int,
+                               current_time: dt.datetime,
+                               seed: int = 0) -> dict:
+    """
+    Creates a stop monitoring response with the layout of the 511.org feed.
+
+    :param operator_id: operator id
+    :type operator_id: str
+
+    :param visit_count: number of monitored stop visits
+    :type visit_count: int
+
+    :param current_time: response timestamp in utc
+    :type current_time: dt.datetime
+
+    :param seed: seed of the random number generator
+    :type seed: int
+
+    :return: stop monitoring response
+    :rtype: dict
+    """
+    rng = random.Random(seed)
+    visits = []
+    for visit_index in range(visit_count):
+        journey = synthesize_journey(rng, visit_index, current_time)
+        stop_id = f"{visit_index % 5000 + 10000}"
+        journey["MonitoredCall"] = synthesize_call(rng, stop_id, current_time + dt.timedelta(minutes=visit_index % 60))
+        journey["MonitoredCall"]["VehicleAtStop"] = ""
+        visits.append({"RecordedAtTime": format_time(current_time), "MonitoringRef": stop_id,
+                       "MonitoredVehicleJourney": journey})
+    return {"ServiceDelivery": {
+        "ResponseTimestamp": format_time(current_time),
+        "ProducerRef": operator_id,
+        "Status": True,
+        "StopMonitoringDelivery": {"version": "1.4",
+                                   "ResponseTimestamp": format_time(current_time),
+                                   "Status": True,
+                                   "MonitoredStopVisit": visits}}}
+
+
+def synthesize_journey(rng: random.Random, index: int, current_time: dt.datetime) -> dict:
+    """
+    Creates the MonitoredVehicleJourney element of a synthetic vehicle.
+    """
+    return {"LineRef": str(index % 80 + 1),
+            "DirectionRef": rng.choice(["IB", "OB"]),
+            "FramedVehicleJourneyRef": {"DataFrameRef": current_time.strftime("%Y-%m-%d"),
+                                        "DatedVehicleJourneyRef": f"Synthetic_{index}"},
+            "VehicleLocation": {"Longitude": f"{-122.5 + rng.random() * 0.2:.6f}",
+                                "Latitude": f"{37.7 + rng.random() * 0.1:.6f}"},
+            "Bearing": f"{rng.random() * 360:.10f}"}
+
+
+def synthesize_call(rng: random.Random, stop_id: str, aimed_time: dt.datetime) -> dict:
+    """
+    Creates a call of a synthetic vehicle at a stop.
+    """
+    expected_time = aimed_time + dt.timedelta(seconds=rng.randint(-60, 300))
+    return {"StopPointRef": stop_id,
+            "AimedArrivalTime": format_time(aimed_time),
+            "ExpectedArrivalTime": format_time(expected_time),
+            "AimedDepartureTime": format_time(aimed_time),
+            "ExpectedDepartureTime": None}
+
+
+def format_time(time_value: dt.datetime) -> str:
+    """
+    Formats an utc time like the 511.org feed.
+    """
+    return time_value.astimezone(dt.UTC).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def write_synthetic_responses(directory: str,
+                              operator_id: str,
+                              polls: int,
+                              vehicle_count: int,
+                              calls_per_vehicle: int,
+                              start_time: dt.datetime,
+                              poll_interval: float = 60) -> list[str]:
+    """
+    Writes a sequence of synthetic vehicle monitoring responses to a directory.
+
+    :param directory: output directory
+    :type directory: str
+
+    :param operator_id: operator id
+    :type operator_id: str
+
+    :param polls: number of responses to write
+    :type polls: int
+
+    :param vehicle_count: number of vehicles in each response
+    :type vehicle_count: int
+
+    :param calls_per_vehicle: number of calls for each vehicle
+    :type calls_per_vehicle: int
+
+    :param start_time: response timestamp of the first response
+    :type start_time: dt.datetime
+
+    :param poll_interval: seconds between the response timestamps
+    :type poll_interval: float
+
+    :return: paths of the written files
+    :rtype: list[str]
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for poll in range(polls):
+        poll_time = start_time + dt.timedelta(seconds=poll * poll_interval)
+        response = synthesize_vehicle_monitoring(operator_id, vehicle_count, calls_per_vehicle, poll_time, seed=poll)
+        path = os.path.join(directory, f"vehicle_monitoring_{poll:05d}.json")
+        with open(path, 'w') as f:
+            json.dump(response, f)
+        paths.append(path)
+    return paths
+
+
+@click.group("replay")
+def replay_command():
+    """Replay recorded SIRI monitoring responses to benchmark ingestion."""
+
+
+@replay_command.command("run")
+@click.argument("directory", type=click.Path(exists=True, file_okay=False))
+@click.option("--operator", "operator_id", default=None, help="Operator id. Defaults to the ProducerRef.")
+@click.option("--speed", type=float, default=None,
+              help="Replay at this multiple of real time. Replays as fast as possible when omitted.")
+@click.option("--profile", is_flag=True, help="Write a profile of the replay to the profile directory.")
+@with_appcontext
+def replay_run_command(directory, operator_id, speed, profile):
+    """Replay the monitoring responses stored in DIRECTORY."""
+    from flask import current_app
+
+    from transit_notification import db, profiling
+
+    archive = current_app.config["ARCHIVE_ONWARD_CALLS"]
+    if profile:
+        with profiling.profiled('replay', profiling.profile_directory(current_app)):
+            report = replay_responses(db, iter_recorded_responses(directory), operator_id=operator_id, speed=speed,
+                                      archive=archive)
+    else:
+        report = replay_responses(db, iter_recorded_responses(directory), operator_id=operator_id, speed=speed,
+                                  archive=archive)
+    for line in report.summary():
+        click.echo(line)
+
+
+@replay_command.command("generate")
+@click.argument("directory", type=click.Path(file_okay=False))
+@click.option("--operator", "operator_id", default="SF", show_default=True, help="Operator id.")
+@click.option("--polls", type=int, default=10, show_default=True, help="Number of responses.")
+@click.option("--vehicles", "vehicle_count", type=int, default=500, show_default=True,
+              help="Vehicles in each response.")
+@click.option("--calls", "calls_per_vehicle", type=int, default=20, show_default=True,
+              help="Calls for each vehicle.")
+@click.option("--interval", "poll_interval", type=float, default=60, show_default=True,
+              help="Seconds between responses.")
+def replay_generate_command(directory, operator_id, polls, vehicle_count, calls_per_vehicle, poll_interval):
+    """Write synthetic vehicle monitoring responses to DIRECTORY."""
+    start_time = dt.datetime.now(dt.UTC).replace(microsecond=0)
+    paths = write_synthetic_responses(directory, operator_id, polls, vehicle_count, calls_per_vehicle, start_time,
+                                      poll_interval)
+    click.echo(f"Wrote {len(paths)} responses to {directory}")
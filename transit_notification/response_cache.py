@@ -0,0 +1,209 @@
+"""
+File cache of the raw SIRI responses of the static datasets, so restarts and additional processes do not refetch the
+operators, lines, stops and patterns.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+import typing
+
+from flask import Flask, current_app
+
+from transit_notification import metrics
+
+logger = logging.getLogger(__name__)
+
+# the static datasets are refreshed at most daily
+DEFAULT_TTL_S = 24 * 60 * 60
+EXTENSION_KEY = 'response_cache'
+
+
+class ResponseCache:
+    """
+    Gzip compressed JSON files, one per dataset and set of request parameters. The api key is not part of the
+    parameters, so it never reaches the disk and a new key keeps the cached responses.
+    """
+
+    def __init__(self, directory: str, ttl_s: float = DEFAULT_TTL_S):
+        self.directory = directory
+        self.ttl_s = ttl_s
+
+    def path(self, dataset: str, params: typing.Mapping[str, typing.Any]) -> str:
+        """
+        Path of the cache file of a request.
+
+        :param dataset: name of the dataset, used as the file name prefix
+        :type dataset: str
+
+        :param params: request parameters that select the response
+        :type params: typing.Mapping[str, typing.Any]
+
+        :return: path of the cache file
+        :rtype: str
+        """
+        digest = hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()[:32]
+        return os.path.join(self.directory, f"{dataset}-{digest}.json.gz")
+
+    def get(self, dataset: str, params: typing.Mapping[str, typing.Any],
+            current_time: float | None = None) -> dict | None:
+        """
+        Reads a cached response.
+
+        :param dataset: name of the dataset
+        :type dataset: str
+
+        :param params: request parameters that select the response
+        :type params: typing.Mapping[str, typing.Any]
+
+        :param current_time: current unix time, defaults to now
+        :type current_time: float, optional
+
+        :return: cached response, None if it is missing, expired or unreadable
+        :rtype: dict, optional
+        """
+        if current_time is None:
+            current_time = time.time()
+        path = self.path(dataset, params)
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, EOFError, ValueError):
+            logger.warning("Discarding unreadable cached response %s", path)
+            self.discard(path)
+            return None
+        if current_time - entry['fetched'] > self.ttl_s:
+            return None
+        return entry['response']
+
+    def put(self, dataset: str, params: typing.Mapping[str, typing.Any], response: dict,
+            current_time: float | None = None) -> None:
+        """
+        Stores a response. The file is written under a temporary name and renamed, so concurrent readers never see a
+        partial file.
+
+        :param dataset: name of the dataset
+        :type dataset: str
+
+        :param params: request parameters that select the response
+        :type params: typing.Mapping[str, typing.Any]
+
+        :param response: decoded response
+        :type response: dict
+
+        :param current_time: unix time the response was fetched, defaults to now
+        :type current_time: float, optional
+
+        :return: None
+        :rtype: None
+        """
+        if current_time is None:
+            current_time = time.time()
+        os.makedirs(self.directory, exist_ok=True)
+        data = gzip.compress(json.dumps({'fetched': current_time, 'response': response}).encode('utf-8'))
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, self.path(dataset, params))
+        except BaseException:
+            self.discard(temp_path)
+            raise
+
+    def fetch(self, dataset: str, params: typing.Mapping[str, typing.Any],
+              fetch_response: typing.Callable[[], dict]) -> dict:
+        """
+        Returns the cached response, fetching and storing it when it is missing or expired.
+
+        :param dataset: name of the dataset
+        :type dataset: str
+
+        :param params: request parameters that select the response
+        :type params: typing.Mapping[str, typing.Any]
+
+        :param fetch_response: requests the response from the api
+        :type fetch_response: typing.Callable[[], dict]
+
+        :return: response
+        :rtype: dict
+        """
+        response = self.get(dataset, params)
+        if response is not None:
+            metrics.RESPONSE_CACHE_LOOKUPS.inc(1, dataset, 'hit')
+            return response
+        metrics.RESPONSE_CACHE_LOOKUPS.inc(1, dataset, 'miss')
+        response = fetch_response()
+        try:
+            self.put(dataset, params, response)
+        except OSError:
+            logger.warning("Unable to cache the %s response in %s", dataset, self.directory, exc_info=True)
+        return response
+
+    def clear(self) -> None:
+        """Removes every cached response."""
+        if not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            if name.endswith('.json.gz'):
+                self.discard(os.path.join(self.directory, name))
+
+    @staticmethod
+    def discard(path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def read_through(cache: ResponseCache | None, dataset: str, params: typing.Mapping[str, typing.Any],
+                 fetch_response: typing.Callable[[], dict]) -> dict:
+    """
+    Fetches a response through the cache, or directly when there is no cache.
+
+    :param cache: response cache
+    :type cache: ResponseCache, optional
+
+    :param dataset: name of the dataset
+    :type dataset: str
+
+    :param params: request parameters that select the response
+    :type params: typing.Mapping[str, typing.Any]
+
+    :param fetch_response: requests the response from the api
+    :type fetch_response: typing.Callable[[], dict]
+
+    :return: response
+    :rtype: dict
+    """
+    if cache is None:
+        return fetch_response()
+    return cache.fetch(dataset, params, fetch_response)
+
+
+def init_app(app: Flask) -> None:
+    """
+    Creates the response cache of the app. RESPONSE_CACHE_DIR sets the directory, instance/response_cache by default,
+    and RESPONSE_CACHE_TTL_S the age after which a response is fetched again, 0 disables the cache.
+
+    :param app: flask application
+    :type app: Flask
+
+    :return: None
+    :rtype: None
+    """
+    ttl_s = app.config.get("RESPONSE_CACHE_TTL_S", DEFAULT_TTL_S)
+    if not ttl_s or ttl_s <= 0:
+        app.extensions[EXTENSION_KEY] = None
+        return
+    directory = app.config.get("RESPONSE_CACHE_DIR") or os.path.join(app.instance_path, 'response_cache')
+    app.extensions[EXTENSION_KEY] = ResponseCache(directory, ttl_s)
+
+
+def current_cache() -> ResponseCache | None:
+    """Response cache of the current app, None if it is disabled."""
+    return current_app.extensions.get(EXTENSION_KEY)
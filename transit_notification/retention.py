@@ -0,0 +1,231 @@
+"""
+Evicts realtime rows whose trips are over. The rows are deleted in small batches, each in its own transaction, so the
+eviction can run between ingest writes without holding the write lock for long.
+"""
+import datetime as dt
+import logging
+import threading
+import typing
+
+import click
+import flask_sqlalchemy
+from flask import Flask, current_app, has_app_context
+from flask.cli import with_appcontext
+
+from transit_notification import content_hash, metrics
+from transit_notification.models import (
+    OnwardCall,
+    StopTimetable,
+    Vehicle,
+    onward_call_expiry_time,
+    stop_timetable_expiry_time,
+)
+
+logger = logging.getLogger(__name__)
+
+# rows are kept this long after their arrival time
+DEFAULT_HORIZON_S = 60 * 60
+DEFAULT_BATCH_SIZE = 500
+# least time between two incremental eviction steps of the ingest
+DEFAULT_INTERVAL_S = 60
+# trips run past midnight, so a dataframe ref is only over a day after its date
+DATAFRAME_REF_GRACE = dt.timedelta(days=1)
+EXTENSION_KEY = 'retention'
+
+
+def expired_conditions(siri_db: flask_sqlalchemy.SQLAlchemy,
+                       current_time: dt.datetime,
+                       horizon_s: float) -> list[tuple[str, type, typing.Any, str]]:
+    """
+    Conditions that select the expired rows of each table, in eviction order. Onward calls go before the vehicles
+    they reference.
+
+    :param siri_db: database
+    :type siri_db: flask_sqlalchemy.SQLAlchemy
+
+    :param current_time: current utc time
+    :type current_time: dt.datetime
+
+    :param horizon_s: rows are kept this many seconds after their arrival time
+    :type horizon_s: float
+
+    :return: (table name, model, condition, digest scope) of each table
+    :rtype: list[tuple[str, type, typing.Any, str]]
+    """
+    cutoff = current_time.replace(tzinfo=None) - dt.timedelta(seconds=horizon_s)
+    cutoff_date = cutoff.date() - DATAFRAME_REF_GRACE
+    vehicle_has_calls = siri_db.select(OnwardCall.vehicle_journey_ref).where(
+        OnwardCall.operator_id == Vehicle.operator_id,
+        OnwardCall.vehicle_journey_ref == Vehicle.vehicle_journey_ref,
+        OnwardCall.dataframe_ref_date == Vehicle.dataframe_ref_date).exists()
+    return [
+        ('onward_call', OnwardCall, onward_call_expiry_time < cutoff, 'monitoring'),
+        # calls without any time are evicted with their dataframe ref
+        ('onward_call', OnwardCall, siri_db.and_(onward_call_expiry_time.is_(None),
+                                                 OnwardCall.dataframe_ref_date < cutoff_date), 'monitoring'),
+        ('vehicle', Vehicle, siri_db.and_(Vehicle.dataframe_ref_date < cutoff_date, ~vehicle_has_calls),
+         'monitoring'),
+        ('stop_timetable', StopTimetable, stop_timetable_expiry_time < cutoff, 'stop_timetable'),
+    ]
+
+
+def evict_batch(siri_db: flask_sqlalchemy.SQLAlchemy, model: type, condition, batch_size: int) -> int:
+    """
+    Deletes up to batch_size rows of a table that match the condition and commits.
+
+    :param siri_db: database
+    :type siri_db: flask_sqlalchemy.SQLAlchemy
+
+    :param model: model of the table
+    :type model: type
+
+    :param condition: condition that selects the expired rows
+    :type condition: sqlalchemy.sql.ColumnElement
+
+    :param batch_size: most rows deleted
+    :type batch_size: int
+
+    :return: number of deleted rows
+    :rtype: int
+    """
+    primary_key = siri_db.tuple_(*model.__table__.primary_key.columns)
+    batch = siri_db.select(*model.__table__.primary_key.columns).where(condition).limit(batch_size)
+    deleted = siri_db.session.execute(siri_db.delete(model).where(primary_key.in_(batch))).rowcount
+    siri_db.session.commit()
+    return deleted
+
+
+def evict_expired(siri_db: flask_sqlalchemy.SQLAlchemy,
+                  current_time: dt.datetime,
+                  horizon_s: float = DEFAULT_HORIZON_S,
+                  batch_size: int = DEFAULT_BATCH_SIZE,
+                  max_batches: int | None = None) -> dict[str, int]:
+    """
+    Evicts the expired rows of every table. The digests of the evicted rows are forgotten, so the next poll writes
+    the rows again instead of skipping them as unchanged.
+
+    :param siri_db: database
+    :type siri_db: flask_sqlalchemy.SQLAlchemy
+
+    :param current_time: current utc time
+    :type current_time: dt.datetime
+
+    :param horizon_s: rows are kept this many seconds after their arrival time
+    :type horizon_s: float
+
+    :param batch_size: most rows deleted per transaction
+    :type batch_size: int
+
+    :param max_batches: most batches per table, None evicts until no expired rows are left
+    :type max_batches: int, optional
+
+    :return: number of deleted rows per table
+    :rtype: dict[str, int]
+    """
+    evicted = {}
+    for table_name, model, condition, scope in expired_conditions(siri_db, current_time, horizon_s):
+        batches = 0
+        table_evicted = 0
+        while max_batches is None or batches < max_batches:
+            deleted = evict_batch(siri_db, model, condition, batch_size)
+            batches += 1
+            table_evicted += deleted
+            if deleted < batch_size:
+                break
+        if table_evicted:
+            content_hash.forget_digests(siri_db, scope)
+            siri_db.session.commit()
+            metrics.ROWS_EVICTED.inc(table_evicted, table_name)
+        evicted[table_name] = evicted.get(table_name, 0) + table_evicted
+    return evicted
+
+
+class Retention:
+    """Settings of the eviction and the time of the last incremental step of an app."""
+
+    def __init__(self, horizon_s: float = DEFAULT_HORIZON_S, batch_size: int = DEFAULT_BATCH_SIZE,
+                 interval_s: float = DEFAULT_INTERVAL_S):
+        self.horizon_s = horizon_s
+        self.batch_size = batch_size
+        self.interval_s = interval_s
+        self.last_step = None
+        self._lock = threading.Lock()
+
+    def step_due(self, current_time: dt.datetime) -> bool:
+        with self._lock:
+            if self.last_step is not None and (current_time - self.last_step).total_seconds() < self.interval_s:
+                return False
+            self.last_step = current_time
+            return True
+
+    def step(self, siri_db: flask_sqlalchemy.SQLAlchemy, current_time: dt.datetime) -> dict | None:
+        """
+        Evicts one batch per table if the last step is at least interval_s old.
+
+        :param siri_db: database
+        :type siri_db: flask_sqlalchemy.SQLAlchemy
+
+        :param current_time: current utc time
+        :type current_time: dt.datetime
+
+        :return: number of deleted rows per table, None if no step was due
+        :rtype: dict, optional
+        """
+        if not self.step_due(current_time):
+            return None
+        return evict_expired(siri_db, current_time, self.horizon_s, self.batch_size, max_batches=1)
+
+
+def init_app(app: Flask) -> None:
+    """
+    Creates the retention settings of the app. RETENTION_HORIZON_S sets how long rows are kept after their arrival,
+    0 disables the incremental eviction, RETENTION_BATCH_SIZE the rows deleted per transaction and
+    RETENTION_INTERVAL_S the least time between two incremental steps.
+
+    :param app: flask application
+    :type app: Flask
+
+    :return: None
+    :rtype: None
+    """
+    horizon_s = app.config.get("RETENTION_HORIZON_S", DEFAULT_HORIZON_S)
+    if not horizon_s or horizon_s <= 0:
+        app.extensions[EXTENSION_KEY] = None
+        return
+    app.extensions[EXTENSION_KEY] = Retention(horizon_s, app.config.get("RETENTION_BATCH_SIZE", DEFAULT_BATCH_SIZE),
+                                              app.config.get("RETENTION_INTERVAL_S", DEFAULT_INTERVAL_S))
+
+
+def current_retention() -> Retention | None:
+    """Retention of the current app, None outside an app context or if it is disabled."""
+    if not has_app_context():
+        return None
+    return current_app.extensions.get(EXTENSION_KEY)
+
+
+def step(siri_db: flask_sqlalchemy.SQLAlchemy, current_time: dt.datetime) -> None:
+    """Runs an incremental eviction step of the current app if one is due, see Retention.step."""
+    retention = current_retention()
+    if retention is not None:
+        evicted = retention.step(siri_db, current_time)
+        if evicted and any(evicted.values()):
+            logger.debug("Evicted expired rows: %s", evicted)
+
+
+@click.command("evict-expired")
+@click.option("--horizon", type=float, default=None,
+              help="Seconds rows are kept after their arrival time, defaults to RETENTION_HORIZON_S.")
+@click.option("--batch-size", type=int, default=None,
+              help="Rows deleted per transaction, defaults to RETENTION_BATCH_SIZE.")
+@with_appcontext
+def evict_expired_command(horizon, batch_size):
+    """Delete every expired vehicle, onward call and stop timetable row."""
+    from transit_notification import db
+
+    if horizon is None:
+        horizon = current_app.config.get("RETENTION_HORIZON_S") or DEFAULT_HORIZON_S
+    if batch_size is None:
+        batch_size = current_app.config.get("RETENTION_BATCH_SIZE", DEFAULT_BATCH_SIZE)
+    evicted = evict_expired(db, dt.datetime.now(dt.UTC), horizon, batch_size)
+    for table_name, count in evicted.items():
+        click.echo(f"{table_name}: {count} rows evicted")
@@ -1,9 +1,10 @@
-from flask import Blueprint, render_template, redirect, url_for, flash
-from transit_notification import db
-from transit_notification.models import Operator, Line, Pattern, StopPattern, Stop, Shape
-import siri_transit_api_client
 import datetime as dt
+
+from flask import Blueprint, current_app, flash, redirect, render_template, request, url_for
+
 import transit_notification.db_commands as tndc
+from transit_notification import cadence, db, demand, prefetch, rate_limit, read_db, response_cache
+from transit_notification.models import Line, Operator, Pattern, Stop, StopPattern
 
 routes = Blueprint('routes', __name__)
 
@@ -12,8 +13,13 @@ OPERATORS_REFRESH_LIMIT = 24*60
 LINES_REFRESH_LIMIT = 24*60
 STOPS_REFRESH_LIMIT = 24*60
 PATTERN_REFRESH_LIMIT = 24*60
+STOP_TIMETABLE_REFRESH_LIMIT = 24*60
+# used until the update interval of the feed has been learned
 VEHICLE_MONITORING_REFRESH_LIMIT = 1
 STOP_MONITORING_REFRESH_LIMIT = 1
+# stops of a board, each stop may need its own stop monitoring request
+MAX_BOARD_STOPS = 10
+RATE_LIMIT_ERROR = 'The request budget of the api key is exhausted. Please try again later.'
 
 
 @routes.route('/setup')
@@ -31,24 +37,32 @@ def index():
 @routes.route('/operators')
 def show_operators():
     transit_api_key, siri_base_url = tndc.read_key_api_file()
-    operator_val = db.session.execute(db.select(Operator)).first()
-    current_time = dt.datetime.now(dt.timezone.utc)
-    operator_refresh_needed = tndc.operator_refresh_needed(db, OPERATORS_REFRESH_LIMIT, current_time)
+    operator_val = read_db.session.execute(db.select(Operator)).first()
+    current_time = dt.datetime.now(dt.UTC)
+    operator_refresh_needed = tndc.operator_refresh_needed(read_db, OPERATORS_REFRESH_LIMIT, current_time)
 
     if operator_val is None or operator_refresh_needed:
+        import siri_transit_api_client.exceptions
+
         try:
-            operators_json = tndc.get_operators_dict(transit_api_key=transit_api_key, siri_base_url=siri_base_url)
+            operators_json = tndc.get_operators_dict(transit_api_key=transit_api_key, siri_base_url=siri_base_url,
+                                                    cache=response_cache.current_cache())
             tndc.save_operators(db, operators_json)
             tndc.save_operator_refresh_time(db, current_time)
         except siri_transit_api_client.exceptions.TransportError:
-            error = 'Unable to establish connection to {0}. Please check url and resubmit.'.format(siri_base_url)
+            error = f'Unable to establish connection to {siri_base_url}. Please check url and resubmit.'
             return render_template('setup.html', error=error)
         except siri_transit_api_client.exceptions.ApiError:
             error = 'This API key provided is invalid.'
             return render_template('setup.html', error=error)
+        except rate_limit.RateLimitExceeded:
+            if operator_val is None:
+                return render_template('setup.html', error=RATE_LIMIT_ERROR)
+            # show the stored operators until the request budget allows a refresh
+            current_app.logger.warning("Request budget exhausted, showing stored operators")
 
     return render_template('show_operators.html',
-                           operators=db.session.execute(
+                           operators=read_db.session.execute(
                                db.select(Operator).filter(Operator.operator_monitored)).scalars().all())
 
 
@@ -57,15 +71,25 @@ def render_lines(operator_id):
     operator_check = check_valid_operator(operator_id)
     if operator_check is not None:
         return operator_check
-    current_time = dt.datetime.now(dt.timezone.utc)
+    current_time = dt.datetime.now(dt.UTC)
     transit_api_key, siri_base_url = tndc.read_key_api_file()
-    if tndc.refresh_needed(db, operator_id, 'lines_updated', LINES_REFRESH_LIMIT, current_time):
-        lines_dict = tndc.get_lines_dict(transit_api_key, siri_base_url, operator_id)
-        tndc.save_lines(db, operator_id, lines_dict, current_time)
-    lines = db.session.execute(
+    error = None
+    if tndc.refresh_needed(read_db, operator_id, 'lines_updated', LINES_REFRESH_LIMIT, current_time):
+        try:
+            lines_dict = tndc.get_lines_dict(transit_api_key, siri_base_url, operator_id,
+                                             cache=response_cache.current_cache())
+            tndc.save_lines(db, operator_id, lines_dict, current_time)
+        except rate_limit.RateLimitExceeded:
+            # show the stored lines until the request budget allows a refresh
+            current_app.logger.warning("Request budget exhausted, showing stored lines for %s", operator_id)
+            error = RATE_LIMIT_ERROR
+    # the line pages are usually visited next, so their patterns are loaded while this page is read
+    prefetch.schedule_patterns(operator_id, PATTERN_REFRESH_LIMIT)
+    lines = read_db.session.execute(
         db.select(Line).filter(Line.operator_id == operator_id).order_by(Line.sort_index.asc())).scalars().all()
     return render_template('show_lines.html',
-                           lines=lines)
+                           lines=lines,
+                           error=None if lines else error)
 
 
 @routes.route('/operator/<operator_id>/line/<line_id>', methods=["GET"])
@@ -76,50 +100,69 @@ def render_stops(operator_id, line_id):
     line_check = check_valid_line(operator_id, line_id)
     if line_check is not None:
         return line_check
-    current_time = dt.datetime.now(dt.timezone.utc)
+    current_time = dt.datetime.now(dt.UTC)
     transit_api_key, siri_base_url = tndc.read_key_api_file()
-    if tndc.refresh_needed(db, operator_id, 'stops_updated', STOPS_REFRESH_LIMIT, current_time):
-        stops_dict = tndc.get_stops_dict(transit_api_key, siri_base_url, operator_id)
-        tndc.save_stops(db, operator_id, stops_dict, current_time)
-    if tndc.refresh_needed(db, operator_id, 'patterns_updated', PATTERN_REFRESH_LIMIT, current_time):
-        pattern_dict = tndc.get_pattern_dict(transit_api_key, siri_base_url, operator_id, line_id)
-        tndc.save_patterns(db, operator_id, line_id, pattern_dict)
-
-    operator_val = db.session.execute(db.select(Operator)).first()
-    line_val = db.session.execute(db.select(Line).filter(
+    rate_limited = False
+    try:
+        if tndc.refresh_needed(read_db, operator_id, 'stops_updated', STOPS_REFRESH_LIMIT, current_time):
+            stops_dict = tndc.get_stops_dict(transit_api_key, siri_base_url, operator_id,
+                                             cache=response_cache.current_cache())
+            tndc.save_stops(db, operator_id, stops_dict, current_time)
+        if tndc.line_patterns_refresh_needed(read_db, operator_id, line_id, PATTERN_REFRESH_LIMIT, current_time):
+            pattern_dict = tndc.get_pattern_dict(transit_api_key, siri_base_url, operator_id, line_id,
+                                                 cache=response_cache.current_cache())
+            tndc.save_patterns(db, operator_id, line_id, pattern_dict, current_time)
+    except rate_limit.RateLimitExceeded:
+        # show the stored stops until the request budget allows a refresh
+        current_app.logger.warning("Request budget exhausted, showing stored stops for %s line %s",
+                                   operator_id, line_id)
+        rate_limited = True
+
+    operator_val = read_db.session.execute(db.select(Operator)).first()
+    line_val = read_db.session.execute(db.select(Line).filter(
         db.and_(Line.operator_id == operator_id, Line.line_id == line_id))).scalar()
 
     direction_0_id = line_val.direction_0_id
-    direction_0_pattern = db.session.execute(db.select(Pattern).filter(
+    direction_0_pattern = read_db.session.execute(db.select(Pattern).filter(
         db.and_(Pattern.operator_id == operator_id,
                 Pattern.line_id == line_id,
                 Pattern.pattern_direction == direction_0_id)).order_by(Pattern.pattern_trip_count.desc())).scalar()
-    direction_0_stops = db.session.execute(
+    if rate_limited and direction_0_pattern is None:
+        flash(RATE_LIMIT_ERROR, 'error')
+        return redirect(url_for('routes.render_lines', operator_id=operator_id))
+    direction_0_stops = read_db.session.execute(
         db.select(Stop, StopPattern).join(StopPattern, Stop.stop_id == StopPattern.stop_id
                                           ).filter(StopPattern.pattern_id == direction_0_pattern.pattern_id
                                                    ).order_by(StopPattern.stop_order.asc())).scalars().all()
+    if rate_limited and not direction_0_stops:
+        flash(RATE_LIMIT_ERROR, 'error')
+        return redirect(url_for('routes.render_lines', operator_id=operator_id))
     direction_0_beg_stop_id = direction_0_stops[0].stop_id
     direction_0_end_stop_id = direction_0_stops[-1].stop_id
 
-    direction_0_beg_stop_json = tndc.get_stop_timetable_dict(transit_api_key,siri_base_url,operator_id,
-                                                             direction_0_beg_stop_id)
-    direction_0_end_stop_json = tndc.get_stop_timetable_dict(transit_api_key, siri_base_url, operator_id,
-                                                             direction_0_end_stop_id)
-
-
-    tndc.save_stop_timetable(db, operator_id, direction_0_beg_stop_id, direction_0_beg_stop_json)
-    tndc.save_stop_timetable(db, operator_id, direction_0_end_stop_id, direction_0_end_stop_json)
-
-    direction_0_vehicle_ref = tndc.determine_vehicle_ref_full_journey(db,
-                                                                      operator_id,
-                                                                      direction_0_beg_stop_id,
-                                                                      direction_0_end_stop_id)
+    direction_0_vehicle_ref = None
+    try:
+        for stop_id in (direction_0_beg_stop_id, direction_0_end_stop_id):
+            if tndc.stop_timetable_refresh_needed(read_db, operator_id, stop_id, STOP_TIMETABLE_REFRESH_LIMIT,
+                                                  current_time):
+                stop_timetable_json = tndc.get_stop_timetable_dict(transit_api_key, siri_base_url, operator_id,
+                                                                   stop_id)
+                tndc.save_stop_timetable(db, operator_id, stop_id, stop_timetable_json, current_time)
+
+        direction_0_vehicle_ref = tndc.determine_vehicle_ref_full_journey(read_db,
+                                                                          operator_id,
+                                                                          direction_0_beg_stop_id,
+                                                                          direction_0_end_stop_id)
+    except rate_limit.RateLimitExceeded:
+        # the timetables are not shown yet, the page is rendered without them
+        current_app.logger.warning("Request budget exhausted, skipping the timetables of %s line %s",
+                                   operator_id, line_id)
 
     # TODO
     #shape_dict = tndc.get_shapes_dict(transit_api_key, siri_base_url, operator_id, direction_0_vehicle_ref)
     #tndc.save_shapes(db, operator_id, line_id, shape_dict, current_time)
 
-    #shape_coordinates = db.session.execute(db.select(Shape).filter(
+    #shape_coordinates = read_db.session.execute(db.select(Shape).filter(
     #    db.and_(Shape.operator_id == operator_id, Shape.line_id == line_id))).scalars().all()
 
     # Need to handle case where transit agency does not return a shape
@@ -138,11 +181,14 @@ def render_stops(operator_id, line_id):
                                operator=operator_val,
                                line=line_val)
 
-    direction_1_pattern = db.session.execute(db.select(Pattern).filter(
+    direction_1_pattern = read_db.session.execute(db.select(Pattern).filter(
         db.and_(Pattern.operator_id == operator_id,
                 Pattern.line_id == line_id,
                 Pattern.pattern_direction == direction_1_id)).order_by(Pattern.pattern_trip_count.desc())).scalar()
-    direction_1_stops = db.session.execute(
+    if rate_limited and direction_1_pattern is None:
+        flash(RATE_LIMIT_ERROR, 'error')
+        return redirect(url_for('routes.render_lines', operator_id=operator_id))
+    direction_1_stops = read_db.session.execute(
         db.select(Stop, StopPattern).join(StopPattern, Stop.stop_id == StopPattern.stop_id
                                           ).filter(StopPattern.pattern_id == direction_1_pattern.pattern_id
                                                    ).order_by(StopPattern.stop_order.asc())).scalars().all()
@@ -163,38 +209,101 @@ def render_eta(operator_id, stop_id):
     stop_check = check_valid_stop(operator_id, stop_id)
     if stop_check is not None:
         return stop_check
-    current_time = dt.datetime.now(dt.timezone.utc)
-    transit_api_key, siri_base_url = tndc.read_key_api_file()
-    if tndc.refresh_needed(db, operator_id, 'stop_monitoring_updated', STOP_MONITORING_REFRESH_LIMIT, current_time):
-        stop_monitoring_dict = tndc.get_stop_monitoring_dict(transit_api_key, siri_base_url, operator_id)
-        tndc.save_stop_monitoring(db, operator_id, stop_monitoring_dict, current_time)
+    current_time = dt.datetime.now(dt.UTC)
+    refresh_stop_monitoring(operator_id, [stop_id], current_time)
 
-    upcoming_dict = tndc.sort_response_dict(tndc.upcoming_vehicles(db, operator_id, stop_id, current_time))
+    upcoming_dict = tndc.sort_response_dict(tndc.upcoming_vehicles(read_db, operator_id, stop_id, current_time))
     return render_template('show_etas.html', eta_dict=upcoming_dict)
 
 
+@routes.route('/operator/<operator_id>/station/<stop_id>', methods=["GET"])
+def render_station(operator_id, stop_id):
+    operator_check = check_valid_operator(operator_id)
+    if operator_check is not None:
+        return operator_check
+    stop_check = check_valid_stop(operator_id, stop_id)
+    if stop_check is not None:
+        return stop_check
+    return render_board(operator_id, tndc.station_stop_ids(read_db, operator_id, stop_id)[:MAX_BOARD_STOPS])
+
+
+@routes.route('/operator/<operator_id>/board', methods=["GET"])
+def render_stop_board(operator_id):
+    operator_check = check_valid_operator(operator_id)
+    if operator_check is not None:
+        return operator_check
+    # stops are given as repeated or comma separated stop arguments
+    stop_ids = list(dict.fromkeys(stop_id.strip() for stop_ids in request.args.getlist('stop')
+                                  for stop_id in stop_ids.split(',') if stop_id.strip()))
+    return render_board(operator_id, stop_ids[:MAX_BOARD_STOPS])
+
+
+def render_board(operator_id, stop_ids):
+    stops = read_db.session.execute(db.select(Stop).filter(
+        Stop.operator_id == operator_id, Stop.stop_id.in_(stop_ids)).order_by(Stop.stop_id)).scalars().all()
+    if not stops:
+        error = 'Operator {0} with stops {1} is not in database.'.format(operator_id, ', '.join(stop_ids))
+        lines = read_db.session.execute(
+            db.select(Line).filter(Line.operator_id == operator_id).order_by(Line.sort_index.asc())).scalars().all()
+        return render_template('show_lines.html',
+                               lines=lines,
+                               error=error)
+    current_time = dt.datetime.now(dt.UTC)
+    refresh_stop_monitoring(operator_id, [stop.stop_id for stop in stops], current_time)
+
+    upcoming = tndc.upcoming_vehicles_for_stops(read_db, operator_id, [stop.stop_id for stop in stops], current_time)
+    board = [(stop, tndc.sort_response_dict(upcoming.get(stop.stop_id, {}))) for stop in stops]
+    return render_template('show_board.html', board=board)
+
+
+def refresh_stop_monitoring(operator_id, stop_ids, current_time):
+    transit_api_key, siri_base_url = tndc.read_key_api_file()
+    tracker = demand.current_tracker()
+    for stop_id in stop_ids:
+        tracker.record_view(operator_id, stop_id, current_time)
+    # poll just after the learned update of the feed when the budget allows it, the fixed refresh limit is used until
+    # the update interval is learned
+    spare_requests = demand.spare_requests(transit_api_key)
+    refresh_due = cadence.current_cadence().refresh_due(operator_id, 'stop_monitoring', current_time,
+                                                        STOP_MONITORING_REFRESH_LIMIT,
+                                                        spare_budget=spare_requests is None or spare_requests > 0)
+    if refresh_due is None:
+        refresh_due = tndc.refresh_needed(read_db, operator_id, 'stop_monitoring_updated',
+                                          STOP_MONITORING_REFRESH_LIMIT, current_time)
+    # one refresh covers every viewed stop, the hot stops of the tracker include the stops of the page
+    if refresh_due and not all(tracker.stop_refreshed_within(operator_id, stop_id, STOP_MONITORING_REFRESH_LIMIT,
+                                                             current_time) for stop_id in stop_ids):
+        try:
+            demand.refresh_stop_monitoring(db, tracker, transit_api_key, siri_base_url, operator_id, current_time,
+                                           archive=current_app.config["ARCHIVE_ONWARD_CALLS"])
+        except rate_limit.RateLimitExceeded:
+            # show the stored predictions until the request budget allows a refresh
+            current_app.logger.warning("Request budget exhausted, showing stored predictions for %s", operator_id)
+
+
 def check_valid_operator(operator_id: str):
-    operator_val = db.session.execute(db.select(Operator)).scalars()
+    operator_val = read_db.session.execute(db.select(Operator)).scalars()
     if operator_val is None:
         error = 'Please use links instead of directly typing web address.'
         flash(error, 'error')
         return redirect(url_for('routes.show_operators'))
-    operator_val = db.session.execute(db.select(Operator).filter(Operator.operator_id == operator_id)).scalar_one_or_none()
+    operator_val = read_db.session.execute(
+        db.select(Operator).filter(Operator.operator_id == operator_id)).scalar_one_or_none()
     if operator_val is None:
-        error = ('Operator {0} is not in database or database not initialized. Check to see if monitored '
-                 'or valid operator id is below.').format(operator_id)
+        error = (f'Operator {operator_id} is not in database or database not initialized. Check to see if monitored '
+                 'or valid operator id is below.')
         flash(error, 'error')
         return redirect(url_for('routes.show_operators'))
     return None
 
 
 def check_valid_line(operator_id, line_id):
-    line_val = db.session.execute(
+    line_val = read_db.session.execute(
         db.select(Line).filter(Line.operator_id == operator_id and Line.line_id == line_id).order_by(
             Line.sort_index.asc())).scalar()
     if line_val is None:
-        error = 'Operator {0} with line {1} is not in database.'.format(operator_id, line_id)
-        lines = db.session.execute(
+        error = f'Operator {operator_id} with line {line_id} is not in database.'
+        lines = read_db.session.execute(
             db.select(Line).filter(Line.operator_id == operator_id).order_by(Line.sort_index.asc())).scalars().all()
         return render_template('show_lines.html',
                                lines=lines,
@@ -203,11 +312,11 @@ def check_valid_line(operator_id, line_id):
 
 
 def check_valid_stop(operator_id, stop_id):
-    stop_val = db.session.execute(
+    stop_val = read_db.session.execute(
         db.select(Stop).filter(Stop.operator_id == operator_id and Stop.stop_id == stop_id)).scalar()
     if stop_val is None:
-        error = 'Operator {0} with stop {1} is not in database.'.format(operator_id, stop_id)
-        lines = db.session.execute(
+        error = f'Operator {operator_id} with stop {stop_id} is not in database.'
+        lines = read_db.session.execute(
             db.select(Line).filter(Line.operator_id == operator_id).order_by(Line.sort_index.asc())).scalars().all()
         return render_template('show_lines.html',
                                lines=lines,
@@ -0,0 +1,167 @@
+"""Schema versioning so the database can be kept across restarts."""
+import logging
+import typing
+
+import flask_sqlalchemy
+import sqlalchemy
+
+from transit_notification.models import RETENTION_INDEXES, Line, Parameter
+
+logger = logging.getLogger(__name__)
+
+# increase when a model changes and add a migration from the previous version to MIGRATIONS
+SCHEMA_VERSION = 3
+SCHEMA_VERSION_PARAMETER = "schema_version"
+
+
+def add_retention_indexes(siri_db: flask_sqlalchemy.SQLAlchemy) -> None:
+    """
+    Version 2 adds the indexes used by the retention eviction.
+
+    :param siri_db: database
+    :type siri_db: flask_sqlalchemy.SQLAlchemy
+
+    :return: None
+    :rtype: None
+    """
+    for index in RETENTION_INDEXES:
+        index.create(siri_db.engine, checkfirst=True)
+
+
+def add_line_patterns_updated(siri_db: flask_sqlalchemy.SQLAlchemy) -> None:
+    """
+    Version 3 adds the time the patterns of each line were saved.
+
+    :param siri_db: database
+    :type siri_db: flask_sqlalchemy.SQLAlchemy
+
+    :return: None
+    :rtype: None
+    """
+    column = Line.__table__.c.patterns_updated
+    existing = {existing['name'] for existing in sqlalchemy.inspect(siri_db.engine).get_columns(Line.__tablename__)}
+    if column.name in existing:
+        return
+    column_type = column.type.compile(dialect=siri_db.engine.dialect)
+    with siri_db.engine.begin() as connection:
+        connection.execute(sqlalchemy.text(f"ALTER TABLE {Line.__tablename__} ADD COLUMN {column.name} {column_type}"))
+
+
+# migrations keyed by the version they upgrade from, each one upgrades the schema by one version
+MIGRATIONS: dict[int, typing.Callable[[flask_sqlalchemy.SQLAlchemy], None]] = {
+    1: add_retention_indexes,
+    2: add_line_patterns_updated,
+}
+
+
+def stored_schema_version(siri_db: flask_sqlalchemy.SQLAlchemy) -> int | None:
+    """
+    Reads the schema version stamped in the parameter table.
+
+    :param siri_db: database
+    :type siri_db: flask_sqlalchemy.SQLAlchemy
+
+    :return: stored schema version, None if the database has no version
+    :rtype: int, optional
+    """
+    if not sqlalchemy.inspect(siri_db.engine).has_table(Parameter.__tablename__):
+        return None
+    version = siri_db.session.execute(siri_db.select(Parameter.value).filter_by(
+        name=SCHEMA_VERSION_PARAMETER)).scalar_one_or_none()
+    return None if version is None else int(version)
+
+
+def stamp_schema_version(siri_db: flask_sqlalchemy.SQLAlchemy, version: int | None = None) -> None:
+    """
+    Stores the schema version in the parameter table.
+
+    :param siri_db: database
+    :type siri_db: flask_sqlalchemy.SQLAlchemy
+
+    :param version: schema version, defaults to the current version
+    :type version: int, optional
+
+    :return: None
+    :rtype: None
+    """
+    if version is None:
+        version = SCHEMA_VERSION
+    siri_db.session.merge(Parameter(SCHEMA_VERSION_PARAMETER, str(version)))
+    siri_db.session.commit()
+
+
+def rebuild_database(siri_db: flask_sqlalchemy.SQLAlchemy) -> None:
+    """
+    Drops and recreates every table and stamps the current schema version.
+
+    :param siri_db: database
+    :type siri_db: flask_sqlalchemy.SQLAlchemy
+
+    :return: None
+    :rtype: None
+    """
+    siri_db.session.remove()
+    # the models live in the default bind, the read bind points at the same tables
+    siri_db.drop_all(bind_key=None)
+    siri_db.create_all(bind_key=None)
+    stamp_schema_version(siri_db)
+
+
+def migration_path(stored_version: int) -> list[typing.Callable] | None:
+    """
+    Finds the migrations that upgrade a schema to the current version.
+
+    :param stored_version: version of the existing schema
+    :type stored_version: int
+
+    :return: migrations to apply in order, None if the version cannot be upgraded
+    :rtype: list[typing.Callable], optional
+    """
+    if stored_version > SCHEMA_VERSION:
+        return None
+    path = []
+    for version in range(stored_version, SCHEMA_VERSION):
+        if version not in MIGRATIONS:
+            return None
+        path.append(MIGRATIONS[version])
+    return path
+
+
+def prepare_database(siri_db: flask_sqlalchemy.SQLAlchemy, reset: bool = False) -> str:
+    """
+    Gets the database ready to serve. With reset the tables are rebuilt. Otherwise the existing data is kept when the
+    schema is current, the schema is migrated when a migration exists and the tables are rebuilt as a last resort.
+
+    :param siri_db: database
+    :type siri_db: flask_sqlalchemy.SQLAlchemy
+
+    :param reset: drop and recreate the tables regardless of the schema version
+    :type reset: bool
+
+    :return: action taken: created, current, migrated or rebuilt
+    :rtype: str
+    """
+    if reset:
+        rebuild_database(siri_db)
+        action = "rebuilt"
+    elif not sqlalchemy.inspect(siri_db.engine).get_table_names():
+        siri_db.create_all(bind_key=None)
+        stamp_schema_version(siri_db)
+        action = "created"
+    else:
+        stored_version = stored_schema_version(siri_db)
+        migrations = None if stored_version is None else migration_path(stored_version)
+        if migrations is None:
+            logger.warning("Rebuilding the database, schema version %s cannot be upgraded to %s",
+                           stored_version, SCHEMA_VERSION)
+            rebuild_database(siri_db)
+            action = "rebuilt"
+        else:
+            for migration in migrations:
+                migration(siri_db)
+            # create tables added since the stored version
+            siri_db.create_all(bind_key=None)
+            stamp_schema_version(siri_db)
+            action = "migrated" if migrations else "current"
+    logger.info("Database schema version %s: %s", SCHEMA_VERSION, action)
+    return action
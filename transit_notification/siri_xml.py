@@ -0,0 +1,290 @@
+"""
+Ingests SIRI responses served as XML. The document is walked with iterparse and each VehicleActivity,
+MonitoredStopVisit or TimetabledStopVisit element is converted to the dictionary layout of the JSON response, parsed
+by the same functions as the JSON response and removed from the tree, so the memory used is bounded by the largest
+element instead of the document.
+"""
+import datetime as dt
+import io
+import typing
+import xml.etree.ElementTree as ElementTree
+
+import click
+import flask_sqlalchemy
+from flask.cli import with_appcontext
+
+from transit_notification import cadence, metrics, retention
+from transit_notification.db_commands import (
+    archive_onward_calls,
+    parse_stop_monitoring_dict,
+    parse_timetabled_stop_visit,
+    parse_vehicle_dict,
+    recorded_time,
+    write_monitoring,
+    write_stop_timetable,
+)
+from transit_notification.records import OnwardCallRecord, StopTimetableRecord, VehicleRecord
+from transit_notification.symbols import symbol_table
+
+VEHICLE_MONITORING = 'vehicle_monitoring'
+STOP_MONITORING = 'stop_monitoring'
+STOP_TIMETABLE = 'stop_timetable'
+# element of each record of a feed
+RECORD_TAGS = {VEHICLE_MONITORING: 'VehicleActivity',
+               STOP_MONITORING: 'MonitoredStopVisit',
+               STOP_TIMETABLE: 'TimetabledStopVisit'}
+# elements that are lists in the JSON response, even when the XML response has only one of them
+LIST_TAGS = {'OnwardCall'}
+# elements that only hold other elements, dropped when empty
+CONTAINER_TAGS = {'OnwardCalls'}
+XSI_NIL = '{http://www.w3.org/2001/XMLSchema-instance}nil'
+XmlSource = str | bytes | typing.BinaryIO
+
+
+class SiriElement(dict):
+    """Dictionary of an XML element. Elements missing from the response read as None, like a null in the JSON."""
+
+    def __missing__(self, key):
+        return None
+
+
+def local_name(tag: str) -> str:
+    """Removes the namespace of an element tag."""
+    return tag.rpartition('}')[2]
+
+
+def element_dict(element: ElementTree.Element) -> SiriElement | str | None:
+    """
+    Converts an element to the layout of the JSON response. Leaf elements become their text, empty leaf elements an
+    empty string and nil elements None.
+
+    :param element: element to convert
+    :type element: ElementTree.Element
+
+    :return: dictionary of the child elements or the text of a leaf element
+    :rtype: SiriElement or str or None
+    """
+    if len(element) == 0:
+        if element.get(XSI_NIL) == 'true':
+            return None
+        return element.text or ''
+    result = SiriElement()
+    for child in element:
+        tag = local_name(child.tag)
+        if tag in CONTAINER_TAGS and len(child) == 0:
+            continue
+        if tag in LIST_TAGS:
+            result.setdefault(tag, []).append(element_dict(child))
+        else:
+            result[tag] = element_dict(child)
+    return result
+
+
+def iter_records(source: XmlSource, record_tag: str,
+                 header: dict | None = None) -> typing.Iterator[SiriElement]:
+    """
+    Yields the record elements of a SIRI XML response as dictionaries. Each record is removed from the tree once it is
+    converted.
+
+    :param source: path, content or binary file of the response
+    :type source: str or bytes or typing.BinaryIO
+
+    :param record_tag: local name of the record elements
+    :type record_tag: str
+
+    :param header: if given, filled with the leaf elements of ServiceDelivery such as ResponseTimestamp and with the
+        latest RecordedAtTime of the records
+    :type header: dict, optional
+
+    :return: iterator over the records
+    :rtype: typing.Iterator[SiriElement]
+    """
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    open_elements = []
+    for event, element in ElementTree.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            open_elements.append(element)
+            continue
+        open_elements.pop()
+        tag = local_name(element.tag)
+        if tag == record_tag:
+            record = element_dict(element)
+            recorded_at = record['RecordedAtTime']
+            if header is not None and recorded_at and recorded_at > header.get('RecordedAtTime', ''):
+                header['RecordedAtTime'] = recorded_at
+            yield record
+            if open_elements:
+                open_elements[-1].remove(element)
+        elif (header is not None and open_elements and len(element) == 0 and
+              local_name(open_elements[-1].tag) == 'ServiceDelivery'):
+            header[tag] = element.text
+
+
+def parse_vehicle_monitoring_xml(operator_id: str, source: XmlSource, header: dict | None = None) -> (
+        list[VehicleRecord], list[OnwardCallRecord]):
+    """
+    Parses a vehicle monitoring XML response into the vehicles and onward calls to be stored, see
+    parse_vehicle_monitoring.
+
+    :param operator_id: operator id
+    :type operator_id: str
+
+    :param source: path, content or binary file of the response
+    :type source: str or bytes or typing.BinaryIO
+
+    :param header: if given, filled with the leaf elements of ServiceDelivery
+    :type header: dict, optional
+
+    :return: vehicles and onward calls
+    :rtype: (list[VehicleRecord], list[OnwardCallRecord])
+    """
+    symbols = symbol_table(operator_id)
+    vehicles_to_add = []
+    onward_calls_to_add = []
+    for vehicle_dict in iter_records(source, RECORD_TAGS[VEHICLE_MONITORING], header):
+        vehicle, onward_calls = parse_vehicle_dict(operator_id, vehicle_dict, symbols)
+        if not vehicle.contains_none():
+            vehicles_to_add.append(vehicle)
+        onward_calls_to_add.extend(onward_calls)
+    return vehicles_to_add, onward_calls_to_add
+
+
+def parse_stop_monitoring_xml(operator_id: str, source: XmlSource, header: dict | None = None) -> (
+        list[VehicleRecord], list[OnwardCallRecord]):
+    """
+    Parses a stop monitoring XML response into the vehicles and onward calls to be stored, see parse_stop_monitoring.
+
+    :param operator_id: operator id
+    :type operator_id: str
+
+    :param source: path, content or binary file of the response
+    :type source: str or bytes or typing.BinaryIO
+
+    :param header: if given, filled with the leaf elements of ServiceDelivery
+    :type header: dict, optional
+
+    :return: vehicles and onward calls
+    :rtype: (list[VehicleRecord], list[OnwardCallRecord])
+    """
+    symbols = symbol_table(operator_id)
+    vehicles_to_add = []
+    vehicle_tracker = set()
+    onward_calls_to_add = []
+    for monitored_stop_visit in iter_records(source, RECORD_TAGS[STOP_MONITORING], header):
+        vehicle, onward_call = parse_stop_monitoring_dict(operator_id, monitored_stop_visit, symbols)
+        vehicle_tuple = (vehicle.vehicle_journey_ref, vehicle.dataframe_ref_date)
+        if not vehicle.contains_none() and vehicle_tuple not in vehicle_tracker:
+            vehicles_to_add.append(vehicle)
+            vehicle_tracker.add(vehicle_tuple)
+        onward_calls_to_add.append(onward_call)
+    return vehicles_to_add, onward_calls_to_add
+
+
+def parse_stop_timetable_xml(operator_id: str, source: XmlSource) -> list[StopTimetableRecord]:
+    """
+    Parses a stop timetable XML response, see parse_stop_timetable.
+
+    :param operator_id: operator id
+    :type operator_id: str
+
+    :param source: path, content or binary file of the response
+    :type source: str or bytes or typing.BinaryIO
+
+    :return: timetabled visits of the stop
+    :rtype: list[StopTimetableRecord]
+    """
+    return [parse_timetabled_stop_visit(operator_id, timetable)
+            for timetable in iter_records(source, RECORD_TAGS[STOP_TIMETABLE])]
+
+
+def save_monitoring_xml(siri_db: flask_sqlalchemy.SQLAlchemy, operator_id: str, feed: str, source: XmlSource,
+                        current_time: dt.datetime, archive: bool = False) -> bool:
+    """
+    Stores the vehicles and onward calls of a vehicle or stop monitoring XML response, like save_vehicle_monitoring
+    and save_stop_monitoring.
+
+    :param siri_db: database
+    :type siri_db: flask_sqlalchemy.SQLAlchemy
+
+    :param operator_id: operator id
+    :type operator_id: str
+
+    :param feed: vehicle_monitoring or stop_monitoring
+    :type feed: str
+
+    :param source: path, content or binary file of the response
+    :type source: str or bytes or typing.BinaryIO
+
+    :param current_time: current utc time
+    :type current_time: dt.datetime
+
+    :param archive: if True, copy the onward calls into the onward call archive
+    :type archive: bool
+
+    :return: True if the rows were written, False if they matched the stored rows
+    :rtype: bool
+    """
+    parse = {VEHICLE_MONITORING: parse_vehicle_monitoring_xml, STOP_MONITORING: parse_stop_monitoring_xml}[feed]
+    header = {}
+    with metrics.PARSE_SECONDS.time(f'{feed}_xml'):
+        vehicles_to_add, onward_calls_to_add = parse(operator_id, source, header)
+    with metrics.WRITE_SECONDS.time(f'save_{feed}'):
+        changed = write_monitoring(siri_db, operator_id, vehicles_to_add, onward_calls_to_add, f'{feed}_updated',
+                                   current_time)
+    cadence.observe(operator_id, feed, recorded_time([header]), current_time)
+
+    if archive:
+        archive_onward_calls(siri_db, operator_id, current_time)
+    retention.step(siri_db, current_time)
+    return changed
+
+
+def save_stop_timetable_xml(siri_db: flask_sqlalchemy.SQLAlchemy, operator_id: str, stop_id: str,
+                            source: XmlSource) -> None:
+    """
+    Stores the timetable of a stop from a stop timetable XML response, like save_stop_timetable.
+
+    :param siri_db: database
+    :type siri_db: flask_sqlalchemy.SQLAlchemy
+
+    :param operator_id: operator id
+    :type operator_id: str
+
+    :param stop_id: stop id
+    :type stop_id: str
+
+    :param source: path, content or binary file of the response
+    :type source: str or bytes or typing.BinaryIO
+
+    :return: None
+    :rtype: None
+    """
+    with metrics.PARSE_SECONDS.time(f'{STOP_TIMETABLE}_xml'):
+        stop_timetable_list = parse_stop_timetable_xml(operator_id, source)
+    with metrics.WRITE_SECONDS.time('save_stop_timetable'):
+        write_stop_timetable(siri_db, operator_id, stop_id, stop_timetable_list)
+    return None
+
+
+@click.command("ingest-siri-xml")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--operator", "operator_id", required=True, help="Operator id the rows are stored under.")
+@click.option("--feed", type=click.Choice(list(RECORD_TAGS)), required=True, help="Feed of the response.")
+@click.option("--stop", "stop_id", default=None, help="Stop of a stop timetable response.")
+@click.option("--archive", is_flag=True, help="Copy the onward calls into the onward call archive.")
+@with_appcontext
+def ingest_siri_xml_command(path, operator_id, feed, stop_id, archive):
+    """Store a SIRI vehicle monitoring, stop monitoring or stop timetable response saved as XML."""
+    from transit_notification import db
+
+    try:
+        if feed == STOP_TIMETABLE:
+            if stop_id is None:
+                raise click.UsageError("--stop is required for a stop timetable")
+            save_stop_timetable_xml(db, operator_id, stop_id, path)
+        else:
+            save_monitoring_xml(db, operator_id, feed, path, dt.datetime.now(dt.UTC), archive)
+    except ElementTree.ParseError as exc:
+        raise click.ClickException(f"{path} is not a SIRI XML response: {exc}") from exc
+    click.echo(f"Ingested {path} as {operator_id}")
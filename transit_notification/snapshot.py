@@ -0,0 +1,212 @@
+"""
+Snapshots of the static tables. A snapshot is a gzip compressed stream of msgpack objects: a header, then for each
+table its columns and its rows in chunks. Importing a snapshot bulk loads the rows, so a fresh database is ready without
+requesting and parsing the SIRI responses again.
+"""
+import datetime as dt
+import gzip
+import typing
+
+import click
+import flask_sqlalchemy
+import sqlalchemy
+from flask.cli import with_appcontext
+
+from transit_notification import content_hash, schema
+from transit_notification.models import Line, Operator, Parameter, Pattern, Shape, Stop, StopPattern
+
+FORMAT = "transit_notification.snapshot"
+# increase when the layout of the file changes, the columns of the tables are stored in the file
+SNAPSHOT_VERSION = 1
+# rows per msgpack object, bounds the memory used while writing and reading a table
+CHUNK_ROWS = 10000
+# in insert order, the snapshot is imported in this order and deleted in reverse
+TABLES = (Operator, Line, Stop, Pattern, StopPattern, Shape)
+# realtime columns of the static tables, not meaningful without the realtime rows
+REALTIME_COLUMNS = {'vehicle_monitoring_updated', 'stop_monitoring_updated'}
+OPERATOR_REFRESH_TIME = "operator_refresh_time"
+
+
+class SnapshotError(Exception):
+    """Raised when a file is not a snapshot or was written by a newer version."""
+
+
+def msgpack_module():
+    try:
+        import msgpack
+    except ImportError as exc:
+        raise SnapshotError("Snapshots need msgpack, install transit_notification[snapshot]") from exc
+    return msgpack
+
+
+def encode_value(value):
+    if isinstance(value, (dt.datetime, dt.date)):
+        return value.isoformat()
+    return value
+
+
+def column_decoder(column: sqlalchemy.Column) -> typing.Callable:
+    """Converts the stored value of a column back to the python type of the column."""
+    if isinstance(column.type, sqlalchemy.DateTime):
+        return lambda value: None if value is None else dt.datetime.fromisoformat(value)
+    if isinstance(column.type, sqlalchemy.Date):
+        return lambda value: None if value is None else dt.date.fromisoformat(value)
+    return lambda value: value
+
+
+def export_snapshot(siri_db: flask_sqlalchemy.SQLAlchemy, path: str,
+                    operator_ids: typing.Sequence[str] | None = None) -> dict[str, int]:
+    """
+    Writes the static tables to a snapshot file.
+
+    :param siri_db: database
+    :type siri_db: flask_sqlalchemy.SQLAlchemy
+
+    :param path: path of the snapshot file
+    :type path: str
+
+    :param operator_ids: operators to export, None exports every operator
+    :type operator_ids: typing.Sequence[str], optional
+
+    :return: number of exported rows per table
+    :rtype: dict[str, int]
+    """
+    msgpack = msgpack_module()
+    packer = msgpack.Packer()
+    if operator_ids is None:
+        operator_ids = siri_db.session.execute(siri_db.select(Operator.operator_id)).scalars().all()
+    operator_ids = sorted(operator_ids)
+    refresh_time = siri_db.session.get(Parameter, OPERATOR_REFRESH_TIME)
+    counts = {}
+    with gzip.open(path, 'wb') as f:
+        f.write(packer.pack({'format': FORMAT,
+                             'version': SNAPSHOT_VERSION,
+                             'schema_version': schema.SCHEMA_VERSION,
+                             'created': dt.datetime.now(dt.UTC).isoformat(),
+                             'operators': operator_ids,
+                             'operator_refresh_time': None if refresh_time is None else refresh_time.value,
+                             'tables': [model.__tablename__ for model in TABLES]}))
+        for model in TABLES:
+            table = model.__table__
+            columns = [column for column in table.columns if column.name not in REALTIME_COLUMNS]
+            count = siri_db.session.execute(siri_db.select(siri_db.func.count()).select_from(table).where(
+                table.c.operator_id.in_(operator_ids))).scalar()
+            f.write(packer.pack({'table': table.name, 'columns': [column.name for column in columns],
+                                 'rows': count}))
+            result = siri_db.session.execute(siri_db.select(*columns).where(
+                table.c.operator_id.in_(operator_ids)).order_by(*table.primary_key.columns).execution_options(
+                yield_per=CHUNK_ROWS))
+            for partition in result.partitions(CHUNK_ROWS):
+                f.write(packer.pack([[encode_value(value) for value in row] for row in partition]))
+            counts[table.name] = count
+    return counts
+
+
+def read_objects(path: str) -> typing.Iterator:
+    msgpack = msgpack_module()
+    with gzip.open(path, 'rb') as f:
+        yield from msgpack.Unpacker(f, raw=False)
+
+
+def import_snapshot(siri_db: flask_sqlalchemy.SQLAlchemy, path: str) -> dict[str, int]:
+    """
+    Replaces the static rows of the operators in a snapshot with the rows of the snapshot, in one transaction. The
+    rows of other operators are kept. Columns missing from the snapshot are left empty and columns that no longer
+    exist are dropped, so a snapshot of an older schema can be imported.
+
+    :param siri_db: database
+    :type siri_db: flask_sqlalchemy.SQLAlchemy
+
+    :param path: path of the snapshot file
+    :type path: str
+
+    :return: number of imported rows per table
+    :rtype: dict[str, int]
+
+    :raises SnapshotError: if the file is not a snapshot or was written by a newer version
+    """
+    objects = read_objects(path)
+    try:
+        header = next(objects, None)
+    except (OSError, ValueError) as exc:
+        raise SnapshotError(f"{path} is not a snapshot") from exc
+    if not isinstance(header, dict) or header.get('format') != FORMAT:
+        raise SnapshotError(f"{path} is not a snapshot")
+    if header['version'] > SNAPSHOT_VERSION:
+        raise SnapshotError(f"{path} is snapshot version {header['version']}, "
+                            f"this version reads up to {SNAPSHOT_VERSION}")
+    models = {model.__tablename__: model for model in TABLES}
+    operator_ids = header['operators']
+    counts = {}
+    try:
+        for model in reversed(TABLES):
+            siri_db.session.execute(siri_db.delete(model).where(model.operator_id.in_(operator_ids)))
+        for _ in header['tables']:
+            table_header = next(objects)
+            model = models.get(table_header['table'])
+            table_columns = {} if model is None else model.__table__.columns
+            kept = [(index, name, column_decoder(table_columns[name]))
+                    for index, name in enumerate(table_header['columns']) if name in table_columns]
+            read_rows = 0
+            while read_rows < table_header['rows']:
+                chunk = next(objects)
+                read_rows += len(chunk)
+                # tables that no longer exist are skipped
+                if model is not None:
+                    rows = [{name: decode(row[index]) for index, name, decode in kept} for row in chunk]
+                    siri_db.session.execute(siri_db.insert(model), rows)
+            if model is not None:
+                counts[table_header['table']] = read_rows
+        if header.get('operator_refresh_time') is not None:
+            siri_db.session.merge(Parameter(OPERATOR_REFRESH_TIME, header['operator_refresh_time']))
+        # the stored digests describe the replaced rows
+        content_hash.forget_digests(siri_db, 'operators')
+        for operator_id in operator_ids:
+            for dataset in ('lines', 'stops', 'patterns'):
+                content_hash.forget_digests(siri_db, dataset, operator_id)
+        siri_db.session.commit()
+    except BaseException:
+        siri_db.session.rollback()
+        raise
+    return counts
+
+
+@click.group("snapshot")
+def snapshot_command():
+    """Export and import snapshots of the static tables."""
+
+
+@snapshot_command.command("export")
+@click.argument("path", type=click.Path(dir_okay=False))
+@click.option("--operators", default=None, help="Comma separated operator ids. Defaults to every operator.")
+@with_appcontext
+def export_command(path, operators):
+    """Write the operators, lines, stops, patterns and shapes to a snapshot file."""
+    from transit_notification import db
+
+    operator_ids = None
+    if operators:
+        operator_ids = [operator_id.strip() for operator_id in operators.split(',') if operator_id.strip()]
+    try:
+        counts = export_snapshot(db, path, operator_ids)
+    except SnapshotError as exc:
+        raise click.ClickException(str(exc)) from exc
+    for table_name, count in counts.items():
+        click.echo(f"{table_name}: {count} rows")
+    click.echo(f"Wrote {path}")
+
+
+@snapshot_command.command("import")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@with_appcontext
+def import_command(path):
+    """Replace the static rows of the operators in a snapshot file."""
+    from transit_notification import db
+
+    try:
+        counts = import_snapshot(db, path)
+    except SnapshotError as exc:
+        raise click.ClickException(str(exc)) from exc
+    for table_name, count in counts.items():
+        click.echo(f"{table_name}: {count} rows")
+    click.echo(f"Imported {path}")
@@ -0,0 +1,97 @@
+"""SQLite tuning applied to every new connection."""
+import re
+import typing
+
+import sqlalchemy
+
+# WAL lets the pages read while the monitoring tables are rewritten and NORMAL only syncs at checkpoints in WAL mode
+DEFAULT_SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    # negative sizes are in KiB
+    'cache_size': -64 * 1024,
+    'busy_timeout': 5000,
+    'temp_store': 'MEMORY',
+}
+
+# persistent settings of the database file that only the write engine changes
+WRITE_ONLY_PRAGMAS = {'journal_mode'}
+
+PRAGMA_NAME = re.compile(r'^[a-z_]+$')
+PRAGMA_VALUE = re.compile(r'^(-?\d+|[A-Za-z_]+)$')
+
+
+def pragma_statements(pragmas: typing.Mapping[str, str | int]) -> list[str]:
+    """
+    Builds the PRAGMA statements of a tuning profile.
+
+    :param pragmas: pragma values keyed by pragma name
+    :type pragmas: typing.Mapping[str, typing.Union[str, int]]
+
+    :return: PRAGMA statements
+    :rtype: list[str]
+    """
+    statements = []
+    for name, value in pragmas.items():
+        if not PRAGMA_NAME.match(name) or not PRAGMA_VALUE.match(str(value)):
+            raise ValueError(f"Invalid SQLite pragma {name}={value}")
+        statements.append(f"PRAGMA {name}={value}")
+    return statements
+
+
+def register_engine(engine: sqlalchemy.engine.Engine,
+                    pragmas: typing.Mapping[str, str | int] | None,
+                    read_only: bool = False) -> None:
+    """
+    Applies the pragmas to every connection the engine opens. Engines of other databases are left unchanged.
+
+    :param engine: engine to tune
+    :type engine: sqlalchemy.engine.Engine
+
+    :param pragmas: pragma values keyed by pragma name, nothing is applied if empty
+    :type pragmas: typing.Mapping[str, typing.Union[str, int]], optional
+
+    :param read_only: skip the pragmas that change the database file
+    :type read_only: bool
+
+    :return: None
+    :rtype: None
+    """
+    if engine.dialect.name != 'sqlite' or not pragmas:
+        return
+    if read_only:
+        pragmas = {name: value for name, value in pragmas.items() if name not in WRITE_ONLY_PRAGMAS}
+    statements = pragma_statements(pragmas)
+
+    def apply_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for statement in statements:
+                cursor.execute(statement)
+        finally:
+            cursor.close()
+
+    sqlalchemy.event.listen(engine, 'connect', apply_pragmas)
+
+
+def read_pragmas(engine: sqlalchemy.engine.Engine, names: typing.Iterable[str]) -> dict[str, typing.Any]:
+    """
+    Reads the current value of pragmas on a connection of the engine.
+
+    :param engine: engine
+    :type engine: sqlalchemy.engine.Engine
+
+    :param names: pragma names
+    :type names: typing.Iterable[str]
+
+    :return: values keyed by pragma name
+    :rtype: dict[str, typing.Any]
+    """
+    values = {}
+    with engine.connect() as connection:
+        for name in names:
+            if not PRAGMA_NAME.match(name):
+                raise ValueError(f"Invalid SQLite pragma {name}")
+            values[name] = connection.exec_driver_sql(f"PRAGMA {name}").scalar()
+    return values
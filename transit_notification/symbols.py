@@ -0,0 +1,54 @@
+"""Per operator symbol tables that intern the identifiers repeated throughout the SIRI responses."""
+import threading
+
+# a table is replaced before it is handed out once it holds this many symbols, journey refs change every day
+MAX_SYMBOLS = 200000
+
+
+class SymbolTable:
+    """
+    Maps every identifier to a single shared string, so the records of a response do not each keep their own copy of
+    the operator, line, stop and journey ids. The hash of a shared string is computed once, which also speeds up the
+    dictionaries and sets keyed by the identifiers.
+    """
+
+    def __init__(self):
+        self._strings = {}
+
+    def __len__(self) -> int:
+        return len(self._strings)
+
+    def intern(self, value: str | None) -> str | None:
+        """
+        Returns the shared copy of the identifier, None is passed through.
+
+        :param value: identifier
+        :type value: str, optional
+
+        :return: shared copy of the identifier
+        :rtype: str, optional
+        """
+        # setdefault is a single atomic dict operation, None is stored as its own symbol
+        return self._strings.setdefault(value, value)
+
+
+_tables = {}
+_tables_lock = threading.Lock()
+
+
+def symbol_table(operator_id: str) -> SymbolTable:
+    """
+    Returns the symbol table of an operator. Tables that have grown past MAX_SYMBOLS are replaced by an empty table,
+    so the strings of journeys that are no longer in service are eventually released.
+
+    :param operator_id: operator id
+    :type operator_id: str
+
+    :return: symbol table of the operator
+    :rtype: SymbolTable
+    """
+    with _tables_lock:
+        table = _tables.get(operator_id)
+        if table is None or len(table) > MAX_SYMBOLS:
+            table = _tables[operator_id] = SymbolTable()
+        return table
@@ -0,0 +1,320 @@
+"""
+Preloads the static datasets of the monitored operators so the first visitors after a deploy find them stored. Meant
+to run as a deploy hook with ``flask warm-cache``. When the request budget runs out the remaining requests are not
+sent and are reported as deferred, a later run continues with the datasets that are still stale.
+"""
+import datetime as dt
+import functools
+import threading
+import time
+import typing
+
+import click
+import flask_sqlalchemy
+from flask.cli import with_appcontext
+
+from transit_notification import db_commands as tndc
+from transit_notification import rate_limit, routes
+from transit_notification.models import Line, Operator, Pattern, StopPattern
+from transit_notification.response_cache import ResponseCache
+
+
+class StageReport:
+    """Counts of the requests of a warm up stage and its duration."""
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.saved = 0
+        self.failed = 0
+        self.skipped = 0
+        self.deferred = 0
+        self.seconds = 0.0
+
+    def __repr__(self):
+        return (f"{self.stage}: {self.saved} saved, {self.skipped} fresh, {self.failed} failed, "
+                f"{self.deferred} deferred in {self.seconds:.1f}s")
+
+
+def line_endpoint_stops(siri_db: flask_sqlalchemy.SQLAlchemy, operator_id: str,
+                        line_id: str) -> tuple[str, str] | None:
+    """
+    First and last stop of the most travelled pattern in direction 0 of a line, the stops whose timetables the line
+    page loads.
+
+    :param siri_db: database
+    :type siri_db: flask_sqlalchemy.SQLAlchemy
+
+    :param operator_id: operator id
+    :type operator_id: str
+
+    :param line_id: line id
+    :type line_id: str
+
+    :return: first and last stop id, None if the patterns of the line are not stored
+    :rtype: tuple[str, str], optional
+    """
+    pattern_id = siri_db.session.execute(siri_db.select(Pattern.pattern_id).join(
+        Line, siri_db.and_(Line.operator_id == Pattern.operator_id, Line.line_id == Pattern.line_id)).where(
+        Pattern.operator_id == operator_id, Pattern.line_id == line_id,
+        Pattern.pattern_direction == Line.direction_0_id).order_by(Pattern.pattern_trip_count.desc())).scalar()
+    if pattern_id is None:
+        return None
+    stop_ids = siri_db.session.execute(siri_db.select(StopPattern.stop_id).where(
+        StopPattern.operator_id == operator_id, StopPattern.pattern_id == pattern_id).order_by(
+        StopPattern.stop_order.asc())).scalars().all()
+    if not stop_ids:
+        return None
+    return stop_ids[0], stop_ids[-1]
+
+
+def save_responses(siri_db: flask_sqlalchemy.SQLAlchemy, report: StageReport, requests: dict,
+                   save: typing.Callable[[typing.Hashable, dict], None], max_workers: int,
+                   budget_exhausted: threading.Event | None = None) -> None:
+    """
+    Sends the requests of a stage concurrently and saves each response as it arrives. A failed request or save is
+    counted and reported, the other requests continue. Once a request finds the request budget exhausted, the
+    requests that were not sent yet are counted as deferred instead of waiting for the budget.
+
+    :param siri_db: database
+    :type siri_db: flask_sqlalchemy.SQLAlchemy
+
+    :param report: report of the stage
+    :type report: StageReport
+
+    :param requests: functions that send a request, keyed by what they request
+    :type requests: dict
+
+    :param save: saves the response of a key
+    :type save: typing.Callable[[typing.Hashable, dict], None]
+
+    :param max_workers: most requests in flight
+    :type max_workers: int
+
+    :param budget_exhausted: set when the request budget runs out, shared by the stages of a run
+    :type budget_exhausted: threading.Event, optional
+
+    :return: None
+    :rtype: None
+    """
+    if budget_exhausted is None:
+        budget_exhausted = threading.Event()
+
+    def unless_exhausted(request):
+        if budget_exhausted.is_set():
+            raise rate_limit.RateLimitExceeded("Request budget exhausted earlier in the run")
+        return request()
+
+    requests = {key: functools.partial(unless_exhausted, request) for key, request in requests.items()}
+    for key, response, error in tndc.fetch_concurrently(requests, max_workers):
+        if isinstance(error, rate_limit.RateLimitExceeded):
+            budget_exhausted.set()
+            report.deferred += 1
+            continue
+        try:
+            if error is not None:
+                raise error
+            save(key, response)
+        except Exception as exc:
+            siri_db.session.rollback()
+            report.failed += 1
+            click.echo(f"  {report.stage} {key}: {type(exc).__name__}: {exc}", err=True)
+            continue
+        report.saved += 1
+
+
+def warm_cache(siri_db: flask_sqlalchemy.SQLAlchemy,
+               transit_api_key: str,
+               siri_base_url: str,
+               operator_ids: typing.Sequence[str] | None,
+               current_time: dt.datetime,
+               refresh_limit: float | None = None,
+               max_workers: int = tndc.DEFAULT_PREFETCH_WORKERS,
+               cache: ResponseCache | None = None,
+               progress: typing.Callable[[StageReport], None] = lambda report: None) -> list[StageReport]:
+    """
+    Loads the operators, then the lines, stops, patterns and line endpoint timetables of the selected operators.
+    Datasets that are still within their refresh limit are skipped. Requests within a stage run concurrently and
+    take their turn in the request budget of the app, once it is exhausted the remaining requests are deferred.
+
+    :param siri_db: database
+    :type siri_db: flask_sqlalchemy.SQLAlchemy
+
+    :param transit_api_key: api key
+    :type transit_api_key: str
+
+    :param siri_base_url: url for the transit api
+    :type siri_base_url: str
+
+    :param operator_ids: operators to warm up, None for every monitored operator
+    :type operator_ids: typing.Sequence[str], optional
+
+    :param current_time: current utc time
+    :type current_time: dt.datetime
+
+    :param refresh_limit: minutes a dataset stays fresh, None uses the refresh limits of the pages and 0 reloads all
+    :type refresh_limit: float, optional
+
+    :param max_workers: most requests in flight
+    :type max_workers: int
+
+    :param cache: cache of the responses, the api is always requested if None
+    :type cache: ResponseCache, optional
+
+    :param progress: called with the report of each stage when it finishes
+    :type progress: typing.Callable[[StageReport], None]
+
+    :return: report of each stage
+    :rtype: list[StageReport]
+    """
+    def limit(page_limit):
+        return page_limit if refresh_limit is None else refresh_limit
+
+    reports = []
+    budget_exhausted = threading.Event()
+
+    def run_stage(stage, stage_function):
+        report = StageReport(stage)
+        start = time.perf_counter()
+        stage_function(report)
+        report.seconds = time.perf_counter() - start
+        reports.append(report)
+        progress(report)
+
+    def load_operators(report):
+        stored = siri_db.session.execute(siri_db.select(Operator)).first()
+        if stored is not None and not tndc.operator_refresh_needed(siri_db, limit(routes.OPERATORS_REFRESH_LIMIT),
+                                                                   current_time):
+            report.skipped += 1
+            return
+
+        def save(key, operators_dict):
+            tndc.save_operators(siri_db, operators_dict)
+            tndc.save_operator_refresh_time(siri_db, current_time)
+
+        save_responses(siri_db, report, {'operators': functools.partial(
+            tndc.get_operators_dict, transit_api_key, siri_base_url, cache=cache)}, save, max_workers, budget_exhausted)
+
+    run_stage('operators', load_operators)
+
+    known_operators = siri_db.session.execute(siri_db.select(Operator.operator_id).where(
+        Operator.operator_monitored)).scalars().all()
+    selected = known_operators if operator_ids is None else [operator_id for operator_id in operator_ids
+                                                             if operator_id in known_operators]
+    if operator_ids is not None and len(selected) < len(operator_ids):
+        click.echo(f"  skipping operators that are not monitored: "
+                   f"{', '.join(sorted(set(operator_ids) - set(selected)))}", err=True)
+
+    def stale(report, column, page_limit):
+        stale_operators = []
+        for operator_id in selected:
+            if tndc.refresh_needed(siri_db, operator_id, column, limit(page_limit), current_time):
+                stale_operators.append(operator_id)
+            else:
+                report.skipped += 1
+        return stale_operators
+
+    def load_lines(report):
+        requests = {operator_id: functools.partial(tndc.get_lines_dict, transit_api_key, siri_base_url, operator_id,
+                                                   cache=cache)
+                    for operator_id in stale(report, 'lines_updated', routes.LINES_REFRESH_LIMIT)}
+        save_responses(siri_db, report, requests,
+                       lambda operator_id, lines_dict: tndc.save_lines(siri_db, operator_id, lines_dict, current_time),
+                       max_workers, budget_exhausted)
+
+    def load_stops(report):
+        requests = {operator_id: functools.partial(tndc.get_stops_dict, transit_api_key, siri_base_url, operator_id,
+                                                   cache=cache)
+                    for operator_id in stale(report, 'stops_updated', routes.STOPS_REFRESH_LIMIT)}
+        save_responses(siri_db, report, requests,
+                       lambda operator_id, stops_dict: tndc.save_stops(siri_db, operator_id, stops_dict, current_time),
+                       max_workers, budget_exhausted)
+
+    def load_patterns(report):
+        requests = {}
+        for operator_id in selected:
+            line_ids = siri_db.session.execute(siri_db.select(Line.line_id).where(
+                Line.operator_id == operator_id)).scalars().all()
+            stale_line_ids = tndc.stale_pattern_lines(siri_db, operator_id, limit(routes.PATTERN_REFRESH_LIMIT),
+                                                      current_time)
+            report.skipped += len(line_ids) - len(stale_line_ids)
+            for line_id in stale_line_ids:
+                requests[(operator_id, line_id)] = functools.partial(
+                    tndc.get_pattern_dict, transit_api_key, siri_base_url, operator_id, line_id, cache=cache)
+
+        def save(key, pattern_dict):
+            operator_id, line_id = key
+            tndc.save_patterns(siri_db, operator_id, line_id, pattern_dict, current_time)
+
+        save_responses(siri_db, report, requests, save, max_workers, budget_exhausted)
+        for operator_id in selected:
+            if not tndc.stale_pattern_lines(siri_db, operator_id, limit(routes.PATTERN_REFRESH_LIMIT), current_time):
+                siri_db.session.execute(siri_db.update(Operator).where(Operator.operator_id == operator_id).values(
+                    patterns_updated=current_time))
+        siri_db.session.commit()
+
+    def load_timetables(report):
+        requests = {}
+        fresh = set()
+        for operator_id in selected:
+            for line_id in siri_db.session.execute(siri_db.select(Line.line_id).where(
+                    Line.operator_id == operator_id)).scalars().all():
+                endpoints = line_endpoint_stops(siri_db, operator_id, line_id)
+                if endpoints is None:
+                    report.skipped += 1
+                    continue
+                for stop_id in endpoints:
+                    if (operator_id, stop_id) in requests or (operator_id, stop_id) in fresh:
+                        continue
+                    if not tndc.stop_timetable_refresh_needed(siri_db, operator_id, stop_id,
+                                                              limit(routes.STOP_TIMETABLE_REFRESH_LIMIT), current_time):
+                        fresh.add((operator_id, stop_id))
+                        report.skipped += 1
+                        continue
+                    requests[(operator_id, stop_id)] = functools.partial(
+                        tndc.get_stop_timetable_dict, transit_api_key, siri_base_url, operator_id, stop_id)
+
+        def save(key, stop_timetable):
+            operator_id, stop_id = key
+            tndc.save_stop_timetable(siri_db, operator_id, stop_id, stop_timetable, current_time)
+
+        save_responses(siri_db, report, requests, save, max_workers, budget_exhausted)
+
+    for stage, stage_function in (('lines', load_lines), ('stops', load_stops), ('patterns', load_patterns),
+                                  ('timetables', load_timetables)):
+        run_stage(stage, stage_function)
+    return reports
+
+
+@click.command("warm-cache")
+@click.option("--operators", default=None,
+              help="Comma separated operator ids, for example SF,CT. Defaults to every monitored operator.")
+@click.option("--force", is_flag=True,
+              help="Reload every dataset from the api, even the ones within their refresh limit or cached.")
+@click.option("--workers", type=int, default=tndc.DEFAULT_PREFETCH_WORKERS, show_default=True,
+              help="Most requests in flight.")
+@with_appcontext
+def warm_cache_command(operators, force, workers):
+    """Preload the operators, lines, stops, patterns and line endpoint timetables."""
+    from transit_notification import db, response_cache
+
+    operator_ids = None
+    if operators:
+        operator_ids = [operator_id.strip() for operator_id in operators.split(',') if operator_id.strip()]
+    transit_api_key, siri_base_url = tndc.read_key_api_file()
+    cache = response_cache.current_cache()
+    if force and cache is not None:
+        # every cached response is expired, the responses are requested again and replace the cached ones
+        cache = ResponseCache(cache.directory, ttl_s=0)
+    start = time.perf_counter()
+    reports = warm_cache(db, transit_api_key, siri_base_url, operator_ids, dt.datetime.now(dt.UTC),
+                         refresh_limit=0 if force else None, max_workers=workers, cache=cache,
+                         progress=lambda report: click.echo(repr(report)))
+    failed = sum(report.failed for report in reports)
+    deferred = sum(report.deferred for report in reports)
+    click.echo(f"Warmed up in {time.perf_counter() - start:.1f}s with {failed} failed requests")
+    if deferred:
+        # not a failure, the next run or the pages load the deferred datasets once the budget refills
+        click.echo(f"Request budget exhausted, {deferred} requests deferred to the next run", err=True)
+    if failed:
+        # a deploy hook sees the failure, the pages still load the missing datasets on demand
+        raise click.exceptions.Exit(1)